@@ -8,8 +8,11 @@ except importlib.metadata.PackageNotFoundError:
 
 __license__ = 'Apache 2.0'
 
+import collections
+import concurrent.futures
 import getpass
 import glob
+import hashlib
 import io
 import json
 import logging
@@ -18,13 +21,20 @@ import os
 import re
 import shutil
 import tempfile
-from contextlib import contextmanager
+import threading
+from contextlib import ExitStack, contextmanager
 
 import diskcache
 import requests
+import requests.adapters
 
 DEFAULT_PAGE_LIMIT = 50  # Number of results to fetch per request
 REQ_BUFFER_SIZE = 65536  # Chunk size when iterating a download body
+# Suffix of files that are being downloaded, which later downloads resume
+PARTIAL_DOWNLOAD_SUFFIX = '.girder-partial'
+# What a partial download was written from is recorded next to it, in a file
+# named with this suffix added to the name of the partial download
+PARTIAL_DOWNLOAD_INFO_SUFFIX = '.json'
 
 _safeNameRegex = re.compile(r'^[/\\]+')
 
@@ -119,6 +129,8 @@ class GirderClient:
 
     # The current maximum chunk size for uploading file chunks
     MAX_CHUNK_SIZE = 1024 * 1024 * 64
+    # How many times a part sent directly to S3 is retried
+    S3_PART_RETRIES = 3
 
     DEFAULT_API_ROOT = 'api/v1'
     DEFAULT_HOST = 'localhost'
@@ -150,7 +162,8 @@ class GirderClient:
             return 'https'
 
     def __init__(self, host=None, port=None, apiRoot=None, scheme=None, apiUrl=None,
-                 cacheSettings=None, progressReporterCls=None):
+                 cacheSettings=None, progressReporterCls=None, uploadThreads=1,
+                 downloadThreads=1):
         """
         Construct a new GirderClient object, given a host name and port number,
         as well as a username and password which will be used in all requests
@@ -178,6 +191,15 @@ class GirderClient:
             a class attribute `reportProgress` set to True (It can conveniently be
             initialized using `sys.stdout.isatty()`).
             This defaults to :class:`_NoopProgressReporter`.
+        :param uploadThreads: The number of files that :py:func:`upload` uploads
+            at once.  If this is more than 1, files in S3 assetstores are also
+            sent directly to S3, this many parts at once, rather than through
+            Girder, so S3 must be reachable from the client.
+        :type uploadThreads: int
+        :param downloadThreads: The number of items that folders are downloaded
+            with at once, and the number of files that items are downloaded
+            with at once.
+        :type downloadThreads: int
         """
         self.host = None
         self.scheme = None
@@ -218,7 +240,12 @@ class GirderClient:
             progressReporterCls = _NoopProgressReporter
 
         self.progressReporterCls = progressReporterCls
+        self.uploadThreads = uploadThreads
+        self.downloadThreads = downloadThreads
         self._session = None
+        self._uploadExecutor = None
+        self._s3PartSlots = None
+        self._downloadExecutor = None
 
     @contextmanager
     def session(self, session=None):
@@ -958,7 +985,8 @@ class GirderClient:
 
     def _uploadContents(self, uploadObj, stream, size, progressCallback=None):
         """
-        Uploads contents of a file.
+        Uploads contents of a file.  The next chunk is read from the stream
+        while the current one is sent.
 
         :param uploadObj: The upload object contain the upload id.
         :type uploadObj: dict
@@ -973,19 +1001,30 @@ class GirderClient:
             to the callable which is a dict of information about progress.
         :type progressCallback: callable
         """
+        if self.uploadThreads > 1 and uploadObj.get('behavior') == 's3' and size:
+            return self._uploadContentsToS3(uploadObj, stream, size, progressCallback)
+
         offset = 0
         uploadId = uploadObj['_id']
 
-        with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter:
+        def read(length):
+            chunk = stream.read(length)
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf8')
+            return chunk
+
+        with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter, \
+                concurrent.futures.ThreadPoolExecutor(1) as reader:
+            nextChunk = reader.submit(read, min(self.MAX_CHUNK_SIZE, size))
 
             while True:
-                chunk = stream.read(min(self.MAX_CHUNK_SIZE, (size - offset)))
+                chunk = nextChunk.result()
 
                 if not chunk:
                     break
 
-                if isinstance(chunk, str):
-                    chunk = chunk.encode('utf8')
+                nextChunk = reader.submit(
+                    read, min(self.MAX_CHUNK_SIZE, size - offset - len(chunk)))
 
                 uploadObj = self.post(
                     'file/chunk?offset=%d&uploadId=%s' % (offset, uploadId),
@@ -1012,6 +1051,124 @@ class GirderClient:
 
         return uploadObj
 
+    def _uploadContentsToS3(self, uploadObj, stream, size, progressCallback=None):
+        """
+        Uploads contents of a file directly to an S3 assetstore, sending up to
+        ``uploadThreads`` parts at once.  See :py:func:`_uploadContents`.
+        The parts held in memory are limited to ``uploadThreads`` across all of
+        the files that :py:func:`upload` sends at once.
+        """
+        s3 = uploadObj['s3']
+        partLength = s3['chunkLength'] if s3['chunked'] else size
+        partSlots = self._s3PartSlots or threading.BoundedSemaphore(self.uploadThreads)
+        offset = 0
+        partNumber = 1
+        sent = 0
+        pending = set()
+
+        def finished(done):
+            nonlocal sent
+            sent += sum(future.result() for future in done)
+            if done and callable(progressCallback):
+                progressCallback({
+                    'current': sent,
+                    'total': size
+                })
+
+        with self.progressReporterCls(label=uploadObj.get('name', ''), length=size) as reporter, \
+                concurrent.futures.ThreadPoolExecutor(self.uploadThreads) as pool:
+            s3UploadId = None
+            if s3['chunked']:
+                resp = self._sendS3Request(s3['request'])
+                s3UploadId = re.search('<UploadId>(.*)</UploadId>', resp.text).group(1)
+
+            try:
+                while True:
+                    partSlots.acquire()
+                    future = None
+                    try:
+                        chunk = stream.read(min(partLength, size - offset))
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode('utf8')
+                        if chunk:
+                            future = pool.submit(
+                                self._sendS3Part, uploadObj, s3UploadId, partNumber, chunk,
+                                reporter)
+                            future.add_done_callback(lambda _: partSlots.release())
+                    finally:
+                        if future is None:
+                            partSlots.release()
+                    if not chunk:
+                        break
+                    pending.add(future)
+                    offset += len(chunk)
+                    partNumber += 1
+                    done = {future for future in pending if future.done()}
+                    pending -= done
+                    finished(done)
+                while pending:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    finished(done)
+            except BaseException:
+                # Parts that have not started are not sent after a failure
+                for future in pending:
+                    future.cancel()
+                raise
+
+        if offset != size:
+            self.delete('file/upload/' + uploadObj['_id'])
+            raise IncorrectUploadLengthError(
+                'Expected upload to be %d bytes, but received %d.' % (size, offset),
+                upload=uploadObj)
+
+        return self.post('file/completion', parameters={'uploadId': uploadObj['_id']})
+
+    def _sendS3Part(self, uploadObj, s3UploadId, partNumber, data, reporter):
+        """
+        Send one part of a file to an S3 assetstore.  A part that fails with a
+        connection error or a server error is sent again, up to
+        ``S3_PART_RETRIES`` times.
+
+        :param s3UploadId: The ID of the multipart upload, or None if the file
+            is sent in a single request.
+        :returns: The length of the part.
+        """
+        request = uploadObj['s3']['request']
+        if s3UploadId is not None:
+            request = self.post('file/chunk', parameters={
+                'offset': 0,
+                'uploadId': uploadObj['_id'],
+                'chunk': json.dumps({
+                    's3UploadId': s3UploadId,
+                    'partNumber': partNumber,
+                    'contentLength': len(data)
+                })
+            })['s3']['request']
+        for retries in range(self.S3_PART_RETRIES, -1, -1):
+            try:
+                self._sendS3Request(request, _ProgressBytesIO(data, reporter=reporter))
+                return len(data)
+            except (HttpError, requests.ConnectionError) as exc:
+                if not retries or (isinstance(exc, HttpError) and exc.status < 500):
+                    raise
+
+    def _sendS3Request(self, request, data=None):
+        """
+        Send a request that Girder has signed to an S3 assetstore.
+
+        :param request: A dict with the ``method``, ``url`` and optional
+            ``headers`` of the request.
+        :param data: The body of the request.
+        """
+        result = self._requestFunc(request['method'])(
+            request['url'], data=data, headers=request.get('headers'))
+        if not result.ok:
+            raise HttpError(
+                status=result.status_code, url=result.url, method=request['method'],
+                text=result.text, response=result)
+        return result
+
     def uploadFile(self, parentId, stream, name, size, parentType='item',
                    progressCallback=None, reference=None, mimeType=None):
         """
@@ -1148,25 +1305,42 @@ class GirderClient:
             # assume `path` is a file-like object
             shutil.copyfileobj(fp, path)
 
-    def _streamingFileDownload(self, fileId):
+    def _streamingFileDownload(self, fileId, offset=0, ifRange=None):
         """
         Download a file streaming the contents
 
         :param fileId: The ID of the Girder file to download.
+        :param offset: The offset in the file to start downloading at.
+        :param ifRange: If set, the value of an If-Range header, so that the
+            whole file is sent if it no longer matches this validator.
 
         :returns: The request
         """
         path = 'file/%s/download' % fileId
-        return self.sendRestRequest('get', path, stream=True, jsonResp=False)
+        headers = None
+        if offset:
+            headers = {'Range': 'bytes=%d-' % offset}
+            if ifRange:
+                headers['If-Range'] = ifRange
+        return self.sendRestRequest('get', path, stream=True, jsonResp=False, headers=headers)
 
     def downloadFile(self, fileId, path, created=None):
         """
-        Download a file to the given local path or file-like object.
+        Download a file to the given local path or file-like object.  If a
+        local file already has the size and, as computed by the server,
+        sha512 of the file, it is not downloaded again.  A download to a local
+        path that was interrupted is resumed, unless the file has changed since.
 
         :param fileId: The ID of the Girder file to download.
         :param path: The path to write the file to, or a file-like object.
         """
-        fileObj = self.getFile(fileId)
+        self._downloadFile(self.getFile(fileId), path, created)
+
+    def _downloadFile(self, fileObj, path, created=None):
+        """
+        Download a file, given its document.  See :py:func:`downloadFile`.
+        """
+        fileId = fileObj['_id']
         created = created or fileObj['created']
         cacheKey = '\n'.join([self.urlBase, fileId, created])
 
@@ -1178,41 +1352,131 @@ class GirderClient:
                     self._copyFile(fp, path)
                 return
 
-        # download to a tempfile
-        progressFileName = fileId
+        # download to a partial file that can be resumed, or a tempfile
+        offset = 0
+        ifRange = None
         if isinstance(path, str):
+            if self._isLocalFileCurrent(fileObj, path):
+                return
             progressFileName = os.path.basename(path)
+            # Use "abspath" to cleanly get the parent of ".", without following symlinks otherwise
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmpName = path + PARTIAL_DOWNLOAD_SUFFIX
+            offset, ifRange = self._partialDownload(fileObj, tmpName)
+        else:
+            progressFileName = fileId
+            with tempfile.NamedTemporaryFile(delete=False) as tmp:
+                tmpName = tmp.name
 
-        req = self._streamingFileDownload(fileId)
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        req = self._streamingFileDownload(fileId, offset, ifRange)
+        if offset and not self._isResumed(req, offset, fileObj['size']):
+            # The file changed since the partial download was written
+            offset = 0
+            if req.status_code == 206:
+                req.close()
+                req = self._streamingFileDownload(fileId)
+        if not offset and isinstance(path, str):
+            self._writePartialDownloadInfo(fileObj, tmpName, req)
+        with open(tmpName, 'ab' if offset else 'wb') as tmp:
             with self.progressReporterCls(
-                    label=progressFileName,
-                    length=int(req.headers.get('content-length', 0))) as reporter:
+                    label=progressFileName, length=fileObj['size']) as reporter:
+                reporter.update(offset)
                 for chunk in req.iter_content(chunk_size=REQ_BUFFER_SIZE):
                     reporter.update(len(chunk))
                     tmp.write(chunk)
 
-        size = os.stat(tmp.name).st_size
+        size = os.stat(tmpName).st_size
         if size != fileObj['size']:
-            os.remove(tmp.name)
+            if size > fileObj['size'] or not isinstance(path, str):
+                os.remove(tmpName)
             raise IncompleteResponseError('File %s download' % fileId, fileObj['size'], size)
+        if offset and fileObj.get('sha512') and not self._isLocalFileCurrent(fileObj, tmpName):
+            # The file changed since the partial download was written
+            os.remove(tmpName)
+            raise IncompleteResponseError(
+                'File %s download did not match its sha512' % fileId, fileObj['size'], size)
 
         # save file in cache
         if self.cache is not None:
-            with open(tmp.name, 'rb') as fp:
+            with open(tmpName, 'rb') as fp:
                 self.cache.set(cacheKey, fp, read=True)
 
         if isinstance(path, str):
-            # we can just rename the tempfile
-            # Use "abspath" to cleanly get the parent of ".", without following symlinks otherwise
-            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-            shutil.move(tmp.name, path)
+            # we can just rename the partial file
+            shutil.move(tmpName, path)
+            os.remove(tmpName + PARTIAL_DOWNLOAD_INFO_SUFFIX)
         else:
             # write to file-like object
-            with open(tmp.name, 'rb') as fp:
+            with open(tmpName, 'rb') as fp:
                 shutil.copyfileobj(fp, path)
             # delete the temp file
-            os.remove(tmp.name)
+            os.remove(tmpName)
+
+    def _partialDownload(self, fileObj, tmpName):
+        """
+        Get the offset that a download can be resumed at from a partial file,
+        and the If-Range header to resume it with.  A partial download is only
+        resumed if it was written from the same version of the file.
+
+        :param fileObj: The Girder file document.
+        :param tmpName: The path of the partial file.
+        :returns: The offset, which is 0 if the download cannot be resumed,
+            and the If-Range header or None.
+        """
+        try:
+            with open(tmpName + PARTIAL_DOWNLOAD_INFO_SUFFIX) as fp:
+                info = json.load(fp)
+            size = os.path.getsize(tmpName)
+        except (OSError, ValueError):
+            return 0, None
+        if info.get('version') != self._fileVersion(fileObj) or size >= fileObj['size']:
+            return 0, None
+        return size, info.get('ifRange')
+
+    def _writePartialDownloadInfo(self, fileObj, tmpName, req):
+        """
+        Record the version of the file that a partial download is written
+        from, and the validator of the response if it has a strong one.
+        """
+        etag = req.headers.get('ETag')
+        with open(tmpName + PARTIAL_DOWNLOAD_INFO_SUFFIX, 'w') as fp:
+            json.dump({
+                'version': self._fileVersion(fileObj),
+                'ifRange': etag if etag and not etag.startswith('W/') else req.headers.get(
+                    'Last-Modified')
+            }, fp)
+
+    @staticmethod
+    def _fileVersion(fileObj):
+        return [fileObj['_id'], fileObj['size'], fileObj.get('sha512'),
+                fileObj.get('updated', fileObj['created'])]
+
+    @staticmethod
+    def _isResumed(req, offset, size):
+        """
+        Check whether a response to a range request continues a partial
+        download at the given offset.
+        """
+        return req.status_code == 206 and req.headers.get('Content-Range') == (
+            'bytes %d-%d/%d' % (offset, size - 1, size))
+
+    def _isLocalFileCurrent(self, fileObj, path):
+        """
+        Check whether a local file has the same contents as a file in Girder,
+        using the sha512 that the server computed, if it has.
+
+        :param fileObj: The Girder file document.
+        :param path: The path of the local file.
+        :type path: str
+        """
+        if (not fileObj.get('sha512') or not os.path.isfile(path)
+                or os.path.getsize(path) != fileObj['size']):
+            return False
+        sha512 = hashlib.sha512()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(REQ_BUFFER_SIZE), b''):
+                sha512.update(chunk)
+        return sha512.hexdigest() == fileObj['sha512']
 
     def downloadFileAsIterator(self, fileId, chunkSize=REQ_BUFFER_SIZE):
         """
@@ -1233,7 +1497,9 @@ class GirderClient:
         item will be placed into the directory specified by the dest parameter.
         If the item contains multiple files or a single file with a different
         name than the item, the item will be created as a directory under dest
-        and the files will become files within that directory.
+        and the files will become files within that directory.  Unless the item
+        is being downloaded as part of a folder, up to ``downloadThreads``
+        files are downloaded at once.
 
         :param itemId: The Id of the Girder item to download.
         :param dest: The destination directory to write the item into.
@@ -1244,6 +1510,25 @@ class GirderClient:
             item = self.get('item/' + itemId)
             name = item['name']
 
+        with ExitStack() as stack:
+            executor = None
+            if self.downloadThreads > 1 and self._downloadExecutor is None:
+                executor = self._startThreadPool(stack, self.downloadThreads)
+            downloads = []
+            for path, file in self._itemFiles(itemId, dest, name):
+                if executor is not None:
+                    downloads.append(executor.submit(self._downloadFile, file, path))
+                else:
+                    self._downloadFile(file, path)
+            for download in downloads:
+                download.result()
+
+    def _itemFiles(self, itemId, dest, name):
+        """
+        Yield the local path and document of each file of an item, creating a
+        directory for the item if it has more than one file.  See
+        :py:func:`downloadItem`.
+        """
         offset = 0
         first = True
         while True:
@@ -1254,20 +1539,14 @@ class GirderClient:
 
             if first:
                 if len(files) == 1 and files[0]['name'] == name:
-                    self.downloadFile(
-                        files[0]['_id'],
-                        os.path.join(dest, self.transformFilename(name)),
-                        created=files[0]['created'])
+                    yield os.path.join(dest, self.transformFilename(name)), files[0]
                     break
                 else:
                     dest = os.path.join(dest, self.transformFilename(name))
                     os.makedirs(dest, exist_ok=True)
 
             for file in files:
-                self.downloadFile(
-                    file['_id'],
-                    os.path.join(dest, self.transformFilename(file['name'])),
-                    created=file['created'])
+                yield os.path.join(dest, self.transformFilename(file['name'])), file
 
             first = False
             offset += len(files)
@@ -1277,6 +1556,8 @@ class GirderClient:
     def downloadFolderRecursive(self, folderId, dest, sync=False):
         """
         Download a folder recursively from Girder into a local directory.
+        Folders are listed breadth-first, and up to ``downloadThreads`` items
+        are downloaded at once.
 
         :param folderId: Id of the Girder folder or resource path to download.
         :type folderId: ObjectId or Unix-style path to the resource in Girder.
@@ -1286,46 +1567,45 @@ class GirderClient:
             cache and skip download provided that metadata is identical.
         :type sync: bool
         """
-        offset = 0
-        folderId = self._checkResourcePath(folderId)
-        while True:
-            folders = self.get('folder', parameters={
-                'limit': DEFAULT_PAGE_LIMIT,
-                'offset': offset,
-                'parentType': 'folder',
-                'parentId': folderId
-            })
-
-            for folder in folders:
-                local = os.path.join(dest, self.transformFilename(folder['name']))
-                os.makedirs(local, exist_ok=True)
-
-                self.downloadFolderRecursive(folder['_id'], local, sync=sync)
-
-            offset += len(folders)
-            if len(folders) < DEFAULT_PAGE_LIMIT:
-                break
+        self._downloadFolders([(self._checkResourcePath(folderId), dest)], sync)
 
-        offset = 0
-
-        while True:
-            items = self.get('item', parameters={
-                'folderId': folderId,
-                'limit': DEFAULT_PAGE_LIMIT,
-                'offset': offset
-            })
-
-            for item in items:
-                _id = item['_id']
-                self.incomingMetadata[_id] = item
-                if (sync and _id in self.localMetadata
-                        and item['updated'] == self.localMetadata[_id]['updated']):
-                    continue
-                self.downloadItem(item['_id'], dest, name=item['name'])
+    def _downloadFolders(self, folders, sync=False):
+        """
+        Download folders recursively.  See :py:func:`downloadFolderRecursive`.
 
-            offset += len(items)
-            if len(items) < DEFAULT_PAGE_LIMIT:
-                break
+        :param folders: A list of the Girder folder IDs and local destinations
+            of the folders.
+        :param sync: If True, skip items whose local metadata is identical.
+        """
+        queue = collections.deque(folders)
+        with ExitStack() as stack:
+            if self.downloadThreads > 1 and self._downloadExecutor is None:
+                self._downloadExecutor = self._startThreadPool(stack, self.downloadThreads)
+                stack.callback(setattr, self, '_downloadExecutor', None)
+            downloads = collections.deque()
+            while queue:
+                folderId, dest = queue.popleft()
+                for folder in self.listFolder(folderId):
+                    local = os.path.join(dest, self.transformFilename(folder['name']))
+                    os.makedirs(local, exist_ok=True)
+                    queue.append((folder['_id'], local))
+
+                for item in self.listItem(folderId):
+                    _id = item['_id']
+                    self.incomingMetadata[_id] = item
+                    if (sync and _id in self.localMetadata
+                            and item['updated'] == self.localMetadata[_id]['updated']):
+                        continue
+                    if self._downloadExecutor is not None:
+                        downloads.append(self._downloadExecutor.submit(
+                            self.downloadItem, _id, dest, name=item['name']))
+                    else:
+                        self.downloadItem(_id, dest, name=item['name'])
+                    # Report failures early, and don't keep finished downloads
+                    while downloads and downloads[0].done():
+                        downloads.popleft().result()
+            for download in downloads:
+                download.result()
 
     def downloadResource(self, resourceId, dest, resourceType='folder', sync=False):
         """
@@ -1346,25 +1626,13 @@ class GirderClient:
         if resourceType == 'folder':
             self.downloadFolderRecursive(resourceId, dest, sync)
         elif resourceType in ('collection', 'user'):
-            offset = 0
             resourceId = self._checkResourcePath(resourceId)
-            while True:
-                folders = self.get('folder', parameters={
-                    'limit': DEFAULT_PAGE_LIMIT,
-                    'offset': offset,
-                    'parentType': resourceType,
-                    'parentId': resourceId
-                })
-
-                for folder in folders:
-                    local = os.path.join(dest, self.transformFilename(folder['name']))
-                    os.makedirs(local, exist_ok=True)
-
-                    self.downloadFolderRecursive(folder['_id'], local, sync=sync)
-
-                offset += len(folders)
-                if len(folders) < DEFAULT_PAGE_LIMIT:
-                    break
+            folders = []
+            for folder in self.listFolder(resourceId, parentFolderType=resourceType):
+                local = os.path.join(dest, self.transformFilename(folder['name']))
+                os.makedirs(local, exist_ok=True)
+                folders.append((folder['_id'], local))
+            self._downloadFolders(folders, sync)
         else:
             raise Exception('Invalid resource type: %s' % resourceType)
 
@@ -1513,10 +1781,15 @@ class GirderClient:
         :param reuseExisting: boolean indicating whether to accept an existing item
             of the same name in the same location, or create a new one instead
         :param reference: Option reference to send along with the upload.
+        :returns: If files are being uploaded on a thread pool, the future of
+            the upload, otherwise None.
         """
         if not self.progressReporterCls.reportProgress:
             print('Uploading Item from %s' % localFile)
-        if not dryRun:
+        if dryRun:
+            return
+
+        def uploadItem():
             # If we are reusing existing items or have upload callbacks, then
             # we need to know the item as part of the process.  If this is a
             # zero-length file, we create an item.  Otherwise, we can just
@@ -1533,6 +1806,10 @@ class GirderClient:
                 self.uploadFileToFolder(
                     parentFolderId, filePath, filename=localFile, reference=reference)
 
+        if self._uploadExecutor is not None:
+            return self._uploadExecutor.submit(uploadItem)
+        uploadItem()
+
     def _uploadFolderAsItem(self, localFolder, parentFolderId, reuseExisting=False, blacklist=None,
                             dryRun=False, reference=None):
         """
@@ -1554,6 +1831,7 @@ class GirderClient:
         subdircontents = sorted(os.listdir(localFolder))
         # for each file in the subdir, add it to the item
         filecount = len(subdircontents)
+        uploads = []
         for (ind, currentFile) in enumerate(subdircontents):
             filepath = os.path.join(localFolder, currentFile)
             if currentFile in blacklist:
@@ -1562,9 +1840,16 @@ class GirderClient:
                 continue
             print('Adding file %s, (%d of %d) to Item' % (currentFile, ind + 1, filecount))
 
-            if not dryRun:
+            if dryRun:
+                continue
+            if self._uploadExecutor is not None:
+                uploads.append(self._uploadExecutor.submit(
+                    self.uploadFileToItem, item['_id'], filepath, filename=currentFile))
+            else:
                 self.uploadFileToItem(item['_id'], filepath, filename=currentFile)
 
+        for future in uploads:
+            future.result()
         if not dryRun:
             for callback in self._itemUploadCallbacks:
                 callback(item, localFolder)
@@ -1582,8 +1867,11 @@ class GirderClient:
         :param reuseExisting: boolean indicating whether to accept an existing item
             of the same name in the same location, or create a new one instead
         :param reference: Option reference to send along with the upload.
+        :returns: A list of the futures of files that are being uploaded on a
+            thread pool.
         """
         blacklist = blacklist or []
+        uploads = []
         if leafFoldersAsItems and self._hasOnlyFiles(localFolder):
             if parentType != 'folder':
                 raise Exception(
@@ -1596,7 +1884,7 @@ class GirderClient:
             if filename in blacklist:
                 if dryRun:
                     print('Ignoring file %s as it is blacklisted' % filename)
-                return
+                return uploads
 
             print('Creating Folder from %s' % localFolder)
             if dryRun:
@@ -1619,17 +1907,38 @@ class GirderClient:
                 elif os.path.isdir(fullEntry):
                     # At this point we should have an actual folder, so can
                     # pass that as the parent_type
-                    self._uploadFolderRecursive(
+                    uploads += self._uploadFolderRecursive(
                         fullEntry, folder['_id'], 'folder', leafFoldersAsItems, reuseExisting,
                         blacklist=blacklist, dryRun=dryRun, reference=reference)
                 else:
-                    self._uploadAsItem(
+                    upload = self._uploadAsItem(
                         entry, folder['_id'], fullEntry, reuseExisting, dryRun=dryRun,
                         reference=reference)
+                    if upload is not None:
+                        uploads.append(upload)
 
             if not dryRun:
-                for callback in self._folderUploadCallbacks:
-                    callback(folder, localFolder)
+                uploads = self._finishFolderUpload(folder, localFolder, uploads)
+        return uploads
+
+    def _finishFolderUpload(self, folder, localFolder, uploads):
+        """
+        Call the folder upload callbacks once the files in a folder have been
+        uploaded.
+
+        :param folder: The folder in Girder.
+        :param localFolder: The full path to the local folder.
+        :param uploads: The futures of the files in the folder that are being
+            uploaded on a thread pool.
+        :returns: The futures that have not been waited for.
+        """
+        if not self._folderUploadCallbacks:
+            return uploads
+        for upload in uploads:
+            upload.result()
+        for callback in self._folderUploadCallbacks:
+            callback(folder, localFolder)
+        return []
 
     def upload(self, filePattern, parentId, parentType='folder', leafFoldersAsItems=False,
                reuseExisting=False, blacklist=None, dryRun=False, reference=None):
@@ -1663,31 +1972,61 @@ class GirderClient:
         blacklist = blacklist or []
         empty = True
         parentId = self._checkResourcePath(parentId)
-        for pattern in filePatternList:
-            for currentFile in glob.iglob(pattern):
-                empty = False
-                currentFile = os.path.normpath(currentFile)
-                filename = os.path.basename(currentFile)
-                if filename in blacklist:
-                    if dryRun:
-                        print('Ignoring file %s as it is blacklisted' % filename)
-                    continue
-                if os.path.isfile(currentFile):
-                    if parentType != 'folder':
-                        raise Exception(
-                            'Attempting to upload an item under a %s. Items can only be added to '
-                            'folders.' % parentType)
+        with ExitStack() as stack:
+            if self.uploadThreads > 1 and not dryRun:
+                self._uploadExecutor = self._startThreadPool(stack, self.uploadThreads)
+                self._s3PartSlots = threading.BoundedSemaphore(self.uploadThreads)
+                stack.callback(setattr, self, '_uploadExecutor', None)
+                stack.callback(setattr, self, '_s3PartSlots', None)
+            uploads = []
+            for pattern in filePatternList:
+                for currentFile in glob.iglob(pattern):
+                    empty = False
+                    currentFile = os.path.normpath(currentFile)
+                    filename = os.path.basename(currentFile)
+                    if filename in blacklist:
+                        if dryRun:
+                            print('Ignoring file %s as it is blacklisted' % filename)
+                        continue
+                    if os.path.isfile(currentFile):
+                        if parentType != 'folder':
+                            raise Exception(
+                                'Attempting to upload an item under a %s. Items can only be '
+                                'added to folders.' % parentType)
+                        else:
+                            upload = self._uploadAsItem(
+                                os.path.basename(currentFile), parentId, currentFile,
+                                reuseExisting, dryRun=dryRun, reference=reference)
+                            if upload is not None:
+                                uploads.append(upload)
                     else:
-                        self._uploadAsItem(
-                            os.path.basename(currentFile), parentId, currentFile, reuseExisting,
-                            dryRun=dryRun, reference=reference)
-                else:
-                    self._uploadFolderRecursive(
-                        currentFile, parentId, parentType, leafFoldersAsItems, reuseExisting,
-                        blacklist=blacklist, dryRun=dryRun, reference=reference)
+                        uploads += self._uploadFolderRecursive(
+                            currentFile, parentId, parentType, leafFoldersAsItems, reuseExisting,
+                            blacklist=blacklist, dryRun=dryRun, reference=reference)
+            for upload in uploads:
+                upload.result()
         if empty:
             print('No matching files: ' + repr(filePattern))
 
+    def _startThreadPool(self, stack, threads):
+        """
+        Start a pool of threads that is shut down when ``stack`` is closed.
+        The threads share one session, with a connection for each.  Work that
+        has not started when the pool is shut down, such as after a failure,
+        is cancelled.
+
+        :returns: The executor of the pool.
+        """
+        if self._session is None:
+            stack.enter_context(self.session())
+        adapter = self._session.get_adapter(self.urlBase)
+        if isinstance(adapter, requests.adapters.HTTPAdapter):
+            self._session.mount(self.urlBase, requests.adapters.HTTPAdapter(
+                pool_maxsize=threads, max_retries=adapter.max_retries))
+        executor = concurrent.futures.ThreadPoolExecutor(threads)
+        stack.callback(executor.shutdown, cancel_futures=True)
+        return executor
+
     def _checkResourcePath(self, objId):
         if isinstance(objId, str) and objId.startswith('/'):
             try:
@@ -2,6 +2,7 @@
 import logging
 import sys
 import types
+from contextlib import contextmanager
 from http.client import HTTPConnection
 
 import click
@@ -80,11 +81,19 @@ class GirderCli(GirderClient):
         elif username:
             self.authenticate(username, password, interactive=interactive)
 
-    def sendRestRequest(self, *args, **kwargs):
-        with self.session() as session:
+    @contextmanager
+    def session(self, session=None):
+        with super().session(session) as session:
             session.verify = self.sslVerify
             if self.retries:
                 session.mount(self.urlBase, HTTPAdapter(max_retries=self.retries))
+            yield session
+
+    def sendRestRequest(self, *args, **kwargs):
+        if self._session is not None:
+            # Requests from several threads share the open session
+            return super().sendRestRequest(*args, **kwargs)
+        with self.session():
             return super().sendRestRequest(*args, **kwargs)
 
 
@@ -291,10 +300,13 @@ _short_help = 'Download files from Girder'
     _short_help, _common_help.replace('LOCAL_FOLDER', 'LOCAL_FOLDER (default: ".")')))
 @_CommonParameters(additional_parent_types=[
     'collection', 'user', 'item', 'file'], path_default='.')
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1), show_default=True,
+              help='number of items or files to download at once')
 @click.pass_obj
-def _download(gc, parent_type, parent_id, local_folder):
+def _download(gc, parent_type, parent_id, local_folder, jobs):
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
+    gc.downloadThreads = jobs
     if parent_type == 'item':
         gc.downloadItem(parent_id, local_folder)
     elif parent_type == 'file':
@@ -335,11 +347,15 @@ _short_help = 'Upload files to Girder'
               help='comma-separated list of filenames to ignore')
 @click.option('--reference', default=None,
               help='optional reference to send along with the upload')
+@click.option('--upload-threads', default=1, type=click.IntRange(min=1), show_default=True,
+              help='number of files to upload at once; with more than 1, files in S3 '
+              'assetstores are sent directly to S3')
 @click.pass_obj
 def _upload(gc, parent_type, parent_id, local_folder,
-            leaf_folders_as_items, reuse, blacklist, dry_run, reference):
+            leaf_folders_as_items, reuse, blacklist, dry_run, reference, upload_threads):
     if parent_type == 'auto':
         parent_type = _lookup_parent_type(gc, parent_id)
+    gc.uploadThreads = upload_threads
     gc.upload(
         local_folder, parent_id, parent_type,
         leafFoldersAsItems=leaf_folders_as_items, reuseExisting=reuse,
@@ -376,7 +376,8 @@ class Description:
 
         return self
 
-    def pagingParams(self, defaultSort, defaultSortDir=SortDir.ASCENDING, defaultLimit=50):
+    def pagingParams(self, defaultSort, defaultSortDir=SortDir.ASCENDING, defaultLimit=50,
+                     keyset=False):
         """
         Adds the limit, offset, sort, and sortdir parameter documentation to
         this route handler.
@@ -387,10 +388,20 @@ class Description:
         :type defaultSortDir: int
         :param defaultLimit: The default page size.
         :type defaultLimit: int
+        :param keyset: Whether the route supports keyset pagination, in which
+            case the "after" parameter is also documented. Such routes should
+            return their results through :py:meth:`girder.api.rest.Resource.keysetPage`.
+        :type keyset: bool
         """
         self.param(
             'limit', 'Result set size limit.', default=defaultLimit, required=False, dataType='int')
         self.param('offset', 'Offset into result set.', default=0, required=False, dataType='int')
+        if keyset:
+            self.param(
+                'after', 'Return the results following a previous page. Pass the value of the '
+                '"Girder-Next-After" header of the previous response. This is faster than '
+                'using an offset for deep pages. The "Girder-Total-Count" header is not set '
+                'when this is passed.', required=False)
 
         if defaultSort is not None:
             self.param(
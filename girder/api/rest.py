@@ -22,11 +22,12 @@ from dogpile.cache.util import kwarg_function_key_generator
 from girder import auditLogger, events
 from girder.constants import ServerMode, SortDir, TokenScope
 from girder.exceptions import AccessException, GirderException, RestException, ValidationException
+from girder.models.model_base import makeAfterToken
 from girder.models.setting import Setting
 from girder.models.token import Token
-from girder.models.user import User
 from girder.settings import SettingKey
 from girder.utility import JsonEncoder, config, optionalArgumentDecorator, toBool
+from girder.utility._auth_cache import authCache
 from girder.utility._cache import requestCache
 from girder.utility.model_importer import ModelImporter
 
@@ -163,7 +164,7 @@ def getCurrentToken(allowCookie=None):
     if not tokenStr:
         return None
 
-    return Token().load(tokenStr, force=True, objectId=False)
+    return authCache.loadToken(tokenStr)
 
 
 def getCurrentUser(returnToken=False):
@@ -206,7 +207,7 @@ def getCurrentUser(returnToken=False):
         except AccessException:
             return retVal(None, token)
 
-        user = User().load(token['userId'], force=True)
+        user = authCache.loadUser(token['userId'])
         return retVal(user, token)
 
 
@@ -264,6 +265,62 @@ def setContentDisposition(filename, disposition='attachment', setHeader=True):
     return value
 
 
+# The archive formats of resource downloads, with their MIME types and
+# filename extensions
+ARCHIVE_FORMATS = {
+    'zip': ('application/zip', '.zip'),
+    'tar': ('application/x-tar', '.tar'),
+    'tar.zst': ('application/zstd', '.tar.zst'),
+}
+
+
+def archiveResponse(name, fileList, format='zip', compression=False, rootPath=''):
+    """
+    Set the headers for downloading files as an archive, and return a
+    generator function that streams the archive.
+
+    :param name: The name of the archive, without an extension.
+    :type name: str
+    :param fileList: A function that returns the files to archive, as
+        returned by a model's ``fileList`` method with ``data=False``.
+    :param format: One of the ARCHIVE_FORMATS.
+    :type format: str
+    :param compression: Whether to compress the files in a zip archive.  Files
+        whose types are already compressed are stored as they are.
+    :type compression: bool
+    :param rootPath: The root path for all files in the archive.
+    :type rootPath: str
+    """
+    from girder.models.file import File
+    from girder.utility import tarutil, ziputil
+
+    if format not in ARCHIVE_FORMATS:
+        raise RestException('Unsupported format: %s.' % format)
+    if format == 'tar.zst' and not tarutil.zstandard:
+        raise RestException('The tar.zst format is not available on this server.')
+
+    setResponseHeader('Content-Type', ARCHIVE_FORMATS[format][0])
+    setContentDisposition(name + ARCHIVE_FORMATS[format][1])
+
+    def files():
+        for path, file in fileList():
+            if isinstance(file, dict):
+                yield path, File().download(file, headers=False), file
+            else:
+                yield path, file, None
+
+    def stream():
+        if format == 'zip':
+            archive = ziputil.ZipGenerator(
+                rootPath, compression=ziputil.DEFLATE if compression else ziputil.STORE)
+        else:
+            archive = tarutil.TarGenerator(
+                rootPath, compression=tarutil.ZSTD if format == 'tar.zst' else None)
+        yield from archive.addFiles(files())
+        yield archive.footer()
+    return stream
+
+
 def requireAdmin(user, message=None):
     """
     Calling this on a user will ensure that they have admin rights.  If not,
@@ -1098,6 +1155,32 @@ class Resource:
         """
         return setRawResponse(*args, **kwargs)
 
+    def keysetPage(self, results, limit, sort, after=None):
+        """
+        Return a page of results from a route that supports keyset pagination.
+        If the page is full, the "Girder-Next-After" response header is set to a
+        token that can be passed as the "after" parameter to get the next page.
+
+        The "Girder-Total-Count" header is only set on the first page, since
+        counting the results that follow a token would scan the rest of the
+        result set for every page, and would not be the total.
+
+        :param results: The results of a find using the ``sort`` order.
+        :type results: iterable
+        :param limit: The page size.
+        :type limit: int
+        :param sort: The sort order, as returned by
+            :py:func:`girder.models.model_base.keysetSort`.
+        :type sort: List of (key, order) tuples.
+        :param after: The "after" token the results were found with, if any.
+        :type after: str or None
+        :returns: The results as a list.
+        """
+        results = list(results if after is not None else _mongoCursorToList(results))
+        if limit and len(results) == limit:
+            setResponseHeader('Girder-Next-After', makeAfterToken(results[-1], sort))
+        return results
+
     def getPagingParameters(self, params, defaultSortField=None, defaultSortDir=SortDir.ASCENDING):
         """
         Pass the URL parameters into this function if the request is for a
@@ -4,7 +4,7 @@ from girder.constants import AccessType, AssetstoreType, TokenScope
 from girder.exceptions import RestException
 from girder.models.assetstore import Assetstore as AssetstoreModel
 from girder.models.file import File
-from girder.tasks import ensure_local_worker_available, importDataTask
+from girder.tasks import blobReportTask, ensure_local_worker_available, importDataTask
 from girder.utility.model_importer import ModelImporter
 from girder.utility.s3_assetstore_adapter import DEFAULT_REGION
 
@@ -29,6 +29,8 @@ class Assetstore(Resource):
         self.route('PUT', (':id',), self.updateAssetstore)
         self.route('DELETE', (':id',), self.deleteAssetstore)
         self.route('GET', (':id', 'files'), self.getAssetstoreFiles)
+        self.route('GET', (':id', 'blobs'), self.getBlobReport)
+        self.route('DELETE', (':id', 'blobs'), self.reclaimOrphanedBlobs)
 
     @access.admin
     @autoDescribeRoute(
@@ -256,3 +258,51 @@ class Assetstore(Resource):
     def getAssetstoreFiles(self, assetstore, limit, offset, sort):
         return File().find(
             query={'assetstoreId': assetstore['_id']}, offset=offset, limit=limit, sort=sort)
+
+    def _blobReport(self, assetstore, progress, **kwargs):
+        if assetstore['type'] != AssetstoreType.FILESYSTEM:
+            raise RestException('This operation is only supported for filesystem assetstores.')
+        ensure_local_worker_available()
+        # Checking every file and blob can take a long time
+        task = blobReportTask.delay(
+            assetstoreId=str(assetstore['_id']),
+            progress=progress,
+            userId=str(self.getCurrentUser()['_id']),
+            **kwargs,
+        )
+        return {'taskId': task.id}
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Report how the stored data of a filesystem assetstore is shared.')
+        .notes('This compares the data stored on disk with the files that reference it, '
+               'and reports how much space is saved by files sharing identical data, '
+               'data that no file references, and files whose data is missing. '
+               'The report is made by a task on the local worker; this returns the ID '
+               'of the task, and the report is sent to the user as an '
+               '"assetstore.blob_report" notification when it is done.')
+        .modelParam('id', model=AssetstoreModel)
+        .param('progress', 'Whether to record progress on this task.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse()
+        .errorResponse('You are not an administrator.', 403)
+    )
+    def getBlobReport(self, assetstore, progress):
+        return self._blobReport(assetstore, progress)
+
+    @access.admin(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Delete data in a filesystem assetstore that no file references.')
+        .notes('This runs as a task on the local worker and returns the ID of the '
+               'task. The report, including the amount of data that was deleted, is '
+               'sent to the user as an "assetstore.blob_report" notification.')
+        .modelParam('id', model=AssetstoreModel)
+        .param('minimumAge', 'Only delete data that has not been modified for at least '
+               'this many days.', dataType='float', required=False, default=1)
+        .param('progress', 'Whether to record progress on this task.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse()
+        .errorResponse('You are not an administrator.', 403)
+    )
+    def reclaimOrphanedBlobs(self, assetstore, minimumAge, progress):
+        return self._blobReport(assetstore, progress, reclaim=True, minimumAge=minimumAge)
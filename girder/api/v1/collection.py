@@ -3,11 +3,10 @@ from girder.constants import AccessType, TokenScope
 from girder.exceptions import AccessException
 from girder.models.collection import Collection as CollectionModel
 from girder.tasks import deleteCollectionTask, ensure_local_worker_available
-from girder.utility import ziputil
 from girder.utility.progress import ProgressContext
 
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setContentDisposition, setResponseHeader
+from ..rest import ARCHIVE_FORMATS, Resource, archiveResponse, filtermodel
 
 
 class Collection(Resource):
@@ -105,25 +104,25 @@ class Collection(Resource):
 
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
-        Description('Download an entire collection as a zip archive.')
+        Description('Download an entire collection as an archive.')
         .modelParam('id', model=CollectionModel, level=AccessType.READ)
         .jsonParam('mimeFilter', 'JSON list of MIME types to include.', requireArray=True,
                    required=False)
-        .produces('application/zip')
+        .param('format', 'The archive format.', required=False,
+               enum=list(ARCHIVE_FORMATS), default='zip')
+        .param('compression', 'Whether to compress the files in a zip archive.  Files '
+               'of types that are already compressed are stored as they are.',
+               required=False, dataType='boolean', default=False)
+        .produces(['application/zip', 'application/x-tar', 'application/zstd'])
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the collection.', 403)
     )
-    def downloadCollection(self, collection, mimeFilter):
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition(collection['name'] + '.zip')
-
-        def stream():
-            zip = ziputil.ZipGenerator(collection['name'])
-            for (path, file) in self._model.fileList(
-                    collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter):
-                yield from zip.addFile(file, path)
-            yield zip.footer()
-        return stream
+    def downloadCollection(self, collection, mimeFilter, format, compression):
+        return archiveResponse(
+            collection['name'], lambda: self._model.fileList(
+                collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter,
+                data=False),
+            format=format, compression=compression, rootPath=collection['name'])
 
     @access.user(scope=TokenScope.DATA_OWN)
     @autoDescribeRoute(
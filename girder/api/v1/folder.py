@@ -2,13 +2,13 @@ from girder.api import access
 from girder.constants import AccessType, SortDir, TokenScope
 from girder.exceptions import RestException
 from girder.models.folder import Folder as FolderModel
+from girder.models.model_base import keysetSort
 from girder.tasks import copyFolderTask, deleteFolderTask, ensure_local_worker_available
-from girder.utility import ziputil
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
 
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setContentDisposition, setResponseHeader
+from ..rest import ARCHIVE_FORMATS, Resource, archiveResponse, filtermodel
 
 
 class Folder(Resource):
@@ -49,11 +49,11 @@ class Folder(Resource):
         .param('text', 'Pass to perform a text search.', required=False)
         .param('name', 'Pass to lookup a folder by exact name match. Must '
                'pass parentType and parentId as well when using this.', required=False)
-        .pagingParams(defaultSort='lowerName')
+        .pagingParams(defaultSort='lowerName', keyset=True)
         .errorResponse()
         .errorResponse('Read access was denied on the parent resource.', 403)
     )
-    def find(self, parentType, parentId, text, name, limit, offset, sort):
+    def find(self, parentType, parentId, text, name, limit, offset, sort, after):
         """
         Get a list of folders with given search parameters. Currently accepted
         search modes are:
@@ -64,10 +64,21 @@ class Folder(Resource):
            parameter to invoke these additional filters.
         2. Searching with full text search across all folders in the system.
            Simply pass a "text" parameter for this mode.
+
+        Keyset pagination via the "after" parameter is supported when
+        searching by parentId and parentType.
         """
-        return self._find(parentType, parentId, text, name, limit, offset, sort)
+        if not (parentType and parentId):
+            if after is not None:
+                raise RestException('The "after" parameter requires a parentType and parentId.')
+            return self._find(parentType, parentId, text, name, limit, offset, sort)
+        sort = keysetSort(sort)
+        return self.keysetPage(
+            self._find(parentType, parentId, text, name, limit, offset, sort, after=after),
+            limit, sort, after=after)
 
-    def _find(self, parentType, parentId, text, name, limit, offset, sort, filters=None):
+    def _find(self, parentType, parentId, text, name, limit, offset, sort, filters=None,
+              after=None):
         user = self.getCurrentUser()
 
         filters = (filters.copy() if filters else {})
@@ -84,7 +95,7 @@ class Folder(Resource):
 
             return self._model.childFolders(
                 parentType=parentType, parent=parent, user=user,
-                offset=offset, limit=limit, sort=sort, filters=filters)
+                offset=offset, limit=limit, sort=sort, filters=filters, after=after)
         elif text:
             return self._model.textSearch(
                 text, user=user, limit=limit, offset=offset, sort=sort, filters=filters)
@@ -147,30 +158,29 @@ class Folder(Resource):
 
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
-        Description('Download an entire folder as a zip archive.')
+        Description('Download an entire folder as an archive.')
         .modelParam('id', model=FolderModel, level=AccessType.READ)
         .jsonParam('mimeFilter', 'JSON list of MIME types to include.', required=False,
                    requireArray=True)
-        .produces('application/zip')
+        .param('format', 'The archive format.', required=False,
+               enum=list(ARCHIVE_FORMATS), default='zip')
+        .param('compression', 'Whether to compress the files in a zip archive.  Files '
+               'of types that are already compressed are stored as they are.',
+               required=False, dataType='boolean', default=False)
+        .produces(['application/zip', 'application/x-tar', 'application/zstd'])
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the folder.', 403)
     )
-    def downloadFolder(self, folder, mimeFilter):
+    def downloadFolder(self, folder, mimeFilter, format, compression):
         """
-        Returns a generator function that will be used to stream out a zip
-        file containing this folder's contents, filtered by permissions.
+        Returns a generator function that will be used to stream out an
+        archive containing this folder's contents, filtered by permissions.
         """
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition(folder['name'] + '.zip')
         user = self.getCurrentUser()
-
-        def stream():
-            zip = ziputil.ZipGenerator(folder['name'])
-            for (path, file) in self._model.fileList(
-                    folder, user=user, subpath=False, mimeFilter=mimeFilter):
-                yield from zip.addFile(file, path)
-            yield zip.footer()
-        return stream
+        return archiveResponse(
+            folder['name'], lambda: self._model.fileList(
+                folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False),
+            format=format, compression=compression, rootPath=folder['name'])
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel(model=FolderModel)
@@ -4,10 +4,10 @@ from girder.exceptions import RestException
 from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item as ItemModel
-from girder.utility import ziputil
+from girder.models.model_base import keysetSort
 
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setContentDisposition, setResponseHeader
+from ..rest import ARCHIVE_FORMATS, Resource, archiveResponse, filtermodel
 
 
 class Item(Resource):
@@ -27,6 +27,7 @@ class Item(Resource):
         self.route('POST', (), self.createItem)
         self.route('PUT', (':id',), self.updateItem)
         self.route('POST', (':id', 'copy'), self.copyItem)
+        self.route('PUT', ('metadata',), self.bulkSetMetadata)
         self.route('PUT', (':id', 'metadata'), self.setMetadata)
         self.route('DELETE', (':id', 'metadata'), self.deleteMetadata)
 
@@ -45,11 +46,11 @@ class Item(Resource):
                required=False)
         .param('name', 'Pass to lookup an item by exact name match. Must '
                'pass folderId as well when using this.', required=False)
-        .pagingParams(defaultSort='lowerName')
+        .pagingParams(defaultSort='lowerName', keyset=True)
         .errorResponse()
         .errorResponse('Read access was denied on the parent folder.', 403)
     )
-    def find(self, folderId, text, name, limit, offset, sort):
+    def find(self, folderId, text, name, limit, offset, sort, after):
         """
         Get a list of items with given search parameters. Currently accepted
         search modes are:
@@ -60,10 +61,20 @@ class Item(Resource):
            additional filters.
         2. Searching with full text search across all items in the system.
            Simply pass a "text" parameter for this mode.
+
+        Keyset pagination via the "after" parameter is supported when
+        searching by folderId.
         """
-        return self._find(folderId, text, name, limit, offset, sort)
+        if not folderId:
+            if after is not None:
+                raise RestException('The "after" parameter requires a folderId.')
+            return self._find(folderId, text, name, limit, offset, sort)
+        sort = keysetSort(sort)
+        return self.keysetPage(
+            self._find(folderId, text, name, limit, offset, sort, after=after), limit, sort,
+            after=after)
 
-    def _find(self, folderId, text, name, limit, offset, sort, filters=None):
+    def _find(self, folderId, text, name, limit, offset, sort, filters=None, after=None):
         user = self.getCurrentUser()
 
         filters = (filters.copy() if filters else {})
@@ -78,7 +89,8 @@ class Item(Resource):
                 filters['name'] = name
 
             return Folder().childItems(
-                folder=folder, limit=limit, offset=offset, sort=sort, filters=filters)
+                folder=folder, limit=limit, offset=offset, sort=sort, filters=filters,
+                after=after)
         elif text is not None:
             return self._model.textSearch(
                 text, user=user, limit=limit, offset=offset, sort=sort, filters=filters)
@@ -212,6 +224,70 @@ class Item(Resource):
     def setMetadata(self, item, metadata, allowNull):
         return self._model.setMetadata(item, metadata, allowNull=allowNull)
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Set metadata fields on many items at once.')
+        .notes('Pass either "updates", a list of objects with "id" and "metadata" keys, or '
+               'a "query" and "metadata" to set the same metadata on every matching item '
+               'that the user can write. The query must match a "folderId", and may also '
+               'match on the "name" field and on metadata fields prefixed by "meta.". Set metadata '
+               'fields to null in order to delete them. Returns the number of matched and '
+               'modified items.')
+        .jsonParam('body', 'A JSON object describing the updates.', paramType='body', schema={
+            'type': 'object',
+            'properties': {
+                'updates': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'id': {'type': 'string'},
+                            'metadata': {'type': 'object'}
+                        },
+                        'required': ['id', 'metadata']
+                    }
+                },
+                'query': {'type': 'object'},
+                'metadata': {'type': 'object'}
+            }
+        })
+        .param('allowNull', 'Whether "null" is allowed as a metadata value.', required=False,
+               dataType='boolean', default=False)
+        .errorResponse(('ID was invalid.',
+                        'Invalid JSON passed in request body.',
+                        'Metadata key name was invalid.'))
+        .errorResponse('Write access was denied for an item.', 403)
+    )
+    def bulkSetMetadata(self, body, allowNull):
+        updates = body.get('updates')
+        query = body.get('query')
+        if updates is not None:
+            updates = [(update['id'], update['metadata']) for update in updates]
+        if query is not None:
+            query = self._bulkMetadataQuery(query)
+        return self._model.bulkSetMetadata(
+            updates=updates, query=query, metadata=body.get('metadata'),
+            user=self.getCurrentUser(), allowNull=allowNull)
+
+    def _bulkMetadataQuery(self, query):
+        """
+        Restrict a user-supplied query to equality matches on a few fields, so
+        that arbitrary query operators can't be used.
+        """
+        for key, value in query.items():
+            if key not in ('folderId', 'name') and not key.startswith('meta.'):
+                raise RestException('Invalid query field: %s.' % key)
+            if isinstance(value, dict) or (
+                    isinstance(value, list) and any(isinstance(v, dict) for v in value)):
+                raise RestException('Query values must not be objects.')
+        # Without a folder, the query could match every item in the database
+        if not isinstance(query.get('folderId'), str):
+            raise RestException('The query must match a single folderId.')
+        query['folderId'] = Folder().load(
+            query['folderId'], user=self.getCurrentUser(), level=AccessType.READ, exc=True
+        )['_id']
+        return query
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel(ItemModel)
     @autoDescribeRoute(
@@ -235,16 +311,10 @@ class Item(Resource):
     def deleteMetadata(self, item, fields):
         return self._model.deleteMetadata(item, fields)
 
-    def _downloadMultifileItem(self, item, user):
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition(item['name'] + '.zip')
-
-        def stream():
-            zip = ziputil.ZipGenerator(item['name'])
-            for (path, file) in self._model.fileList(item, subpath=False):
-                yield from zip.addFile(file, path)
-            yield zip.footer()
-        return stream
+    def _downloadMultifileItem(self, item, user, format='zip', compression=False):
+        return archiveResponse(
+            item['name'], lambda: self._model.fileList(item, subpath=False, data=False),
+            format=format, compression=compression, rootPath=item['name'])
 
     @access.public(scope=TokenScope.DATA_READ)
     @filtermodel(model=File)
@@ -267,8 +337,11 @@ class Item(Resource):
                required=False, default=0)
         .param('format', 'If unspecified, items with one file are downloaded '
                'as that file, and other items are downloaded as a zip '
-               "archive.  If 'zip', a zip archive is always sent.",
-               required=False)
+               "archive.  If 'zip', 'tar', or 'tar.zst', an archive of that "
+               'format is always sent.', required=False)
+        .param('compression', 'Whether to compress the files in a zip archive.  Files '
+               'of types that are already compressed are stored as they are.',
+               required=False, dataType='boolean', default=False)
         .param('contentDisposition', 'Specify the Content-Disposition response '
                'header disposition-type value, only applied for single file '
                'items.', required=False, enum=['inline', 'attachment'],
@@ -277,23 +350,26 @@ class Item(Resource):
                    'download request, only applied for single file '
                    'items.', required=False)
         # single file items could produce other types, too.
-        .produces(['application/zip', 'application/octet-stream'])
+        .produces(['application/zip', 'application/x-tar', 'application/zstd',
+                   'application/octet-stream'])
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the item.', 403)
     )
-    def download(self, item, offset, format, contentDisposition, extraParameters):
+    def download(self, item, offset, format, compression, contentDisposition,
+                 extraParameters):
         user = self.getCurrentUser()
         files = list(self._model.childFiles(item=item, limit=2))
-        if format not in (None, '', 'zip'):
+        if format not in (None, '') and format not in ARCHIVE_FORMATS:
             raise RestException('Unsupported format: %s.' % format)
-        if len(files) == 1 and format != 'zip':
+        if len(files) == 1 and not format:
             if contentDisposition not in {None, 'inline', 'attachment'}:
                 raise RestException('Unallowed contentDisposition type "%s".' % contentDisposition)
             return File().download(
                 files[0], offset, contentDisposition=contentDisposition,
                 extraParameters=extraParameters)
         else:
-            return self._downloadMultifileItem(item, user)
+            return self._downloadMultifileItem(
+                item, user, format=format or 'zip', compression=compression)
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
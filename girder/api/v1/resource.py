@@ -3,14 +3,14 @@ from girder.constants import AccessType, TokenScope
 from girder.exceptions import RestException
 from girder.utility import parseTimestamp
 from girder.utility import path as path_util
-from girder.utility import ziputil
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
 from girder.utility.search import getSearchModeHandler
 
 from ..describe import Description, autoDescribeRoute
+from ..rest import ARCHIVE_FORMATS
 from ..rest import Resource as BaseResource
-from ..rest import setContentDisposition, setResponseHeader
+from ..rest import archiveResponse
 
 # Plugins can modify this set to allow other types to be searched
 allowedSearchTypes = {'collection', 'file', 'folder', 'group', 'item', 'user'}
@@ -136,7 +136,7 @@ class Resource(BaseResource):
     @access.public(scope=TokenScope.DATA_READ, cookie=True)
     @autoDescribeRoute(
         Description('Download a set of items, folders, collections, and users '
-                    'as a zip archive.')
+                    'as an archive.')
         .notes('This route is also exposed via the POST method because the '
                'request parameters can be quite long, and encoding them in the '
                'URL (as is standard when using the GET method) can cause the '
@@ -146,17 +146,22 @@ class Resource(BaseResource):
                    '"folder": [(folder id 1)]}.', requireObject=True)
         .param('includeMetadata', 'Include any metadata in JSON files in the '
                'archive.', required=False, dataType='boolean', default=False)
-        .produces('application/zip')
+        .param('format', 'The archive format.', required=False,
+               enum=list(ARCHIVE_FORMATS), default='zip')
+        .param('compression', 'Whether to compress the files in a zip archive.  Files '
+               'of types that are already compressed are stored as they are.',
+               required=False, dataType='boolean', default=False)
+        .produces(['application/zip', 'application/x-tar', 'application/zstd'])
         .errorResponse('Unsupported or unknown resource type.')
         .errorResponse('Invalid resources format.')
         .errorResponse('No resources specified.')
         .errorResponse('Resource not found.')
         .errorResponse('Read access was denied for a resource.', 403)
     )
-    def download(self, resources, includeMetadata):
+    def download(self, resources, includeMetadata, format, compression):
         """
-        Returns a generator function that will be used to stream out a zip
-        file containing the listed resource's contents, filtered by
+        Returns a generator function that will be used to stream out an
+        archive containing the listed resource's contents, filtered by
         permissions.
         """
         user = self.getCurrentUser()
@@ -168,20 +173,17 @@ class Resource(BaseResource):
             for id in resources[kind]:
                 if not model.load(id=id, user=user, level=AccessType.READ):
                     raise RestException('Resource %s %s not found.' % (kind, id))
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition('Resources.zip')
 
-        def stream():
-            zip = ziputil.ZipGenerator()
+        def files():
             for kind in resources:
                 model = ModelImporter.model(kind)
                 for id in resources[kind]:
                     doc = model.load(id=id, user=user, level=AccessType.READ)
-                    for (path, file) in model.fileList(
-                            doc=doc, user=user, includeMetadata=includeMetadata, subpath=True):
-                        yield from zip.addFile(file, path)
-            yield zip.footer()
-        return stream
+                    yield from model.fileList(
+                        doc=doc, user=user, includeMetadata=includeMetadata, subpath=True,
+                        data=False)
+
+        return archiveResponse('Resources', files, format=format, compression=compression)
 
     @access.user(scope=TokenScope.DATA_OWN)
     @autoDescribeRoute(
@@ -1,28 +1,202 @@
 import asyncio
+import concurrent.futures
+import io
 import logging
-import queue
+import os
+import re
 import socket
 import sys
 import threading
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+from http.cookies import CookieError, SimpleCookie
 
+import cherrypy
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import cptools, httputil
 from starlette.applications import Starlette
 from starlette.routing import Mount, WebSocketRoute
 
+from girder import __version__
 from girder.notification import UserNotificationsSocket
+from girder.utility import config
 from girder.wsgi import app as wsgi_app
+from girder.wsgi import info
+
+# The size of the reads used to send a wrapped file when the ASGI server
+# cannot send it directly from disk, and the most bytes of response chunks that
+# are taken from the WSGI app at once and joined into one message
+FILE_CHUNK_SIZE = 1024 * 1024
+# The most response chunks of a request that are taken from the WSGI app at
+# once, unless GIRDER_ASGI_QUEUE_DEPTH is set
+RESPONSE_QUEUE_DEPTH = 8
+# GET requests for these resources by ID are dispatched straight to their REST
+# resource rather than through CherryPy, unless GIRDER_ASGI_DIRECT_ROUTES=false
+DIRECT_ROUTE_RESOURCES = ('item', 'folder', 'file')
+
+_executor = None
+_executorPid = None
+_executorLock = threading.Lock()
+
+
+def _wsgi_executor():
+    """
+    Get the pool of threads that run the WSGI app. Its size is the
+    ``server.thread_pool`` setting (``GIRDER_THREAD_POOL``).
+    """
+    global _executor, _executorPid
+    with _executorLock:
+        if _executor is None or _executorPid != os.getpid():
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=config.getConfig()['server.thread_pool'],
+                thread_name_prefix='girder-wsgi')
+            _executorPid = os.getpid()
+        return _executor
+
+
+def _queue_depth():
+    try:
+        return max(int(os.environ['GIRDER_ASGI_QUEUE_DEPTH']), 1)
+    except (KeyError, ValueError):
+        return RESPONSE_QUEUE_DEPTH
+
+
+def _join_chunks(items):
+    """
+    Join runs of consecutive bytes chunks, up to FILE_CHUNK_SIZE, so that each
+    run is sent as one message.
+    """
+    run = []
+    size = 0
+    for item in items:
+        if isinstance(item, bytes):
+            if run and size + len(item) > FILE_CHUNK_SIZE:
+                yield b''.join(run)
+                run, size = [], 0
+            run.append(item)
+            size += len(item)
+            continue
+        if run:
+            yield b''.join(run)
+            run, size = [], 0
+        yield item
+    if run:
+        yield b''.join(run)
+
+
+class _FileWrapper:
+    """
+    The ``wsgi.file_wrapper`` offered to the WSGI app. If the app returns it
+    as the response body, the bridge sends the file itself rather than
+    iterating over it.
+    """
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, 'close'):
+            self.close = filelike.close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.filelike.read(self.blksize)
+        if data:
+            return data
+        raise StopIteration
+
+
+def _wrapped_file(result):
+    """
+    Get the file wrapper returned as the body of a WSGI response, or None.
+    CherryPy wraps the iterator of the body in its own response objects, one
+    for each layer of its WSGI pipeline.
+    """
+    body = result
+    while hasattr(body, 'iter_response'):
+        body = body.iter_response
+    if isinstance(body, _FileWrapper) and hasattr(body.filelike, 'fileno'):
+        return body
+    return None
+
+
+class _WSGIResponse:
+    """
+    The response of the WSGI app to a request. Its body is taken from the app
+    a batch of chunks at a time, each by a task on the WSGI pool, so that no
+    thread of the pool is held while the chunks are sent. CherryPy keeps the
+    request that it is serving in thread locals, so these are moved to
+    whichever thread takes the next batch.
+
+    :param result: The iterable returned by the WSGI app.
+    :param depth: The most chunks that are taken at once.
+    """
+
+    def __init__(self, result, depth):
+        self._result = result
+        self._iter = iter(result)
+        self._depth = depth
+        self._serving = (cherrypy.serving.request, cherrypy.serving.response)
+        self.file_wrapper = _wrapped_file(result)
+
+    @contextmanager
+    def _served(self):
+        cherrypy.serving.load(*self._serving)
+        try:
+            yield
+        finally:
+            cherrypy.serving.clear()
+
+    def take(self):
+        """
+        Take the next chunks of the body, up to the depth or FILE_CHUNK_SIZE
+        bytes. The last chunk is followed by None.
+        """
+        items = []
+        size = 0
+        with self._served():
+            while len(items) < self._depth and size < FILE_CHUNK_SIZE:
+                chunk = next(self._iter, None)
+                if chunk is None:
+                    items.append(None)
+                    break
+                if chunk:
+                    items.append(bytes(chunk))
+                    size += len(chunk)
+        return items
+
+    def close(self):
+        with self._served():
+            if hasattr(self._result, 'close'):
+                self._result.close()
 
 
 class _WSGIBridge:
     """
     Streaming WSGI bridge for ASGI.
 
-    Streams request bodies directly to the WSGI app via a socketpair,
+    Runs the WSGI app on a bounded pool of threads. Request bodies that arrive
+    in more than one message are streamed to the app via a socketpair,
     eliminating async/sync round-trip overhead and large memory copies.
+
+    :param api_root: If set, the ``v1`` node of the REST API, whose resources
+        handle GET requests for the ``DIRECT_ROUTE_RESOURCES`` by ID directly.
+    :param tree: The CherryPy tree that the REST API is mounted in, which is
+        required with ``api_root``.
     """
 
-    def __init__(self, wsgi_app):
+    def __init__(self, wsgi_app, api_root=None, tree=None):
         self._app = wsgi_app
+        self._api_root = api_root
+        self._api_apps = {}
+        self._direct_route = None
+        if api_root is not None:
+            self._api_apps = {
+                script_name: app for script_name, app in tree.apps.items()
+                if getattr(app.root, 'v1', None) is api_root}
+            self._direct_route = re.compile(r'^(%s)/v1/(%s)/([0-9a-f]{24})$' % (
+                '|'.join(re.escape(script_name) for script_name in self._api_apps),
+                '|'.join(DIRECT_ROUTE_RESOURCES)))
 
     def _build_environ(self, scope, body_file):
         environ = {
@@ -38,6 +212,7 @@ class _WSGIBridge:
             'wsgi.multithread': True,
             'wsgi.multiprocess': False,
             'wsgi.run_once': False,
+            'wsgi.file_wrapper': _FileWrapper,
         }
         client = scope.get('client')
         if client:
@@ -58,17 +233,157 @@ class _WSGIBridge:
             environ['wsgi.input_terminated'] = True
         return environ
 
-    async def __call__(self, scope, receive, send):  # noqa
+    async def _send_file(self, scope, send, file_wrapper, headers):
+        """
+        Send a wrapped file from its current position, up to the Content-Length
+        of the response. The file is sent directly from disk if the server
+        supports the zero-copy or path send extensions; otherwise it is read
+        off the event loop in large chunks. Afterwards, the file is positioned
+        after the data that was sent, as if it had been read.
+
+        :returns: True if the response is complete.
+        """
+        loop = asyncio.get_running_loop()
+        fd = file_wrapper.filelike.fileno()
+        offset = os.lseek(fd, 0, os.SEEK_CUR)
+        size = os.fstat(fd).st_size
+        count = max(size - offset, 0)
+        for name, value in headers:
+            if name.lower() == b'content-length':
+                count = min(count, int(value))
+        extensions = scope.get('extensions') or {}
+        if 'http.response.zerocopysend' in extensions:
+            await send({
+                'type': 'http.response.zerocopysend',
+                'file': file_wrapper.filelike,
+                'offset': offset,
+                'count': count,
+                'more_body': False,
+            })
+            file_wrapper.filelike.seek(offset + count)
+            return True
+        path = getattr(file_wrapper.filelike, 'name', None)
+        if ('http.response.pathsend' in extensions and isinstance(path, str)
+                and offset == 0 and count == size):
+            await send({'type': 'http.response.pathsend', 'path': path})
+            file_wrapper.filelike.seek(count)
+            return True
+        while count > 0:
+            data = await loop.run_in_executor(
+                None, os.pread, fd, min(FILE_CHUNK_SIZE, count), offset)
+            if not data:
+                break
+            offset += len(data)
+            count -= len(data)
+            await send({
+                'type': 'http.response.body',
+                'body': data,
+                'more_body': True,
+            })
+        file_wrapper.filelike.seek(offset)
+        return False
+
+    async def __call__(self, scope, receive, send):
         if scope['type'] != 'http':
             return
+        if (self._direct_route is not None and scope['method'] == 'GET'
+                and not scope.get('root_path')):
+            match = self._direct_route.match(scope.get('path', ''))
+            if match and await self._call_direct(scope, send, *match.groups()):
+                return
+        await self._call_wsgi(scope, receive, send)
+
+    async def _call_direct(self, scope, send, script_name, resource, id):
+        """
+        Handle a GET request for a resource by ID by calling the GET method of
+        its REST resource, skipping CherryPy's dispatching and WSGI layer. Of
+        CherryPy's tools, only the proxy tool applies to these requests; it is
+        applied with the same configuration. Routing, REST events,
+        authentication, access checks and the encoding of the response are the
+        same as via the WSGI app.
+
+        :returns: False if the request must be handled by the WSGI app instead.
+        """
         loop = asyncio.get_running_loop()
-        rsock, wsock = socket.socketpair()
-        rsock.setblocking(True)
-        wsock.setblocking(False)
+        result = await loop.run_in_executor(
+            _wsgi_executor(), self._run_direct, scope, script_name, resource, id)
+        if result is None:
+            return False
+        status, headers, body = result
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers,
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+            'more_body': False,
+        })
+        return True
+
+    def _run_direct(self, scope, script_name, resource, id):
+        server = scope.get('server') or ('', 0)
+        client = scope.get('client') or ('', 0)
+        app = self._api_apps[script_name]
+        request = Request(
+            httputil.Host(server[0], server[1] or 0), httputil.Host(client[0], client[1] or 0),
+            scope.get('scheme', 'http'), f"HTTP/{scope.get('http_version', '1.1')}")
+        request.app = app
+        request.hooks = Request.hooks.copy()
+        request.method = 'GET'
+        request.script_name = script_name
+        request.path_info = scope['path'][len(script_name):]
+        request.query_string = scope.get('query_string', b'').decode('latin-1')
+        request.params = httputil.parse_query_string(request.query_string, encoding='utf-8')
+        request.headers = httputil.HeaderMap()
+        request.cookie = SimpleCookie()
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').title()
+            value = value.decode('latin-1').strip()
+            request.headers[name] = value
+            if name == 'Cookie':
+                try:
+                    request.cookie.load(value)
+                except CookieError:
+                    return None
+        request.base = '%s://%s' % (request.scheme, request.headers.get('Host') or server[0])
+
+        response = Response()
+        response.headers['Server'] = 'Girder %s' % __version__
+        cherrypy.serving.load(request, response)
+        try:
+            _apply_proxy(app)
+            try:
+                response.body = getattr(self._api_root, resource).GET(id, **request.params)
+            except cherrypy.HTTPRedirect as redirect:
+                redirect.set_response()
+            response.finalize()
+            body = response.collapse_body()
+        finally:
+            request.close()
+            cherrypy.serving.clear()
+        return int(response.output_status.split()[0]), response.header_list, body
+
+    async def _call_wsgi(self, scope, receive, send):  # noqa
+        loop = asyncio.get_running_loop()
+        first = await receive()
+        if first['type'] == 'http.disconnect':
+            return
+        if first.get('more_body', False):
+            rsock, wsock = socket.socketpair()
+            rsock.setblocking(True)
+            wsock.setblocking(False)
+            body_file = rsock.makefile('rb')
+        else:
+            # The whole body has arrived, so it needn't be streamed
+            rsock = wsock = None
+            body_file = io.BytesIO(first.get('body', b''))
+        executor = _wsgi_executor()
+        depth = _queue_depth()
         response_status = {}
         response_headers = []
-        chunk_queue = queue.Queue(maxsize=1)
-        error = []
+        written = []
 
         def start_response(status, headers, exc_info=None):
             response_headers.clear()
@@ -80,43 +395,53 @@ class _WSGIBridge:
 
             def write(data):
                 if data:
-                    chunk_queue.put(bytes(data))
+                    written.append(bytes(data))
 
             return write
 
-        def run_wsgi():
-            body_file = rsock.makefile('rb')
+        def close_body():
+            body_file.close()
+            if rsock is not None:
+                rsock.close()
+
+        def start():
+            """
+            Call the WSGI app and take the first chunks of its response.
+            """
             try:
                 environ = self._build_environ(scope, body_file)
-                result = self._app(environ, start_response)
+                response = _WSGIResponse(self._app(environ, start_response), depth)
+                cherrypy.serving.clear()
                 try:
-                    for chunk in result:
-                        if chunk:
-                            chunk_queue.put(bytes(chunk))
-                finally:
-                    if hasattr(result, 'close'):
-                        result.close()
-            except Exception as exc:
-                error.append(exc)
-            finally:
-                chunk_queue.put(None)
-                body_file.close()
-                rsock.close()
+                    items = [] if response.file_wrapper is not None else response.take()
+                except BaseException:
+                    response.close()
+                    raise
+            except BaseException:
+                close_body()
+                raise
+            return response, written + items
 
-        thread = threading.Thread(target=run_wsgi, daemon=True)
-        thread.start()
+        def finish(response):
+            try:
+                response.close()
+            finally:
+                close_body()
 
         async def handle_request():
+            if wsock is None:
+                return
             try:
+                message = first
                 while True:
-                    message = await receive()
-                    if message['type'] == 'http.disconnect':
-                        break
                     body = message.get('body', b'')
                     if body:
                         await loop.sock_sendall(wsock, body)
                     if not message.get('more_body', False):
                         break
+                    message = await receive()
+                    if message['type'] == 'http.disconnect':
+                        break
             finally:
                 try:
                     wsock.shutdown(socket.SHUT_WR)
@@ -124,30 +449,44 @@ class _WSGIBridge:
                     pass
                 wsock.close()
 
-        async def handle_response():
-            headers_sent = False
-            while True:
-                chunk = await loop.run_in_executor(None, chunk_queue.get)
-                if not headers_sent:
-                    await send({
-                        'type': 'http.response.start',
-                        'status': response_status.get('code', 500),
-                        'headers': response_headers,
-                    })
-                    headers_sent = True
-                if chunk is None:
-                    await send({
-                        'type': 'http.response.body',
-                        'body': b'',
-                        'more_body': False,
-                    })
-                    break
+        async def send_items(items):
+            for chunk in _join_chunks(items):
                 await send({
                     'type': 'http.response.body',
-                    'body': chunk,
-                    'more_body': True,
+                    'body': chunk or b'',
+                    'more_body': chunk is not None,
                 })
 
+        async def handle_response():
+            # The app runs on the pool, but neither it nor the taking of the
+            # next chunks are cancelled with the request, so that the response
+            # is always closed once they are done.
+            started = loop.run_in_executor(executor, start)
+            taking = None
+            try:
+                response, items = await asyncio.shield(started)
+                await send({
+                    'type': 'http.response.start',
+                    'status': response_status.get('code', 500),
+                    'headers': response_headers,
+                })
+                if response.file_wrapper is not None:
+                    if not await self._send_file(
+                            scope, send, response.file_wrapper, response_headers):
+                        await send_items([None])
+                    return
+                while items[-1] is not None:
+                    # Take the next chunks while these are sent
+                    taking = loop.run_in_executor(executor, response.take)
+                    await send_items(items)
+                    items = await asyncio.shield(taking)
+                    taking = None
+                await send_items(items)
+            finally:
+                await asyncio.wait([future for future in (started, taking) if future])
+                if not started.exception():
+                    await loop.run_in_executor(executor, finish, started.result()[0])
+
         req_task = asyncio.create_task(handle_request())
         res_task = asyncio.create_task(handle_response())
         try:
@@ -155,17 +494,27 @@ class _WSGIBridge:
         except BaseException:
             req_task.cancel()
             res_task.cancel()
-            while thread.is_alive():
-                try:
-                    if chunk_queue.get(timeout=0.1) is None:
-                        break
-                except queue.Empty:
-                    pass
             raise
-        finally:
-            await loop.run_in_executor(None, thread.join)
-        if error:
-            raise error[0]
+
+
+def _apply_proxy(app):
+    """
+    Apply CherryPy's proxy tool to the request being served, if it is enabled
+    in the global or application configuration.
+    """
+    conf = dict(cherrypy.config)
+    conf.update(app.config.get('/', {}))
+    if conf.get('tools.proxy.on'):
+        cptools.proxy(**{
+            key[len('tools.proxy.'):]: value for key, value in conf.items()
+            if key.startswith('tools.proxy.')
+            and key not in ('tools.proxy.on', 'tools.proxy.priority')})
+
+
+def _direct_api_root():
+    if os.environ.get('GIRDER_ASGI_DIRECT_ROUTES', '').lower() in ('0', 'false'):
+        return None
+    return info['apiRoot']
 
 
 @asynccontextmanager
@@ -179,6 +528,6 @@ app = Starlette(
     lifespan=lifespan,
     routes=[
         WebSocketRoute('/notifications/me', UserNotificationsSocket),
-        Mount('/', app=_WSGIBridge(wsgi_app)),
+        Mount('/', app=_WSGIBridge(wsgi_app, _direct_api_root(), info['serverRoot'])),
     ],
 )
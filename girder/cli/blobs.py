@@ -0,0 +1,77 @@
+import os
+
+import click
+
+from girder.utility import config
+
+_default_db_url = os.environ.get('GIRDER_MONGO_URI', 'mongodb://localhost:27017/girder')
+
+_REPORT_LINES = (
+    ('blobs', 'blobBytes', 'Stored blobs'),
+    ('files', 'fileBytes', 'Files referencing them'),
+    ('sharedBlobs', 'savedBytes', 'Shared blobs (bytes saved)'),
+    ('orphanedBlobs', 'orphanedBytes', 'Orphaned blobs'),
+    ('reclaimedBlobs', 'reclaimedBytes', 'Reclaimed blobs'),
+)
+
+
+def _assetstores(assetstore):
+    from bson.objectid import ObjectId
+
+    from girder.constants import AssetstoreType
+    from girder.models.assetstore import Assetstore
+
+    query = {'type': AssetstoreType.FILESYSTEM}
+    if assetstore:
+        query['$or'] = [{'name': assetstore}]
+        if ObjectId.is_valid(assetstore):
+            query['$or'].append({'_id': ObjectId(assetstore)})
+    assetstores = list(Assetstore().find(query, sort=[('name', 1)]))
+    if assetstore and not assetstores:
+        raise click.BadParameter(
+            'No filesystem assetstore is named %s.' % assetstore, param_hint='--assetstore')
+    return assetstores
+
+
+def _run(assetstore, batchSize, **kwargs):
+    from girder.utility import assetstore_utilities
+
+    for doc in _assetstores(assetstore):
+        adapter = assetstore_utilities.getAssetstoreAdapter(doc)
+        report = adapter.blobReport(batchSize=batchSize, **kwargs)
+        click.echo('%s (%s)' % (doc['name'], doc['root']))
+        for count, size, label in _REPORT_LINES:
+            click.echo('  %-28s %12d %16d bytes' % (label, report[count], report[size]))
+        click.echo('  %-28s %12d' % ('Missing blobs', report['missingBlobs']))
+
+
+@click.group(name='blobs', short_help='Report on the data in filesystem assetstores.',
+             help='Compare the data stored in filesystem assetstores with the files that '
+             'reference it.')
+@click.option('-d', '--database', default=_default_db_url,
+              show_default=True, help='The database URI to connect to')
+def main(database):
+    config.getConfig()['database']['uri'] = database
+
+
+@main.command(name='report', help='Report the space used by stored data, the space saved '
+              'by files sharing identical data, data that no file references, and files '
+              'whose data is missing.')
+@click.option('--assetstore', help='The name or ID of the assetstore to check.  By '
+              'default, all filesystem assetstores are checked.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='The number of files to fetch from the database at a time')
+def report(assetstore, batch_size):
+    _run(assetstore, batch_size)
+
+
+@main.command(name='reclaim', help='Delete stored data that no file or upload references.  '
+              'This is safe to run while the server is running.')
+@click.option('--assetstore', help='The name or ID of the assetstore to reclaim space in.  '
+              'By default, space is reclaimed in all filesystem assetstores.')
+@click.option('--minimum-age', type=float, default=1, show_default=True,
+              help='Only delete data that has not been modified for at least this many days')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='The number of files to fetch from the database at a time')
+def reclaim(assetstore, minimum_age, batch_size):
+    _run(assetstore, batch_size, reclaim=True, minimumAge=minimum_age)
@@ -0,0 +1,41 @@
+import os
+
+import click
+
+from girder.utility import config
+
+_default_db_url = os.environ.get('GIRDER_MONGO_URI', 'mongodb://localhost:27017/girder')
+
+
+@click.group(name='migrate', short_help='Run Girder data migrations.',
+             help='Run data migrations against a Girder database.')
+@click.option('-d', '--database', default=_default_db_url,
+              show_default=True, help='The database URI to connect to')
+def main(database):
+    config.getConfig()['database']['uri'] = database
+
+
+@main.command(name='ancestors', help='Backfill the ancestorIds field of folders and items. '
+              'This is safe to run while the server is running, and may be interrupted and rerun.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='The number of documents to update per batch')
+def ancestors(batch_size):
+    from girder.models.folder import Folder
+
+    folders, items = Folder().backfillAncestorIds(batchSize=batch_size)
+    click.echo('Updated ancestorIds on %d folders and %d items.' % (folders, items))
+
+
+@main.command(name='access', help='Backfill the inheritedAccess field of items and files. '
+              'This may be interrupted and rerun.  Access changes made to folders while it '
+              'runs may not be copied, so it should be run when access lists are not being '
+              'modified.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='The number of documents to read per batch')
+def access(batch_size):
+    from girder.models.file import File
+    from girder.models.item import Item
+
+    items = Item().backfillInheritedAccess(batchSize=batch_size)
+    files = File().backfillInheritedAccess(batchSize=batch_size)
+    click.echo('Updated inheritedAccess on %d items and %d files.' % (items, files))
@@ -0,0 +1,62 @@
+import os
+import time
+
+import click
+
+from girder.utility import config
+
+_default_db_url = os.environ.get('GIRDER_MONGO_URI', 'mongodb://localhost:27017/girder')
+
+
+@click.group(name='sizes', short_help='Maintain the sizes of Girder resources.',
+             help='Apply buffered size changes and fix the sizes of items, folders, '
+             'collections, and users.')
+@click.option('-d', '--database', default=_default_db_url,
+              show_default=True, help='The database URI to connect to')
+def main(database):
+    config.getConfig()['database']['uri'] = database
+
+
+@main.command(name='apply', help='Apply the size changes recorded while the '
+              'core.buffer_size_changes setting is enabled.  This may be run by several '
+              'processes at once.')
+@click.option('--batch-size', type=int, default=1000, show_default=True,
+              help='The number of logged changes to apply per batch')
+@click.option('--interval', type=float, default=0,
+              help='If set, keep running, checking for new changes after this many seconds')
+def apply(batch_size, interval):
+    from girder.models.size_delta import SizeDelta
+
+    while True:
+        total = 0
+        while True:
+            applied = SizeDelta().applyPending(limit=batch_size)
+            total += applied
+            if applied < batch_size:
+                break
+        if not interval:
+            click.echo('Applied %d logged size changes.' % total)
+            return
+        time.sleep(interval)
+
+
+@main.command(name='reconcile', help='Check and fix the sizes of items, folders, collections, '
+              'and users.  Each run continues from where the previous one stopped.  This is safe '
+              'to run while the server is running.')
+@click.option('--batch-size', type=int, default=100, show_default=True,
+              help='The number of resources to check per batch')
+@click.option('--batches', type=int, default=0,
+              help='The number of batches to check.  By default, checking continues until '
+              'the end of the current pass.')
+def reconcile(batch_size, batches):
+    from girder.models.size_delta import SizeDelta
+
+    checked = fixed = count = 0
+    while True:
+        result = SizeDelta().reconcile(batchSize=batch_size)
+        checked += result['checked']
+        fixed += result['fixed']
+        count += 1
+        if result['completed'] or count == batches:
+            break
+    click.echo('Checked %d resources and fixed %d sizes.' % (checked, fixed))
@@ -210,6 +210,9 @@ class CoreEventHandler:
     # For updating an item's size to include a new file.
     FILE_PROPAGATE_SIZE = 'core.propagateSizeToItem'
 
+    # For rereading the size change buffering setting when it changes.
+    SIZE_DELTA_SETTING = 'core.sizeDeltaSetting'
+
     # For adding a group's creator into its ACL at creation time.
     GROUP_CREATOR_ACCESS = 'core.grantCreatorAccess'
 
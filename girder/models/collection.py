@@ -5,6 +5,7 @@ from girder.constants import AccessType
 from girder.exceptions import ValidationException
 from girder.settings import SettingKey
 from girder.utility.progress import noProgress
+from girder.utility.subtree_delete import SubtreeDelete
 
 from .model_base import AccessControlledModel
 
@@ -61,22 +62,17 @@ class Collection(AccessControlledModel):
 
     def remove(self, collection, progress=None, **kwargs):
         """
-        Delete a collection recursively.
+        Delete a collection recursively.  Its contents are deleted a batch at
+        a time by :py:class:`girder.utility.subtree_delete.SubtreeDelete`,
+        which triggers ``model.<name>.bulkRemove`` events rather than the
+        per-document remove events.
 
         :param collection: The collection document to delete.
         :type collection: dict
         :param progress: A progress context to record progress on.
         :type progress: girder.utility.progress.ProgressContext or None.
         """
-        from .folder import Folder
-
-        folderModel = Folder()
-        folders = folderModel.find({
-            'parentId': collection['_id'],
-            'parentCollection': 'collection'
-        })
-        for folder in folders:
-            folderModel.remove(folder, progress=progress, **kwargs)
+        SubtreeDelete(collection, 'collection', progress=progress).run()
 
         # Delete this collection
         super().remove(collection)
@@ -11,6 +11,7 @@ from girder.models.setting import Setting
 from girder.settings import SettingKey
 from girder.utility import acl_mixin
 from girder.utility import path as path_util
+from girder.utility import ziputil
 from girder.utility.model_importer import ModelImporter
 
 from .model_base import AccessControlledModel, Model
@@ -18,6 +19,24 @@ from .model_base import AccessControlledModel, Model
 logger = logging.getLogger(__name__)
 
 
+def _notifyOnClose(fileWrapper, size, callback):
+    """
+    Call a function when the server closes a ``wsgi.file_wrapper`` after
+    sending all of its file. The position of the file shows how much of it
+    was sent.
+    """
+    close = fileWrapper.close
+
+    def closeWrapper():
+        sent = fileWrapper.filelike.tell() >= size
+        close()
+        if sent:
+            callback()
+
+    fileWrapper.close = closeWrapper
+    return fileWrapper
+
+
 class File(acl_mixin.AccessControlMixin, Model):
     """
     This model represents a File, which is stored in an assetstore.
@@ -28,11 +47,12 @@ class File(acl_mixin.AccessControlMixin, Model):
 
         self.name = 'file'
         self.ensureIndices(
-            ['itemId', 'assetstoreId', 'exts']
+            ['itemId', 'assetstoreId', 'exts', 'inheritedAccess.sourceId']
             + assetstore_utilities.fileIndexFields())
         self.ensureTextIndex({'name': 1})
         self.resourceColl = 'item'
         self.resourceParent = 'itemId'
+        self.storeInheritedAccess = True
 
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'mimeType', 'itemId', 'exts', 'name', 'created', 'creatorId',
@@ -114,15 +134,29 @@ class File(acl_mixin.AccessControlMixin, Model):
                     contentDisposition=contentDisposition,
                     extraParameters=extraParameters)
 
-                def downloadGenerator():
-                    yield from fileDownload()
+                def downloadComplete():
                     if endByte is None or endByte >= file['size']:
                         events.trigger('model.file.download.complete', info={
                             'file': file,
                             'startByte': offset,
                             'endByte': endByte,
                             'redirect': False})
-                return downloadGenerator
+
+                def downloadGenerator(result):
+                    yield from result
+                    # If the data was read ahead for an archive, the event is
+                    # triggered once the archive has taken all of it
+                    ziputil.whenConsumed(downloadComplete)
+
+                def download():
+                    result = fileDownload()
+                    if getattr(result, 'filelike', None) is None:
+                        return downloadGenerator(result)
+                    # The adapter returned the whole file in a
+                    # wsgi.file_wrapper, which is passed through so that the
+                    # server can send it from disk.
+                    return _notifyOnClose(result, file['size'], downloadComplete)
+                return download
             except cherrypy.HTTPRedirect:
                 events.trigger('model.file.download.complete', info={
                     'file': file,
@@ -141,14 +175,17 @@ class File(acl_mixin.AccessControlMixin, Model):
             else:
                 endByte = endByte or len(file['linkUrl'])
 
+                def downloadComplete():
+                    events.trigger('model.file.download.complete', info={
+                        'file': file,
+                        'startByte': offset,
+                        'endByte': endByte,
+                        'redirect': False})
+
                 def stream():
                     yield file['linkUrl'][offset:endByte]
                     if endByte >= len(file['linkUrl']):
-                        events.trigger('model.file.download.complete', info={
-                            'file': file,
-                            'startByte': offset,
-                            'endByte': endByte,
-                            'redirect': False})
+                        ziputil.whenConsumed(downloadComplete)
                 return stream
         else:
             raise Exception('File has no known download mechanism.')
@@ -172,6 +209,7 @@ class File(acl_mixin.AccessControlMixin, Model):
             raise ValidationException('File name must not be empty.', 'name')
 
         doc['exts'] = [ext.lower() for ext in doc['name'].split('.')[1:]]
+        self._updateInheritedAccess(doc)
 
         return doc
 
@@ -238,6 +276,9 @@ class File(acl_mixin.AccessControlMixin, Model):
                 'assetstoreId': None,
                 'name': name
             }
+            inheritedAccess = self._inheritedAccessFromParentDoc(item)
+            if inheritedAccess is not None:
+                file['inheritedAccess'] = inheritedAccess
 
         file.update({
             'creatorId': creator['_id'],
@@ -264,7 +305,10 @@ class File(acl_mixin.AccessControlMixin, Model):
         parents in the hierarchy. Internally, this records subtree size in
         the item, the parent folder, and the root node under which the item
         lives. Should be called anytime a new file is added, a file is
-        deleted, or a file size changes.
+        deleted, or a file size changes. If the ``core.buffer_size_changes``
+        setting is enabled, the changes to the folder and root node are
+        recorded in the size delta log and applied later; the item size is
+        always changed immediately.
 
         :param item: The parent item of the file.
         :type item: dict
@@ -274,8 +318,8 @@ class File(acl_mixin.AccessControlMixin, Model):
             False if you plan to delete the item immediately and don't care to
             update its size.
         """
-        from .folder import Folder
         from .item import Item
+        from .size_delta import SizeDelta
 
         if updateItemSize:
             # Propagate size up to item
@@ -283,15 +327,10 @@ class File(acl_mixin.AccessControlMixin, Model):
                 '_id': item['_id']
             }, field='size', amount=sizeIncrement, multi=False)
 
-        # Propagate size to direct parent folder
-        Folder().increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=sizeIncrement, multi=False)
-
-        # Propagate size up to root data node
-        ModelImporter.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=sizeIncrement, multi=False)
+        SizeDelta().propagate([
+            ('folder', item['folderId'], sizeIncrement),
+            (item['baseParentType'], item['baseParentId'], sizeIncrement)
+        ])
 
     def createFile(self, creator, item, name, size, assetstore, mimeType=None,
                    saveFile=True, reuseExisting=False, assetstoreType=None):
@@ -335,6 +374,9 @@ class File(acl_mixin.AccessControlMixin, Model):
             'size': size,
             'itemId': item['_id'] if item else None
         }
+        inheritedAccess = self._inheritedAccessFromParentDoc(item)
+        if inheritedAccess is not None:
+            file['inheritedAccess'] = inheritedAccess
 
         if assetstoreType:
             file['assetstoreType'] = assetstoreType
@@ -1,17 +1,25 @@
+import collections
 import copy
 import datetime
 import json
 import os
 
+import bson
 from bson.objectid import ObjectId
+from dogpile.cache.api import NO_VALUE
+from pymongo import UpdateMany, UpdateOne
 
 from girder import events
 from girder.constants import AccessType
 from girder.exceptions import GirderException, ValidationException
+from girder.utility._cache import requestCache
+from girder.utility.acl_mixin import _inheritableAccess
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import noProgress
+from girder.utility.subtree_copy import SubtreeCopy
+from girder.utility.subtree_delete import SubtreeDelete
 
-from .model_base import AccessControlledModel
+from .model_base import AccessControlledModel, _invalidateAclCache
 
 
 class Folder(AccessControlledModel):
@@ -23,10 +31,15 @@ class Folder(AccessControlledModel):
     Top-level folders are ones whose parent is a user or a collection.
     """
 
+    # Set once every folder and item is known to have ancestorIds
+    _ancestorIdsComplete = False
+
     def initialize(self):
         self.name = 'folder'
-        self.ensureIndices(('parentId', 'name', 'lowerName',
-                            ([('parentId', 1), ('name', 1)], {})))
+        self.trackChanges = True
+        self.ensureIndices(('parentId', 'name', 'lowerName', 'ancestorIds',
+                            ([('parentId', 1), ('name', 1)], {}),
+                            ([('parentId', 1), ('lowerName', 1), ('_id', 1)], {})))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
@@ -120,7 +133,7 @@ class Folder(AccessControlledModel):
         """
         # Ensure we include extra fields to do the migration below
         extraFields = {'baseParentId', 'baseParentType', 'parentId', 'parentCollection', 'meta',
-                       'name', 'lowerName'}
+                       'name', 'lowerName', 'ancestorIds'}
         loadFields = self._supplementFields(fields, extraFields)
 
         doc = super().load(
@@ -147,18 +160,152 @@ class Folder(AccessControlledModel):
                 self.update({'_id': doc['_id']}, {'$set': {
                     'meta': {}
                 }})
+            if 'ancestorIds' not in doc:
+                doc['ancestorIds'] = self.getAncestorIds(doc)
+                self.update({'_id': doc['_id']}, {'$set': {
+                    'ancestorIds': doc['ancestorIds']
+                }})
 
             self._removeSupplementalFields(doc, fields)
 
         return doc
 
+    def getAncestorIds(self, folder):
+        """
+        Return the ids of the folders above a folder, ordered from the top-level
+        folder down to its immediate parent.  Folders under a user or
+        collection have no ancestors.  Every folder and item stores this list
+        as ``ancestorIds`` (items also include their own folder), which lets
+        subtree operations query a whole hierarchy at once.  For documents
+        that predate the field, the list is computed by walking up the tree.
+
+        :param folder: The folder document.  This may be a partial document.
+        :type folder: dict
+        :returns: a list of folder ids.
+        """
+        if 'ancestorIds' in folder:
+            return folder['ancestorIds']
+        if 'parentCollection' not in folder:
+            folder = self.load(folder['_id'], force=True, fields=[
+                'parentId', 'parentCollection', 'ancestorIds'])
+            if folder is None:
+                return []
+            if 'ancestorIds' in folder:
+                return folder['ancestorIds']
+        if folder['parentCollection'] != 'folder':
+            return []
+        parent = self.load(folder['parentId'], force=True, fields=[
+            'parentId', 'parentCollection', 'ancestorIds'])
+        if parent is None:
+            # An orphaned folder; its ancestry above the missing parent is unknown
+            return [folder['parentId']]
+        return parent['ancestorIds'] + [parent['_id']]
+
+    def hasCompleteAncestorIds(self):
+        """
+        Whether every folder and item in the database has an ``ancestorIds``
+        field, so that subtree queries may rely on it.  Databases created
+        before this field existed must be backfilled (see
+        :py:meth:`backfillAncestorIds`) before the recursive code paths are
+        bypassed.  Once this is true, the result is remembered; until then, a
+        false result is remembered for the rest of the request when the request
+        cache is enabled.
+        """
+        from .item import Item
+
+        if not self._ancestorIdsComplete:
+            if requestCache.get('folder.ancestorIdsIncomplete') is not NO_VALUE:
+                return False
+            self._ancestorIdsComplete = all(
+                model.findOne({'ancestorIds': {'$exists': False}}, fields=['_id']) is None
+                for model in (self, Item()))
+            if not self._ancestorIdsComplete:
+                requestCache.set('folder.ancestorIdsIncomplete', True)
+        return self._ancestorIdsComplete
+
+    def backfillAncestorIds(self, batchSize=1000, progress=noProgress):
+        """
+        Populate ``ancestorIds`` on all folders and items that lack it.  This
+        is the migration for databases created before the field existed.  Work
+        is done in batches of bulk writes so that it can be run against very
+        large databases, and it is safe to interrupt and rerun.
+
+        :param batchSize: The number of documents to read and update per batch.
+        :type batchSize: int
+        :param progress: Progress context to update.
+        :type progress: :py:class:`girder.utility.progress.ProgressContext`
+        :returns: a tuple of the number of folders and items updated.
+        """
+        from .item import Item
+
+        # Ancestors of recently resolved folders, so walking up from a batch of
+        # siblings or cousins doesn't repeatedly load the same parents.
+        known = collections.OrderedDict()
+
+        def ancestorsOf(folderId):
+            if folderId in known:
+                known.move_to_end(folderId)
+                return known[folderId]
+            folder = self.findOne({'_id': folderId}, fields=[
+                'parentId', 'parentCollection', 'ancestorIds'])
+            if folder is None:
+                ancestorIds = []
+            elif 'ancestorIds' in folder:
+                ancestorIds = folder['ancestorIds']
+            elif folder['parentCollection'] != 'folder':
+                ancestorIds = []
+            else:
+                ancestorIds = ancestorsOf(folder['parentId']) + [folder['parentId']]
+            known[folderId] = ancestorIds
+            if len(known) > batchSize * 10:
+                known.popitem(last=False)
+            return ancestorIds
+
+        counts = []
+        for model, query, parentKey in (
+                (self, {'parentCollection': 'folder'}, 'parentId'),
+                (Item(), {}, 'folderId')):
+            updated = 0
+            # Top-level folders have no ancestors, so they can be set at once
+            if model is self:
+                updated += self.update({
+                    'parentCollection': {'$ne': 'folder'},
+                    'ancestorIds': {'$exists': False}
+                }, {'$set': {'ancestorIds': []}}).modified_count
+            query = dict(query, ancestorIds={'$exists': False})
+            while True:
+                batch = list(model.find(
+                    query, limit=batchSize, sort=[('_id', 1)], fields=[parentKey]))
+                if not batch:
+                    break
+                # Siblings share ancestors, so group the updates by parent.
+                # Every document in a batch is updated, so the next query
+                # returns the following batch.
+                parentIds = {doc[parentKey] for doc in batch}
+                result = model.collection.bulk_write([UpdateMany(
+                    {parentKey: parentId, 'ancestorIds': {'$exists': False}},
+                    {'$set': {'ancestorIds': ancestorsOf(parentId) + [parentId]}}
+                ) for parentId in parentIds], ordered=False)
+                updated += result.modified_count
+                progress.update(increment=result.modified_count, message='Updated %d %ss' % (
+                    updated, model.name))
+            counts.append(updated)
+        return tuple(counts)
+
     def getSizeRecursive(self, folder):
         """
-        Calculate the total size of the folder by recursing into all of its
-        descendant folders.
+        Calculate the total size of the folder by summing the sizes of all of
+        its descendant folders.
         """
         size = folder['size']
 
+        if self.hasCompleteAncestorIds():
+            result = list(self.collection.aggregate([
+                {'$match': {'ancestorIds': folder['_id']}},
+                {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+            ]))
+            return size + (result[0]['size'] if result else 0)
+
         q = {
             'parentId': folder['_id'],
             'parentCollection': 'folder'
@@ -229,6 +376,19 @@ class Folder(AccessControlledModel):
 
         return self.save(folder)
 
+    def bulkSetMetadata(self, updates=None, query=None, metadata=None, user=None,
+                        level=AccessType.WRITE, force=False, allowNull=False, batchSize=1000):
+        """
+        Set metadata on many folders at once, triggering a single
+        ``model.folder.bulkSetMetadata.after`` event. See
+        :py:meth:`girder.models.item.Item.bulkSetMetadata` for the parameters.
+
+        :returns: A dict with the ``matched`` and ``modified`` document counts.
+        """
+        return self._bulkSetMetadata(
+            updates=updates, query=query, metadata=metadata, user=user, level=level,
+            force=force, allowNull=allowNull, batchSize=batchSize)
+
     def _updateDescendants(self, folderId, updateQuery):
         """
         This helper is used to update all items and folders underneath a
@@ -241,6 +401,11 @@ class Folder(AccessControlledModel):
         """
         from .item import Item
 
+        if self.hasCompleteAncestorIds():
+            self.update(query={'ancestorIds': folderId}, update=updateQuery, multi=True)
+            Item().update(query={'ancestorIds': folderId}, update=updateQuery, multi=True)
+            return
+
         self.update(query={
             'parentId': folderId,
             'parentCollection': 'folder'
@@ -256,6 +421,27 @@ class Folder(AccessControlledModel):
         for child in self.find(q):
             self._updateDescendants(child['_id'], updateQuery)
 
+    def _replaceDescendantAncestors(self, folderId, newAncestorIds):
+        """
+        Rewrite the leading part of ``ancestorIds`` for every folder and item
+        underneath a folder that has been moved.  Everything before the moved
+        folder in each list is replaced by its new ancestors in a single
+        pipeline update per collection, so each document is rewritten
+        atomically.
+
+        :param folderId: The _id of the folder that was moved.
+        :param newAncestorIds: The ancestors of the folder after the move.
+        :type newAncestorIds: list
+        """
+        from .item import Item
+
+        for model in (self, Item()):
+            model.update({'ancestorIds': folderId}, [{'$set': {'ancestorIds': {
+                '$concatArrays': [newAncestorIds, {'$slice': [
+                    '$ancestorIds',
+                    {'$indexOfArray': ['$ancestorIds', folderId]},
+                    {'$size': '$ancestorIds'}]}]}}}])
+
     def _isAncestor(self, ancestor, descendant):
         """
         Returns whether folder "ancestor" is an ancestor of folder "descendant",
@@ -269,6 +455,9 @@ class Folder(AccessControlledModel):
         if ancestor['_id'] == descendant['_id']:
             return True
 
+        if 'ancestorIds' in descendant:
+            return ancestor['_id'] in descendant['ancestorIds']
+
         if descendant['parentCollection'] != 'folder':
             return False
 
@@ -296,8 +485,18 @@ class Folder(AccessControlledModel):
             raise ValidationException(
                 'You may not move a folder underneath itself.')
 
+        oldAncestorIds = self.getAncestorIds(folder)
+        if parentType == 'folder':
+            newAncestorIds = self.getAncestorIds(parent) + [parent['_id']]
+        else:
+            newAncestorIds = []
+
         folder['parentId'] = parent['_id']
         folder['parentCollection'] = parentType
+        folder['ancestorIds'] = newAncestorIds
+
+        if oldAncestorIds != newAncestorIds:
+            self._replaceDescendantAncestors(folder['_id'], newAncestorIds)
 
         if parentType == 'folder':
             rootType, rootId = parent['baseParentType'], parent['baseParentId']
@@ -306,16 +505,24 @@ class Folder(AccessControlledModel):
 
         if (folder['baseParentType'], folder['baseParentId']) !=\
            (rootType, rootId):
-            def propagateSizeChange(folder, inc):
-                ModelImporter.model(folder['baseParentType']).increment(query={
-                    '_id': folder['baseParentId']
-                }, field='size', amount=inc, multi=False)
-
+            from .size_delta import SizeDelta
+
+            # Pending changes inside the folder would be applied to its old
+            # base parent, so apply them before the size is moved.
+            if SizeDelta().hasPending():
+                if self.hasCompleteAncestorIds():
+                    SizeDelta().flush([folder['_id']] + [f['_id'] for f in self.find(
+                        {'ancestorIds': folder['_id']}, fields=['_id'])])
+                else:
+                    SizeDelta().flush()
+                folder['size'] = self.findOne({'_id': folder['_id']}, fields=['size'])['size']
             totalSize = self.getSizeRecursive(folder)
-            propagateSizeChange(folder, -totalSize)
+            SizeDelta().propagate([
+                (folder['baseParentType'], folder['baseParentId'], -totalSize),
+                (rootType, rootId, totalSize)
+            ])
             folder['baseParentType'] = rootType
             folder['baseParentId'] = rootId
-            propagateSizeChange(folder, totalSize)
             self._updateDescendants(folder['_id'], {
                 '$set': {
                     'baseParentType': rootType,
@@ -328,7 +535,11 @@ class Folder(AccessControlledModel):
     def clean(self, folder, progress=None, **kwargs):
         """
         Delete all contents underneath a folder recursively, but leave the
-        folder itself.
+        folder itself.  Once every folder and item has ``ancestorIds``, the
+        contents are deleted a batch at a time by
+        :py:class:`girder.utility.subtree_delete.SubtreeDelete`, which
+        triggers ``model.<name>.bulkRemove`` events rather than the
+        per-document remove events.
 
         :param folder: The folder document to delete.
         :type folder: dict
@@ -337,6 +548,10 @@ class Folder(AccessControlledModel):
         """
         from .item import Item
 
+        if self.hasCompleteAncestorIds():
+            SubtreeDelete(folder, 'folder', progress=progress).run()
+            return
+
         # Delete all child items
         itemModel = Item()
         items = itemModel.find({
@@ -509,6 +724,11 @@ class Folder(AccessControlledModel):
         else:
             creatorId = creator.get('_id', None)
 
+        if parentType == 'folder':
+            ancestorIds = self.getAncestorIds(parent) + [ObjectId(parent['_id'])]
+        else:
+            ancestorIds = []
+
         folder = {
             'name': name,
             'description': description,
@@ -516,6 +736,7 @@ class Folder(AccessControlledModel):
             'baseParentId': parent['baseParentId'],
             'baseParentType': parent['baseParentType'],
             'parentId': ObjectId(parent['_id']),
+            'ancestorIds': ancestorIds,
             'creatorId': creatorId,
             'created': now,
             'updated': now,
@@ -641,6 +862,14 @@ class Folder(AccessControlledModel):
         """
         count = 1
 
+        if level is None and self.hasCompleteAncestorIds():
+            from .item import Item
+
+            count += self.collection.count_documents({'ancestorIds': folder['_id']})
+            if includeItems:
+                count += Item().collection.count_documents({'ancestorIds': folder['_id']})
+            return count
+
         if includeItems:
             count += self.countItems(folder)
 
@@ -724,7 +953,7 @@ class Folder(AccessControlledModel):
 
     def copyFolder(self, srcFolder, parent=None, name=None, description=None,
                    parentType=None, public=None, creator=None, progress=None,
-                   firstFolder=None):
+                   firstFolder=None, bulk=False):
         """
         Copy a folder, including all child items and child folders.
 
@@ -751,6 +980,11 @@ class Folder(AccessControlledModel):
         :type progress: girder.utility.progress.ProgressContext or None.
         :param firstFolder: if not None, the first folder copied in a tree of
                             folders.
+        :param bulk: whether to copy the contents of the folder a batch at a
+            time with :py:class:`girder.utility.subtree_copy.SubtreeCopy`.
+            This triggers ``model.<name>.bulkCopy`` events in place of the
+            copy events of each item, file and subfolder.
+        :type bulk: bool
         :returns: the new folder document.
         """
         if parentType is None:
@@ -777,10 +1011,10 @@ class Folder(AccessControlledModel):
         if firstFolder is None:
             firstFolder = newFolder
         return self.copyFolderComponents(
-            srcFolder, newFolder, creator, progress, firstFolder)
+            srcFolder, newFolder, creator, progress, firstFolder, bulk=bulk)
 
     def copyFolderComponents(self, srcFolder, newFolder, creator, progress,
-                             firstFolder=None):
+                             firstFolder=None, bulk=False):
         """
         Copy the items, subfolders, and extended data of a folder that was just
         copied.
@@ -795,6 +1029,8 @@ class Folder(AccessControlledModel):
         :type progress: girder.utility.progress.ProgressContext or None.
         :param firstFolder: if not None, the first folder copied in a tree of
                             folders.
+        :param bulk: whether to copy the items and subfolders a batch at a time.
+        :type bulk: bool
         :returns: the new folder document.
         """
         from .item import Item
@@ -809,18 +1045,21 @@ class Folder(AccessControlledModel):
         newFolder = self.save(newFolder, triggerEvents=False)
         # Give listeners a chance to change things
         events.trigger('model.folder.copy.prepare', (srcFolder, newFolder))
-        # copy items
-        itemModel = Item()
-        for item in self.childItems(folder=srcFolder):
-            itemModel.copyItem(item, creator, folder=newFolder)
-            if progress:
-                progress.update(increment=1, message='Copied item ' + item['name'])
-        # copy subfolders
-        for sub in self.childFolders(parentType='folder', parent=srcFolder, user=creator):
-            if firstFolder and firstFolder['_id'] == sub['_id']:
-                continue
-            self.copyFolder(sub, parent=newFolder, parentType='folder',
-                            creator=creator, progress=progress)
+        if bulk:
+            SubtreeCopy(srcFolder, newFolder, creator, progress=progress).run()
+        else:
+            # copy items
+            itemModel = Item()
+            for item in self.childItems(folder=srcFolder):
+                itemModel.copyItem(item, creator, folder=newFolder)
+                if progress:
+                    progress.update(increment=1, message='Copied item ' + item['name'])
+            # copy subfolders
+            for sub in self.childFolders(parentType='folder', parent=srcFolder, user=creator):
+                if firstFolder and firstFolder['_id'] == sub['_id']:
+                    continue
+                self.copyFolder(sub, parent=newFolder, parentType='folder',
+                                creator=creator, progress=progress)
         events.trigger('model.folder.copy.after', newFolder)
         if progress:
             progress.update(increment=1, message='Copied folder ' + newFolder['name'])
@@ -869,7 +1108,11 @@ class Folder(AccessControlledModel):
         doc = AccessControlledModel.setAccessList(
             self, doc, access, user=user, save=save, force=force)
 
-        if recurse:
+        if recurse and self.hasCompleteAncestorIds():
+            self._setDescendantAccessList(
+                doc, access, user=user, progress=progress, setPublic=setPublic,
+                publicFlags=publicFlags, force=force)
+        elif recurse:
             subfolders = self.findWithPermissions({
                 'parentId': doc['_id'],
                 'parentCollection': 'folder'
@@ -882,6 +1125,125 @@ class Folder(AccessControlledModel):
 
         return doc
 
+    def _setDescendantAccessList(self, doc, access, user, progress, setPublic, publicFlags,
+                                 force, batchSize=1000):
+        """
+        Set the access list on every folder underneath a folder that the given
+        user has ADMIN access on, skipping the subtrees below any folder that
+        they do not.  This gives the same result as recursing through
+        :py:meth:`setAccessList`, but uses the ``ancestorIds`` index to find
+        the subtree with two queries and writes the changes in bulk.  Each
+        folder is still validated and triggers the save events.
+
+        Takes the same parameters as :py:meth:`setAccessList`.
+        """
+        # Folders the user can't administer block their own subtrees as well,
+        # so only the topmost of them need to be excluded.
+        permissions = self.permissionClauses(user, AccessType.ADMIN)
+        blocked = []
+        if permissions:
+            blocked = list(self.find({'$and': [
+                {'ancestorIds': doc['_id']}, {'$nor': [permissions]}
+            ]}, fields=['ancestorIds']))
+            blockedIds = {f['_id'] for f in blocked}
+            blocked = [
+                f['_id'] for f in blocked if blockedIds.isdisjoint(f['ancestorIds'])]
+
+        subfolders = self.find({'$and': [
+            {'ancestorIds': doc['_id']},
+            {'ancestorIds': {'$nin': blocked}},
+            {'_id': {'$nin': blocked}}
+        ]})
+
+        batch = []
+        for folder in subfolders:
+            progress.update(increment=1, message='Updating ' + folder['name'])
+            if setPublic is not None:
+                self.setPublic(folder, setPublic, save=False)
+            if publicFlags is not None:
+                folder = self.setPublicFlags(
+                    folder, publicFlags, user=user, save=False, force=force)
+            folder = AccessControlledModel.setAccessList(
+                self, folder, access, user=user, save=False, force=force)
+            batch.append(folder)
+            if len(batch) >= batchSize:
+                self._saveAclBatch(batch)
+                batch = []
+        if batch:
+            self._saveAclBatch(batch)
+
+    def _saveAclBatch(self, folders):
+        """
+        Save a batch of folders whose access control lists changed, as
+        :py:meth:`_saveAcl` does for a single folder, but with one bulk write.
+
+        :param folders: The full folder documents to save.
+        :type folders: list[dict]
+        """
+        saved = []
+        for folder in folders:
+            event = events.trigger('model.folder.validate', folder)
+            if not event.defaultPrevented:
+                folder = self.validate(folder)
+            event = events.trigger('model.folder.save', folder)
+            if not event.defaultPrevented:
+                saved.append(folder)
+        if not saved:
+            return
+        self.collection.bulk_write([UpdateOne({'_id': folder['_id']}, {'$set': {
+            key: value for key, value in folder.items() if key != '_id'
+        }}) for folder in saved], ordered=False)
+        for folder in saved:
+            _invalidateAclCache(self.name, folder['_id'])
+        self.propagateInheritedAccess(saved)
+        for folder in saved:
+            events.trigger('model.folder.save.after', folder)
+
+    def propagateInheritedAccess(self, folders):
+        """
+        Copy the access control lists of folders onto the items and files that
+        resolve their access through them.  See
+        :py:class:`girder.utility.acl_mixin.AccessControlMixin`.
+
+        :param folders: The folders whose access changed.  These must include
+            the ``public`` and ``access`` fields.
+        :type folders: list[dict]
+        """
+        from .file import File
+        from .item import Item
+
+        ops = [UpdateMany({'inheritedAccess.sourceId': folder['_id']}, {'$set': {
+            'inheritedAccess.%s' % key: value for key, value in _inheritableAccess(folder).items()
+        }}) for folder in folders]
+        if ops:
+            for model in (Item(), File()):
+                model.collection.bulk_write(ops, ordered=False)
+
+    def save(self, folder, *args, **kwargs):
+        """
+        Override of AccessControlledModel.save to update the copies of the
+        folder's access control list held by its items and files if it
+        changed.  The parameters are the same as Model.save.
+        """
+        # Folders loaded by load() or findOne() remember how they were loaded,
+        # so the previous access control list is only queried for others.
+        previous = None
+        snapshot = getattr(folder, '_snapshot', None)
+        if snapshot is not None:
+            previous = bson.decode(snapshot, self.collection.codec_options)
+        elif '_id' in folder:
+            previous = self.findOne({'_id': folder['_id']}, fields=['public', 'access'])
+        folder = super().save(folder, *args, **kwargs)
+        if previous is not None and _inheritableAccess(previous) != _inheritableAccess(folder):
+            self.propagateInheritedAccess([folder])
+        return folder
+
+    def _saveAcl(self, doc, update):
+        doc = super()._saveAcl(doc, update)
+        if '_id' in doc:
+            self.propagateInheritedAccess([doc])
+        return doc
+
     def isOrphan(self, folder):
         """
         Returns True if this folder is orphaned (its parent is missing).
@@ -10,7 +10,6 @@ from girder import events
 from girder.constants import AccessType
 from girder.exceptions import GirderException, ValidationException
 from girder.utility import acl_mixin
-from girder.utility.model_importer import ModelImporter
 
 from .model_base import Model
 
@@ -25,14 +24,18 @@ class Item(acl_mixin.AccessControlMixin, Model):
 
     def initialize(self):
         self.name = 'item'
-        self.ensureIndices(('folderId', 'name', 'lowerName',
-                            ([('folderId', 1), ('name', 1)], {})))
+        self.ensureIndices(('folderId', 'name', 'lowerName', 'ancestorIds',
+                            ([('folderId', 1), ('name', 1)], {}),
+                            ([('folderId', 1), ('lowerName', 1), ('_id', 1)], {}),
+                            'inheritedAccess.sourceId'))
         self.ensureTextIndex({
             'name': 10,
             'description': 1
         })
         self.resourceColl = 'folder'
         self.resourceParent = 'folderId'
+        self.storeInheritedAccess = True
+        self.trackChanges = True
 
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'size', 'updated', 'description', 'created', 'meta',
@@ -97,6 +100,13 @@ class Item(acl_mixin.AccessControlMixin, Model):
                 name = '%s (%d)' % (doc['name'], n)
 
         doc['lowerName'] = doc['name'].lower()
+
+        if self._updateInheritedAccess(doc) and '_id' in doc:
+            # The item was moved, so its files now resolve access elsewhere
+            from .file import File
+
+            File().update({'itemId': doc['_id']}, {'$set': {'inheritedAccess': dict(
+                doc['inheritedAccess'], parentId=doc['_id'])}})
         return doc
 
     def load(self, id, level=AccessType.ADMIN, user=None, objectId=True,
@@ -109,7 +119,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
         """
         # Ensure we include extra fields to do the migration below
         extraFields = {'baseParentId', 'baseParentType', 'parentId', 'parentCollection', 'meta',
-                       'name', 'lowerName'}
+                       'name', 'lowerName', 'folderId', 'ancestorIds'}
         loadFields = self._supplementFields(fields, extraFields)
 
         doc = super().load(
@@ -136,11 +146,28 @@ class Item(acl_mixin.AccessControlMixin, Model):
                 self.update({'_id': doc['_id']}, {'$set': {
                     'meta': {}
                 }})
+            if 'ancestorIds' not in doc:
+                doc['ancestorIds'] = self._folderAncestorIds({'_id': doc['folderId']})
+                self.update({'_id': doc['_id']}, {'$set': {
+                    'ancestorIds': doc['ancestorIds']
+                }})
 
             self._removeSupplementalFields(doc, fields)
 
         return doc
 
+    def _folderAncestorIds(self, folder):
+        """
+        Return the ``ancestorIds`` value for an item in the given folder, which
+        is the folder's own ancestors followed by the folder.
+
+        :param folder: The parent folder.  This may be a partial document.
+        :type folder: dict
+        """
+        from .folder import Folder
+
+        return Folder().getAncestorIds(folder) + [ObjectId(folder['_id'])]
+
     def move(self, item, folder):
         """
         Move the given item from its current folder into another folder.
@@ -150,26 +177,29 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :param folder: The folder to move the item into.
         :type folder: dict.
         """
+        from .size_delta import SizeDelta
+
+        # Pending changes to the item would be applied to its old folder
+        if SizeDelta().flush([item['_id']]):
+            item['size'] = self.findOne({'_id': item['_id']}, fields=['size'])['size']
         self.propagateSizeChange(item, -item['size'])
 
         item['folderId'] = folder['_id']
         item['baseParentType'] = folder['baseParentType']
         item['baseParentId'] = folder['baseParentId']
+        item['ancestorIds'] = self._folderAncestorIds(folder)
 
         self.propagateSizeChange(item, item['size'])
 
         return self.save(item)
 
     def propagateSizeChange(self, item, inc):
-        from .folder import Folder
-
-        Folder().increment(query={
-            '_id': item['folderId']
-        }, field='size', amount=inc, multi=False)
+        from .size_delta import SizeDelta
 
-        ModelImporter.model(item['baseParentType']).increment(query={
-            '_id': item['baseParentId']
-        }, field='size', amount=inc, multi=False)
+        SizeDelta().propagate([
+            ('folder', item['folderId'], inc),
+            (item['baseParentType'], item['baseParentId'], inc)
+        ])
 
     def recalculateSize(self, item):
         """
@@ -283,18 +313,23 @@ class Item(acl_mixin.AccessControlMixin, Model):
             folder['baseParentType'] = pathFromRoot[0]['type']
             folder['baseParentId'] = pathFromRoot[0]['object']['_id']
 
-        return self.save({
+        item = {
             'name': self._validateString(name),
             'description': self._validateString(description),
             'folderId': ObjectId(folder['_id']),
             'creatorId': creator['_id'],
             'baseParentType': folder['baseParentType'],
             'baseParentId': folder['baseParentId'],
+            'ancestorIds': self._folderAncestorIds(folder),
             'created': now,
             'updated': now,
             'size': 0,
             'meta': {}
-        })
+        }
+        inheritedAccess = self._inheritedAccessFromParentDoc(folder)
+        if inheritedAccess is not None:
+            item['inheritedAccess'] = inheritedAccess
+        return self.save(item)
 
     def updateItem(self, item):
         """
@@ -380,6 +415,45 @@ class Item(acl_mixin.AccessControlMixin, Model):
 
         return self.save(item)
 
+    def bulkSetMetadata(self, updates=None, query=None, metadata=None, user=None,
+                        level=AccessType.WRITE, force=False, allowNull=False, batchSize=1000):
+        """
+        Set metadata on many items at once. Either a list of ``(id, metadata)``
+        pairs is passed as ``updates``, or a ``query`` selecting the items to
+        which the same ``metadata`` is applied. The changes are applied with
+        batched bulk writes rather than by saving each item, so the per-item
+        validate and save events are not triggered. Instead, a single
+        ``model.item.bulkSetMetadata.after`` event is triggered with the list
+        of updated ids.
+
+        If access is denied on any of the items in ``updates``, nothing is
+        written. Items matching ``query`` that the user cannot access are
+        skipped.
+
+        :param updates: An iterable of ``(id, metadata)`` pairs.
+        :type updates: iterable or None
+        :param query: A query selecting the items to update.
+        :type query: dict or None
+        :param metadata: The metadata to apply to every item matching ``query``.
+        :type metadata: dict or None
+        :param user: The user performing the update.
+        :type user: dict or None
+        :param level: The access level required on each item.
+        :type level: AccessType
+        :param force: Skip access checks.
+        :type force: bool
+        :param allowNull: Whether to allow `null` values to be set in the items'
+            metadata. If set to `False` or omitted, a `null` value will cause that
+            metadata field to be deleted.
+        :type allowNull: bool
+        :param batchSize: The number of documents to update per bulk write.
+        :type batchSize: int
+        :returns: A dict with the ``matched`` and ``modified`` document counts.
+        """
+        return self._bulkSetMetadata(
+            updates=updates, query=query, metadata=metadata, user=user, level=level,
+            force=force, allowNull=allowNull, batchSize=batchSize)
+
     def parentsToRoot(self, item, user=None, force=False):
         """
         Get the path to traverse to a root of the hierarchy.
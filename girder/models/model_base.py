@@ -1,21 +1,30 @@
+import base64
 import copy
 import functools
 import itertools
 import logging
 import os
 import re
-from datetime import timezone
+from datetime import datetime, timezone
 
+import bson
 import pymongo
+from bson import json_util
 from bson.codec_options import CodecOptions
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.backends.null import NullBackend
+from pymongo import UpdateMany, UpdateOne
 from pymongo.errors import WriteError
 
 from girder import auditLogger, events
-from girder.constants import ACCESS_FLAGS, TEXT_SCORE_SORT_MAX, AccessType, CoreEventHandler
+from girder.constants import (ACCESS_FLAGS, TEXT_SCORE_SORT_MAX, AccessType, CoreEventHandler,
+                              SortDir)
 from girder.exceptions import AccessException, ValidationException
 from girder.models import getDbConnection
+from girder.utility._cache import requestCache
 
 # pymongo3 complains about extra kwargs to find(), so we must filter them.
 _allowedFindArgs = ('cursor_type', 'allow_partial_results', 'oplog_replay',
@@ -70,6 +79,196 @@ def _permissionClauses(user=None, level=None, prefix=''):
     return {'$or': permissionClauses}
 
 
+def keysetSort(sort):
+    """
+    Make a sort order suitable for keyset pagination by appending ``_id`` as a
+    tie breaker, in the same direction as the last sort key, if it is not
+    already part of the sort.
+
+    :param sort: The sort order.
+    :type sort: List of (key, order) tuples or None.
+    :returns: A list of (key, order) tuples including the ``_id`` key.
+    """
+    sort = [(key, dir) for key, dir in (sort or [])]
+    if not any(key == '_id' for key, _ in sort):
+        sort.append(('_id', sort[-1][1] if sort else SortDir.ASCENDING))
+    return sort
+
+
+def makeAfterToken(doc, sort):
+    """
+    Create an opaque token that can be passed as the ``after`` parameter of
+    :py:meth:`Model.find` and the ``findWithPermissions`` methods to get the
+    documents that follow ``doc`` in the given sort order.
+
+    :param doc: The last document of the current page.  It must include the
+        sort keys.
+    :type doc: dict
+    :param sort: The sort order that was used, as returned by
+        :py:func:`keysetSort`.
+    :type sort: List of (key, order) tuples.
+    :returns: The token string.
+    """
+    values = []
+    for key, _ in sort:
+        value = doc
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        values.append(value)
+    token = json_util.dumps({'sort': sort, 'values': values})
+    return base64.urlsafe_b64encode(token.encode('utf8')).decode('utf8').rstrip('=')
+
+
+def _afterQuery(after, sort):
+    """
+    Decode an ``after`` token and build the query clause selecting the
+    documents that follow it in the given sort order.
+    """
+    try:
+        token = json_util.loads(base64.urlsafe_b64decode(after + '=' * (-len(after) % 4)))
+        tokenSort, values = token['sort'], token['values']
+    except (ValueError, TypeError, KeyError):
+        raise ValidationException('Invalid "after" token.', 'after')
+    if [list(key) for key in tokenSort] != [list(key) for key in sort]:
+        raise ValidationException('The "after" token does not match the sort order.', 'after')
+
+    # For sort keys (k1, ..., kn), a document comes after the token if for some
+    # i, it is equal on k1 ... k(i-1) and strictly after on ki.  Missing and
+    # null values sort first in ascending order and last in descending order.
+    # Since comparison operators only match values of the same type, sort keys
+    # should hold a single type (besides null).
+    clauses = []
+    for i, ((key, dir), value) in enumerate(zip(sort, values)):
+        prefix = {k: v for (k, _), v in zip(sort[:i], values[:i])}
+        if value is None:
+            if dir == SortDir.DESCENDING:
+                continue
+            clauses.append(dict(prefix, **{key: {'$ne': None}}))
+        elif dir == SortDir.ASCENDING:
+            clauses.append(dict(prefix, **{key: {'$gt': value}}))
+        else:
+            clauses.append(dict(prefix, **{key: {'$lt': value}}))
+            clauses.append(dict(prefix, **{key: None}))
+    return {'$or': clauses} if clauses else {'__matchnothing': 'nothing'}
+
+
+def _aclCacheEnabled():
+    """
+    Whether access decisions are memoized in the request cache.  This is the
+    case when caching is enabled via the ``core.cache.enabled`` setting.
+    """
+    return not isinstance(requestCache.backend, NullBackend)
+
+
+# Fields of access controlled documents that determine access decisions
+_ACL_FIELDS = frozenset({'access', 'public', 'publicFlags'})
+
+
+def _aclVersionKey(modelName, id=None):
+    return 'acl.version.%s.%s' % (modelName, '*' if id is None else id)
+
+
+def _aclCacheKey(modelName, id, user, *extra):
+    """
+    Build the request cache key for an access decision on a document.  The
+    key includes the versions of the document's and the model's access
+    policies within the current request, so that
+    :py:func:`_invalidateAclCache` discards all earlier decisions about the
+    document, and the user's groups and admin status, since those also
+    determine the outcome.
+
+    :param modelName: The name of the model of the document.
+    :type modelName: str
+    :param id: The _id of the document.
+    :param user: The user whose access is being decided.
+    :type user: dict or None
+    :param extra: Any other values that distinguish the decision.
+    """
+    versions = [
+        requestCache.get(key) for key in (_aclVersionKey(modelName), _aclVersionKey(modelName, id))]
+    if user is None:
+        userKey = 'anonymous'
+    else:
+        userKey = '%s.%d.%d' % (
+            user['_id'], bool(user.get('admin')), hash(tuple(user.get('groups', ()))))
+    return '.'.join(['acl', modelName, str(id)] + [
+        str(0 if version is NO_VALUE else version) for version in versions
+    ] + [userKey] + [str(value) for value in extra])
+
+
+def _invalidateAclCache(modelName, id=None):
+    """
+    Discard any access decisions about a document that were memoized during
+    the current request.  This should be called whenever the access policies of
+    the document change.
+
+    :param modelName: The name of the model of the document.
+    :type modelName: str
+    :param id: The _id of the document, or None to discard the decisions about
+        every document of the model.
+    """
+    if not _aclCacheEnabled():
+        return
+    key = _aclVersionKey(modelName, id)
+    version = requestCache.get(key)
+    requestCache.set(key, 1 if version is NO_VALUE else version + 1)
+
+
+class _TrackedDocument(dict):
+    """
+    A document loaded by a model that tracks changes.  It holds the BSON of the
+    document as it was last loaded or saved, which save() compares it with.
+    """
+
+    __slots__ = ('_snapshot',)
+
+
+def _sameValue(old, new):
+    """
+    Test whether two values would be stored the same way, unlike ``==``, for
+    which 1, 1.0 and True are equal.
+    """
+    if type(old) is not type(new):
+        return False
+    if isinstance(old, dict):
+        return old.keys() == new.keys() and all(_sameValue(old[k], new[k]) for k in old)
+    if isinstance(old, list):
+        return len(old) == len(new) and all(map(_sameValue, old, new))
+    return old == new
+
+
+def _diffDocuments(old, new, prefix=''):
+    """
+    Compute the MongoDB update that turns one document into another, setting or
+    unsetting only the fields that differ.  Subdocuments are compared field by
+    field, unless they have keys that can't be used in a field path.
+
+    :returns: An update specifier, which is empty if the documents are the same.
+    """
+    sets, unsets = {}, {}
+    for key, value in new.items():
+        path = prefix + key
+        if key not in old:
+            sets[path] = value
+        elif (isinstance(value, dict) and isinstance(old[key], dict)
+                and not any('.' in k or k.startswith('$') or not k
+                            for k in itertools.chain(value, old[key]))):
+            update = _diffDocuments(old[key], value, path + '.')
+            sets.update(update.get('$set', {}))
+            unsets.update(update.get('$unset', {}))
+        elif not _sameValue(old[key], value):
+            sets[path] = value
+    for key in old:
+        if key not in new:
+            unsets[prefix + key] = ''
+    update = {}
+    if sets:
+        update['$set'] = sets
+    if unsets:
+        update['$unset'] = unsets
+    return update
+
+
 class _ModelSingleton(type):
     def __init__(cls, name, bases, dict):
         super().__init__(name, bases, dict)
@@ -101,6 +300,9 @@ class Model(metaclass=_ModelSingleton):
         self._textIndex = None
         self._textLanguage = None
         self.prefixSearchFields = ('lowerName', 'name')
+        # If set, documents returned by findOne() and load() remember how they
+        # were loaded, and save() only writes the fields that changed since
+        self.trackChanges = False
 
         self._filterKeys = {
             AccessType.READ: set(),
@@ -122,6 +324,9 @@ class Model(metaclass=_ModelSingleton):
         self.database = db_connection.get_database()
         self.collection = self.database[self.name].with_options(
             codec_options=CodecOptions(tz_aware=True, tzinfo=timezone.utc))
+        self._rawCollection = self.collection.with_options(
+            codec_options=self.collection.codec_options.with_options(
+                document_class=RawBSONDocument))
 
         for index in self._indices:
             self._createIndex(index)
@@ -310,7 +515,7 @@ class Model(metaclass=_ModelSingleton):
                                   % self.__class__.__name__)
 
     def find(self, query=None, offset=0, limit=0, timeout=None,
-             fields=None, sort=None, **kwargs):
+             fields=None, sort=None, after=None, **kwargs):
         """
         Search the collection by a set of parameters. Passes any extra kwargs
         through to the underlying pymongo.collection.find function.
@@ -331,9 +536,15 @@ class Model(metaclass=_ModelSingleton):
         :type fields: `str, list, set, or tuple`
         :param sort: The sort order.
         :type sort: List of (key, order) tuples.
+        :param after: A token from :py:func:`makeAfterToken`.  If passed, only
+            documents following the one the token was made from are returned,
+            and ``_id`` is appended to the sort order as a tie breaker.  Unlike
+            ``offset``, this is as fast for deep pages as for the first page
+            when there is an index matching the query and sort.
+        :type after: str or None
         :returns: A pymongo database cursor.
         """
-        query = query or {}
+        query, sort = self._applyAfter(query, sort, after)
         kwargs = {k: kwargs[k] for k in kwargs if k in _allowedFindArgs}
 
         timeout = timeout or _MAX_CURSOR_TIMEOUT_MS
@@ -346,6 +557,19 @@ class Model(metaclass=_ModelSingleton):
 
         return cursor
 
+    def _applyAfter(self, query, sort, after, defaultSort=None):
+        """
+        Restrict a query to the documents following an ``after`` token.
+
+        :param defaultSort: The sort order to paginate by if ``sort`` is None.
+        :returns: The query and the sort order to use.
+        """
+        query = query or {}
+        if after is None:
+            return query, sort
+        sort = keysetSort(sort or defaultSort)
+        return {'$and': [query, _afterQuery(after, sort)]}, sort
+
     def findOne(self, query=None, fields=None, sort=None, **kwargs):
         """
         Search the collection by a set of parameters. Passes any kwargs
@@ -365,7 +589,14 @@ class Model(metaclass=_ModelSingleton):
         """
         query = query or {}
         kwargs = {k: kwargs[k] for k in kwargs if k in _allowedFindArgs}
-        return self.collection.find_one(query, projection=fields, sort=sort, **kwargs)
+        if not self.trackChanges:
+            return self.collection.find_one(query, projection=fields, sort=sort, **kwargs)
+        raw = self._rawCollection.find_one(query, projection=fields, sort=sort, **kwargs)
+        if raw is None:
+            return None
+        doc = _TrackedDocument(bson.decode(raw.raw, self.collection.codec_options))
+        doc._snapshot = raw.raw
+        return doc
 
     def _textSearchFilters(self, query, filters=None, fields=None):
         """
@@ -499,6 +730,11 @@ class Model(metaclass=_ModelSingleton):
         events; one prior to validation, and one prior to saving. Either of
         these events may have their default action prevented.
 
+        If the model tracks changes and the document was loaded by findOne() or
+        load(), only the fields that changed since it was loaded or last saved
+        are written, so concurrent saves of other fields are kept.  Otherwise
+        the stored document is replaced.
+
         :param document: The document to save.
         :type document: dict
         :param validate: Whether to call the model's validate() before saving.
@@ -525,7 +761,7 @@ class Model(metaclass=_ModelSingleton):
             if isNew:
                 document['_id'] = \
                     self.collection.insert_one(document).inserted_id
-            else:
+            elif not self._saveChanges(document):
                 self.collection.replace_one(
                     {'_id': document['_id']}, document, True)
         except WriteError as e:
@@ -544,6 +780,25 @@ class Model(metaclass=_ModelSingleton):
 
         return document
 
+    def _saveChanges(self, document):
+        """
+        Write the fields of a tracked document that changed since it was loaded.
+
+        :returns: False if the document must be replaced instead.
+        """
+        snapshot = getattr(document, '_snapshot', None)
+        if snapshot is None:
+            return False
+        old = bson.decode(snapshot, self.collection.codec_options)
+        if old.get('_id') != document['_id']:
+            return False
+        update = _diffDocuments(old, document)
+        if update and not self.collection.update_one(
+                {'_id': document['_id']}, update).matched_count:
+            return False
+        document._snapshot = bson.encode(document, codec_options=self.collection.codec_options)
+        return True
+
     def update(self, query, update, multi=True):
         """
         This method should be used for updating multiple documents in the
@@ -977,13 +1232,42 @@ class AccessControlledModel(Model):
 
         if save:
             doc = self._saveAcl(doc, update)
+        elif '_id' in doc:
+            _invalidateAclCache(self.name, doc['_id'])
 
         return doc
 
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save to discard any access decisions about the
+        document memoized during the current request, since its access
+        policies may have changed.  The parameters are the same as
+        Model.save.
+        """
+        if '_id' in document:
+            _invalidateAclCache(self.name, document['_id'])
+        return super().save(document, *args, **kwargs)
+
+    def update(self, query, update, multi=True):
+        """
+        Override of Model.update to discard the access decisions memoized
+        during the current request about every document of this model if the
+        update may change access policies.  The parameters are the same as
+        Model.update.
+        """
+        # Pipeline updates may set any field
+        if isinstance(update, list) or any(
+                key.split('.', 1)[0] in _ACL_FIELDS
+                for fields in update.values() if isinstance(fields, dict) for key in fields):
+            _invalidateAclCache(self.name)
+        return super().update(query, update, multi=multi)
+
     def _saveAcl(self, doc, update):
         if '_id' not in doc:
             return self.save(doc)
 
+        _invalidateAclCache(self.name, doc['_id'])
+
         # copy all other (potentially updated) fields to the update list,
         # and trigger normal save events
         if '$set' in update:
@@ -1002,6 +1286,84 @@ class AccessControlledModel(Model):
             events.trigger('model.%s.save.after' % self.name, doc)
         return doc
 
+    def _bulkSetMetadata(self, updates=None, query=None, metadata=None, user=None,
+                         level=AccessType.WRITE, force=False, allowNull=False,
+                         batchSize=1000):
+        """
+        Shared implementation of bulk metadata updates for models with a
+        ``meta`` field. See :py:meth:`girder.models.item.Item.bulkSetMetadata`.
+        """
+        if (updates is None) == (query is None):
+            raise ValidationException('Exactly one of updates or query must be specified.')
+        if query is not None and not isinstance(metadata, dict):
+            raise ValidationException('Metadata must be specified as an object.', 'metadata')
+        now = datetime.now(timezone.utc)
+
+        def metadataUpdate(metadata):
+            if not isinstance(metadata, dict):
+                raise ValidationException('Metadata must be specified as an object.', 'metadata')
+            self.validateKeys(metadata)
+            update = {'$set': {'updated': now}}
+            for key, value in metadata.items():
+                if value is None and not allowNull:
+                    update.setdefault('$unset', {})['meta.' + key] = ''
+                else:
+                    update['$set']['meta.' + key] = value
+            return update
+
+        if updates is not None:
+            try:
+                updates = [(ObjectId(id), metadataUpdate(meta)) for id, meta in updates]
+            except (InvalidId, TypeError):
+                raise ValidationException('Invalid ObjectId in updates.', 'id')
+            ids = [id for id, _ in updates]
+            if not force:
+                self._requireBulkAccess(ids, user, level, batchSize)
+            requests = [UpdateOne({'_id': id}, update) for id, update in updates]
+        else:
+            update = metadataUpdate(metadata)
+            ids = [doc['_id'] for doc in self.findWithPermissions(
+                query, fields=['_id'], user=user, level=None if force else level)]
+            requests = [
+                UpdateMany({'_id': {'$in': ids[i:i + batchSize]}}, update)
+                for i in range(0, len(ids), batchSize)]
+            # Each request covers a full batch of documents
+            batchSize = 1
+
+        matched = modified = 0
+        for i in range(0, len(requests), batchSize):
+            result = self.collection.bulk_write(requests[i:i + batchSize], ordered=False)
+            matched += result.matched_count
+            modified += result.modified_count
+
+        events.trigger('model.%s.bulkSetMetadata.after' % self.name, {
+            'ids': ids,
+            'user': user
+        })
+        return {'matched': matched, 'modified': modified}
+
+    def _requireBulkAccess(self, ids, user, level, batchSize=1000):
+        """
+        Make sure that a list of documents all exist and that the user has the
+        given access level on each of them, checking a batch at a time.
+
+        :raises: ValidationException if a document does not exist.
+        :raises: AccessException if access is denied on a document.
+        """
+        for i in range(0, len(ids), batchSize):
+            batch = set(ids[i:i + batchSize])
+            allowed = {doc['_id'] for doc in self.findWithPermissions(
+                {'_id': {'$in': list(batch)}}, fields=['_id'], user=user, level=level)}
+            denied = batch - allowed
+            if denied:
+                existing = {doc['_id'] for doc in self.find(
+                    {'_id': {'$in': list(denied)}}, fields=['_id'])}
+                for id in sorted(denied):
+                    if id not in existing:
+                        raise ValidationException('No such %s: %s' % (self.name, id), 'id')
+                raise AccessException('Access denied for %s %s (user %s).' % (
+                    self.name, sorted(denied)[0], user['_id'] if user else None))
+
     def setPublic(self, doc, public, save=False):
         """
         Set the flag for public read access on the object.
@@ -1022,6 +1384,8 @@ class AccessControlledModel(Model):
 
         if save:
             doc = self.save(doc)
+        elif '_id' in doc:
+            _invalidateAclCache(self.name, doc['_id'])
 
         return doc
 
@@ -1172,6 +1536,8 @@ class AccessControlledModel(Model):
 
         if save:
             doc = self.save(doc)
+        elif '_id' in doc:
+            _invalidateAclCache(self.name, doc['_id'])
 
         return doc
 
@@ -1221,22 +1587,34 @@ class AccessControlledModel(Model):
         elif user['admin']:
             return AccessType.ADMIN
         else:
-            access = doc.get('access', {})
-            level = AccessType.NONE
+            return self._getAclLevel(doc, user)
 
-            for group in access.get('groups', []):
-                if group['id'] in user.get('groups', []):
-                    level = max(level, group['level'])
-                    if level == AccessType.ADMIN:
-                        return level
+    def _getAclLevel(self, doc, user):
+        """
+        Return the maximum access level granted to a non-admin user by the
+        access control list of a document, through either group membership or
+        explicit user access.
+
+        :param doc: The object to check access on.
+        :param user: The user to get the access level for.
+        :type user: dict
+        """
+        access = doc.get('access', {})
+        level = AccessType.NONE
+
+        for group in access.get('groups', []):
+            if group['id'] in user.get('groups', []):
+                level = max(level, group['level'])
+                if level == AccessType.ADMIN:
+                    return level
 
-            for userAccess in access.get('users', []):
-                if userAccess['id'] == user['_id']:
-                    level = max(level, userAccess['level'])
-                    if level == AccessType.ADMIN:
-                        return level
+        for userAccess in access.get('users', []):
+            if userAccess['id'] == user['_id']:
+                level = max(level, userAccess['level'])
+                if level == AccessType.ADMIN:
+                    return level
 
-            return level
+        return level
 
     def getFullAccessList(self, doc):
         """
@@ -1379,13 +1757,7 @@ class AccessControlledModel(Model):
 
         # If all that fails, descend into real permission checking.
         if 'access' in doc:
-            perms = doc['access']
-            if self._hasGroupAccess(perms.get('groups', []),
-                                    user.get('groups', []), level):
-                return True
-            elif self._hasUserAccess(perms.get('users', []),
-                                     user['_id'], level):
-                return True
+            return self._getAclLevel(doc, user) >= level
 
         return False
 
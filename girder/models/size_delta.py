@@ -0,0 +1,270 @@
+import collections
+import datetime
+import logging
+import time
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from girder import events
+from girder.constants import CoreEventHandler
+from girder.settings import SettingKey
+from girder.utility.model_importer import ModelImporter
+
+from .model_base import Model
+
+logger = logging.getLogger(__name__)
+
+# How long, in seconds, each process remembers the core.buffer_size_changes
+# setting.  Changes made in the same process are seen at once.
+BUFFER_SETTING_TTL = 30
+
+
+class SizeDelta(Model):
+    """
+    This model is a log of pending changes to the ``size`` field of items,
+    folders, collections, and users. When the ``core.buffer_size_changes``
+    setting is enabled, size propagation appends a single document to this log
+    instead of incrementing every ancestor in turn, and :py:meth:`applyPending`
+    later folds the log into the sized documents with one ``$inc`` per
+    resource. :py:meth:`reconcile` corrects any drift in bounded batches.
+    """
+
+    # The order in which reconcile walks the sized models.  Children come
+    # before their parents so that a full pass fixes parents using corrected
+    # child sizes.
+    reconcileOrder = ('item', 'folder', 'collection', 'user')
+
+    def initialize(self):
+        self.name = 'size_delta'
+        self.ensureIndices(['deltas.id', 'claimed'])
+        self._buffered = None
+
+        for event in ('model.setting.save.after', 'model.setting.remove'):
+            events.bind(event, CoreEventHandler.SIZE_DELTA_SETTING, self._settingChanged)
+
+    def _settingChanged(self, event):
+        if event.info.get('key') == SettingKey.BUFFER_SIZE_CHANGES:
+            self._buffered = None
+
+    def isBuffered(self):
+        """
+        Whether size changes are recorded in the log rather than made
+        immediately, according to the ``core.buffer_size_changes`` setting.
+        The setting is read at most once every ``BUFFER_SETTING_TTL`` seconds,
+        since this is checked for every size change.
+        """
+        from .setting import Setting
+
+        now = time.monotonic()
+        if self._buffered is None or self._buffered[1] < now:
+            self._buffered = (
+                bool(Setting().get(SettingKey.BUFFER_SIZE_CHANGES)), now + BUFFER_SETTING_TTL)
+        return self._buffered[0]
+
+    def validate(self, doc):
+        return doc
+
+    def propagate(self, deltas):
+        """
+        Change the sizes of a set of resources. Depending on the
+        ``core.buffer_size_changes`` setting, the changes are either made
+        immediately or recorded in the log to be applied by
+        :py:meth:`applyPending`.
+
+        :param deltas: The changes to make.
+        :type deltas: list of (model name, id, amount) tuples.
+        """
+        deltas = [(modelName, id, amount) for modelName, id, amount in deltas if amount]
+        if not deltas:
+            return
+
+        if self.isBuffered():
+            self.collection.insert_one({
+                'created': datetime.datetime.now(datetime.timezone.utc),
+                'claimed': None,
+                'deltas': [
+                    {'model': modelName, 'id': id, 'amount': amount}
+                    for modelName, id, amount in deltas]
+            })
+            return
+
+        for modelName, id, amount in deltas:
+            ModelImporter.model(modelName).increment(
+                query={'_id': id}, field='size', amount=amount, multi=False)
+
+    def applyPending(self, limit=1000, claimTimeout=300, ids=None):
+        """
+        Apply a batch of pending size changes from the log. Entries are claimed
+        before they are applied so that several processes can run this at
+        once. Claims older than ``claimTimeout`` are assumed to belong to a
+        process that died and may be claimed again; if that process had
+        already applied its changes they will be applied twice, which the
+        reconciler later corrects.
+
+        :param limit: The maximum number of log entries to apply.
+        :type limit: int
+        :param claimTimeout: The age in seconds after which a claim is stale.
+        :type claimTimeout: int
+        :param ids: If given, only apply the log entries that change the size
+            of one of these resources.
+        :type ids: list or None
+        :returns: The number of log entries that were applied.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        claimable = {
+            'deltas': {'$exists': True},
+            '$or': [
+                {'claimed': None},
+                {'claimedAt': {'$lt': now - datetime.timedelta(seconds=claimTimeout)}}
+            ]
+        }
+        if ids is not None:
+            claimable['deltas.id'] = {'$in': list(ids)}
+        ids = [doc['_id'] for doc in self.collection.find(
+            claimable, {'_id': True}, sort=[('_id', 1)], limit=limit)]
+        if not ids:
+            return 0
+
+        token = ObjectId()
+        self.collection.update_many(
+            dict(claimable, _id={'$in': ids}), {'$set': {'claimed': token, 'claimedAt': now}})
+
+        count = 0
+        totals = collections.defaultdict(int)
+        for doc in self.collection.find({'claimed': token}):
+            count += 1
+            for delta in doc['deltas']:
+                totals[(delta['model'], delta['id'])] += delta['amount']
+
+        updates = collections.defaultdict(list)
+        for (modelName, id), amount in totals.items():
+            if amount:
+                updates[modelName].append(UpdateOne({'_id': id}, {'$inc': {'size': amount}}))
+        for modelName, requests in updates.items():
+            ModelImporter.model(modelName).collection.bulk_write(requests, ordered=False)
+
+        self.collection.delete_many({'claimed': token})
+        return count
+
+    def flush(self, ids=None, batchSize=1000):
+        """
+        Apply the pending size changes of some resources right away.  This is
+        done before resources are moved, since the logged changes refer to
+        their old ancestors and would otherwise be applied there after the
+        sizes have moved.  This does not depend on the
+        ``core.buffer_size_changes`` setting, since changes logged before it
+        was turned off may still be pending.
+
+        :param ids: The resources whose pending changes are applied, or None
+            for all of them.
+        :type ids: list or None
+        :param batchSize: The number of log entries to apply at a time.
+        :type batchSize: int
+        :returns: The number of log entries that were applied.
+        """
+        count = 0
+        if self.hasPending(ids):
+            applied = batchSize
+            while applied == batchSize:
+                applied = self.applyPending(limit=batchSize, ids=ids)
+                count += applied
+        return count
+
+    def hasPending(self, ids=None):
+        """
+        Returns whether the log holds any size changes that have not been
+        applied.
+
+        :param ids: If given, only consider the changes to these resources.
+        :type ids: list or None
+        """
+        query = {'deltas': {'$exists': True}}
+        if ids is not None:
+            query['deltas.id'] = {'$in': list(ids)}
+        return self.collection.find_one(query, {'_id': True}) is not None
+
+    def _correctSizes(self, modelName, ids):
+        """
+        Compute the correct sizes of a batch of resources of a single model
+        from the stored sizes of their children.
+
+        :returns: A dict of id to size.
+        """
+        from .file import File
+        from .folder import Folder
+        from .item import Item
+
+        if modelName in ('item', 'folder'):
+            childModel, field = (File(), 'itemId') if modelName == 'item' else (Item(), 'folderId')
+            sizes = dict.fromkeys(ids, 0)
+            sizes.update({
+                result['_id']: result['size'] for result in childModel.collection.aggregate([
+                    {'$match': {field: {'$in': ids}}},
+                    {'$group': {'_id': '$' + field, 'size': {'$sum': '$size'}}}
+                ])})
+            return sizes
+
+        folderModel = Folder()
+        return {
+            id: sum(folderModel.getSizeRecursive(folder) for folder in folderModel.find({
+                'parentId': id,
+                'parentCollection': modelName
+            }, fields=['size']))
+            for id in ids
+        }
+
+    def reconcile(self, batchSize=100):
+        """
+        Check and fix the sizes of the next batch of resources. Each call
+        continues where the previous one stopped, walking items, then folders,
+        then collections, and then users, before starting over. Resources that
+        have changes pending in the log are skipped until a later pass, and a
+        size is only replaced if it was not modified while being checked, so
+        this is safe to run while the server is handling uploads.
+
+        :param batchSize: The maximum number of resources to check.
+        :type batchSize: int
+        :returns: A dict with the name of the ``model`` that was checked, the
+            number of resources that were ``checked`` and ``fixed``, and
+            whether this call ``completed`` a pass over all of the models.
+        """
+        state = self.collection.find_one({'_id': 'reconcile'}) or {
+            'model': self.reconcileOrder[0], 'after': None}
+        modelName = state['model']
+        model = ModelImporter.model(modelName)
+
+        query = {} if state['after'] is None else {'_id': {'$gt': state['after']}}
+        docs = list(model.collection.find(
+            query, {'size': True}, sort=[('_id', 1)], limit=batchSize))
+        ids = [doc['_id'] for doc in docs]
+
+        fixed = 0
+        if ids:
+            pending = set(self.collection.distinct('deltas.id', {'deltas.id': {'$in': ids}}))
+            sizes = self._correctSizes(modelName, [id for id in ids if id not in pending])
+            requests = []
+            for doc in docs:
+                if doc['_id'] in sizes and sizes[doc['_id']] != doc.get('size'):
+                    logger.info(
+                        '%s %s was wrong size: was %s, is %d',
+                        modelName.capitalize(), doc['_id'], doc.get('size'), sizes[doc['_id']])
+                    requests.append(UpdateOne(
+                        {'_id': doc['_id'], 'size': doc.get('size')},
+                        {'$set': {'size': sizes[doc['_id']]}}))
+            if requests:
+                fixed = model.collection.bulk_write(requests, ordered=False).modified_count
+
+        completed = False
+        if len(docs) == batchSize:
+            state['after'] = ids[-1]
+        else:
+            index = self.reconcileOrder.index(modelName) + 1
+            completed = index == len(self.reconcileOrder)
+            state['model'] = self.reconcileOrder[index % len(self.reconcileOrder)]
+            state['after'] = None
+        self.collection.update_one(
+            {'_id': 'reconcile'},
+            {'$set': {'model': state['model'], 'after': state['after']}}, upsert=True)
+
+        return {'model': modelName, 'checked': len(docs), 'fixed': fixed, 'completed': completed}
@@ -4,6 +4,7 @@ from girder.constants import AccessType, TokenScope
 from girder.exceptions import AccessException
 from girder.settings import SettingKey
 from girder.utility import genToken
+from girder.utility._auth_cache import authCache
 
 from .model_base import AccessControlledModel
 
@@ -23,6 +24,28 @@ class Token(AccessControlledModel):
         doc['scope'] = list(set(doc['scope']))
         return doc
 
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save to drop the token from the authentication cache,
+        since its scopes or expiration may have changed.  The parameters are the
+        same as Model.save.
+        """
+        isNew = '_id' not in document
+        document = super().save(document, *args, **kwargs)
+        if not isNew:
+            authCache.invalidate(tokenIds=[document['_id']])
+        return document
+
+    def remove(self, document, **kwargs):
+        result = super().remove(document, **kwargs)
+        authCache.invalidate(tokenIds=[document['_id']])
+        return result
+
+    def removeWithQuery(self, query):
+        result = super().removeWithQuery(query)
+        authCache.clear()
+        return result
+
     def createToken(self, user=None, days=None, scope=None, apiKey=None):
         """
         Creates a new token. You can create an anonymous token
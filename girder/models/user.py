@@ -11,6 +11,7 @@ from girder.constants import AccessType, CoreEventHandler, TokenScope
 from girder.exceptions import AccessException, ValidationException
 from girder.settings import SettingKey
 from girder.utility import mail_utils
+from girder.utility._auth_cache import authCache
 from girder.utility._cache import rateLimitBuffer
 
 from .model_base import AccessControlledModel
@@ -153,6 +154,34 @@ class User(AccessControlledModel):
 
         return filteredDoc
 
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save to drop the user from the authentication cache.
+        The parameters are the same as Model.save.
+        """
+        isNew = '_id' not in document
+        document = super().save(document, *args, **kwargs)
+        if not isNew:
+            authCache.invalidate(userIds=[document['_id']])
+        return document
+
+    def update(self, query, update, multi=True):
+        """
+        Override of Model.update to drop the updated users from the
+        authentication cache.  The parameters are the same as Model.update.
+        """
+        result = super().update(query, update, multi)
+        if set(query) == {'_id'} and not isinstance(query['_id'], dict):
+            authCache.invalidate(userIds=[query['_id']])
+        else:
+            authCache.clear()
+        return result
+
+    def _saveAcl(self, doc, update):
+        doc = super()._saveAcl(doc, update)
+        authCache.invalidate(userIds=[doc['_id']])
+        return doc
+
     def authenticate(self, login, password, otpToken=None):
         """
         Validate a user login via username and password. If authentication fails,
@@ -257,6 +286,7 @@ class User(AccessControlledModel):
 
         # Finally, delete the user document itself
         super().remove(user)
+        authCache.invalidate(userIds=[user['_id']])
         if progress:
             progress.update(increment=1, message='Deleted user ' + user['login'])
 
@@ -18,6 +18,7 @@ class SettingKey:
     API_KEYS = 'core.api_keys'
     BANNER_COLOR = 'core.banner_color'
     BRAND_NAME = 'core.brand_name'
+    BUFFER_SIZE_CHANGES = 'core.buffer_size_changes'
     CACHE_ENABLED = 'core.cache.enabled'
     CACHE_CONFIG = 'core.cache_config'
     COLLECTION_CREATE_POLICY = 'core.collection_create_policy'
@@ -57,6 +58,7 @@ class SettingDefault:
         SettingKey.API_KEYS: True,
         SettingKey.BANNER_COLOR: '#3F3B3B',
         SettingKey.BRAND_NAME: 'Girder',
+        SettingKey.BUFFER_SIZE_CHANGES: False,
         SettingKey.CACHE_ENABLED: False,
         SettingKey.CACHE_CONFIG: {},
         SettingKey.COLLECTION_CREATE_POLICY: {
@@ -74,7 +76,8 @@ class SettingDefault:
             'Content-Type, Cookie, Girder-Authorization, Girder-OTP, Girder-Token',
         SettingKey.CORS_ALLOW_METHODS: 'GET, POST, PUT, HEAD, DELETE',
         SettingKey.CORS_ALLOW_ORIGIN: '',
-        SettingKey.CORS_EXPOSE_HEADERS: 'Girder-Total-Count, Content-Disposition',
+        SettingKey.CORS_EXPOSE_HEADERS:
+            'Girder-Total-Count, Girder-Next-After, Content-Disposition',
         # An apache server using reverse proxy would also need
         #  X-Requested-With, X-Forwarded-Server, X-Forwarded-For,
         #  X-Forwarded-Host, Remote-Addr
@@ -136,6 +139,12 @@ class SettingValidator:
         if not doc['value']:
             raise ValidationException('The brand name may not be empty', 'value')
 
+    @staticmethod
+    @setting_utilities.validator(SettingKey.BUFFER_SIZE_CHANGES)
+    def _validateBufferSizeChanges(doc):
+        if not isinstance(doc['value'], bool):
+            raise ValidationException('Buffer size changes setting must be boolean.', 'value')
+
     @staticmethod
     @setting_utilities.validator(SettingKey.CACHE_ENABLED)
     def _validateCacheEnabled(doc):
@@ -5,10 +5,14 @@ from girder_worker.app import app
 from girder.models.assetstore import Assetstore
 from girder.models.collection import Collection
 from girder.models.folder import Folder
+from girder.models.size_delta import SizeDelta
 from girder.models.user import User
+from girder.notification import Notification
+from girder.utility import assetstore_utilities
 from girder.utility._cache import hourCache as _hourCache
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
+from girder.utility.subtree_delete import SubtreeDelete
 
 logger = logging.getLogger(__name__)
 
@@ -86,6 +90,36 @@ def importDataTask(
         )
 
 
+@app.task(queue='local', bind=True)
+def blobReportTask(
+    self,
+    assetstoreId: str,
+    progress: bool,
+    userId: str,
+    reclaim: bool = False,
+    minimumAge: float = 1,
+):
+    """
+    Report how the data of a filesystem assetstore is shared, optionally
+    deleting the data that no file references. The report is the result of
+    the task, and is also sent to the user as a notification.
+    """
+    user = User().load(userId, force=True)
+    assetstore = Assetstore().load(assetstoreId)
+    adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+    action = 'Reclaiming' if reclaim else 'Checking'
+
+    with ProgressContext(progress, user=user,
+                         title=f'{action} data in assetstore {assetstore["name"]}') as ctx:
+        report = adapter.blobReport(progress=ctx, reclaim=reclaim, minimumAge=minimumAge)
+    Notification('assetstore.blob_report', {
+        'assetstoreId': assetstoreId,
+        'taskId': self.request.id,
+        'report': report,
+    }, user).flush()
+    return report
+
+
 @app.task(queue='local')
 def deleteFolderTask(
     folderId: str,
@@ -124,8 +158,9 @@ def deleteCollectionTask(
                          title=f'Deleting collection {collection["name"]}',
                          message='Calculating collection size...') as ctx:
         if progress:
-            total = Collection().subtreeCount(collection)
-            ctx.update(total=total)
+            # Count what will be deleted, including folders and items that
+            # aren't reachable from the collection's top-level folders
+            ctx.update(total=SubtreeDelete(collection, 'collection').count() + 1)
 
         Collection().remove(collection, progress=ctx)
 
@@ -156,4 +191,28 @@ def copyFolderTask(
             ctx.update(total=Folder().subtreeCount(folder))
         Folder().copyFolder(
             folder, creator=user, name=name, parentType=parentType,
-            parent=parent, description=description, public=public, progress=ctx)
+            parent=parent, description=description, public=public, progress=ctx, bulk=True)
+
+
+@app.task(queue='local')
+def applySizeDeltasTask(batchSize: int = 1000):
+    """
+    Apply the size changes recorded while the ``core.buffer_size_changes``
+    setting is enabled. This should be scheduled periodically, e.g. with
+    celery beat.
+    """
+    total = 0
+    while True:
+        applied = SizeDelta().applyPending(limit=batchSize)
+        total += applied
+        if applied < batchSize:
+            return total
+
+
+@app.task(queue='local')
+def reconcileSizesTask(batchSize: int = 100):
+    """
+    Check and fix the sizes of the next batch of resources. Scheduling this
+    periodically walks the whole hierarchy a batch at a time.
+    """
+    return SizeDelta().reconcile(batchSize=batchSize)
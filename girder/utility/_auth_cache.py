@@ -0,0 +1,203 @@
+"""
+An in-process cache of the tokens that authenticate requests and of their
+users, so that most authenticated requests don't load both from the database.
+
+Tokens and users are dropped from the cache when they are saved or removed by
+any Girder process: their IDs are published on a redis channel, using the
+connection configured for notifications via GIRDER_NOTIFICATION_REDIS_URL. The
+cache is only consulted while this process is subscribed to that channel, so a
+lost redis connection degrades to loading from the database rather than serving
+stale tokens.
+"""
+import collections
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Tokens and users are served from the cache for at most this many seconds,
+# unless GIRDER_AUTH_CACHE_TTL is set.  0 disables the cache.
+TTL = 30
+# The most tokens and users held in the cache, unless GIRDER_AUTH_CACHE_SIZE is set.
+MAX_SIZE = 10000
+
+
+def _setting(envName, default):
+    try:
+        return float(os.environ[envName])
+    except (KeyError, ValueError):
+        return default
+
+
+class AuthCache:
+    """
+    A least recently used cache of token and user documents by ID.  Documents
+    are copied in and out of the cache, so callers may modify them.
+
+    :param channel: The redis pub/sub channel used for invalidations.
+    :type channel: str
+    """
+
+    def __init__(self, channel='girder.auth_cache.invalidate'):
+        self.channel = channel
+        self._senderId = uuid.uuid4().hex
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listenerPid = None
+        self._retryAt = 0
+        self._hits = 0
+        self._misses = 0
+
+    def loadToken(self, id):
+        """
+        Load a token, as ``Token().load(id, force=True, objectId=False)``.
+        """
+        from girder.models.token import Token
+
+        return self._load(('token', str(id)), lambda: Token().load(
+            id, force=True, objectId=False))
+
+    def loadUser(self, id):
+        """
+        Load a user, as ``User().load(id, force=True)``.
+        """
+        from girder.models.user import User
+
+        return self._load(('user', str(id)), lambda: User().load(id, force=True))
+
+    def invalidate(self, tokenIds=(), userIds=()):
+        """
+        Drop tokens and users from the cache of every Girder process.  Call
+        this after they are changed in the database.
+        """
+        keys = [('token', str(id)) for id in tokenIds] + [('user', str(id)) for id in userIds]
+        self._drop(keys)
+        self._publish(keys)
+
+    def clear(self):
+        """
+        Drop everything from the cache of every Girder process.
+        """
+        self._drop(None)
+        self._publish(None)
+
+    def stats(self):
+        """
+        Get the number of lookups served from the cache and from the database
+        by this process, and the current size of the cache.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'active': self._listening(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRate': self._hits / lookups if lookups else None,
+                'size': len(self._entries),
+            }
+
+    def _load(self, key, load):
+        ttl = _setting('GIRDER_AUTH_CACHE_TTL', TTL)
+        if ttl <= 0 or not self._active():
+            return load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return copy.deepcopy(entry[0])
+            self._misses += 1
+            generation = self._generation
+        doc = load()
+        if doc is not None:
+            cached = copy.deepcopy(doc)
+            with self._lock:
+                # Don't store documents that may have changed while they were being loaded
+                if generation == self._generation:
+                    self._entries[key] = (cached, time.monotonic() + ttl)
+                    self._entries.move_to_end(key)
+                    maxSize = _setting('GIRDER_AUTH_CACHE_SIZE', MAX_SIZE)
+                    while len(self._entries) > maxSize:
+                        self._entries.popitem(last=False)
+        return doc
+
+    def _drop(self, keys):
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._entries.clear()
+            else:
+                for key in keys:
+                    self._entries.pop(key, None)
+
+    def _onInvalidate(self, message):
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('sender') == self._senderId:
+            return
+        keys = data.get('keys')
+        self._drop(None if keys is None else [tuple(key) for key in keys])
+
+    def _onListenerError(self, exc, pubsub, thread):
+        logger.warning('Lost authentication cache invalidation subscription: %s', exc)
+        thread.stop()
+
+    def _listening(self):
+        return (self._listenerPid == os.getpid() and self._listener is not None
+                and self._listener.is_alive())
+
+    def _active(self):
+        """
+        Make sure this process is subscribed to invalidations, (re)starting the
+        listener after a fork or a lost connection.
+
+        :returns: Whether the cache may be used.
+        """
+        if self._listening():
+            return True
+        if self._listenerPid == os.getpid() and time.monotonic() < self._retryAt:
+            return False
+
+        from girder.notification import _redis_client_sync
+
+        with self._lock:
+            if self._listening():
+                return True
+            # Anything held may have missed invalidations
+            self._entries.clear()
+            self._generation += 1
+            self._listener = None
+            self._listenerPid = os.getpid()
+            try:
+                pubsub = _redis_client_sync().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._onInvalidate})
+                self._listener = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=self._onListenerError)
+            except redis.RedisError as exc:
+                logger.warning('Could not subscribe to authentication cache invalidations: %s', exc)
+                self._retryAt = time.monotonic() + 10
+                return False
+        return True
+
+    def _publish(self, keys):
+        from girder.notification import _redis_client_sync
+
+        try:
+            _redis_client_sync().publish(
+                self.channel, json.dumps({'sender': self._senderId, 'keys': keys}))
+        except redis.RedisError as exc:
+            logger.warning('Could not publish authentication cache invalidation: %s', exc)
+
+
+authCache = AuthCache()
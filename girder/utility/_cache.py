@@ -1,6 +1,18 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
 import cherrypy
+import redis
 from dogpile.cache import make_region, register_backend
+from dogpile.cache.api import NO_VALUE
 from dogpile.cache.backends.memory import MemoryBackend
+from dogpile.cache.backends.redis import RedisBackend
+
+logger = logging.getLogger(__name__)
 
 
 def _setupCache(curConfig: dict):
@@ -34,8 +46,17 @@ def _setupCache(curConfig: dict):
         requestCache.configure(backend='dogpile.cache.null', replace_existing_backend=True)
 
     # Although the rateLimitBuffer has no pre-existing backend, this method may be called multiple
-    # times in testing (where caches were already configured)
-    rateLimitBuffer.configure(backend='dogpile.cache.memory', replace_existing_backend=True)
+    # times in testing (where caches were already configured). Rate limiting is not optional, so
+    # its backend is configured from the CACHE_CONFIG setting even when caching is disabled.
+    rateLimitConfig = {
+        'cache.rate_limit.replace_existing_backend': True,
+        'cache.rate_limit.backend': 'dogpile.cache.memory',
+    }
+    rateLimitConfig.update({
+        k: v for k, v in Setting().get(SettingKey.CACHE_CONFIG).items()
+        if k.startswith('cache.rate_limit.')
+    })
+    rateLimitBuffer.configure_from_config(rateLimitConfig, 'cache.rate_limit.')
 
 
 class CherrypyRequestBackend(MemoryBackend):
@@ -58,7 +79,184 @@ class CherrypyRequestBackend(MemoryBackend):
         return cherrypy.request._girderCache
 
 
+class GirderRedisBackend(RedisBackend):
+    """
+    A redis cache backend which is shared between Girder server processes.
+
+    Unless connection arguments are explicitly passed, this reuses the redis
+    connection configured for notifications via GIRDER_NOTIFICATION_REDIS_URL.
+
+    Each process also keeps a local in-memory tier in front of redis. Writes and
+    deletes are published on a redis channel, and every other process drops the
+    corresponding keys from its local tier when it receives them. The local tier
+    is only consulted while the invalidation subscription is alive, so a lost
+    redis connection degrades to reading through to redis rather than serving
+    stale values. In addition to the arguments of the dogpile redis backend,
+    this accepts:
+
+    :param local_tier: Whether to keep the local in-memory tier.
+    :type local_tier: bool
+    :param local_expiration_time: Upper bound, in seconds, on how long a value is
+        served from the local tier without consulting redis.
+    :type local_expiration_time: int
+    :param local_max_size: Maximum number of entries held in the local tier.
+    :type local_max_size: int
+    :param invalidation_channel: The redis pub/sub channel used for invalidations.
+    :type invalidation_channel: str
+    """
+
+    def __init__(self, arguments):
+        arguments = arguments.copy()
+        self.localTier = arguments.pop('local_tier', True)
+        self.localExpirationTime = arguments.pop('local_expiration_time', 300)
+        self.localMaxSize = arguments.pop('local_max_size', 10000)
+        self.channel = arguments.pop('invalidation_channel', 'girder.cache.invalidate')
+
+        if not {'url', 'host', 'port', 'connection_pool'} & arguments.keys():
+            from girder.notification import _redis_client_sync
+
+            arguments['connection_pool'] = _redis_client_sync().connection_pool
+
+        super().__init__(arguments)
+
+        self._senderId = uuid.uuid4().hex
+        self._local = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listenerPid = None
+        self._retryAt = 0
+
+    def _onInvalidate(self, message):
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('sender') == self._senderId:
+            return
+        with self._lock:
+            self._generation += 1
+            if data.get('keys') is None:
+                self._local.clear()
+            else:
+                for key in data['keys']:
+                    self._local.pop(key, None)
+
+    def _onListenerError(self, exc, pubsub, thread):
+        logger.warning('Lost cache invalidation subscription: %s', exc)
+        thread.stop()
+
+    def _listening(self):
+        return (self._listenerPid == os.getpid() and self._listener is not None
+                and self._listener.is_alive())
+
+    def _localTierActive(self):
+        """
+        Make sure this process is subscribed to invalidations, (re)starting the
+        listener after a fork or a lost connection.
+
+        :returns: Whether the local tier may be used.
+        """
+        if not self.localTier:
+            return False
+        if self._listening():
+            return True
+        if self._listenerPid == os.getpid() and time.monotonic() < self._retryAt:
+            return False
+
+        with self._lock:
+            if self._listening():
+                return True
+            # Anything held locally may have missed invalidations
+            self._local.clear()
+            self._generation += 1
+            self._listener = None
+            self._listenerPid = os.getpid()
+            try:
+                pubsub = self.writer_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.channel: self._onInvalidate})
+                self._listener = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=self._onListenerError)
+            except redis.RedisError as exc:
+                logger.warning('Could not subscribe to cache invalidations: %s', exc)
+                self._retryAt = time.monotonic() + 10
+                return False
+        return True
+
+    def _publish(self, keys):
+        try:
+            self.writer_client.publish(
+                self.channel, json.dumps({'sender': self._senderId, 'keys': keys}))
+        except redis.RedisError:
+            logger.exception('Could not publish cache invalidation')
+
+    def _localGet(self, key):
+        entry = self._local.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return NO_VALUE
+        return entry[0]
+
+    def _localSet(self, mapping, generation):
+        with self._lock:
+            # Don't store values that may have been invalidated while they were being fetched
+            if generation != self._generation:
+                return
+            if len(self._local) + len(mapping) > self.localMaxSize:
+                self._local.clear()
+            expires = time.monotonic() + self.localExpirationTime
+            for key, value in mapping.items():
+                self._local[key] = (value, expires)
+
+    def get_serialized(self, key):
+        if not self._localTierActive():
+            return super().get_serialized(key)
+        value = self._localGet(key)
+        if value is NO_VALUE:
+            generation = self._generation
+            value = super().get_serialized(key)
+            if value is not NO_VALUE:
+                self._localSet({key: value}, generation)
+        return value
+
+    def get_serialized_multi(self, keys):
+        if not self._localTierActive():
+            return super().get_serialized_multi(keys)
+        values = [self._localGet(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is NO_VALUE]
+        if missing:
+            generation = self._generation
+            fetched = dict(zip(missing, super().get_serialized_multi(missing)))
+            self._localSet({k: v for k, v in fetched.items() if v is not NO_VALUE}, generation)
+            values = [fetched.get(key, value) for key, value in zip(keys, values)]
+        return values
+
+    def set_serialized(self, key, value):
+        self.set_serialized_multi({key: value})
+
+    def set_serialized_multi(self, mapping):
+        if len(mapping) == 1:
+            super().set_serialized(*next(iter(mapping.items())))
+        else:
+            super().set_serialized_multi(mapping)
+        self._publish(list(mapping))
+        if self._localTierActive():
+            self._localSet(mapping, self._generation)
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        keys = list(keys)
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._local.pop(key, None)
+        super().delete_multi(keys)
+        self._publish(keys)
+
+
 register_backend('cherrypy_request', 'girder.utility._cache', 'CherrypyRequestBackend')
+register_backend('girder_redis', 'girder.utility._cache', 'GirderRedisBackend')
 
 # These caches must be configured with the null backend upon creation due to the fact
 # that user-based configuration of the regions doesn't happen until server start, which
@@ -72,6 +270,6 @@ hourCache = make_region(name='girder.hour_cache').configure(
 
 # This cache is not configurable by the user, and will always be configured when the server is.
 # It holds data for rate limiting, which is ephemeral, but must be persisted (i.e. it's not optional
-# or best-effort).
-# TODO we need to make this configurable to be share-nothing in a multi-process environment
+# or best-effort). When running multiple server processes, it should be configured to use a shared
+# backend via the "cache.rate_limit." keys of the CACHE_CONFIG setting.
 rateLimitBuffer = make_region(name='girder.rate_limit').configure(backend='dogpile.cache.memory')
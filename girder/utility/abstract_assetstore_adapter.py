@@ -233,6 +233,21 @@ class AbstractAssetstoreAdapter:
         raise NotImplementedError('Must override deleteFile in %s.' %
                                   self.__class__.__name__)
 
+    def deleteFiles(self, files):
+        """
+        This is called when many Files in this assetstore are deleted at once,
+        such as when a folder is deleted.  As with :py:meth:`deleteFile`, the
+        File documents still exist, and the caller will delete them afterward.
+        By default, this calls :py:meth:`deleteFile` for each file.  Adapters
+        whose data may be shared by several files should override this, since
+        files sharing data may be deleted together.
+
+        :param files: The File documents about to be deleted.
+        :type files: list
+        """
+        for file in files:
+            self.deleteFile(file)
+
     def shouldImportFile(self, path, params):
         """
         This is a helper used during the import process to determine if a file located at
@@ -316,6 +331,23 @@ class AbstractAssetstoreAdapter:
         """
         return destFile
 
+    def copyFiles(self, srcFiles, destFiles):
+        """
+        This is called when many Files in this assetstore are copied at once,
+        such as when a folder is copied.  Like :py:meth:`copyFile`, it updates
+        each destination File so that it contains the same data as its source
+        File; the destination Files are saved afterward.  By default, this
+        calls :py:meth:`copyFile` for each pair of files.  Adapters that must
+        duplicate stored data should override this to do so in parallel.
+
+        :param srcFiles: The original File documents.
+        :type srcFiles: list
+        :param destFiles: The new File documents, in the same order.
+        :type destFiles: list
+        """
+        for srcFile, destFile in zip(srcFiles, destFiles):
+            self.copyFile(srcFile, destFile)
+
     def getChunkSize(self, chunk):
         """
         Given a chunk that is either a file-like object or a string, attempt to
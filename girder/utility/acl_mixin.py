@@ -2,10 +2,37 @@ import collections
 import itertools
 from collections import abc
 
+from dogpile.cache.api import NO_VALUE
+from pymongo import UpdateMany
+
 from ..constants import TEXT_SCORE_SORT_MAX, AccessType
 from ..exceptions import AccessException
-from ..models.model_base import AccessControlledModel, Model, _permissionClauses
+from ..models.model_base import (AccessControlledModel, Model, _aclCacheEnabled, _aclCacheKey,
+                                 _permissionClauses)
+from ..utility._cache import requestCache
 from ..utility.model_importer import ModelImporter
+from ..utility.progress import noProgress
+
+
+def _inheritableAccess(doc):
+    """
+    Get the parts of a document's access control list that are copied onto
+    the documents which resolve their access through it.
+
+    :param doc: An access controlled document.
+    :type doc: dict
+    :returns: A dict with the ``public`` flag and the ``access`` user and group
+        levels of the document.
+    """
+    access = doc.get('access') or {}
+    return {
+        'public': doc.get('public', False),
+        'access': {
+            entity: [{'id': entry['id'], 'level': entry['level']}
+                     for entry in access.get(entity, [])]
+            for entity in ('users', 'groups')
+        }
+    }
 
 
 class AccessControlMixin:
@@ -22,11 +49,21 @@ class AccessControlMixin:
 
     resourceParent corresponds to the field in which the parent resource
     belongs, so for an item it would be the folderId.
+
+    If storeInheritedAccess is True, the access control list that a document
+    resolves to is copied into its inheritedAccess field, which lets
+    findWithPermissions filter with a plain query instead of joining with the
+    parent collection.  The copy records the parent it was made from, and is
+    refreshed on validate when the parent changes.  The owner of the access
+    control list must update the copies when its access changes, matching on
+    inheritedAccess.sourceId.
     """
 
     resourceColl = None
     resourceParent = None
+    storeInheritedAccess = False
     _parentModel = None
+    _inheritedAccessComplete = False
 
     @property
     def parentModel(self):
@@ -58,6 +95,12 @@ class AccessControlMixin:
 
         doc = Model.load(self, id=id, objectId=objectId, fields=loadFields, exc=exc)
 
+        if doc is not None and fields is None and self._updateInheritedAccess(doc):
+            # A document that was written without the field; others may also
+            # lack it, so check again before relying on it in queries.
+            self.update({'_id': doc['_id']}, {'$set': {'inheritedAccess': doc['inheritedAccess']}})
+            self._inheritedAccessComplete = False
+
         if not force and doc is not None:
             if doc.get(self.resourceParent):
                 loadType = self.resourceColl
@@ -66,11 +109,20 @@ class AccessControlMixin:
                 loadType = doc.get('attachedToType')
                 loadId = doc.get('attachedToId')
             if isinstance(loadType, str):
-                ModelImporter.model(loadType).load(loadId, level=level, user=user, exc=exc)
+                loadModel = ModelImporter.model(loadType)
             elif isinstance(loadType, abc.Sequence) and len(loadType) == 2:
-                ModelImporter.model(*loadType).load(loadId, level=level, user=user, exc=exc)
+                loadModel = ModelImporter.model(*loadType)
             else:
                 raise Exception('Invalid model type: %s' % str(loadType))
+            # Only successful checks are memoized, and only when the parent
+            # holds its own ACL, since changes to it invalidate the decision.
+            cacheable = isinstance(loadModel, AccessControlledModel) and _aclCacheEnabled()
+            if cacheable:
+                key = _aclCacheKey(loadModel.name, loadId, user, 'load', level)
+            if not cacheable or requestCache.get(key) is NO_VALUE:
+                loadModel.load(loadId, level=level, user=user, exc=exc)
+                if cacheable:
+                    requestCache.set(key, True)
 
             self._removeSupplementalFields(doc, fields)
 
@@ -79,13 +131,166 @@ class AccessControlMixin:
     def hasAccess(self, resource, user=None, level=AccessType.READ):
         """
         Determines if a user has access to a resource based on their access to
-        the resourceParent.
+        the resourceParent.  When caching is enabled, the decision for each
+        parent is computed once per request.
 
         Takes the same parameters as
         :py:func:`girder.models.model_base.AccessControlledModel.hasAccess`.
         """
-        resource = self.parentModel.load(resource[self.resourceParent], force=True)
-        return self.parentModel.hasAccess(resource, user=user, level=level)
+        parentId = resource[self.resourceParent]
+        cacheable = isinstance(self.parentModel, AccessControlledModel) and _aclCacheEnabled()
+        if cacheable:
+            key = _aclCacheKey(self.parentModel.name, parentId, user, 'hasAccess', level)
+            val = requestCache.get(key)
+            if val is not NO_VALUE:
+                return val
+
+        resource = self.parentModel.load(parentId, force=True)
+        val = self.parentModel.hasAccess(resource, user=user, level=level)
+
+        if cacheable:
+            requestCache.set(key, val)
+        return val
+
+    def _inheritedAccessFromParent(self, parentId):
+        """
+        Compute the inheritedAccess field of a document with the given parent.
+        If the parent doesn't exist, the document is not accessible through it.
+        """
+        inherited = {'parentId': parentId}
+        parentModel = self.parentModel
+        if parentId is None:
+            return inherited
+        if isinstance(parentModel, AccessControlledModel):
+            parent = parentModel.findOne({'_id': parentId}, fields=['public', 'access'])
+            inherited['sourceId'] = parentId
+            if parent is not None:
+                inherited.update(_inheritableAccess(parent))
+        elif getattr(parentModel, 'storeInheritedAccess', False):
+            parent = parentModel.findOne(
+                {'_id': parentId}, fields=['inheritedAccess', parentModel.resourceParent])
+            if parent is not None:
+                grandparentId = parent.get(parentModel.resourceParent)
+                source = parent.get('inheritedAccess')
+                if source is None or source.get('parentId') != grandparentId:
+                    source = parentModel._inheritedAccessFromParent(grandparentId)
+                inherited.update({k: v for k, v in source.items() if k != 'parentId'})
+        return inherited
+
+    def _inheritedAccessFromParentDoc(self, parent):
+        """
+        Compute the inheritedAccess field of a document from its parent
+        document, when that is already loaded, so that no query is needed.
+
+        :param parent: The parent document, which may be partial.
+        :type parent: dict or None
+        :returns: The inheritedAccess field, or None if the parent document
+            doesn't include the fields to compute it from.
+        """
+        if not self.storeInheritedAccess or not parent or '_id' not in parent:
+            return None
+        if isinstance(self.parentModel, AccessControlledModel):
+            if 'access' not in parent:
+                return None
+            return dict(
+                _inheritableAccess(parent), parentId=parent['_id'], sourceId=parent['_id'])
+        source = parent.get('inheritedAccess')
+        if source is None or source.get('parentId') != parent.get(
+                self.parentModel.resourceParent, False):
+            return None
+        return dict(source, parentId=parent['_id'])
+
+    def save(self, document, *args, **kwargs):
+        """
+        Override of Model.save to make sure that documents get an
+        inheritedAccess field even when they are saved without validation.
+        The parameters are the same as Model.save.
+        """
+        if self.storeInheritedAccess and 'inheritedAccess' not in document:
+            self._updateInheritedAccess(document)
+        return super().save(document, *args, **kwargs)
+
+    def _updateInheritedAccess(self, doc):
+        """
+        Refresh the inheritedAccess field of a document if it was not computed
+        from its current parent.  This should be called from validate.
+
+        :param doc: The document being validated.
+        :type doc: dict
+        :returns: True if the field was changed.
+        """
+        if not self.storeInheritedAccess:
+            return False
+        parentId = doc.get(self.resourceParent)
+        if doc.get('inheritedAccess', {}).get('parentId', False) == parentId:
+            return False
+        doc['inheritedAccess'] = self._inheritedAccessFromParent(parentId)
+        return True
+
+    def hasCompleteInheritedAccess(self):
+        """
+        Whether every document in this collection has an inheritedAccess
+        field, so that it can be used to check permissions in queries.  Once
+        true, this is remembered for the life of the process.
+        """
+        if not self.storeInheritedAccess:
+            return False
+        if not self._inheritedAccessComplete:
+            self._inheritedAccessComplete = self.findOne({
+                'inheritedAccess.sourceId': None,
+                'inheritedAccess': {'$exists': False}
+            }, fields=['_id']) is None
+        return self._inheritedAccessComplete
+
+    def backfillInheritedAccess(self, batchSize=1000, progress=noProgress):
+        """
+        Set the inheritedAccess field on all documents that lack it.  This is
+        done in batches of bulk writes, grouped by parent, and can be
+        interrupted and rerun.  For models whose parent also stores inherited
+        access, the parent collection should be backfilled first.
+
+        :param batchSize: The number of documents to read per batch.
+        :type batchSize: int
+        :param progress: Progress context to update.
+        :type progress: :py:class:`girder.utility.progress.ProgressContext`
+        :returns: The number of updated documents.
+        """
+        if not self.storeInheritedAccess:
+            return 0
+        query = {'inheritedAccess': {'$exists': False}}
+        count = 0
+        lastId = None
+        while True:
+            # Page by _id, so that each document is only read once
+            batchQuery = dict(query) if lastId is None else dict(query, _id={'$gt': lastId})
+            batch = list(self.find(
+                batchQuery, limit=batchSize, sort=[('_id', 1)], fields=[self.resourceParent]))
+            if not batch:
+                break
+            lastId = batch[-1]['_id']
+            parentIds = {doc.get(self.resourceParent) for doc in batch}
+            result = self.collection.bulk_write([
+                UpdateMany(dict(query, **{self.resourceParent: parentId}), {
+                    '$set': {'inheritedAccess': self._inheritedAccessFromParent(parentId)}})
+                for parentId in parentIds
+            ], ordered=False)
+            count += result.modified_count
+            progress.update(current=count)
+        return count
+
+    def _bulkSetMetadata(self, *args, **kwargs):
+        """
+        See the documentation of AccessControlledModel._bulkSetMetadata, which
+        this reuses.  Access is checked through findWithPermissions.
+        """
+        return AccessControlledModel._bulkSetMetadata(self, *args, **kwargs)
+
+    def _requireBulkAccess(self, *args, **kwargs):
+        """
+        See the documentation of AccessControlledModel._requireBulkAccess, which
+        this reuses.
+        """
+        return AccessControlledModel._requireBulkAccess(self, *args, **kwargs)
 
     def hasAccessFlags(self, doc, user=None, flags=None):
         """
@@ -249,7 +454,7 @@ class AccessControlMixin:
 
     def findWithPermissions(self, query=None, offset=0, limit=0, timeout=None, fields=None,
                             sort=None, user=None, level=AccessType.READ, aggregateSort=None,
-                            **kwargs):
+                            after=None, **kwargs):
         """
         Search the collection by a set of parameters, only returning results
         that the combined user and level have permission to access. Passes any
@@ -278,10 +483,19 @@ class AccessControlMixin:
         :param aggregateSort: A sort order to use if `sort` is None and an
             aggregation is used.
         :type aggregateSort: List of (key, order) tuples.
+        :param after: A token for keyset pagination; see
+            :py:meth:`girder.models.model_base.Model.find`.
+        :type after: str or None
         :returns: A pymongo Cursor, CommandCursor, or an iterable.  If a
             CommandCursor, it has been augmented with a count function.
         """
+        query, sort = self._applyAfter(query, sort, after, aggregateSort)
         if level is not None and (not user or not user['admin']):
+            if self.hasCompleteInheritedAccess():
+                # The parent's access control list is copied onto every
+                # document, so permissions can be checked with a plain match.
+                query = {'$and': [
+                    query or {}, self.permissionClauses(user, level, 'inheritedAccess.')]}
             # If the resourceColl isn't an access controlled model that we
             # know how to reach, fall back to performing the ordinary query and
             # then filtering it by permission.  For instance, if a model uses
@@ -291,79 +505,91 @@ class AccessControlMixin:
             #  Note, this also handles models which use attachedToType and
             # attachedToId, since ModelImporter.model(None) will not be an access
             # controlled model.
-            if not isinstance(self.parentModel, AccessControlledModel):
+            elif not isinstance(self.parentModel, AccessControlledModel):
                 return self._findWithPermissionsFallback(
                     query, offset, limit, timeout, fields, sort, user, level,
                     **kwargs)
-
-            query = query or {}
-            initialPipeline = [
-                {'$match': query},
-                {'$lookup': {
-                    'from': self.parentModel.name,
-                    'localField': self.resourceParent,
-                    'foreignField': '_id',
-                    'as': '__parent'
-                }},
-                {'$match': self.permissionClauses(user, level, '__parent.')},
-            ]
-            countPipeline = initialPipeline + [
-                {'$count': 'count'},
-            ]
-            fullPipeline = initialPipeline + [
-                {'$project': {'__parent': False}},
-            ]
-            if sort is not None or aggregateSort is not None:
-                fullPipeline.append({'$sort': collections.OrderedDict(sort or aggregateSort)})
-            # limit should immediately follow sort for efficiency
-            if limit:
-                fullPipeline.append({'$limit': limit + (offset or 0)})
-            if offset:
-                fullPipeline.append({'$skip': offset})
-            if fields is not None:
-                # fields can be a Sequence, Set, or Mapping.  If a Mapping, the
-                # values are typically booleans or themselves a mapping (such
-                # as from text search to add a field like _textScore: {$meta:
-                # 'textScore'}).  Convert sequences and sets to mappings (as
-                # done in pymongo), then use values that aren't themselves
-                # mappings as a projection and those that are mappings as
-                # added fields.
-                if isinstance(fields, (abc.Sequence, abc.Set)):
-                    fields = dict.fromkeys(fields, 1)
-                if any(not isinstance(v, abc.Mapping) for v in fields.values()):
-                    fullPipeline.append({'$project': {
-                        k: v for k, v in fields.items()
-                        if not isinstance(v, abc.Mapping)}})
-                if any(isinstance(v, abc.Mapping) for v in fields.values()):
-                    fullPipeline.append({'$addFields': {
-                        k: v for k, v in fields.items()
-                        if isinstance(v, abc.Mapping)}})
-            options = {
-                # By allowing disk use, large sorted queries will work.  If
-                # disallowed, they will fail.  Although this is slower than
-                # memory sorting, actual experiemnts show it to be acceptable
-                'allowDiskUse': True,
-                # Start with a 0-sized batch.  This avoids fetching data from
-                # the Mongo server if the query is never polled and starts
-                # streaming data faster than a fixed batch size.
-                'cursor': {'batchSize': 0}
-            }
-            if timeout:
-                options['maxTimeMS'] = timeout
-            result = self.collection.aggregate(fullPipeline, **options)
-
-            def count():
-                try:
-                    return next(iter(self.collection.aggregate(countPipeline, **options)))['count']
-                except StopIteration:
-                    # If there are no values, this won't return the count, in
-                    # which case it is zero.
-                    return 0
-
-            result.count = count
-            # Mark that this result came from an aggregate.  If an aggregate
-            # is used, the results could be sorted via the aggregateSort
-            # parameter.  This informs the consumer of the result.
-            result.fromAggregate = True
-            return result
+            else:
+                return self._findWithPermissionsAggregate(
+                    query, offset, limit, timeout, fields, sort, user, level, aggregateSort)
         return self.find(query, offset, limit, timeout, fields, sort, **kwargs)
+
+    def _findWithPermissionsAggregate(self, query, offset, limit, timeout, fields, sort, user,
+                                      level, aggregateSort):
+        """
+        See findWithPermissions.  This joins each document with its parent
+        resource in an aggregation to check permissions on the parent's access
+        control list.
+
+        See findWithPermissions for parameters and return.
+        """
+        query = query or {}
+        initialPipeline = [
+            {'$match': query},
+            {'$lookup': {
+                'from': self.parentModel.name,
+                'localField': self.resourceParent,
+                'foreignField': '_id',
+                'as': '__parent'
+            }},
+            {'$match': self.permissionClauses(user, level, '__parent.')},
+        ]
+        countPipeline = initialPipeline + [
+            {'$count': 'count'},
+        ]
+        fullPipeline = initialPipeline + [
+            {'$project': {'__parent': False}},
+        ]
+        if sort is not None or aggregateSort is not None:
+            fullPipeline.append({'$sort': collections.OrderedDict(sort or aggregateSort)})
+        # limit should immediately follow sort for efficiency
+        if limit:
+            fullPipeline.append({'$limit': limit + (offset or 0)})
+        if offset:
+            fullPipeline.append({'$skip': offset})
+        if fields is not None:
+            # fields can be a Sequence, Set, or Mapping.  If a Mapping, the
+            # values are typically booleans or themselves a mapping (such
+            # as from text search to add a field like _textScore: {$meta:
+            # 'textScore'}).  Convert sequences and sets to mappings (as
+            # done in pymongo), then use values that aren't themselves
+            # mappings as a projection and those that are mappings as
+            # added fields.
+            if isinstance(fields, (abc.Sequence, abc.Set)):
+                fields = dict.fromkeys(fields, 1)
+            if any(not isinstance(v, abc.Mapping) for v in fields.values()):
+                fullPipeline.append({'$project': {
+                    k: v for k, v in fields.items()
+                    if not isinstance(v, abc.Mapping)}})
+            if any(isinstance(v, abc.Mapping) for v in fields.values()):
+                fullPipeline.append({'$addFields': {
+                    k: v for k, v in fields.items()
+                    if isinstance(v, abc.Mapping)}})
+        options = {
+            # By allowing disk use, large sorted queries will work.  If
+            # disallowed, they will fail.  Although this is slower than
+            # memory sorting, actual experiemnts show it to be acceptable
+            'allowDiskUse': True,
+            # Start with a 0-sized batch.  This avoids fetching data from
+            # the Mongo server if the query is never polled and starts
+            # streaming data faster than a fixed batch size.
+            'cursor': {'batchSize': 0}
+        }
+        if timeout:
+            options['maxTimeMS'] = timeout
+        result = self.collection.aggregate(fullPipeline, **options)
+
+        def count():
+            try:
+                return next(iter(self.collection.aggregate(countPipeline, **options)))['count']
+            except StopIteration:
+                # If there are no values, this won't return the count, in
+                # which case it is zero.
+                return 0
+
+        result.count = count
+        # Mark that this result came from an aggregate.  If an aggregate
+        # is used, the results could be sorted via the aggregateSort
+        # parameter.  This informs the consumer of the result.
+        result.fromAggregate = True
+        return result
@@ -1,12 +1,21 @@
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
+import errno
 import io
 import logging
 import mimetypes
 import os
+import re
 import shutil
 import stat
 import tempfile
+import threading
+import time
 from hashlib import sha512
 
+import cherrypy
 import filelock
 import psutil
 
@@ -21,14 +30,113 @@ from girder.utility import mkdir, progress
 
 from . import _hash_state
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
+from .import_batch import ImportBatch
+from .system import formatSize
 
 BUF_SIZE = 65536
+# Uploaded chunks are copied in pieces of this size, so that one piece can be
+# hashed while the next is read and written.
+UPLOAD_BUF_SIZE = 1024 * 1024
+# While a process keeps handling an upload, the checksum state is kept in
+# memory and only persisted in the upload document once this many bytes have
+# been received since it was last persisted.  A different process continuing
+# the upload rehashes those bytes from the temp file.
+HASH_STATE_INTERVAL = 256 * 1024 * 1024
+# The maximum number of uploads whose checksums are kept in memory
+HASH_CACHE_SIZE = 1000
+
+# Temp files of uploads at least this large have their disk space reserved
+# when the upload is created.
+PREALLOCATE_MIN_SIZE = 64 * 1024 * 1024
+# The flag that makes fallocate(2) reserve space without changing the
+# apparent size of the file.
+_FALLOC_FL_KEEP_SIZE = 1
+
+# The number of directories listed at once during an import
+IMPORT_THREADS = 8
+# The number of imported files written to the database at a time
+IMPORT_BATCH_SIZE = 1000
+# The number of blobs deleted at once when many files are deleted together
+DELETE_THREADS = 8
+
+# Blobs are stored as <hash[0:2]>/<hash[2:4]>/<hash> under the assetstore root
+_BLOB_DIR_RE = re.compile(r'^[0-9a-f]{2}$')
+_BLOB_NAME_RE = re.compile(r'^[0-9a-f]{128}$')
 
 # Default permissions for the files written to the filesystem
 DEFAULT_PERMS = stat.S_IRUSR | stat.S_IWUSR
 
 logger = logging.getLogger(__name__)
 
+_checksums = collections.OrderedDict()
+_checksumsLock = threading.Lock()
+_hashExecutor = None
+_fallocate = None
+
+
+def _getHashExecutor():
+    """
+    Get the thread pool used for hashing uploaded data. A new pool is created
+    after forking, since the threads of the parent's pool do not exist in the
+    child.
+    """
+    global _hashExecutor
+
+    with _checksumsLock:
+        if _hashExecutor is None or _hashExecutor[0] != os.getpid():
+            _hashExecutor = (os.getpid(), concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix='girder-upload-hash'))
+        return _hashExecutor[1]
+
+
+def _getFallocate():
+    """
+    Get the fallocate function of the C library, or False if it does not have
+    one. This is called through ctypes since os.posix_fallocate is emulated
+    by writing every block on filesystems that cannot reserve space.
+    """
+    global _fallocate
+
+    if _fallocate is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            func = getattr(libc, 'fallocate64', None) or libc.fallocate
+            func.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+            func.restype = ctypes.c_int
+        except (OSError, AttributeError):
+            func = False
+        _fallocate = func
+    return _fallocate
+
+
+def _copyChunk(chunk, tempFile, checksum, limit):
+    """
+    Copy an uploaded chunk into a file, updating a checksum. Each piece is
+    hashed on a worker thread while the next piece is read and written, so
+    hashing overlaps with network and disk I/O. Reading stops at the end of
+    the chunk or once more than ``limit`` bytes have been read.
+
+    :returns: The number of bytes copied.
+    """
+    size = 0
+    hashing = None
+    try:
+        while size <= limit:
+            data = chunk.read(UPLOAD_BUF_SIZE)
+            if not data:
+                break
+            size += len(data)
+            # Only one piece is hashed at a time, since the updates must be
+            # applied in order.
+            if hashing is not None:
+                hashing.result()
+            hashing = _getHashExecutor().submit(checksum.update, data)
+            tempFile.write(data)
+    finally:
+        if hashing is not None:
+            hashing.result()
+    return size
+
 
 class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     """
@@ -85,9 +193,10 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     def fileIndexFields():
         """
         File documents should have an index on their sha512 field, as well as
-        whether or not they are imported.
+        whether or not they are imported.  The compound index lets the files
+        of one assetstore be listed in order of hash.
         """
-        return ['sha512', 'imported']
+        return ['sha512', 'imported', ([('assetstoreId', 1), ('sha512', 1)], {})]
 
     def __init__(self, assetstore):
         super().__init__(assetstore)
@@ -156,11 +265,33 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
             msg = 'Assetstore is unavailable or has insufficient free space.'
             raise ValidationException(msg)
         fd, path = tempfile.mkstemp(dir=self.tempDir)
-        os.close(fd)  # Must close this file descriptor or it will leak
+        try:
+            self._preallocate(upload, fd, path)
+        finally:
+            os.close(fd)  # Must close this file descriptor or it will leak
         upload['tempFile'] = path
         upload['sha512state'] = _hash_state.serializeHex(sha512())
+        upload['sha512stateOffset'] = 0
         return upload
 
+    def _preallocate(self, upload, fd, path):
+        """
+        Reserve the disk space for a large upload, so that the file is not
+        fragmented and the filesystem does not need to allocate blocks as the
+        chunks are written. The space is reserved past the end of the file,
+        so the file still only holds the data received so far, and the space
+        is released when the temp file is deleted. Nothing is done if the
+        filesystem cannot reserve space without writing to it.
+        """
+        fallocate = _getFallocate()
+        if not fallocate or (upload['size'] or 0) < PREALLOCATE_MIN_SIZE:
+            return
+        if fallocate(fd, _FALLOC_FL_KEEP_SIZE, 0, upload['size']) == 0:
+            return
+        if ctypes.get_errno() == errno.ENOSPC:
+            os.unlink(path)
+            raise ValidationException('Assetstore has insufficient free space.')
+
     def uploadChunk(self, upload, chunk, uploadExtraParameters):
         """
         Appends the chunk into the temporary file.
@@ -177,43 +308,60 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, bytes):
             chunk = io.BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+        checksum = self._restoreChecksum(upload)
+        upload.setdefault('sha512stateOffset', upload['received'])
+        with open(upload['tempFile'], 'r+b') as tempFile:
+            tempFile.seek(upload['received'])
+            try:
+                size = _copyChunk(
+                    chunk, tempFile, checksum, upload['size'] - upload['received'])
+                self.checkUploadSize(upload, size)
+            except Exception:
+                tempFile.truncate(upload['received'])
+                raise
+            finally:
+                chunk.close()
+            # Discard anything left from a write that was never recorded
+            tempFile.truncate(upload['received'] + size)
+
+        upload['received'] += size
+        # Persist the internal state of the checksum if the upload may be
+        # continued by another process
+        unpersisted = upload['received'] - upload['sha512stateOffset']
+        if '_id' not in upload or unpersisted >= HASH_STATE_INTERVAL:
+            upload['sha512state'] = _hash_state.serializeHex(checksum)
+            upload['sha512stateOffset'] = upload['received']
+        if '_id' in upload:
+            with _checksumsLock:
+                _checksums[upload['_id']] = (checksum, upload['received'])
+                while len(_checksums) > HASH_CACHE_SIZE:
+                    _checksums.popitem(last=False)
+        return upload
+
+    def _restoreChecksum(self, upload):
+        """
+        Get the SHA-512 checksum of the data received so far for an upload.
+        If this process handled the previous chunk, the checksum is taken from
+        memory. Otherwise, the persisted state is restored and updated with any
+        data received since it was persisted.
+        """
+        with _checksumsLock:
+            cached = _checksums.pop(upload.get('_id'), None)
+        if cached is not None and cached[1] == upload['received']:
+            return cached[0]
 
-        if self.requestOffset(upload) > upload['received']:
-            # This probably means the server died midway through writing last
-            # chunk to disk, and the database record was not updated. This
-            # means we need to update the sha512 state with the difference.
+        checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+        offset = upload.get('sha512stateOffset', upload['received'])
+        if offset < upload['received']:
             with open(upload['tempFile'], 'rb') as tempFile:
-                tempFile.seek(upload['received'])
-                while True:
-                    data = tempFile.read(BUF_SIZE)
+                tempFile.seek(offset)
+                while offset < upload['received']:
+                    data = tempFile.read(min(BUF_SIZE, upload['received'] - offset))
                     if not data:
                         break
+                    offset += len(data)
                     checksum.update(data)
-
-        with open(upload['tempFile'], 'a+b') as tempFile:
-            size = 0
-            while not upload['received'] + size > upload['size']:
-                data = chunk.read(BUF_SIZE)
-                if not data:
-                    break
-                size += len(data)
-                tempFile.write(data)
-                checksum.update(data)
-        chunk.close()
-
-        try:
-            self.checkUploadSize(upload, size)
-        except ValidationException:
-            with open(upload['tempFile'], 'a+b') as tempFile:
-                tempFile.truncate(upload['received'])
-            raise
-
-        # Persist the internal state of the checksum
-        upload['sha512state'] = _hash_state.serializeHex(checksum)
-        upload['received'] += size
-        return upload
+        return checksum
 
     def requestOffset(self, upload):
         """
@@ -226,7 +374,7 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         Moves the file into its permanent content-addressed location within the
         assetstore. Directory hierarchy yields 256^2 buckets.
         """
-        hash = _hash_state.restoreHex(upload['sha512state'], 'sha512').hexdigest()
+        hash = self._restoreChecksum(upload).hexdigest()
         dir = os.path.join(hash[0:2], hash[2:4])
         absdir = os.path.join(self.assetstore['root'], dir)
 
@@ -278,7 +426,10 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                      contentDisposition=None, extraParameters=None, **kwargs):
         """
         Returns a generator function that will be used to stream the file from
-        disk to the response.
+        disk to the response. When the whole file is sent as the response and
+        the server offers a ``wsgi.file_wrapper``, the function returns the
+        open file in that wrapper instead, so that the server can send the
+        file directly from disk.
         """
         if endByte is None or endByte > file['size']:
             endByte = file['size']
@@ -291,11 +442,18 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'girder.utility.filesystem_assetstore_adapter.'
                 'file-does-not-exist')
 
+        fileWrapper = None
         if headers:
             setResponseHeader('Accept-Ranges', 'bytes')
             self.setContentHeaders(file, offset, endByte, contentDisposition)
-
-        def stream():
+            # CherryPy's encode tool wraps the body of text responses in a
+            # generator, so the server would never see the file wrapper.
+            contentType = cherrypy.response.headers.get('Content-Type', '')
+            if not contentType.startswith('text/'):
+                environ = getattr(cherrypy.request, 'wsgi_environ', None) or {}
+                fileWrapper = environ.get('wsgi.file_wrapper')
+
+        def readRange():
             bytesRead = offset
             with open(path, 'rb') as f:
                 if offset > 0:
@@ -313,6 +471,11 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                         break
                     yield data
 
+        def stream():
+            if fileWrapper is None or offset or endByte < file['size'] or not endByte:
+                return readRange()
+            return fileWrapper(open(path, 'rb'), BUF_SIZE)
+
         return stream
 
     def deleteFile(self, file):
@@ -340,10 +503,53 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                     except Exception:
                         logger.exception('Failed to delete file %s', path)
 
+    def deleteFiles(self, files):
+        """
+        Deletes the data of many files from disk, on a pool of DELETE_THREADS
+        threads.  Each blob is deleted unless a File that isn't being deleted
+        or an upload has the same sha512, using the same lock as
+        :py:meth:`deleteFile`.
+        """
+        paths = {
+            file['sha512']: file['path'] for file in files
+            if not file.get('imported') and 'path' in file}
+        if not paths:
+            return
+        fileIds = [file['_id'] for file in files]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=DELETE_THREADS, thread_name_prefix='girder-fs-delete') as pool:
+            for future in [
+                    pool.submit(self._deleteBlob, hash, path, fileIds)
+                    for hash, path in paths.items()]:
+                future.result()
+
+    def _deleteBlob(self, hash, relpath, fileIds):
+        """
+        Delete a blob unless a file other than the ones being deleted, or an
+        upload, references it.
+        """
+        q = {
+            'sha512': hash,
+            'assetstoreId': self.assetstore['_id']
+        }
+        path = os.path.join(self.assetstore['root'], relpath)
+        if os.path.isfile(path):
+            with filelock.FileLock(path + '.deleteLock'):
+                if (File().findOne(dict(q, _id={'$nin': fileIds}), fields=[])
+                        or Upload().findOne(q, fields=[])):
+                    return
+                try:
+                    os.unlink(path)
+                except Exception:
+                    logger.exception('Failed to delete file %s', path)
+
     def cancelUpload(self, upload):
         """
-        Delete the temporary files associated with a given upload.
+        Delete the temporary files associated with a given upload. This also
+        releases any disk space reserved for it.
         """
+        with _checksumsLock:
+            _checksums.pop(upload.get('_id'), None)
         if os.path.exists(upload['tempFile']):
             os.unlink(upload['tempFile'])
 
@@ -380,21 +586,6 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                      path, item['_id'], self.assetstore['_id'])
         return file
 
-    def _importDataAsItem(self, name, user, folder, path, files, reuseExisting=True, params=None):
-        params = params or {}
-        item = Item().createItem(
-            name=self.safeName(name), creator=user, folder=folder, reuseExisting=reuseExisting)
-        events.trigger('filesystem_assetstore_imported',
-                       {'id': item['_id'], 'type': 'item',
-                        'importPath': path})
-        for fname in files:
-            fpath = os.path.join(path, fname)
-            if self.shouldImportFile(fpath, params):
-                self.importFile(item, fpath, user, name=fname)
-
-    def _hasOnlyFiles(self, path, files):
-        return all(os.path.isfile(os.path.join(path, name)) for name in files)
-
     def _importFileToFolder(self, name, user, parent, parentType, path):
         if parentType != 'folder':
             raise ValidationException(
@@ -410,6 +601,19 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         self.importFile(item, path, user, name=name)
 
     def importData(self, parent, parentType, params, progress, user, leafFoldersAsItems):
+        """
+        Import a file or a directory tree.  Directories are listed and their
+        files are stat'ed on a pool of IMPORT_THREADS threads ahead of this
+        thread, which creates folders and buffers items and files to be written
+        in batches of IMPORT_BATCH_SIZE.
+
+        Directories are imported in depth-first order of their sorted paths.
+        Each time a batch is written, the ``assetstore_import.checkpoint``
+        event is triggered with the relative path of the last directory whose
+        files have all been written.  Passing that path as the
+        ``resumeCheckpoint`` parameter skips the files of the directories up to
+        and including it.
+        """
         importPath = params['importPath']
 
         if not os.path.exists(importPath):
@@ -420,44 +624,8 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
             self._importFileToFolder(name, user, parent, parentType, importPath)
             return
 
-        listDir = os.listdir(importPath)
-
-        if parentType != 'folder' and any(
-                os.path.isfile(os.path.join(importPath, val)) for val in listDir):
-            raise ValidationException(
-                'Files cannot be imported directly underneath a %s.' % parentType)
-
-        if leafFoldersAsItems and self._hasOnlyFiles(importPath, listDir):
-            self._importDataAsItem(
-                os.path.basename(importPath.rstrip(os.sep)), user, parent, importPath,
-                listDir, params=params)
-            return
-
-        for name in listDir:
-            progress.update(message=name)
-            path = os.path.join(importPath, name)
-
-            if os.path.isdir(path):
-                localListDir = os.listdir(path)
-                if leafFoldersAsItems and self._hasOnlyFiles(path, localListDir):
-                    self._importDataAsItem(name, user, parent, path, localListDir, params=params)
-                else:
-                    folder = Folder().createFolder(
-                        parent=parent, name=self.safeName(name),
-                        parentType=parentType, creator=user, reuseExisting=True)
-                    events.trigger(
-                        'filesystem_assetstore_imported', {
-                            'id': folder['_id'],
-                            'type': 'folder',
-                            'importPath': path
-                        })
-                    nextPath = os.path.join(importPath, name)
-                    self.importData(
-                        folder, 'folder', params=dict(params, importPath=nextPath),
-                        progress=progress, user=user, leafFoldersAsItems=leafFoldersAsItems)
-            else:
-                if self.shouldImportFile(path, params):
-                    self._importFileToFolder(name, user, parent, parentType, path)
+        _DirectoryImport(
+            self, parent, parentType, params, progress, user, leafFoldersAsItems).run()
 
     def findInvalidFiles(self, progress=progress.noProgress, filters=None,
                          checkSize=True, **kwargs):
@@ -503,6 +671,148 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                     'path': path
                 }
 
+    def _sortedBlobEntries(self, path, pattern):
+        """
+        List the entries of a directory in the blob tree whose names match a
+        pattern, sorted by name.
+        """
+        try:
+            with os.scandir(path) as it:
+                entries = [entry for entry in it if pattern.match(entry.name)]
+        except OSError:
+            return []
+        return sorted(entries, key=lambda entry: entry.name)
+
+    def _iterBlobs(self, progress):
+        """
+        Yield a ``(hash, path, stat)`` tuple for each blob stored in the
+        assetstore, in order of hash.  Only one directory listing is held in
+        memory at a time.
+        """
+        top = self._sortedBlobEntries(self.assetstore['root'], _BLOB_DIR_RE)
+        progress.update(total=len(top), current=0)
+        for dir in top:
+            progress.update(increment=1, message='Checking %s' % dir.name)
+            if not dir.is_dir():
+                continue
+            for subdir in self._sortedBlobEntries(dir.path, _BLOB_DIR_RE):
+                if not subdir.is_dir():
+                    continue
+                for entry in self._sortedBlobEntries(subdir.path, _BLOB_NAME_RE):
+                    if entry.is_file():
+                        yield entry.name, entry.path, entry.stat()
+
+    def _iterFileHashes(self, batchSize):
+        """
+        Yield a ``(hash, count, size)`` tuple for each hash referenced by the
+        non-imported files in the assetstore, in order of hash, where ``count``
+        is the number of files with that hash and ``size`` is their total size.
+        """
+        cursor = File().find({
+            'assetstoreId': self.assetstore['_id'],
+            'sha512': {'$exists': True},
+            'imported': {'$ne': True}
+        }, fields=['sha512', 'size'], sort=[('sha512', 1)], batch_size=batchSize)
+        current = None
+        for file in cursor:
+            if current is not None and current[0] == file['sha512']:
+                current[1] += 1
+                current[2] += file.get('size', 0)
+                continue
+            if current is not None:
+                yield tuple(current)
+            current = [file['sha512'], 1, file.get('size', 0)]
+        if current is not None:
+            yield tuple(current)
+
+    def blobReport(self, progress=progress.noProgress, reclaim=False, minimumAge=1,
+                   batchSize=1000):
+        """
+        Compare the blobs stored in this assetstore with the files that
+        reference them.  The blob tree and the files sorted by hash are both
+        streamed and compared with a merge join, so memory use does not depend
+        on the size of the assetstore.
+
+        :param progress: Pass a progress context to record progress.
+        :type progress: :py:class:`girder.utility.progress.ProgressContext`
+        :param reclaim: Whether to delete orphaned blobs, which are not
+            referenced by any file or upload.
+        :type reclaim: bool
+        :param minimumAge: Only delete orphaned blobs that have not been
+            modified for at least this many days, so that blobs of uploads that
+            are being finalized are kept.
+        :type minimumAge: float
+        :param batchSize: The number of files to fetch from the database at a
+            time.
+        :type batchSize: int
+        :returns: A dictionary with the number of blobs (``blobs``), their
+            size on disk (``blobBytes``), the number of files that reference
+            them (``files``) and those files' size (``fileBytes``), the number
+            of blobs referenced by more than one file (``sharedBlobs``) and the
+            space saved by sharing them (``savedBytes``), the number and size
+            of blobs that no file references (``orphanedBlobs`` and
+            ``orphanedBytes``), the number of hashes referenced by files whose
+            blob is missing (``missingBlobs``), and the number and size of
+            orphaned blobs that were deleted (``reclaimedBlobs`` and
+            ``reclaimedBytes``).
+        """
+        report = dict.fromkeys((
+            'blobs', 'blobBytes', 'files', 'fileBytes', 'sharedBlobs', 'savedBytes',
+            'orphanedBlobs', 'orphanedBytes', 'missingBlobs', 'reclaimedBlobs',
+            'reclaimedBytes'), 0)
+        cutoff = time.time() - minimumAge * 86400
+        blobs = self._iterBlobs(progress)
+        hashes = self._iterFileHashes(batchSize)
+        blob = next(blobs, None)
+        hash = next(hashes, None)
+        while blob is not None or hash is not None:
+            if hash is None or (blob is not None and blob[0] < hash[0]):
+                report['blobs'] += 1
+                report['blobBytes'] += blob[2].st_size
+                report['orphanedBlobs'] += 1
+                report['orphanedBytes'] += blob[2].st_size
+                if reclaim and blob[2].st_mtime < cutoff and self._reclaimBlob(*blob[:2]):
+                    report['reclaimedBlobs'] += 1
+                    report['reclaimedBytes'] += blob[2].st_size
+                blob = next(blobs, None)
+            elif blob is None or hash[0] < blob[0]:
+                report['files'] += hash[1]
+                report['fileBytes'] += hash[2]
+                report['missingBlobs'] += 1
+                hash = next(hashes, None)
+            else:
+                report['blobs'] += 1
+                report['blobBytes'] += blob[2].st_size
+                report['files'] += hash[1]
+                report['fileBytes'] += hash[2]
+                if hash[1] > 1:
+                    report['sharedBlobs'] += 1
+                    report['savedBytes'] += (hash[1] - 1) * blob[2].st_size
+                blob = next(blobs, None)
+                hash = next(hashes, None)
+        return report
+
+    def _reclaimBlob(self, hash, path):
+        """
+        Delete an orphaned blob unless a file or upload has started to
+        reference it.  This uses the same lock as :py:meth:`deleteFile`.
+
+        :returns: True if the blob was deleted.
+        """
+        q = {
+            'sha512': hash,
+            'assetstoreId': self.assetstore['_id']
+        }
+        with filelock.FileLock(path + '.deleteLock'):
+            if File().findOne(q, fields=[]) or Upload().findOne(q, fields=[]):
+                return False
+            try:
+                os.unlink(path)
+            except OSError:
+                logger.exception('Failed to delete orphaned blob %s', path)
+                return False
+        return True
+
     def getLocalFilePath(self, file):
         """
         Return a path to the file on the local file system.
@@ -515,3 +825,163 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if path and os.path.exists(path):
             return path
         return super().getLocalFilePath(file)
+
+
+def _scanDirectory(path):
+    """
+    List a directory for an import, sorted by name.
+
+    :returns: a list of ``(name, path, stat)`` tuples, where ``stat`` is None
+        for directories.
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                entries.append((entry.name, entry.path, None))
+            else:
+                entries.append((entry.name, entry.path, entry.stat()))
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+class _DirectoryImport:
+    """
+    The state of a directory tree import by
+    :py:meth:`FilesystemAssetstoreAdapter.importData`.
+    """
+
+    def __init__(self, adapter, parent, parentType, params, progress, user, leafFoldersAsItems):
+        self.adapter = adapter
+        self.parent = parent
+        self.parentType = parentType
+        self.params = params
+        self.progress = progress
+        self.user = user
+        self.leafFoldersAsItems = leafFoldersAsItems
+        self.root = params['importPath']
+        self.batch = ImportBatch(user, adapter.assetstore, batchSize=IMPORT_BATCH_SIZE)
+        resume = params.get('resumeCheckpoint')
+        self.resumeAfter = tuple(resume.split(os.sep)) if resume is not None else None
+        self.completed = None
+        self.files = self.bytes = 0
+        self.started = time.time()
+
+    def run(self):
+        # The directories to import, in reverse order, as (components of the
+        # path relative to the root, parent, parentType, scan future).
+        # Directories near the end of the stack are listed ahead of time.
+        stack = [((), self.parent, self.parentType, None)]
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=IMPORT_THREADS, thread_name_prefix='girder-fs-import') as pool:
+            try:
+                while stack:
+                    for i in range(max(len(stack) - IMPORT_THREADS * 2, 0), len(stack)):
+                        if stack[i][3] is None:
+                            components = stack[i][0]
+                            stack[i] = stack[i][:3] + (pool.submit(
+                                _scanDirectory, os.path.join(self.root, *components)),)
+                    components, parent, parentType, scan = stack.pop()
+                    stack.extend(reversed(
+                        self._importDirectory(components, parent, parentType, scan.result())))
+                    self.completed = components
+            finally:
+                for entry in stack:
+                    if entry[3] is not None:
+                        entry[3].cancel()
+                # Write what was buffered, even if the import failed, so that
+                # it can be resumed from the last checkpoint
+                self._written(self.batch.flush())
+
+    def _importDirectory(self, components, parent, parentType, entries):
+        """
+        Import the files in one directory, creating its folder or item.
+
+        :returns: The subdirectories to import, as stack entries.
+        """
+        path = os.path.join(self.root, *components)
+        name = components[-1] if components else os.path.basename(self.root.rstrip(os.sep))
+        self.progress.update(message=self._status(path))
+        skip = self.resumeAfter is not None and components <= self.resumeAfter
+        hasFiles = any(info is not None for _, _, info in entries)
+        if not components and parentType != 'folder' and hasFiles:
+            raise ValidationException(
+                'Files cannot be imported directly underneath a %s.' % parentType)
+
+        if self.leafFoldersAsItems and all(info is not None for _, _, info in entries):
+            added = False
+            for fname, fpath, info in entries if not skip else ():
+                if self.adapter.shouldImportFile(fpath, self.params):
+                    self._add(parent, name, fname, fpath, info, path)
+                    added = True
+            if not added:
+                item = Item().createItem(
+                    name=self.adapter.safeName(name), creator=self.user, folder=parent,
+                    reuseExisting=True)
+                self._itemEvents([(item, None, path)])
+            return []
+
+        if components:
+            parent = Folder().createFolder(
+                parent=parent, name=self.adapter.safeName(name),
+                parentType=parentType, creator=self.user, reuseExisting=True)
+            parentType = 'folder'
+            events.trigger('filesystem_assetstore_imported', {
+                'id': parent['_id'],
+                'type': 'folder',
+                'importPath': path
+            })
+        subdirs = []
+        for fname, fpath, info in entries:
+            if info is None:
+                subdirs.append((components + (fname,), parent, parentType, None))
+            elif not skip and self.adapter.shouldImportFile(fpath, self.params):
+                self._add(parent, fname, fname, fpath, info, fpath)
+        return subdirs
+
+    def _add(self, folder, itemName, fileName, path, info, importPath):
+        written = self.batch.add(
+            folder, self.adapter.safeName(itemName), fileName, info.st_size, {
+                'path': os.path.abspath(os.path.expanduser(path)),
+                'mtime': info.st_mtime,
+                'imported': True
+            }, importPath, mimeType=mimetypes.guess_type(fileName)[0])
+        self.files += 1
+        self.bytes += info.st_size
+        self._written(written)
+
+    def _itemEvents(self, written):
+        lastItem = None
+        for item, _file, importPath in written:
+            if (item['_id'], importPath) != lastItem:
+                events.trigger('filesystem_assetstore_imported', {
+                    'id': item['_id'],
+                    'type': 'item',
+                    'importPath': importPath
+                })
+            lastItem = (item['_id'], importPath)
+
+    def _written(self, written):
+        """
+        Trigger the events for the items of a written batch, and record a
+        checkpoint.
+        """
+        if not written:
+            return
+        self._itemEvents(written)
+        if self.completed is not None:
+            events.trigger('assetstore_import.checkpoint', {
+                'assetstore': self.adapter.assetstore,
+                'params': self.params,
+                'checkpoint': os.sep.join(self.completed),
+                'files': self.files,
+                'bytes': self.bytes
+            })
+        self.progress.update(message=self._status())
+
+    def _status(self, path=None):
+        elapsed = max(time.time() - self.started, 1e-6)
+        status = 'Imported %d files, %s (%.1f files/s, %s/s)' % (
+            self.files, formatSize(self.bytes), self.files / elapsed,
+            formatSize(self.bytes / elapsed))
+        return '%s: %s' % (status, path) if path else status
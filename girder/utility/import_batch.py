@@ -0,0 +1,241 @@
+import collections
+import datetime
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+
+class ImportBatch:
+    """
+    Buffers the items and files created while importing existing data into an
+    assetstore, and writes them to the database a batch at a time.  Existing
+    items and files are found with one query per batch rather than one per
+    name, new items and files are written with ``insert_many``, and size
+    changes are propagated once per batch.
+
+    As with ``createItem(reuseExisting=True)`` and
+    ``createFile(reuseExisting=True)``, an item with the same name in the same
+    folder is reused, as is a file with the same name in that item; the fields
+    passed for a reused file are set on it.  Documents are written without
+    triggering the per-document model save events.
+
+    :param user: The user performing the import.
+    :type user: dict
+    :param assetstore: The assetstore the files are stored in.
+    :type assetstore: dict
+    :param batchSize: The number of files to buffer before writing them.
+    :type batchSize: int
+    """
+
+    def __init__(self, user, assetstore, batchSize=1000):
+        self.user = user
+        self.assetstore = assetstore
+        self.batchSize = batchSize
+        self._entries = []
+        self._pendingNames = collections.defaultdict(set)
+        self._folders = {}
+
+    def hasPendingItem(self, folder, name):
+        """
+        Whether an item with the given name has been added to a folder but not
+        yet written.
+        """
+        return name in self._pendingNames.get(folder['_id'], ())
+
+    def add(self, folder, itemName, fileName, size, fields, importPath, mimeType=None):
+        """
+        Add a file to the batch, writing the batch if it is full.
+
+        :param folder: The folder to create the item in.
+        :type folder: dict
+        :param itemName: The name of the item.
+        :type itemName: str
+        :param fileName: The name of the file.
+        :type fileName: str
+        :param size: The size of the file.
+        :type size: int
+        :param fields: Additional fields to set on the file, such as the path
+            of the imported data.
+        :type fields: dict
+        :param importPath: The path of the imported data, returned when the
+            batch is written.
+        :param mimeType: The MIME type of the file.
+        :type mimeType: str or None
+        :returns: The same as :py:meth:`flush` if the batch was written, or an
+            empty list.
+        """
+        from girder.models.item import Item
+
+        itemName = Item()._validateString(itemName)
+        self._folders[folder['_id']] = folder
+        self._pendingNames[folder['_id']].add(itemName)
+        self._entries.append({
+            'folderId': folder['_id'],
+            'itemName': itemName,
+            'fileName': fileName,
+            'size': size,
+            'mimeType': mimeType,
+            'fields': fields,
+            'importPath': importPath,
+        })
+        if len(self._entries) >= self.batchSize:
+            return self.flush()
+        return []
+
+    def _existingItems(self, namesByFolder, folders):
+        """
+        Find the items to reuse for a batch, keyed by folder id and name.
+        """
+        from girder.models.folder import Folder
+        from girder.models.item import Item
+
+        items = {}
+        for item in Item().find({'$or': [
+            {'folderId': folderId, 'name': {'$in': list(names)}}
+            for folderId, names in namesByFolder.items()
+        ]}, fields=['name', 'folderId', 'baseParentType', 'baseParentId', 'inheritedAccess']):
+            items.setdefault((item['folderId'], item['name']), item)
+        # An item that would have the same name as a folder is created on its
+        # own, since validation gives it a unique name.
+        for folder in Folder().find({'$or': [
+            {'parentId': folderId, 'parentCollection': 'folder', 'name': {'$in': list(names)}}
+            for folderId, names in namesByFolder.items()
+        ]}, fields=['parentId', 'name']):
+            key = (folder['parentId'], folder['name'])
+            if key not in items:
+                items[key] = Item().createItem(
+                    name=folder['name'], creator=self.user, folder=folders[folder['parentId']],
+                    reuseExisting=True)
+        return items
+
+    def _newItems(self, entries, items, folders, now):
+        """
+        Make the documents for the items of a batch that do not exist yet, and
+        add them to ``items``.
+
+        :returns: The list of new item documents.
+        """
+        from girder.models.item import Item
+
+        newItems = []
+        folderInfo = {}
+        for entry in entries:
+            key = (entry['folderId'], entry['itemName'])
+            if key in items:
+                continue
+            folder = folders[entry['folderId']]
+            if entry['folderId'] not in folderInfo:
+                folderInfo[entry['folderId']] = (
+                    Item()._folderAncestorIds(folder),
+                    Item()._inheritedAccessFromParent(entry['folderId']))
+            ancestorIds, inheritedAccess = folderInfo[entry['folderId']]
+            item = items[key] = {
+                '_id': ObjectId(),
+                'name': entry['itemName'],
+                'lowerName': entry['itemName'].lower(),
+                'description': '',
+                'folderId': entry['folderId'],
+                'creatorId': self.user['_id'],
+                'baseParentType': folder['baseParentType'],
+                'baseParentId': folder['baseParentId'],
+                'ancestorIds': ancestorIds,
+                'inheritedAccess': inheritedAccess,
+                'created': now,
+                'updated': now,
+                'size': 0,
+                'meta': {}
+            }
+            newItems.append(item)
+        return newItems
+
+    def _newFile(self, entry, item, now):
+        """
+        Make the document for a new file in a batch.
+        """
+        from girder.models.file import File
+
+        inherited = item.get('inheritedAccess')
+        if inherited is None or inherited.get('parentId') != item['folderId']:
+            inherited = File()._inheritedAccessFromParent(item['_id'])
+        else:
+            inherited = dict(inherited, parentId=item['_id'])
+        return dict({
+            '_id': ObjectId(),
+            'created': now,
+            'creatorId': self.user['_id'],
+            'assetstoreId': self.assetstore['_id'],
+            'name': entry['fileName'],
+            'mimeType': entry['mimeType'],
+            'size': entry['size'],
+            'itemId': item['_id'],
+            'exts': [ext.lower() for ext in entry['fileName'].split('.')[1:]],
+            'inheritedAccess': inherited,
+        }, **entry['fields'])
+
+    def flush(self):
+        """
+        Write the buffered items and files.
+
+        :returns: A list of ``(item, file, importPath)`` tuples in the order
+            the files were added.  ``item`` and ``file`` are the written or
+            reused documents.
+        """
+        from girder.models.file import File
+        from girder.models.item import Item
+        from girder.models.size_delta import SizeDelta
+
+        entries, folders = self._entries, self._folders
+        self._entries, self._folders = [], {}
+        self._pendingNames.clear()
+        if not entries:
+            return []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        namesByFolder = collections.defaultdict(set)
+        for entry in entries:
+            namesByFolder[entry['folderId']].add(entry['itemName'])
+
+        items = self._existingItems(namesByFolder, folders)
+        existingItemIds = {item['_id'] for item in items.values()}
+
+        files = {}
+        if existingItemIds:
+            for file in File().find({
+                'itemId': {'$in': list(existingItemIds)},
+                'name': {'$in': list({entry['fileName'] for entry in entries})}
+            }):
+                files.setdefault((file['itemId'], file['name']), file)
+
+        newItems = self._newItems(entries, items, folders, now)
+
+        newFiles = []
+        updates = []
+        written = []
+        deltas = collections.defaultdict(int)
+        for entry in entries:
+            item = items[(entry['folderId'], entry['itemName'])]
+            file = files.get((item['_id'], entry['fileName']))
+            if file is not None:
+                file.update(entry['fields'])
+                updates.append(UpdateOne({'_id': file['_id']}, {'$set': entry['fields']}))
+            else:
+                file = files[(item['_id'], entry['fileName'])] = self._newFile(
+                    entry, item, now)
+                newFiles.append(file)
+                if entry['size']:
+                    if item['_id'] in existingItemIds:
+                        deltas[('item', item['_id'])] += entry['size']
+                    else:
+                        item['size'] += entry['size']
+                    deltas[('folder', item['folderId'])] += entry['size']
+                    deltas[(item['baseParentType'], item['baseParentId'])] += entry['size']
+            written.append((item, file, entry['importPath']))
+
+        if newItems:
+            Item().collection.insert_many(newItems)
+        if newFiles:
+            File().collection.insert_many(newFiles)
+        if updates:
+            File().collection.bulk_write(updates, ordered=False)
+        SizeDelta().propagate([
+            (modelName, id, amount) for (modelName, id), amount in deltas.items()])
+        return written
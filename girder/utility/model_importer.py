@@ -8,7 +8,7 @@ def _registerCoreModels():
         return
 
     from girder.models import (api_key, assetstore, collection, file, folder, group, item, setting,
-                               token, upload, user)
+                               size_delta, token, upload, user)
 
     ModelImporter.registerModel('api_key', api_key.ApiKey)
     ModelImporter.registerModel('assetstore', assetstore.Assetstore)
@@ -18,6 +18,7 @@ def _registerCoreModels():
     ModelImporter.registerModel('group', group.Group)
     ModelImporter.registerModel('item', item.Item)
     ModelImporter.registerModel('setting', setting.Setting)
+    ModelImporter.registerModel('size_delta', size_delta.SizeDelta)
     ModelImporter.registerModel('token', token.Token)
     ModelImporter.registerModel('upload', upload.Upload)
     ModelImporter.registerModel('user', user.User)
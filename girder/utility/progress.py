@@ -8,10 +8,12 @@ class ProgressContext:
     """
     This class is a context manager that can be used to update progress in a way
     that rate-limits writes to the database and guarantees a flush when the
-    context is exited. This is a no-op if "on" is set to False, which is
-    meant as a convenience for callers. Any additional kwargs passed to this
-    constructor are passed through to the ``initProgress`` method of the
-    notification model.
+    context is exited. Increments and fields passed to updates that are not
+    written are kept and written with the next one, so the current progress
+    stays accurate however often it is updated. This is a no-op if "on" is
+    set to False, which is meant as a convenience for callers. Any additional
+    kwargs passed to this constructor are passed through to the
+    ``initProgress`` method of the notification model.
 
     :param on: Whether to record progress.
     :type on: bool
@@ -28,6 +30,8 @@ class ProgressContext:
         self.on = on
         self.interval = interval
         self._lastFlush = time.time()
+        self._increment = 0
+        self._pending = {}
 
         if on:
             self.progress = Notification.initProgress(**kwargs)
@@ -48,7 +52,8 @@ class ProgressContext:
             if isinstance(excValue, (ValidationException, RestException)):
                 message = 'Error: ' + str(excValue)
 
-        self.progress.updateProgress(state=state, message=message)
+        self._pending.update(state=state, message=message)
+        self.progress.updateProgress(increment=self._increment, **self._pending)
 
     def update(self, force: bool = False, increment: int = None, **kwargs):
         """
@@ -64,9 +69,14 @@ class ProgressContext:
         if not self.on:
             return
 
+        if increment is not None:
+            self._increment += increment
+        self._pending.update(kwargs)
         if (time.time() - self._lastFlush > self.interval) or force:
             self._lastFlush = time.time()
-            self.progress.updateProgress(increment=increment, **kwargs)
+            self.progress.updateProgress(increment=self._increment, **self._pending)
+            self._increment = 0
+            self._pending = {}
 
 
 noProgress = ProgressContext(on=False)
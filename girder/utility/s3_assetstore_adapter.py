@@ -1,9 +1,12 @@
+import collections
+import concurrent.futures
 import datetime
 import errno
 import json
 import logging
 import os
 import re
+import threading
 import urllib.parse
 import uuid
 
@@ -21,11 +24,80 @@ from girder.models.folder import Folder
 from girder.models.item import Item
 
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
+from .import_batch import ImportBatch
 
 BUF_LEN = 65536  # Buffer size for download stream
+# Downloads that are piped through the server are read in ranges of this size,
+# several at once, if they are larger than one range
+RANGE_LEN = 8 * 1024 * 1024
+# The maximum number of range requests made at once across all downloads
+DOWNLOAD_THREADS = 16
+# The number of pages of keys listed at once during an import
+IMPORT_THREADS = 8
+# The number of imported files written to the database at a time
+IMPORT_BATCH_SIZE = 1000
+# The number of delete_objects requests, of up to DELETE_BATCH_SIZE keys each,
+# made at once when many files are deleted together
+DELETE_THREADS = 8
+DELETE_BATCH_SIZE = 1000
 DEFAULT_REGION = 'us-east-1'
 logger = logging.getLogger(__name__)
 
+_downloadPoolLock = threading.Lock()
+_downloadPool = None
+
+
+def _getDownloadPool():
+    """
+    Get the thread pool and HTTP session used for ranged downloads. New ones
+    are created after forking, since the threads and connections of the
+    parent's pool cannot be used by the child.
+    """
+    global _downloadPool
+
+    with _downloadPoolLock:
+        if _downloadPool is None or _downloadPool[0] != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=DOWNLOAD_THREADS, pool_maxsize=DOWNLOAD_THREADS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _downloadPool = (os.getpid(), concurrent.futures.ThreadPoolExecutor(
+                max_workers=DOWNLOAD_THREADS, thread_name_prefix='girder-s3-download'),
+                session)
+        return _downloadPool[1], _downloadPool[2]
+
+
+def _fetchRange(session, url, start, end, maxRetries):
+    """
+    Fetch the bytes from ``start`` up to but not including ``end`` of an
+    object, retrying from where the data stopped if the request is
+    interrupted.
+    """
+    data = bytearray()
+    retries = 0
+    while start + len(data) < end:
+        try:
+            resp = session.get(url, stream=True, headers={
+                'Range': 'bytes=%d-%d' % (start + len(data), end - 1)})
+            with resp:
+                resp.raise_for_status()
+                for chunk in resp.iter_content(chunk_size=BUF_LEN):
+                    if chunk:
+                        data += chunk
+                        retries = 0
+            if start + len(data) < end:
+                raise OSError(errno.EIO, 'S3 returned fewer bytes than requested.')
+        except OSError as exc:
+            retries += 1
+            if retries >= maxRetries:
+                # Downstream handlers (notably fuse.py) fail if the exception
+                # does not have an errno set.
+                if not getattr(exc, 'errno', None):
+                    exc.errno = errno.EIO
+                raise
+    return bytes(data[:end - start])
+
 
 class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
     """
@@ -459,6 +531,10 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
             # want to retry it up to a point.
             envval = os.environ.get('GIRDER_S3_DOWNLOAD_RETRIES')
             maxRetriesWithoutData = int(envval) if str(envval).isdigit() else 3
+            # The number of ranges to fetch at once for each download; 1 reads
+            # the object with a single request.
+            envval = os.environ.get('GIRDER_S3_DOWNLOAD_STREAMS')
+            streams = int(envval) if str(envval).isdigit() else 4
 
             def stream():
                 streamOffset = offset
@@ -492,76 +568,165 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                         headers['Range'] = 'bytes=%d-%d' % (streamOffset, endByte - 1)
                     except Exception:
                         raise
+
+            def rangedStream():
+                pool, session = _getDownloadPool()
+                starts = iter(range(offset, endByte, RANGE_LEN))
+                pending = collections.deque()
+
+                def fetchNext():
+                    start = next(starts, None)
+                    if start is not None:
+                        # Sign each range, since a slow consumer could outlast
+                        # the expiration of the original URL
+                        rangeUrl = self._generatePresignedUrl(
+                            ClientMethod='get_object', Params=params,
+                            useS3TransferAcceleration=useS3TransferAcceleration)
+                        pending.append(pool.submit(
+                            _fetchRange, session, rangeUrl, start,
+                            min(start + RANGE_LEN, endByte), maxRetriesWithoutData))
+
+                try:
+                    for _ in range(streams):
+                        fetchNext()
+                    # Ranges are yielded in order, keeping at most ``streams``
+                    # ranges in flight or waiting to be consumed.
+                    while pending:
+                        data = pending.popleft().result()
+                        fetchNext()
+                        yield data
+                finally:
+                    for future in pending:
+                        future.cancel()
+
+            if streams > 1 and endByte - offset > RANGE_LEN:
+                return rangedStream
             return stream
 
+    def _listPage(self, prefix, marker):
+        """
+        List one page of the keys and prefixes directly under a prefix.
+        """
+        params = {'Bucket': self.assetstore['bucket'], 'Prefix': prefix, 'Delimiter': '/'}
+        if marker is not None:
+            params['Marker'] = marker
+        return self.client.list_objects(**params)
+
     def importData(self, parent, parentType, params, progress,
-                   user, force_recursive=True, **kwargs):
+                   user, force_recursive=True, _importQueue=None, **kwargs):
+        """
+        Import the keys under a prefix.  Pages of keys are listed on a pool of
+        IMPORT_THREADS threads, several prefixes at once, while this thread
+        creates folders and buffers items and files to be written in batches
+        of IMPORT_BATCH_SIZE.  The ``s3_assetstore_imported`` event is
+        triggered for each folder when it is created, and for each item once
+        its batch has been written.
+
+        Each prefix is imported by calling this method for its folder with the
+        same keyword arguments.  Those calls only queue the prefix to be
+        listed by the import that found it.
+        """
         importPath = params.get('importPath', '').strip().lstrip('/')
-        bucket = self.assetstore['bucket']
-        now = datetime.datetime.now(datetime.timezone.utc)
-        paginator = self.client.get_paginator('list_objects')
-        pageIterator = paginator.paginate(Bucket=bucket, Prefix=importPath, Delimiter='/')
-        for resp in pageIterator:
-            # Start with objects
-            for obj in resp.get('Contents', []):
-                if progress:
-                    progress.update(message=obj['Key'])
-
-                name = obj['Key'].rsplit('/', 1)[-1]
-                if not name:
-                    continue
+        # Pages waiting to be listed, as (prefix, marker, parent, parentType,
+        # params, force_recursive, kwargs)
+        entry = (importPath, None, parent, parentType, params, force_recursive, kwargs)
+        if _importQueue is not None:
+            _importQueue.append(entry)
+            return
 
-                if parentType != 'folder':
-                    raise ValidationException(
-                        'Keys cannot be imported directly underneath a %s.' % parentType)
-
-                if self.shouldImportFile(obj['Key'], params):
-                    item = Item().createItem(
-                        name=self.safeName(name), creator=user, folder=parent,
-                        reuseExisting=True)
-                    events.trigger('s3_assetstore_imported', {
-                        'id': item['_id'],
-                        'type': 'item',
-                        'importPath': obj['Key'],
-                    })
-                    # Create a file record; delay saving it until we have added
-                    # the import information.
-                    file = File().createFile(
-                        name=name, creator=user, item=item, reuseExisting=True,
-                        assetstore=self.assetstore, mimeType=None, size=obj['Size'],
-                        saveFile=False)
-                    file['s3Key'] = obj['Key']
-                    file['imported'] = True
-                    File().save(file)
-
-            for obj in resp.get('CommonPrefixes', []):
-                if progress:
-                    progress.update(message=obj['Prefix'])
-
-                name = obj['Prefix'].rstrip('/').rsplit('/', 1)[-1]
-                # If there is already an item with the folder's name, append
-                # '/'.  This is how S3 presents the names, allowing a folder
-                # and file to have the same name once stripped of the right /.
-                if parentType == 'folder' and Item().findOne({
-                    'folderId': parent['_id'],
-                    'name': self.safeName(name),
-                }):
-                    name = name + '/'
-                folder = Folder().createFolder(
-                    parent=parent, name=self.safeName(name),
-                    parentType=parentType, creator=user, reuseExisting=True)
+        now = datetime.datetime.now(datetime.timezone.utc)
 
+        def itemsImported(written):
+            for item, _file, key in written:
                 events.trigger('s3_assetstore_imported', {
-                    'id': folder['_id'],
-                    'type': 'folder',
-                    'importPath': obj['Prefix'],
+                    'id': item['_id'],
+                    'type': 'item',
+                    'importPath': key,
                 })
-                # recurse into subdirectories if force_recursive is true
-                # or the folder was newly created.
-                if force_recursive or folder['created'] >= now:
-                    self.importData(parent=folder, parentType='folder', params={
-                        **params, 'importPath': obj['Prefix']
-                    }, progress=progress, user=user, **kwargs)
+
+        # Pages being listed in the order they were requested, as (future,
+        # entry).  Only a bounded number of pages are listed ahead of this
+        # thread.
+        waiting = collections.deque([entry])
+        listing = collections.deque()
+        batch = ImportBatch(user, self.assetstore, batchSize=IMPORT_BATCH_SIZE)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=IMPORT_THREADS, thread_name_prefix='girder-s3-import') as pool:
+            try:
+                while waiting or listing:
+                    while waiting and len(listing) < IMPORT_THREADS * 2:
+                        entry = waiting.popleft()
+                        listing.append((pool.submit(self._listPage, *entry[:2]), entry))
+                    future, entry = listing.popleft()
+                    resp = future.result()
+                    if resp.get('IsTruncated'):
+                        marker = resp.get('NextMarker') or max(
+                            [obj['Key'] for obj in resp.get('Contents', [])]
+                            + [obj['Prefix'] for obj in resp.get('CommonPrefixes', [])])
+                        waiting.appendleft((entry[0], marker) + entry[2:])
+                    self._importPage(
+                        resp, *entry[2:], progress=progress, user=user, batch=batch, now=now,
+                        waiting=waiting, itemsImported=itemsImported)
+            finally:
+                for future, _entry in listing:
+                    future.cancel()
+                # Write what was buffered, even if the import failed
+                itemsImported(batch.flush())
+
+    def _importPage(self, resp, parent, parentType, params, force_recursive, kwargs,
+                    progress, user, batch, now, waiting, itemsImported):
+        """
+        Import the keys listed in one page, and queue the prefixes it lists to
+        be imported.
+        """
+        # Start with objects
+        for obj in resp.get('Contents', []):
+            if progress:
+                progress.update(message=obj['Key'])
+
+            name = obj['Key'].rsplit('/', 1)[-1]
+            if not name:
+                continue
+
+            if parentType != 'folder':
+                raise ValidationException(
+                    'Keys cannot be imported directly underneath a %s.' % parentType)
+
+            if self.shouldImportFile(obj['Key'], params):
+                itemsImported(batch.add(
+                    parent, self.safeName(name), name, obj['Size'],
+                    {'s3Key': obj['Key'], 'imported': True}, obj['Key']))
+
+        for obj in resp.get('CommonPrefixes', []):
+            if progress:
+                progress.update(message=obj['Prefix'])
+
+            name = obj['Prefix'].rstrip('/').rsplit('/', 1)[-1]
+            # If there is already an item with the folder's name, append
+            # '/'.  This is how S3 presents the names, allowing a folder
+            # and file to have the same name once stripped of the right /.
+            if parentType == 'folder' and (
+                    batch.hasPendingItem(parent, self.safeName(name)) or Item().findOne({
+                        'folderId': parent['_id'],
+                        'name': self.safeName(name),
+                    })):
+                name = name + '/'
+            folder = Folder().createFolder(
+                parent=parent, name=self.safeName(name),
+                parentType=parentType, creator=user, reuseExisting=True)
+
+            events.trigger('s3_assetstore_imported', {
+                'id': folder['_id'],
+                'type': 'folder',
+                'importPath': obj['Prefix'],
+            })
+            # recurse into subdirectories if force_recursive is true
+            # or the folder was newly created.
+            if force_recursive or folder['created'] >= now:
+                self.importData(parent=folder, parentType='folder', params={
+                    **params, 'importPath': obj['Prefix']
+                }, progress=progress, user=user, force_recursive=force_recursive,
+                    _importQueue=waiting, **kwargs)
 
     def deleteFile(self, file):
         """
@@ -579,6 +744,42 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
             if matching.count(True) == 1:
                 self.client.delete_object(Bucket=self.assetstore['bucket'], Key=file['s3Key'])
 
+    def deleteFiles(self, files):
+        """
+        Delete the objects of many files from S3 with ``delete_objects``
+        requests of up to DELETE_BATCH_SIZE keys, DELETE_THREADS at a time.
+        As with :py:meth:`deleteFile`, imported files and objects that are
+        also referenced by files that aren't being deleted are kept.
+        """
+        keys = {
+            file['relpath']: file['s3Key'] for file in files
+            if file['size'] > 0 and 'relpath' in file}
+        if not keys:
+            return
+        shared = File().collection.distinct('relpath', {
+            'relpath': {'$in': list(keys)},
+            'assetstoreId': self.assetstore['_id'],
+            '_id': {'$nin': [file['_id'] for file in files]}
+        })
+        for relpath in shared:
+            keys.pop(relpath, None)
+        keys = list(keys.values())
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=DELETE_THREADS, thread_name_prefix='girder-s3-delete') as pool:
+            for future in [
+                    pool.submit(self._deleteObjects, keys[i:i + DELETE_BATCH_SIZE])
+                    for i in range(0, len(keys), DELETE_BATCH_SIZE)]:
+                future.result()
+
+    def _deleteObjects(self, keys):
+        resp = self.client.delete_objects(Bucket=self.assetstore['bucket'], Delete={
+            'Objects': [{'Key': key} for key in keys],
+            'Quiet': True
+        })
+        for error in resp.get('Errors', []):
+            logger.error('Failed to delete S3 object %s: %s', error.get('Key'),
+                         error.get('Message'))
+
     def fileUpdated(self, file):
         """
         On file update, if the name or the MIME type changed, we must update
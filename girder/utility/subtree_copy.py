@@ -0,0 +1,210 @@
+import collections
+import copy
+import datetime
+
+from bson.objectid import ObjectId
+
+from girder import events
+from girder.constants import AccessType
+
+from .acl_mixin import _inheritableAccess
+from .progress import noProgress
+
+# The number of documents read and written at a time
+BATCH_SIZE = 1000
+
+
+class SubtreeCopy:
+    """
+    Copies the items, files and subfolders of a folder into a new folder a
+    batch at a time.  The tree is copied a level at a time: the subfolders
+    that the creator can read and the items of each level are read with one
+    query per batch, given new ids, and written with ``insert_many``.  File
+    data is shared with the original files rather than copied, through each
+    assetstore adapter's ``copyFiles``, and size changes are propagated once
+    per batch.
+
+    The copies are the documents that :py:meth:`girder.models.folder.Folder.copyFolder`
+    would otherwise create one at a time: subfolders get the access control
+    list of the new folder, and items and files keep their extension fields.
+    Rather than the per-document copy and save events, a
+    ``model.<name>.bulkCopy`` event is triggered once each batch has been
+    written, with a list of ``(original, copy)`` tuples as ``copies`` in its
+    info.
+
+    :param srcFolder: The folder to copy.
+    :type srcFolder: dict
+    :param newFolder: The folder to copy into, which must already exist.
+    :type newFolder: dict
+    :param creator: The user copying the folder.
+    :type creator: dict
+    :param progress: Progress context to update once per batch, incremented by
+        one for each folder and item.
+    :type progress: :py:class:`girder.utility.progress.ProgressContext` or None
+    :param batchSize: The number of documents to copy at a time.
+    :type batchSize: int
+    """
+
+    def __init__(self, srcFolder, newFolder, creator, progress=None, batchSize=BATCH_SIZE):
+        self.srcFolder = srcFolder
+        self.newFolder = newFolder
+        self.creator = creator
+        self.progress = progress or noProgress
+        self.batchSize = batchSize
+        self.folders = self.items = self.files = 0
+
+    def run(self):
+        """
+        Copy everything underneath the source folder.
+
+        :returns: A dict with the numbers of ``folders``, ``items`` and
+            ``files`` copied.
+        """
+        from girder.models.item import Item
+
+        # Every new folder shares the access control list of the new folder
+        self._access = {
+            key: copy.deepcopy(self.newFolder[key])
+            for key in ('public', 'access') if key in self.newFolder}
+        self._inheritedAccess = _inheritableAccess(self.newFolder)
+        # The copies of the folders of the current level, by original id
+        level = {self.srcFolder['_id']: self.newFolder}
+        while level:
+            srcIds = list(level)
+            for i in range(0, len(srcIds), self.batchSize):
+                for items in self._batches(Item().find, {'folderId': {'$in': srcIds[
+                        i:i + self.batchSize]}}):
+                    self._copyItems(items, level)
+            nextLevel = {}
+            for i in range(0, len(srcIds), self.batchSize):
+                # The new folder may be inside the folder being copied
+                for folders in self._batches(self._readableFolders, {
+                        'parentId': {'$in': srcIds[i:i + self.batchSize]},
+                        'parentCollection': 'folder',
+                        '_id': {'$ne': self.newFolder['_id']}}):
+                    nextLevel.update(self._copyFolders(folders, level))
+            level = nextLevel
+        return {'folders': self.folders, 'items': self.items, 'files': self.files}
+
+    def _readableFolders(self, query, **kwargs):
+        from girder.models.folder import Folder
+
+        return Folder().findWithPermissions(
+            query, user=self.creator, level=AccessType.READ, **kwargs)
+
+    def _batches(self, find, query):
+        """
+        Yield the documents matching a query a batch at a time, in id order.
+        """
+        lastId = None
+        while True:
+            batchQuery = query if lastId is None else dict(
+                query, _id=dict(query.get('_id', {}), **{'$gt': lastId}))
+            batch = list(find(batchQuery, limit=self.batchSize, sort=[('_id', 1)]))
+            if not batch:
+                return
+            yield batch
+            lastId = batch[-1]['_id']
+
+    def _copyFolders(self, folders, level):
+        """
+        Write copies of a batch of folders.
+
+        :returns: The copies by original id.
+        """
+        from girder.models.folder import Folder
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        copies = []
+        for folder in folders:
+            parent = level[folder['parentId']]
+            newFolder = copy.deepcopy(folder)
+            newFolder.update(self._access)
+            newFolder.update({
+                '_id': ObjectId(),
+                'parentId': parent['_id'],
+                'baseParentType': parent['baseParentType'],
+                'baseParentId': parent['baseParentId'],
+                'ancestorIds': parent['ancestorIds'] + [parent['_id']],
+                'creatorId': self.creator['_id'],
+                'created': now,
+                'updated': now,
+                'size': 0,
+            })
+            copies.append((folder, newFolder))
+        Folder().collection.insert_many([newFolder for _, newFolder in copies])
+        events.trigger('model.folder.bulkCopy', {'copies': copies})
+        self.folders += len(copies)
+        self.progress.update(increment=len(copies), message='Copied %d folders' % self.folders)
+        return {folder['_id']: newFolder for folder, newFolder in copies}
+
+    def _copyItems(self, items, level):
+        from girder.models.file import File
+        from girder.models.item import Item
+        from girder.models.size_delta import SizeDelta
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        copies = {}
+        for item in items:
+            folder = level[item['folderId']]
+            newItem = copy.deepcopy(item)
+            newItem.update({
+                '_id': ObjectId(),
+                'folderId': folder['_id'],
+                'creatorId': self.creator['_id'],
+                'baseParentType': folder['baseParentType'],
+                'baseParentId': folder['baseParentId'],
+                'ancestorIds': folder['ancestorIds'] + [folder['_id']],
+                'inheritedAccess': dict(
+                    self._inheritedAccess, parentId=folder['_id'], sourceId=folder['_id']),
+                'created': now,
+                'updated': now,
+                'size': 0,
+                'copyOfItem': item['_id'],
+            })
+            copies[item['_id']] = (item, newItem)
+
+        for files in self._batches(File().find, {'itemId': {'$in': list(copies)}}):
+            self._copyFiles(files, copies, now)
+
+        deltas = collections.defaultdict(int)
+        for _, newItem in copies.values():
+            deltas[('folder', newItem['folderId'])] += newItem['size']
+            deltas[(newItem['baseParentType'], newItem['baseParentId'])] += newItem['size']
+        Item().collection.insert_many([newItem for _, newItem in copies.values()])
+        SizeDelta().propagate([
+            (modelName, id, amount) for (modelName, id), amount in deltas.items()])
+        events.trigger('model.item.bulkCopy', {'copies': list(copies.values())})
+        self.items += len(copies)
+        self.progress.update(increment=len(copies), message='Copied %d items' % self.items)
+
+    def _copyFiles(self, files, itemCopies, now):
+        """
+        Write copies of a batch of files, adding their sizes to the new items.
+        """
+        from girder.models.file import File
+
+        copies = []
+        byAssetstore = collections.defaultdict(list)
+        for file in files:
+            newItem = itemCopies[file['itemId']][1]
+            newFile = dict(file)
+            newFile.update({
+                '_id': ObjectId(),
+                'copied': now,
+                'copierId': self.creator['_id'],
+                'itemId': newItem['_id'],
+                'inheritedAccess': dict(newItem['inheritedAccess'], parentId=newItem['_id']),
+            })
+            copies.append((file, newFile))
+            if file.get('assetstoreId'):
+                byAssetstore[file['assetstoreId']].append((file, newFile))
+            if file.get('size') is not None:
+                newItem['size'] += file['size']
+        for assetstoreCopies in byAssetstore.values():
+            File().getAssetstoreAdapter(assetstoreCopies[0][0]).copyFiles(
+                [file for file, _ in assetstoreCopies],
+                [newFile for _, newFile in assetstoreCopies])
+        File().collection.insert_many([newFile for _, newFile in copies])
+        events.trigger('model.file.bulkCopy', {'copies': copies})
+        self.files += len(copies)
@@ -0,0 +1,153 @@
+import collections
+
+from girder import events
+
+from .progress import noProgress
+
+# The number of documents loaded and deleted at a time
+BATCH_SIZE = 1000
+
+
+class SubtreeDelete:
+    """
+    Deletes the folders, items, files and pending uploads underneath a folder,
+    collection or user a batch at a time.  Each batch of documents is read
+    with one query and deleted with one ``delete_many`` per model, the data of
+    its files is deleted with one ``deleteFiles`` call per assetstore, and
+    size changes are propagated once per batch.  The root itself is not
+    deleted.
+
+    Rather than the per-document ``model.<name>.remove`` events, a
+    ``model.<name>.bulkRemove`` event is triggered before each batch is
+    deleted, with the list of documents as ``documents`` in its info.  These
+    events cannot prevent the deletion.
+
+    Underneath a folder, the subtree is found with ``ancestorIds``, so this
+    should only be used once :py:meth:`girder.models.folder.Folder.hasCompleteAncestorIds`
+    is true.
+
+    :param root: The folder, collection or user document.
+    :type root: dict
+    :param rootType: The type of the root: 'folder', 'collection' or 'user'.
+    :type rootType: str
+    :param progress: Progress context to update once per batch, incremented by
+        one for each folder and item.
+    :type progress: :py:class:`girder.utility.progress.ProgressContext` or None
+    :param batchSize: The number of documents to delete at a time.
+    :type batchSize: int
+    """
+
+    def __init__(self, root, rootType, progress=None, batchSize=BATCH_SIZE):
+        self.root = root
+        self.rootType = rootType
+        self.progress = progress or noProgress
+        self.batchSize = batchSize
+        if rootType == 'folder':
+            self._query = {'ancestorIds': root['_id']}
+        else:
+            self._query = {'baseParentType': rootType, 'baseParentId': root['_id']}
+        self.folders = self.items = self.files = 0
+
+    def count(self):
+        """
+        Count the folders and items that will be deleted.
+        """
+        from girder.models.folder import Folder
+        from girder.models.item import Item
+
+        return sum(model.collection.count_documents(self._query) for model in (Folder(), Item()))
+
+    def run(self):
+        """
+        Delete everything underneath the root: the items with their files and
+        uploads, then the folders with their uploads.
+
+        :returns: A dict with the numbers of ``folders``, ``items`` and
+            ``files`` deleted.
+        """
+        from girder.models.folder import Folder
+        from girder.models.item import Item
+
+        for items in self._batches(Item(), self._query):
+            self._removeItems(items)
+        for folders in self._batches(Folder(), self._query):
+            self._removeFolders(folders)
+        return {'folders': self.folders, 'items': self.items, 'files': self.files}
+
+    def _batches(self, model, query):
+        """
+        Yield the documents matching a query a batch at a time.  Each batch is
+        expected to be deleted before the next one is requested.
+        """
+        lastId = None
+        while True:
+            batchQuery = dict(query) if lastId is None else dict(query, _id={'$gt': lastId})
+            batch = list(model.find(batchQuery, limit=self.batchSize, sort=[('_id', 1)]))
+            if not batch:
+                return
+            yield batch
+            lastId = batch[-1]['_id']
+
+    def _removeDocuments(self, model, documents):
+        events.trigger('model.%s.bulkRemove' % model.name, {'documents': documents})
+        model.collection.delete_many({'_id': {'$in': [doc['_id'] for doc in documents]}})
+
+    def _removeUploads(self, parentType, parentIds):
+        from girder.models.upload import Upload
+
+        for uploads in self._batches(Upload(), {
+                'parentType': parentType, 'parentId': {'$in': parentIds}}):
+            self._removeDocuments(Upload(), uploads)
+
+    def _removeItems(self, items):
+        from girder.models.file import File
+        from girder.models.item import Item
+        from girder.models.size_delta import SizeDelta
+
+        itemIds = [item['_id'] for item in items]
+        # Only the sizes of the root and its base parent outlive the deletion
+        inRoot = {item['_id'] for item in items if item['folderId'] == self.root['_id']}
+        removed = removedFromRoot = 0
+        for files in self._batches(File(), {'itemId': {'$in': itemIds}}):
+            self._removeFiles(files)
+            for file in files:
+                removed += file.get('size') or 0
+                if file['itemId'] in inRoot:
+                    removedFromRoot += file.get('size') or 0
+        self._removeUploads('item', itemIds)
+        self._removeDocuments(Item(), items)
+
+        if self.rootType == 'folder':
+            deltas = [
+                ('folder', self.root['_id'], -removedFromRoot),
+                (self.root['baseParentType'], self.root['baseParentId'], -removed)]
+        else:
+            deltas = [(self.rootType, self.root['_id'], -removed)]
+        SizeDelta().propagate([delta for delta in deltas if delta[2]])
+        self.items += len(items)
+        self.progress.update(increment=len(items), message='Deleted %d items' % self.items)
+
+    def _removeFiles(self, files):
+        """
+        Delete the data of a batch of files from their assetstores, then the
+        file documents.
+        """
+        from girder.models.file import File
+
+        byAssetstore = collections.defaultdict(list)
+        for file in files:
+            if file.get('assetstoreId'):
+                byAssetstore[file['assetstoreId']].append(file)
+        events.trigger('model.file.bulkRemove', {'documents': files})
+        for assetstoreFiles in byAssetstore.values():
+            File().getAssetstoreAdapter(assetstoreFiles[0]).deleteFiles(assetstoreFiles)
+        File().collection.delete_many({'_id': {'$in': [file['_id'] for file in files]}})
+        self.files += len(files)
+
+    def _removeFolders(self, folders):
+        from girder.models.folder import Folder
+
+        self._removeUploads('folder', [folder['_id'] for folder in folders])
+        self._removeDocuments(Folder(), folders)
+        self.folders += len(folders)
+        self.progress.update(increment=len(folders), message='Deleted %d folders' % self.folders)
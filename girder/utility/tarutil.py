@@ -0,0 +1,151 @@
+"""
+This module streams tar archives from generators, in the same way that
+:py:mod:`girder.utility.ziputil` streams zip archives.  Tar archives can be
+written faster than zip archives and, compressed with zstd, are smaller than
+zip archives whose files are compressed separately.
+
+Example of creating and consuming a streaming tar:
+
+    tar = tarutil.TarGenerator('TopLevelFolder')
+
+    for data in tar.addFile(lambda: [b'hello world'], 'hello.txt', size=11):
+        yield data
+
+    yield tar.footer()
+"""
+
+import logging
+import posixpath
+import tarfile
+import time
+
+from .ziputil import PREFETCH_BYTES, _prefetchDepth, readAhead
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__all__ = ('ZSTD', 'TarGenerator')
+
+logger = logging.getLogger(__name__)
+
+ZSTD = 'zstd'
+# The zstd compression level
+ZSTD_LEVEL = 3
+
+
+class TarGenerator:
+    """
+    This class can be used to create a streaming tar file that consumes from
+    one generator and writes to another.
+    """
+
+    def __init__(self, rootPath='', compression=None, prefetch=None,
+                 prefetchBytes=PREFETCH_BYTES):
+        """
+        :param rootPath: The root path for all files within this archive.
+        :type rootPath: str
+        :param compression: ZSTD to compress the archive with zstd on as many
+            threads as there are CPUs, or None.
+        :param prefetch: The number of files that addFiles reads ahead, as for
+            :py:class:`girder.utility.ziputil.ZipGenerator`.
+        :type prefetch: int or None
+        :param prefetchBytes: The most data to buffer for the files read ahead.
+        :type prefetchBytes: int
+        """
+        if compression == ZSTD and not zstandard:
+            raise RuntimeError('Missing zstandard module')
+
+        self.rootPath = rootPath
+        self.compression = compression
+        self.prefetch = _prefetchDepth(prefetch)
+        self.prefetchBytes = prefetchBytes
+        if compression == ZSTD:
+            self._compressor = zstandard.ZstdCompressor(
+                level=ZSTD_LEVEL, threads=-1).compressobj()
+        else:
+            self._compressor = None
+
+    def _output(self, data):
+        if self._compressor:
+            return self._compressor.compress(data)
+        return data
+
+    def addFile(self, generator, path, size=None):
+        """
+        Generates data to add a file at the given path in the archive.
+
+        :param generator: Generator function that will yield the file contents.
+        :type generator: function
+        :param path: The path within the archive for this entry.
+        :type path: str
+        :param size: The size of the file, which is written before its data.
+            If this is None, the whole file is read into memory to find its
+            size.
+        :type size: int or None
+        :raises ValueError: if the file does not have the given size.  The
+            archive cannot be completed, since its header has been written.
+        """
+        def chunks():
+            for buf in generator():
+                if not buf:
+                    continue
+                if isinstance(buf, str):
+                    buf = buf.encode('utf8')
+                yield buf
+
+        data = chunks()
+        if size is None:
+            data = list(data)
+            size = sum(len(buf) for buf in data)
+
+        info = tarfile.TarInfo(posixpath.join(self.rootPath, path))
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        out = self._output(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+        if out:
+            yield out
+
+        written = 0
+        for buf in data:
+            written += len(buf)
+            if written > size:
+                raise ValueError('Archived file %s is longer than %d bytes.' % (info.name, size))
+            out = self._output(buf)
+            if out:
+                yield out
+        if written != size:
+            raise ValueError('Archived file %s was %d bytes long, not %d.' % (
+                info.name, written, size))
+        # Pad the data to a whole block
+        out = self._output(b'\0' * (-size % tarfile.BLOCKSIZE))
+        if out:
+            yield out
+
+    def addFiles(self, files):
+        """
+        Generates data to add a sequence of files to the archive, in order,
+        reading the next ``prefetch`` files ahead.
+
+        :param files: An iterable of ``(path, generator function, file)``
+            tuples, where ``file`` is the file document, whose size is used, or
+            None.  ``(path, generator function)`` pairs, as returned by the
+            ``fileList`` methods of the models, are also accepted, but each
+            file is then read into memory to find its size.
+        """
+        for entry in readAhead(files, self.prefetch, self.prefetchBytes):
+            file = entry[2] if len(entry) > 2 else None
+            size = file['size'] if file and file.get('assetstoreId') else None
+            yield from self.addFile(entry[1], entry[0], size=size)
+
+    def footer(self):
+        """
+        Once all files have been added with addFile, you must call this to get
+        the end of the archive.
+        """
+        data = self._output(b'\0' * (tarfile.BLOCKSIZE * 2))
+        if self._compressor:
+            data += self._compressor.flush()
+        return data
@@ -11,12 +11,22 @@ Example of creating and consuming a streaming zip:
         yield data
 
     yield zip.footer()
+
+To stream a sequence of files, such as the output of a model's ``fileList``,
+use ``addFiles``, which reads the start of the next few files in the background
+while each file is written:
+
+    yield from zip.addFiles(Folder().fileList(folder, user=user))
 """
 
 import binascii
+import collections
+import concurrent.futures
+import mimetypes
 import os
 import struct
 import sys
+import threading
 import time
 
 try:
@@ -24,7 +34,7 @@ try:
 except ImportError:
     zlib = None
 
-__all__ = ('STORE', 'DEFLATE', 'ZipGenerator')
+__all__ = ('STORE', 'DEFLATE', 'ZipGenerator', 'isCompressible')
 
 
 Z64_LIMIT = (1 << 31) - 1
@@ -32,6 +42,289 @@ Z_FILECOUNT_LIMIT = 1 << 16
 STORE = 0
 DEFLATE = 8
 
+# The number of files read ahead by addFiles unless GIRDER_ZIP_PREFETCH is set
+PREFETCH = 4
+# The most data buffered by the files read ahead for one archive
+PREFETCH_BYTES = 64 * 1024 * 1024
+# The number of threads shared by all archives to read ahead
+PREFETCH_THREADS = 16
+# Compressed files are split into blocks of this size that are deflated in
+# parallel by COMPRESS_THREADS threads shared by all archives
+COMPRESS_BLOCK_SIZE = 1024 * 1024
+COMPRESS_THREADS = os.cpu_count() or 1
+# Each block is deflated with the end of the previous block as a dictionary
+_DICT_SIZE = 32 * 1024
+# MIME types of data that is already compressed, which is stored as it is
+COMPRESSED_MIME_TYPES = {
+    'application/gzip',
+    'application/vnd.rar',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-gzip',
+    'application/x-rar-compressed',
+    'application/x-xz',
+    'application/zip',
+    'application/zstd',
+    'image/avif',
+    'image/gif',
+    'image/heic',
+    'image/jp2',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+}
+COMPRESSED_MIME_PREFIXES = ('audio/', 'video/', 'application/vnd.openxmlformats-officedocument.')
+
+_prefetchPoolLock = threading.Lock()
+_prefetchPool = None
+# The functions deferred by whenConsumed on a read ahead worker
+_readingAhead = threading.local()
+# Marks the end of the data of a file read ahead
+_END = object()
+_compressPool = None
+
+
+def _prefetchDepth(prefetch):
+    """
+    The number of files to read ahead, from the GIRDER_ZIP_PREFETCH
+    environment variable if it is not specified.
+    """
+    if prefetch is None:
+        envval = os.environ.get('GIRDER_ZIP_PREFETCH')
+        prefetch = int(envval) if str(envval).isdigit() else PREFETCH
+    return prefetch
+
+
+def isCompressible(path, mimeType=None):
+    """
+    Whether a file is worth compressing, based on its MIME type, or the one
+    guessed from its path.
+
+    :param path: The path or name of the file.
+    :type path: str
+    :param mimeType: The MIME type of the file, if known.
+    :type mimeType: str or None
+    :rtype: bool
+    """
+    mimeType = (mimeType or mimetypes.guess_type(path)[0] or '').lower()
+    return (mimeType not in COMPRESSED_MIME_TYPES
+            and not mimeType.startswith(COMPRESSED_MIME_PREFIXES))
+
+
+def _getPrefetchPool():
+    """
+    Get the thread pool used to read files ahead. A new pool is created after
+    forking, since the threads of the parent's pool do not exist in the child.
+    """
+    global _prefetchPool
+
+    with _prefetchPoolLock:
+        if _prefetchPool is None or _prefetchPool[0] != os.getpid():
+            _prefetchPool = (os.getpid(), concurrent.futures.ThreadPoolExecutor(
+                max_workers=PREFETCH_THREADS, thread_name_prefix='girder-zip-prefetch'))
+        return _prefetchPool[1]
+
+
+def _getCompressPool():
+    """
+    Get the thread pool used to deflate blocks of files. zlib releases the GIL
+    while it compresses, so the blocks are compressed in parallel.
+    """
+    global _compressPool
+
+    with _prefetchPoolLock:
+        if _compressPool is None or _compressPool[0] != os.getpid():
+            _compressPool = (os.getpid(), concurrent.futures.ThreadPoolExecutor(
+                max_workers=COMPRESS_THREADS, thread_name_prefix='girder-zip-compress'))
+        return _compressPool[1]
+
+
+def _deflateBlock(data, zdict):
+    """
+    Deflate a block of a file as part of a raw deflate stream.  The block ends
+    on a byte boundary without ending the stream, so blocks compressed
+    independently can be concatenated.
+    """
+    if zdict:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _deflate(chunks):
+    """
+    Deflate a sequence of chunks into a raw deflate stream, compressing
+    blocks of COMPRESS_BLOCK_SIZE bytes in parallel.
+    """
+    pool = _getCompressPool()
+    pending = collections.deque()
+    block = []
+    blockSize = 0
+    zdict = b''
+    try:
+        for buf in chunks:
+            block.append(buf)
+            blockSize += len(buf)
+            if blockSize < COMPRESS_BLOCK_SIZE:
+                continue
+            data = b''.join(block)
+            block, blockSize = [], 0
+            pending.append(pool.submit(_deflateBlock, data, zdict))
+            zdict = data[-_DICT_SIZE:]
+            while len(pending) > COMPRESS_THREADS * 2 or (pending and pending[0].done()):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+        if block:
+            yield _deflateBlock(b''.join(block), zdict)
+    finally:
+        for future in pending:
+            future.cancel()
+    # An empty final block ends the stream
+    yield b'\x03\x00'
+
+
+def whenConsumed(callback):
+    """
+    Call a function once the data read so far on this thread has been
+    consumed.  Generators of data that may be read ahead by ``readAhead`` use
+    this for side effects that must not happen before their data is written,
+    such as recording that a download is complete.  On a read ahead worker,
+    the function is called when the thread writing the archive has taken the
+    data buffered before the call; otherwise, it is called at once.
+
+    :param callback: The function to call, without arguments.
+    """
+    callbacks = getattr(_readingAhead, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append((len(_readingAhead.chunks), callback))
+
+
+def readAhead(files, prefetch, prefetchBytes=PREFETCH_BYTES):
+    """
+    Open the next files of a sequence and buffer their data on worker threads
+    while each file is consumed, so that the latency of starting each file is
+    not paid one file at a time.
+
+    :param files: An iterable of tuples whose first two elements are a path
+        and a generator function, such as the output of a model's
+        ``fileList``.
+    :param prefetch: The number of files to read ahead.
+    :type prefetch: int
+    :param prefetchBytes: The most data to buffer for the files read ahead.
+    :type prefetchBytes: int
+    :returns: A generator of the same tuples in the same order, with each
+        generator function replaced with one that yields the buffered data
+        followed by the rest of the file.
+    """
+    if not prefetch:
+        yield from files
+        return
+
+    pool = _getPrefetchPool()
+    budget = {'cond': threading.Condition(), 'used': 0, 'limit': prefetchBytes}
+    files = iter(files)
+    pending = collections.deque()
+    try:
+        while True:
+            while len(pending) <= prefetch:
+                entry = next(files, None)
+                if entry is None:
+                    break
+                prefetched = _Prefetch(entry[1], budget)
+                prefetched.future = pool.submit(prefetched.run)
+                pending.append((entry, prefetched))
+            if not pending:
+                break
+            entry, prefetched = pending.popleft()
+            yield (entry[0], prefetched.stream) + tuple(entry[2:])
+    finally:
+        for _entry, prefetched in pending:
+            prefetched.stop()
+
+
+class _Prefetch:
+    """
+    The start of a file's data, read on a worker thread.  The worker stops
+    when the buffered data of all the files read ahead for an archive reaches
+    its limit, and once the file is written, when the data is handed over to
+    the thread writing the archive.
+    """
+
+    def __init__(self, generator, budget):
+        self.generator = generator
+        self.budget = budget
+        self.chunks = collections.deque()
+        self.callbacks = []
+        self.iterator = None
+        self.stopped = False
+        self.error = None
+        self.future = None
+
+    def run(self):
+        budget = self.budget
+        _readingAhead.callbacks, _readingAhead.chunks = self.callbacks, self.chunks
+        try:
+            self.iterator = iter(self.generator())
+            for buf in self.iterator:
+                with budget['cond']:
+                    self.chunks.append(buf)
+                    budget['used'] += len(buf)
+                    while not self.stopped and budget['used'] >= budget['limit']:
+                        budget['cond'].wait()
+                    if self.stopped:
+                        return
+            self.chunks.append(_END)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            _readingAhead.callbacks = _readingAhead.chunks = None
+
+    def stop(self):
+        """
+        Stop the worker.  This does not wait for a running worker to finish.
+        """
+        with self.budget['cond']:
+            self.stopped = True
+            self.budget['cond'].notify_all()
+        self.future.cancel()
+
+    def stream(self):
+        """
+        Yield the data of the file, first from the buffer and then by reading
+        the rest of the file on this thread.  The functions the worker passed
+        to ``whenConsumed`` are called once the data buffered before them has
+        been yielded.
+        """
+        self.stop()
+        if not self.future.cancelled():
+            concurrent.futures.wait([self.future])
+        budget = self.budget
+        callbacks = collections.deque(self.callbacks)
+        taken = 0
+        while True:
+            while callbacks and callbacks[0][0] <= taken:
+                callbacks.popleft()[1]()
+            if not self.chunks:
+                break
+            buf = self.chunks.popleft()
+            if buf is _END:
+                return
+            taken += 1
+            with budget['cond']:
+                budget['used'] -= len(buf)
+                budget['cond'].notify_all()
+            yield buf
+        if self.error is not None:
+            raise self.error
+        if self.iterator is None:
+            self.iterator = iter(self.generator())
+        yield from self.iterator
+
 
 class ZipInfo:
 
@@ -99,13 +392,21 @@ class ZipGenerator:
     one generator and writes to another.
     """
 
-    def __init__(self, rootPath='', compression=STORE):
+    def __init__(self, rootPath='', compression=STORE, prefetch=None,
+                 prefetchBytes=PREFETCH_BYTES):
         """
         :param rootPath: The root path for all files within this archive.
         :type rootPath: str
         :param compression: Whether files in this archive should be compressed.
 
         :type
+        :param prefetch: The number of files that addFiles reads ahead while
+            writing a file, or 0 to read each file only when it is written.
+            If None, the GIRDER_ZIP_PREFETCH environment variable is used, or
+            PREFETCH if it is not set.
+        :type prefetch: int or None
+        :param prefetchBytes: The most data to buffer for the files read ahead.
+        :type prefetchBytes: int
         """
         if compression == DEFLATE and not zlib:
             raise RuntimeError('Missing zlib module')
@@ -115,6 +416,8 @@ class ZipGenerator:
         self.useCRC = True
         self.rootPath = rootPath
         self.offset = 0
+        self.prefetch = _prefetchDepth(prefetch)
+        self.prefetchBytes = prefetchBytes
 
     def _advanceOffset(self, data):
         """
@@ -124,55 +427,70 @@ class ZipGenerator:
         self.offset += len(data)
         return data
 
-    def addFile(self, generator, path):
+    def addFile(self, generator, path, mimeType=None):
         """
         Generates data to add a file at the given path in the archive.
         :param generator: Generator function that will yield the file contents.
         :type generator: function
         :param path: The path within the archive for this entry.
         :type path: str
+        :param mimeType: The MIME type of the file.  If this archive is
+            compressed, files with types that are already compressed are
+            stored as they are.  If not specified, the type is guessed from
+            the path.
+        :type mimeType: str or None
         """
         fullpath = os.path.join(self.rootPath, path)
         header = ZipInfo(fullpath, time.localtime()[0:6])
         header.externalAttr = (0o100644 & 0xFFFF) << 16
         header.compressType = self.compression
+        if header.compressType == DEFLATE and not isCompressible(path, mimeType):
+            header.compressType = STORE
         header.headerOffset = self.offset
 
-        header.crc = crc = 0
-        header.compressSize = compressSize = 0
-        header.fileSize = fileSize = 0
+        header.crc = 0
+        header.compressSize = 0
+        header.fileSize = 0
         yield self._advanceOffset(header.fileHeader())
-        if header.compressType == DEFLATE:
-            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
-                                          zlib.DEFLATED, -15)
-        else:
-            compressor = None
 
-        for buf in generator():
-            if not buf:
-                break
-            if isinstance(buf, str):
-                buf = buf.encode('utf8')
-            fileSize += len(buf)
-            if self.useCRC:
-                crc = binascii.crc32(buf, crc) & 0xFFFFFFFF
-            if compressor:
-                buf = compressor.compress(buf)
-                compressSize += len(buf)
-            yield self._advanceOffset(buf)
-
-        if compressor:
-            buf = compressor.flush()
-            compressSize += len(buf)
-            yield self._advanceOffset(buf)
-            header.compressSize = compressSize
+        def chunks():
+            for buf in generator():
+                if not buf:
+                    break
+                if isinstance(buf, str):
+                    buf = buf.encode('utf8')
+                header.fileSize += len(buf)
+                if self.useCRC:
+                    header.crc = binascii.crc32(buf, header.crc) & 0xFFFFFFFF
+                yield buf
+
+        if header.compressType == DEFLATE:
+            for buf in _deflate(chunks()):
+                header.compressSize += len(buf)
+                yield self._advanceOffset(buf)
         else:
-            header.compressSize = fileSize
-        header.crc = crc
-        header.fileSize = fileSize
+            for buf in chunks():
+                yield self._advanceOffset(buf)
+            header.compressSize = header.fileSize
         yield self._advanceOffset(header.dataDescriptor())
         self.files.append(header)
 
+    def addFiles(self, files):
+        """
+        Generates data to add a sequence of files to the archive, in order.
+        The next ``prefetch`` files are read ahead while each file is written;
+        see :py:func:`readAhead`.
+
+        :param files: An iterable of ``(path, generator function)`` pairs, as
+            returned by the ``fileList`` methods of the models, or of
+            ``(path, generator function, file)`` tuples, where ``file`` is the
+            file document, whose MIME type is used, or None.
+        """
+        for entry in readAhead(files, self.prefetch, self.prefetchBytes):
+            file = entry[2] if len(entry) > 2 else None
+            yield from self.addFile(
+                entry[1], entry[0], mimeType=file.get('mimeType') if file else None)
+
     def footer(self):
         """
         Once all zip files have been added with addFile, you must call this
@@ -21,6 +21,12 @@ class GirderPlugin(plugin.GirderPlugin):
             'system is not imported, even if it is not in the destination '
             'hierarchy.', dataType='boolean', required=False, default=False
         )
+        info['apiRoot'].assetstore.importData.description.param(
+            'resumeImport',
+            'The ID of an earlier import of the same path to resume.  Files in '
+            'the directories that it finished importing are skipped.',
+            required=False
+        )
 
         info['apiRoot'].folder.route('PUT', (':id', 'move'), moveFolder)
 
@@ -5,6 +5,7 @@ from girder_jobs.models.job import Job
 from girder_worker import GirderWorkerPluginABC
 
 from girder import events
+from girder.exceptions import ValidationException
 from girder.models.file import File
 from girder.utility.abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
@@ -61,6 +62,18 @@ def wrapShouldImportFile():
 def createImportRecord(event: events.Event):
     info = event.info
     path = info['params']['importPath']
+    if info['params'].get('resumeImport'):
+        previous = AssetstoreImport().load(info['params']['resumeImport'], force=True, exc=True)
+        # The checkpoint is only meaningful for the same path and destination
+        if (previous['assetstoreId'] != info['assetstore']['_id']
+                or previous['params'].get('importPath') != path
+                or str(previous['params'].get('destinationId')) != str(info['parent']['_id'])
+                or previous['params'].get('destinationType') != info['parentType']):
+            raise ValidationException(
+                'The import to resume must have the same assetstore, import path and '
+                'destination.', 'resumeImport')
+        if previous.get('checkpoint') is not None:
+            info['params']['resumeCheckpoint'] = previous['checkpoint']
     record_data = {
         'destinationId': info['parent']['_id'],
         'destinationType': info['parentType'],
@@ -99,9 +112,17 @@ def createImportRecord(event: events.Event):
         record_data['excludeExisting'] = str(info['params']['excludeExisting']).lower()
 
     import_record = AssetstoreImport().createAssetstoreImport(info['assetstore'], record_data)
+    info['params']['_importRecord'] = str(import_record['_id'])
     event.addResponse({'importRecord': import_record})
 
 
+def recordImportCheckpoint(event: events.Event):
+    recordId = event.info['params'].get('_importRecord')
+    if recordId:
+        AssetstoreImport().recordCheckpoint(
+            recordId, event.info['checkpoint'], event.info['files'], event.info['bytes'])
+
+
 def finalizeImportRecord(event: events.Event):
     job_info = event.info['params']['_job']
     job = Job().load(job_info['id'], force=True, includeLog=False)
@@ -137,4 +158,5 @@ class ImportTrackerWorkerPlugin(GirderWorkerPluginABC):
 
         events.bind('assetstore_import.before', 'import_tracker', createImportRecord)
         events.bind('assetstore_import.after', 'import_tracker', finalizeImportRecord)
+        events.bind('assetstore_import.checkpoint', 'import_tracker', recordImportCheckpoint)
         events.bind('assetstore_import.error', 'import_tracker', finalizeImportRecord)
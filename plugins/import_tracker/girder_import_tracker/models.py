@@ -32,6 +32,21 @@ class AssetstoreImport(Model):
         )
         return record
 
+    def recordCheckpoint(self, recordId, checkpoint, files, bytes):
+        """
+        Record how far an import has progressed, so that it can be resumed.
+
+        :param recordId: The id of the import record.
+        :param checkpoint: The checkpoint reported by the assetstore adapter.
+        :param files: The number of files imported so far.
+        :param bytes: The number of bytes imported so far.
+        """
+        self.update({'_id': ObjectId(recordId)}, {'$set': {
+            'checkpoint': checkpoint,
+            'importedFiles': files,
+            'importedBytes': bytes,
+        }})
+
     def markEnded(self, record, success=None):
         now = datetime.utcnow()
         record['ended'] = now
@@ -0,0 +1,39 @@
+import pytest
+
+from girder.events import Event
+from girder.exceptions import ValidationException
+from girder.models.folder import Folder
+from girder.utility.progress import noProgress
+
+
+@pytest.mark.plugin('import_tracker')
+def test_resume_import_validation(server, admin, fsAssetstore):
+    from girder_import_tracker.girder_worker_plugin import createImportRecord
+    from girder_import_tracker.models import AssetstoreImport
+
+    folder = Folder().createFolder(admin, 'import', parentType='user', creator=admin)
+    other = Folder().createFolder(admin, 'other', parentType='user', creator=admin)
+    previous = AssetstoreImport().createAssetstoreImport(fsAssetstore, {
+        'importPath': '/data',
+        'destinationId': folder['_id'],
+        'destinationType': 'folder',
+    })
+    AssetstoreImport().recordCheckpoint(previous['_id'], 'a', 1, 1)
+
+    def importEvent(importPath, parent):
+        return Event('assetstore_import.before', {
+            'assetstore': fsAssetstore,
+            'parent': parent,
+            'parentType': 'folder',
+            'params': {'importPath': importPath, 'resumeImport': str(previous['_id'])},
+            'progress': noProgress,
+            'user': admin,
+        })
+
+    for importPath, parent in (('/other', folder), ('/data', other)):
+        with pytest.raises(ValidationException, match='same assetstore'):
+            createImportRecord(importEvent(importPath, parent))
+
+    event = importEvent('/data', folder)
+    createImportRecord(event)
+    assert event.info['params']['resumeCheckpoint'] == 'a'
@@ -0,0 +1,212 @@
+"""
+Merging of frequent job progress updates and job notifications, so that a job
+reporting progress many times a second does not write to the database and
+notify its user every time.
+"""
+import collections
+import os
+import threading
+import time
+
+from girder.notification import Notification
+
+# Progress-only updates of a job within this many seconds of the last time its
+# progress was written are merged and written at the end of the window, unless
+# GIRDER_JOB_PROGRESS_WINDOW is set.  0 writes every update.
+PROGRESS_WINDOW = 1.0
+# job_log and job_status notifications about a job are sent to a user at most
+# once in this many seconds, unless GIRDER_JOB_NOTIFICATION_WINDOW is set.
+NOTIFICATION_WINDOW = 0.5
+
+# The number of progress updates received and merged into later updates, and
+# of notifications sent and merged into later notifications.
+counters = collections.Counter()
+_countersLock = threading.Lock()
+
+
+def _count(key):
+    with _countersLock:
+        counters[key] += 1
+
+
+def _window(envName, default):
+    try:
+        return float(os.environ[envName])
+    except (KeyError, ValueError):
+        return default
+
+
+def stats():
+    """
+    Get the counters of merged updates and notifications, and the current
+    windows, in seconds.
+    """
+    with _countersLock:
+        result = {'counters': dict(counters)}
+    result['progressWindow'] = _window('GIRDER_JOB_PROGRESS_WINDOW', PROGRESS_WINDOW)
+    result['notificationWindow'] = _window(
+        'GIRDER_JOB_NOTIFICATION_WINDOW', NOTIFICATION_WINDOW)
+    return result
+
+
+def _startTimer(delay, function, *args):
+    timer = threading.Timer(delay, function, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class ProgressCoalescer:
+    """
+    Merges the progress updates of each job that arrive within a window.  The
+    first update after a quiet window is written immediately; later ones are
+    merged and written when the window ends.
+
+    :param write: A function that writes a merged update, called with the
+        latest job document, the progress total, current value and message,
+        and whether to notify.
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def offer(self, job, total, current, message, notify):
+        """
+        Offer a progress update of a job.
+
+        :returns: True if the update was merged and will be written later, or
+            False if the caller should write it now.
+        """
+        _count('progressUpdates')
+        window = _window('GIRDER_JOB_PROGRESS_WINDOW', PROGRESS_WINDOW)
+        if window <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            state = self._jobs.get(job['_id'])
+            if state is None or (state['pending'] is None and now - state['written'] >= window):
+                self._prune(now, window)
+                self._jobs[job['_id']] = {'written': now, 'pending': None, 'timer': None}
+                return False
+            pending = state['pending'] or {
+                'total': None, 'current': None, 'message': None, 'notify': False}
+            pending['job'] = job
+            for key, value in (('total', total), ('current', current), ('message', message)):
+                if value is not None:
+                    pending[key] = value
+            pending['notify'] = pending['notify'] or notify
+            state['pending'] = pending
+            if state['timer'] is None:
+                state['timer'] = _startTimer(
+                    max(state['written'] + window - now, 0), self._flush, job['_id'])
+        _count('progressCoalesced')
+        return True
+
+    def take(self, job):
+        """
+        Remove the pending progress of a job, so that it can be written along
+        with other changes.
+
+        :returns: A dictionary with the latest ``total``, ``current``, and
+            ``message``, any of which may be None, or None if there is no
+            pending progress.
+        """
+        with self._lock:
+            state = self._jobs.get(job['_id'])
+            if state is None or state['pending'] is None:
+                return None
+            pending, state['pending'] = state['pending'], None
+            state['timer'].cancel()
+            state['timer'] = None
+            state['written'] = time.monotonic()
+        return pending
+
+    def _flush(self, jobId):
+        with self._lock:
+            state = self._jobs.get(jobId)
+            if state is None or state['pending'] is None:
+                return
+            pending, state['pending'] = state['pending'], None
+            state['timer'] = None
+            state['written'] = time.monotonic()
+        self._write(
+            pending['job'], pending['total'], pending['current'], pending['message'],
+            pending['notify'])
+
+    def _prune(self, now, window):
+        if len(self._jobs) < 1000:
+            return
+        for jobId, state in list(self._jobs.items()):
+            if state['pending'] is None and now - state['written'] >= window:
+                del self._jobs[jobId]
+
+
+class NotificationThrottle:
+    """
+    Limits how often ``job_log`` and ``job_status`` notifications about a job
+    are sent to a user.  The first notification after a quiet window is sent
+    immediately; later ones are merged and sent when the window ends.  Log
+    messages are concatenated, and a status replaces the previous one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def send(self, type, data, user):
+        """
+        Send or merge a notification.
+
+        :param type: ``job_log`` or ``job_status``.
+        :param data: The notification data, which includes the job ``_id``.
+        :param user: The user to notify.
+        """
+        window = _window('GIRDER_JOB_NOTIFICATION_WINDOW', NOTIFICATION_WINDOW)
+        if window <= 0:
+            _count('notifications')
+            Notification(type=type, data=data, user=user).flush()
+            return
+        key = (user['_id'], type, data['_id'])
+        now = time.monotonic()
+        with self._lock:
+            state = self._pending.get(key)
+            if state is None or (state['data'] is None and now - state['sent'] >= window):
+                self._prune(now, window)
+                self._pending[key] = {'sent': now, 'data': None, 'timer': None, 'user': user}
+                send = True
+            else:
+                send = False
+                if (type == 'job_log' and state['data'] is not None
+                        and not data.get('overwrite')):
+                    state['data'] = dict(
+                        state['data'], text=(state['data']['text'] or '') + (data['text'] or ''))
+                else:
+                    state['data'] = data
+                if state['timer'] is None:
+                    state['timer'] = _startTimer(
+                        max(state['sent'] + window - now, 0), self._flush, key, type)
+        if send:
+            _count('notifications')
+            Notification(type=type, data=data, user=user).flush()
+        else:
+            _count('notificationsCoalesced')
+
+    def _flush(self, key, type):
+        with self._lock:
+            state = self._pending.get(key)
+            if state is None or state['data'] is None:
+                return
+            data, state['data'] = state['data'], None
+            state['timer'] = None
+            state['sent'] = time.monotonic()
+        _count('notifications')
+        Notification(type=type, data=data, user=state['user']).flush()
+
+    def _prune(self, now, window):
+        if len(self._pending) < 1000:
+            return
+        for key, state in list(self._pending.items()):
+            if state['data'] is None and now - state['sent'] >= window:
+                del self._pending[key]
@@ -1,11 +1,12 @@
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, filtermodel
+from girder.api.rest import Resource, filtermodel, setResponseHeader
 from girder.constants import AccessType, SortDir
 from girder.models.user import User
 
-from . import constants
+from . import coalesce, constants
 from .models.job import Job as JobModel
+from .models.job_log import JobLog
 
 
 class Job(Resource):
@@ -18,7 +19,9 @@ class Job(Resource):
         self.route('GET', (), self.listJobs)
         self.route('POST', (), self.createJob)
         self.route('GET', ('all',), self.listAllJobs)
+        self.route('GET', ('coalescing',), self.getCoalescingStats)
         self.route('GET', (':id',), self.getJob)
+        self.route('GET', (':id', 'log'), self.getJobLog)
         self.route('PUT', (':id',), self.updateJob)
         self.route('PUT', (':id', 'cancel'), self.cancelJob)
         self.route('DELETE', (':id',), self.deleteJob)
@@ -104,6 +107,15 @@ class Job(Resource):
             statuses=statuses, handlers=handlers,
             sort=sort, currentUser=currentUser))
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get how many job progress updates and notifications this '
+                    'server process has merged.')
+        .errorResponse('Admin access was denied.', 403)
+    )
+    def getCoalescingStats(self):
+        return coalesce.stats()
+
     @access.public
     @filtermodel(JobModel)
     @autoDescribeRoute(
@@ -124,6 +136,34 @@ class Job(Resource):
 
         return job
 
+    @access.public
+    @autoDescribeRoute(
+        Description("Stream a job's log.")
+        .notes('To follow a log as it grows, pass the number of bytes already '
+               'received as the offset.')
+        .modelParam('id', 'The ID of the job.', model=JobModel, force=True,
+                    fields={'args': False, 'kwargs': False})
+        .param('offset', 'The byte offset in the log to start from.', dataType='integer',
+               required=False, default=0)
+        .produces('text/plain')
+        .errorResponse('ID was invalid.')
+        .errorResponse('Read access was denied for the job.', 403)
+    )
+    def getJobLog(self, job, offset):
+        user = self.getCurrentUser()
+
+        if not job.get('public', False):
+            if user:
+                self._model.requireAccess(job, user, level=AccessType.READ)
+            else:
+                self.ensureTokenScopes('jobs.job_' + str(job['_id']))
+
+        setResponseHeader('Content-Type', 'text/plain;charset=utf-8')
+
+        def stream():
+            yield from JobLog().stream(job, offset=max(offset, 0))
+        return stream
+
     @access.token
     @filtermodel(JobModel)
     @autoDescribeRoute(
@@ -1,4 +1,5 @@
 import datetime
+import logging
 
 from bson import json_util
 
@@ -10,13 +11,18 @@ from girder.models.token import Token
 from girder.models.user import User
 from girder.notification import Notification
 
+from ..coalesce import NotificationThrottle, ProgressCoalescer
 from ..constants import JOB_HANDLER_LOCAL, JobStatus
+from .job_log import JobLog
+
+logger = logging.getLogger(__name__)
 
 
 class Job(AccessControlledModel):
 
     def initialize(self):
         self.name = 'job'
+        self.trackChanges = True
         compoundSearchIndex = (
             ('userId', SortDir.ASCENDING),
             ('created', SortDir.DESCENDING),
@@ -33,11 +39,14 @@ class Job(AccessControlledModel):
 
         self.exposeFields(level=AccessType.READ, fields={
             'title', 'type', 'created', 'interval', 'when', 'status',
-            'progress', 'log', 'meta', '_id', 'public', 'parentId', 'asynchronous',
+            'progress', 'log', 'logSize', 'meta', '_id', 'public', 'parentId', 'asynchronous',
             'updated', 'timestamps', 'handler', 'jobInfoSpec'})
 
         self.exposeFields(level=AccessType.SITE_ADMIN, fields={'args', 'kwargs'})
 
+        self._progress = ProgressCoalescer(self._writeProgress)
+        self._notifications = NotificationThrottle()
+
     def validate(self, job):
         self._validateStatus(job['status'])
 
@@ -286,6 +295,8 @@ class Job(AccessControlledModel):
     def find(self, *args, **kwargs):
         """
         Overrides the default find behavior to exclude the log by default.
+        Logs are stored by the JobLog model, so only the start of the logs of
+        jobs created before that is included in the documents.
 
         :param includeLog: Whether to include the log field in the documents.
         :type includeLog: bool
@@ -298,21 +309,32 @@ class Job(AccessControlledModel):
         We extend load to deserialize the kwargs back into a dict since we
         serialized them on the way into the database.
 
-        :param includeLog: Whether to include the log field in the document.
+        :param includeLog: Whether to include the log, as a list of messages,
+            in the document.
         :type includeLog: bool
         """
+        includeLog = kwargs.get('includeLog') and kwargs.get('fields') is None
         kwargs['fields'] = self._computeFields(kwargs)
         job = super().load(*args, **kwargs)
 
         if job and isinstance(job.get('kwargs'), str):
             job['kwargs'] = json_util.loads(job['kwargs'])
-        if job and isinstance(job.get('log'), str):
+        if job and includeLog:
+            job['log'] = JobLog().messages(job)
+        elif job and isinstance(job.get('log'), str):
             # Legacy support: log used to be just a string, but we want to
             # consistently return a list of strings now.
             job['log'] = [job['log']]
 
         return job
 
+    def remove(self, job, *args, **kwargs):
+        """
+        Delete a job and its log.
+        """
+        JobLog().removeJob(job)
+        return super().remove(job, *args, **kwargs)
+
     def scheduleJob(self, job):
         """
         Trigger the event to schedule this job. Other plugins are in charge of
@@ -338,6 +360,13 @@ class Job(AccessControlledModel):
         If notify=True, job status changes will also create a notification with type="job_status",
         and log changes will create a notification with type="job_log".
 
+        Updates that only change progress are merged when they arrive within
+        ``girder_jobs.coalesce.PROGRESS_WINDOW`` seconds of the last progress
+        written for the job: the job document passed in is updated, and the
+        latest progress is written at the end of the window or with the next
+        update of other fields.  Notifications are likewise sent to each user
+        at most once per ``girder_jobs.coalesce.NOTIFICATION_WINDOW``.
+
         :param job: The job document to update.
         :param log: Message to append to the job log. If you wish to overwrite
             instead of append, pass overwrite=True.
@@ -350,6 +379,38 @@ class Job(AccessControlledModel):
         :param otherFields: Any additional fields to set on the job.
         :type otherFields: dict
         """
+        progress = (progressMessage, progressCurrent, progressTotal)
+        if log is None and status is None and not otherFields and progress != (None,) * 3:
+            # Frequent progress updates are merged and written once per window
+            if self._progress.offer(
+                    job, progressTotal, progressCurrent, progressMessage, notify):
+                self._updateProgress(
+                    job, progressTotal, progressCurrent, progressMessage, False, None,
+                    {'$set': {}})
+                return job
+        else:
+            pending = self._progress.take(job)
+            if pending:
+                progressTotal = pending['total'] if progressTotal is None else progressTotal
+                progressCurrent = pending['current'] if progressCurrent is None else progressCurrent
+                progressMessage = pending['message'] if progressMessage is None else progressMessage
+        return self._updateJob(
+            job, log, overwrite, status, progressTotal, progressCurrent, notify,
+            progressMessage, otherFields)
+
+    def _writeProgress(self, job, total, current, message, notify):
+        """Write progress updates that were merged by updateJob."""
+        try:
+            self._updateJob(
+                job, progressTotal=total, progressCurrent=current, notify=notify,
+                progressMessage=message)
+        except Exception:
+            logger.exception('Failed to write progress of job %s', job['_id'])
+
+    def _updateJob(self, job, log=None, overwrite=False, status=None,
+                   progressTotal=None, progressCurrent=None, notify=True,
+                   progressMessage=None, otherFields=None):
+        """Update a job without merging progress updates.  See updateJob."""
         event = events.trigger('jobs.job.update', {
             'job': job,
             'params': {
@@ -428,29 +489,22 @@ class Job(AccessControlledModel):
     def _updateLog(self, job, log, overwrite, now, notify, user, updates):
         """Helper for updating a job's log."""
         if overwrite:
-            updates['$set']['log'] = [log]
+            JobLog().overwrite(job, log)
         elif log:
-            # This crudely assumes that the log messages size are vaguely
-            # similar and keeps only the end of the log as it grows large.  It
-            # can be wrong for a variety of reasons, but is better than not
-            # truncating it.
-            if not len(updates['$push']):
-                updates['$push']['log'] = {'$each': [log], '$slice': -((4 * 1024 ** 2) // len(log))}
-            else:
-                updates['$push']['log'] = log
+            JobLog().append(job, log)
+        updates['$set']['updated'] = now
         if notify and user:
-            Notification(
-                type='job_log', data={
-                    '_id': job['_id'],
-                    'overwrite': overwrite,
-                    'text': log
-                }, user=user).flush()
+            self._notifications.send('job_log', {
+                '_id': job['_id'],
+                'overwrite': overwrite,
+                'text': log
+            }, user)
 
     def _createUpdateStatusNotification(self, now, user, job):
         filtered = self.filter(job, user)
         filtered.pop('kwargs', None)
         filtered.pop('log', None)
-        Notification(type='job_status', data=filtered, user=user).flush()
+        self._notifications.send('job_status', filtered, user)
 
     def _updateStatus(self, job, status, now, query, updates):
         """Helper for updating job progress information."""
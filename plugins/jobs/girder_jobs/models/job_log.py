@@ -0,0 +1,175 @@
+import atexit
+import datetime
+import os
+import threading
+
+from girder.constants import SortDir
+from girder.models.model_base import Model
+
+# Pending log messages are written at least this often, in seconds
+LOG_FLUSH_INTERVAL = 1.0
+# Pending log messages are written as soon as they reach this many bytes
+LOG_FLUSH_SIZE = 64 * 1024
+# Only about this many bytes at the end of each job's log are kept
+LOG_MAX_SIZE = 4 * 1024 ** 2
+
+
+class JobLog(Model):
+    """
+    Stores the logs of jobs apart from the job documents, so that appending to
+    a log does not rewrite the job document, and jobs can be loaded without
+    their logs.
+
+    Each document holds a batch of messages of one job's log, along with the
+    byte offset of the batch in the UTF-8 encoded log.  Messages are buffered
+    in each process and written every LOG_FLUSH_INTERVAL seconds.  The job
+    document records the total size of its log in ``logSize``.  Jobs created
+    before logs were stored here may still have a ``log`` field, which is
+    treated as the start of their log.
+    """
+
+    def initialize(self):
+        self.name = 'job_log'
+        self.ensureIndices([
+            ((('jobId', SortDir.ASCENDING), ('end', SortDir.ASCENDING)), {}),
+        ])
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._pendingSize = 0
+        self._timer = None
+        atexit.register(self.flush)
+
+    def validate(self, doc):
+        return doc
+
+    def append(self, job, message):
+        """
+        Add a message to the end of a job's log.  The message is written the
+        next time pending messages are flushed.
+
+        :param job: The job document.
+        :param message: The message to add.
+        :type message: str
+        """
+        with self._lock:
+            self._pending.setdefault(job['_id'], []).append(message)
+            self._pendingSize += len(message)
+            if self._pendingSize >= LOG_FLUSH_SIZE:
+                self.flush()
+            elif self._timer is None or self._timer[0] != os.getpid():
+                # The timer of a parent process does not run after forking
+                self._timer = (os.getpid(), threading.Timer(LOG_FLUSH_INTERVAL, self.flush))
+                self._timer[1].daemon = True
+                self._timer[1].start()
+
+    def overwrite(self, job, message):
+        """
+        Replace a job's log with a message.
+
+        :param job: The job document.
+        :param message: The new log.
+        :type message: str
+        """
+        from .job import Job
+
+        with self._lock:
+            self._pendingSize -= sum(len(msg) for msg in self._pending.pop(job['_id'], ()))
+            self.collection.delete_many({'jobId': job['_id']})
+            Job().update({'_id': job['_id']}, {'$set': {'log': [], 'logSize': 0}})
+            self.append(job, message)
+
+    def flush(self, job=None):
+        """
+        Write pending log messages.
+
+        :param job: If specified, only write the pending messages of this job.
+        """
+        from .job import Job
+
+        with self._lock:
+            if job is None:
+                pending, self._pending = self._pending, {}
+                self._pendingSize = 0
+                if self._timer is not None:
+                    self._timer[1].cancel()
+                    self._timer = None
+            elif job['_id'] in self._pending:
+                pending = {job['_id']: self._pending.pop(job['_id'])}
+                self._pendingSize -= sum(len(msg) for msg in pending[job['_id']])
+            else:
+                return
+            now = datetime.datetime.now(datetime.timezone.utc)
+            docs = []
+            for jobId, messages in pending.items():
+                size = sum(len(msg.encode('utf8')) for msg in messages)
+                # Reserve the range of the log for this batch
+                before = Job().collection.find_one_and_update(
+                    {'_id': jobId}, {'$inc': {'logSize': size}},
+                    projection={'logSize': True})
+                if before is None:
+                    continue
+                offset = before.get('logSize', 0)
+                docs.append({
+                    'jobId': jobId,
+                    'offset': offset,
+                    'end': offset + size,
+                    'messages': messages,
+                    'created': now
+                })
+            if docs:
+                self.collection.insert_many(docs)
+            for doc in docs:
+                if doc['end'] > LOG_MAX_SIZE:
+                    self.collection.delete_many({
+                        'jobId': doc['jobId'], 'end': {'$lte': doc['end'] - LOG_MAX_SIZE}})
+
+    def messages(self, job):
+        """
+        Get the messages of a job's log.
+
+        :param job: The job document.
+        :returns: A list of the messages.
+        """
+        self.flush(job)
+        log = job.get('log') or []
+        if isinstance(log, str):
+            log = [log]
+        log = list(log)
+        for doc in self.find({'jobId': job['_id']}, sort=[('end', SortDir.ASCENDING)]):
+            log.extend(doc['messages'])
+        return log
+
+    def stream(self, job, offset=0):
+        """
+        Stream a job's log as UTF-8 encoded text.
+
+        :param job: The job document.
+        :param offset: The byte offset in the log to start from.  If the log
+            before this offset has been discarded, the log starts at the
+            oldest data that is kept.
+        :type offset: int
+        :returns: A generator of the log data.
+        """
+        self.flush(job)
+        legacy = job.get('log') or []
+        if isinstance(legacy, str):
+            legacy = [legacy]
+        legacy = ''.join(legacy).encode('utf8')
+        if offset < len(legacy):
+            yield legacy[offset:]
+        offset = max(offset - len(legacy), 0)
+        for doc in self.find({
+                'jobId': job['_id'], 'end': {'$gt': offset}
+        }, sort=[('end', SortDir.ASCENDING)]):
+            data = ''.join(doc['messages']).encode('utf8')
+            yield data[max(offset - doc['offset'], 0):]
+
+    def removeJob(self, job):
+        """
+        Delete a job's log.
+
+        :param job: The job document.
+        """
+        with self._lock:
+            self._pendingSize -= sum(len(msg) for msg in self._pending.pop(job['_id'], ()))
+            self.collection.delete_many({'jobId': job['_id']})
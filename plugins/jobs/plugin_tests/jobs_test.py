@@ -1,9 +1,12 @@
 import json
 import time
+from unittest import mock
 
 from bson import json_util
+from girder_jobs import coalesce
 from girder_jobs.constants import REST_CREATE_JOB_TOKEN_SCOPE, JobStatus
 from girder_jobs.models.job import Job
+from girder_jobs.models.job_log import JobLog
 
 from girder import events
 from girder.constants import AccessType
@@ -130,6 +133,74 @@ class JobsTestCase(base.TestCase):
         job = self.jobModel.load(job['_id'], force=True, includeLog=True)
         self.assertEqual(job['log'], ['legacy log'])
 
+        # Appended messages follow the legacy log
+        self.jobModel.updateJob(job, log=' and more')
+        resp = self.request('/job/%s/log' % job['_id'], user=self.users[1], isJson=False)
+        self.assertStatusOk(resp)
+        self.assertEqual(self.getBody(resp), 'legacy log and more')
+
+    def testStreamLog(self):
+        job = self.jobModel.createJob(title='log', type='log', user=self.users[1])
+        for message in ('first\n', 'second \u00e9\n', 'third\n'):
+            job = self.jobModel.updateJob(job, log=message)
+        self.assertNotIn('log', self.jobModel.load(job['_id'], force=True))
+        job = self.jobModel.load(job['_id'], force=True, includeLog=True)
+        self.assertEqual(job['log'], ['first\n', 'second \u00e9\n', 'third\n'])
+        self.assertEqual(self.jobModel.load(job['_id'], force=True)['logSize'], 22)
+
+        path = '/job/%s/log' % job['_id']
+        resp = self.request(path, user=self.users[2], isJson=False)
+        self.assertStatus(resp, 403)
+        resp = self.request(path, user=self.users[1], isJson=False)
+        self.assertStatusOk(resp)
+        self.assertEqual(self.getBody(resp), 'first\nsecond \u00e9\nthird\n')
+        resp = self.request(path, user=self.users[1], isJson=False, params={'offset': 6})
+        self.assertEqual(self.getBody(resp), 'second \u00e9\nthird\n')
+        resp = self.request(path, user=self.users[1], isJson=False, params={'offset': 22})
+        self.assertEqual(self.getBody(resp), '')
+
+        self.jobModel.updateJob(job, log='replaced\n', overwrite=True)
+        resp = self.request(path, user=self.users[1], isJson=False)
+        self.assertEqual(self.getBody(resp), 'replaced\n')
+
+        self.jobModel.remove(job)
+        self.assertEqual(JobLog().collection.count_documents({'jobId': job['_id']}), 0)
+
+    @mock.patch.object(coalesce, 'PROGRESS_WINDOW', 0.5)
+    def testCoalesceProgress(self):
+        job = self.jobModel.createJob(title='progress', type='x', user=self.users[0])
+        before = coalesce.counters['progressCoalesced']
+
+        # The first update is written, and the following ones are merged
+        self.jobModel.updateJob(job, progressTotal=10, progressCurrent=0, progressMessage='a')
+        for current in range(1, 6):
+            job = self.jobModel.updateJob(job, progressCurrent=current)
+        self.assertEqual(job['progress']['current'], 5)
+        self.assertEqual(coalesce.counters['progressCoalesced'] - before, 5)
+        stored = self.jobModel.load(job['_id'], force=True)
+        self.assertEqual(stored['progress'], {'total': 10, 'current': 0, 'message': 'a'})
+
+        # Updating other fields writes the merged progress with them
+        job = self.jobModel.updateJob(job, status=JobStatus.RUNNING)
+        stored = self.jobModel.load(job['_id'], force=True)
+        self.assertEqual(stored['status'], JobStatus.RUNNING)
+        self.assertEqual(stored['progress'], {'total': 10, 'current': 5, 'message': 'a'})
+
+        # Merged progress is written at the end of the window
+        job = self.jobModel.updateJob(job, progressCurrent=7, progressMessage='b')
+        stored = self.jobModel.load(job['_id'], force=True)
+        self.assertEqual(stored['progress']['current'], 5)
+        time.sleep(1)
+        stored = self.jobModel.load(job['_id'], force=True)
+        self.assertEqual(stored['progress'], {'total': 10, 'current': 7, 'message': 'b'})
+
+        resp = self.request('/job/coalescing', user=self.users[0])
+        self.assertStatusOk(resp)
+        self.assertEqual(resp.json['progressWindow'], 0.5)
+        self.assertGreaterEqual(resp.json['counters']['progressCoalesced'], 6)
+        resp = self.request('/job/coalescing', user=self.users[1])
+        self.assertStatus(resp, 403)
+
     def testListJobs(self):
         job = self.jobModel.createJob(title='A job', type='t', user=self.users[1], public=False)
         anonJob = self.jobModel.createJob(title='Anon job', type='t')
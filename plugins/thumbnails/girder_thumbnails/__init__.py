@@ -14,27 +14,16 @@ from girder.utility.model_importer import ModelImporter
 from . import rest, utils
 
 
-def removeThumbnails(event):
-    """
-    When a resource containing thumbnails is about to be deleted, we delete
-    all of the thumbnails that are attached to it.
-    """
-    thumbs = event.info.get('_thumbnails', ())
+def _removeThumbnails(doc):
     fileModel = File()
 
-    for fileId in thumbs:
+    for fileId in doc.get('_thumbnails', ()):
         file = fileModel.load(fileId, force=True)
         if file:
             fileModel.remove(file)
 
 
-def removeThumbnailLink(event):
-    """
-    When a thumbnail file is deleted, we remove the reference to it from the
-    resource to which it is attached.
-    """
-    doc = event.info
-
+def _removeThumbnailLink(doc):
     if doc.get('isThumbnail'):
         model = ModelImporter.model(doc['attachedToType'])
         resource = model.load(doc['attachedToId'], force=True)
@@ -44,6 +33,38 @@ def removeThumbnailLink(event):
             model.save(resource, validate=False)
 
 
+def removeThumbnails(event):
+    """
+    When a resource containing thumbnails is about to be deleted, we delete
+    all of the thumbnails that are attached to it.
+    """
+    _removeThumbnails(event.info)
+
+
+def removeThumbnailLink(event):
+    """
+    When a thumbnail file is deleted, we remove the reference to it from the
+    resource to which it is attached.
+    """
+    _removeThumbnailLink(event.info)
+
+
+def bulkRemoveThumbnails(event):
+    """
+    As :py:func:`removeThumbnails`, for a batch of resources deleted together.
+    """
+    for doc in event.info['documents']:
+        _removeThumbnails(doc)
+
+
+def bulkRemoveThumbnailLinks(event):
+    """
+    As :py:func:`removeThumbnailLink`, for a batch of files deleted together.
+    """
+    for doc in event.info['documents']:
+        _removeThumbnailLink(doc)
+
+
 def _onUpload(event):
     """
     Thumbnail creation can be requested on file upload by passing a reference field
@@ -98,8 +119,10 @@ class ThumbnailsPlugin(GirderPlugin):
         for model in (Item(), Collection(), Folder(), User()):
             model.exposeFields(level=AccessType.READ, fields='_thumbnails')
             events.bind('model.%s.remove' % model.name, name, removeThumbnails)
+            events.bind('model.%s.bulkRemove' % model.name, name, bulkRemoveThumbnails)
 
         events.bind('model.file.remove', name, removeThumbnailLink)
+        events.bind('model.file.bulkRemove', name, bulkRemoveThumbnailLinks)
         events.bind('data.process', name, _onUpload)
 
         registerPluginStaticContent(
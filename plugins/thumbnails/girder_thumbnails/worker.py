@@ -1,6 +1,11 @@
+import concurrent.futures
 import functools
 import io
+import logging
+import multiprocessing
+import os
 import sys
+import threading
 import traceback
 
 import numpy as np
@@ -10,10 +15,23 @@ from girder_jobs.constants import JobStatus
 from girder_jobs.models.job import Job
 from PIL import Image
 
-from girder import events
+from girder import events, plugin
+from girder.models import getDbConfig
 from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.upload import Upload
+from girder.utility import config
 from girder.utility.model_importer import ModelImporter
+from girder.utility.server import create_app
+
+logger = logging.getLogger(__name__)
+
+# Images are not decoded to more than this many pixels, unless
+# GIRDER_THUMBNAIL_MAX_PIXELS is set.
+MAX_PIXELS = 256 * 1024 ** 2
+# The number of processes that generate the thumbnails of a folder
+BATCH_PROCESSES = min(os.cpu_count() or 1, 8)
 
 
 def run(job):
@@ -60,23 +78,22 @@ def createThumbnail(width, height, crop, fileId, attachToType, attachToId):
             return newFile
         else:
             file = newFile
-            streamFn = functools.partial(
-                fileModel.download, file, headers=False)
 
     if 'assetstoreId' not in file:
         # TODO we could thumbnail link files if we really wanted.
         raise Exception('File %s has no assetstore.' % fileId)
 
-    stream = streamFn()
-    data = b''.join(stream())
+    crop = crop and width and height
+    with fileModel.open(file) as handle:
+        image = _getImage(file['mimeType'], file['exts'], handle)
 
-    image = _getImage(file['mimeType'], file['exts'], data)
+        if not width:
+            width = int(height * image.size[0] / image.size[1])
+        elif not height:
+            height = int(width * image.size[1] / image.size[0])
+        image = _decodeImage(image, width, height)
 
-    if not width:
-        width = int(height * image.size[0] / image.size[1])
-    elif not height:
-        height = int(width * image.size[1] / image.size[0])
-    elif crop:
+    if crop:
         x1 = y1 = 0
         x2, y2 = image.size
         wr = float(image.size[0]) / width
@@ -144,20 +161,121 @@ def attachThumbnail(file, thumbnail, attachToType, attachToId, width, height):
     return File().save(thumbnail)
 
 
-def _getImage(mimeType, extension, data):
+def runFolder(job):
+    """
+    Create thumbnails for the images in a folder, attaching each to its item.
+    Items that already have thumbnails are skipped.  The work is done on a
+    background thread, so this returns as soon as it has started; the
+    thumbnails are created on a pool of BATCH_PROCESSES spawned processes.
+    """
+    thread = threading.Thread(target=_runFolder, args=(job,), daemon=True)
+    thread.start()
+    return job, thread
+
+
+def _runFolder(job):
+    jobModel = Job()
+    jobModel.updateJob(job, status=JobStatus.RUNNING)
+
+    try:
+        kwargs = job['kwargs']
+        folder = Folder().load(kwargs['folderId'], force=True)
+        images = list(_folderImages(folder))
+        failed = 0
+        # The server is multithreaded, so the processes are spawned rather
+        # than forked; each one sets up its own database connections and
+        # plugins.
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=BATCH_PROCESSES, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_initProcess, initargs=(
+                    dict(getDbConfig()), config.getConfig()['server']['mode'],
+                    plugin.loadedPlugins())) as pool:
+            futures = {pool.submit(
+                _createItemThumbnail, kwargs['width'], kwargs['height'], kwargs['crop'],
+                file['_id'], item['_id']
+            ): file for item, file in images}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                try:
+                    future.result()
+                except Exception as exc:
+                    failed += 1
+                    jobModel.updateJob(job, log='Failed to create thumbnail for file %s: %r\n' % (
+                        futures[future]['_id'], exc))
+                jobModel.updateJob(
+                    job, progressTotal=len(images), progressCurrent=done,
+                    progressMessage='Created %d of %d thumbnails' % (done - failed, len(images)))
+        log = 'Created %d thumbnails, %d failed.' % (len(images) - failed, failed)
+        jobModel.updateJob(job, status=JobStatus.SUCCESS, log=log)
+    except Exception:
+        t, val, tb = sys.exc_info()
+        log = '%s: %s\n%s' % (t.__name__, repr(val), traceback.extract_tb(tb))
+        jobModel.updateJob(job, status=JobStatus.ERROR, log=log)
+        logger.exception('Failed to create the thumbnails of folder %s', job['kwargs']['folderId'])
+
+
+def _folderImages(folder):
+    """
+    Yield the items of a folder without thumbnails, each with its first image
+    file.
+    """
+    for item in Folder().childItems(folder):
+        if item.get('_thumbnails'):
+            continue
+        for file in Item().childFiles(item):
+            if 'assetstoreId' in file and not file.get('isThumbnail') and (
+                    (file.get('mimeType') or '').startswith('image/')
+                    or file.get('mimeType') == 'application/dicom'
+                    or file.get('exts', [None])[-1] == 'dcm'):
+                yield item, file
+                break
+
+
+def _initProcess(database, mode, plugins):
+    config.getConfig()['database'] = database
+    plugin._loadPlugins(create_app(mode), plugins)
+
+
+def _createItemThumbnail(width, height, crop, fileId, itemId):
+    return str(createThumbnail(width, height, crop, fileId, 'item', itemId)['_id'])
+
+
+def _maxPixels():
+    maxPixels = os.environ.get('GIRDER_THUMBNAIL_MAX_PIXELS')
+    return int(maxPixels) if str(maxPixels).isdigit() else MAX_PIXELS
+
+
+def _decodeImage(image, width, height):
+    """
+    Decode an opened image for a thumbnail of the given size.  JPEG images are
+    decoded at the lowest resolution of at least this size.
+
+    :param image: The opened image, which has not been loaded.
+    :param width: The thumbnail width.
+    :param height: The thumbnail height.
+    :returns: The loaded image.
+    """
+    image.draft(None, (width, height))
+    if image.size[0] * image.size[1] > _maxPixels():
+        raise Exception('Image of %d x %d pixels is too large to create a thumbnail.' % (
+            image.size[0], image.size[1]))
+    image.load()
+    return image
+
+
+def _getImage(mimeType, extension, handle):
     """
     Check extension of image and opens it.
 
     :param extension: The extension of the image that needs to be opened.
-    :param data: The image file stream.
+    :param handle: A file-like object of the image file.
     """
     if (extension and extension[-1] == 'dcm') or mimeType == 'application/dicom':
         # Open the dicom image
-        dicomData = pydicom.dcmread(io.BytesIO(data))
+        dicomData = pydicom.dcmread(handle)
         return scaleDicomLevels(dicomData)
     else:
         # Open other types of images
-        return Image.open(io.BytesIO(data))
+        return Image.open(handle)
 
 
 def scaleDicomLevels(dicomData):
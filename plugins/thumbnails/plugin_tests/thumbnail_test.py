@@ -4,6 +4,7 @@ import os
 import time
 
 from girder_jobs.constants import JobStatus
+from girder_jobs.models.job import Job
 from PIL import Image
 
 from girder import events
@@ -249,6 +250,54 @@ class ThumbnailsTestCase(base.TestCase):
         Folder().remove(self.publicFolder)
         self.assertEqual(File().load(thumbnailId), None)
 
+    def testFolderThumbnailCreation(self):
+        jpeg = io.BytesIO()
+        Image.new('RGB', (2000, 1500), (0, 128, 255)).save(jpeg, 'JPEG')
+        for name, data, mimeType in (
+                ('logo.png', self.image, 'image/png'),
+                ('large.jpg', jpeg.getvalue(), 'image/jpeg'),
+                ('notes.txt', b'not an image', 'text/plain')):
+            Upload().uploadFromFile(
+                io.BytesIO(data), size=len(data), name=name, parentType='folder',
+                parent=self.publicFolder, user=self.admin, mimeType=mimeType)
+
+        params = {'folderId': str(self.publicFolder['_id']), 'width': 64, 'height': 32}
+        resp = self.request(
+            path='/thumbnail/folder', method='POST', user=self.user, params=params)
+        self.assertStatus(resp, 403)
+
+        resp = self.request(
+            path='/thumbnail/folder', method='POST', user=self.admin, params=params)
+        self.assertStatusOk(resp)
+        job = self._waitForJob(resp.json['_id'])
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress']['total'], 2)
+
+        items = {item['name']: item for item in Folder().childItems(self.publicFolder)}
+        self.assertNotIn('_thumbnails', items['notes.txt'])
+        for name in ('logo.png', 'large.jpg'):
+            self.assertEqual(len(items[name]['_thumbnails']), 1)
+            thumbnail = File().load(items[name]['_thumbnails'][0], force=True)
+            with File().open(thumbnail) as fh:
+                self.assertEqual(Image.open(fh).size, (64, 32))
+
+        # Items that already have thumbnails are skipped
+        resp = self.request(
+            path='/thumbnail/folder', method='POST', user=self.admin, params=params)
+        self.assertStatusOk(resp)
+        job = self._waitForJob(resp.json['_id'])
+        self.assertEqual(job['status'], JobStatus.SUCCESS)
+        self.assertEqual(job['progress'], None)
+
+    def _waitForJob(self, jobId):
+        start = time.time()
+        while time.time() - start < 60:
+            job = Job().load(jobId, force=True)
+            if job['status'] in (JobStatus.SUCCESS, JobStatus.ERROR):
+                break
+            time.sleep(0.1)
+        return job
+
     def testCreateThumbnailOverride(self):
         def override(event):
             # Override thumbnail creation -- just grab the first 4 bytes
@@ -0,0 +1,251 @@
+"""
+Measure the requests per second and latency of Girder under uvicorn, comparing
+the ASGI bridge with the previous implementation, which started a thread and a
+socketpair for every request and handed every response chunk to the event loop
+through the default executor.
+
+Three servers are measured in turn: the previous bridge ("legacy"), the bridge
+without direct routes ("pooled"), and the bridge as deployed ("direct").  Each
+serves GET requests for an item, which the deployed bridge dispatches directly,
+and the zip download of a folder, which streams many small chunks.
+
+This creates a user with a public folder in the database named by
+GIRDER_MONGO_URI, which must have an assetstore, and removes it when done.  For
+example::
+
+    python scripts/benchmarks/asgi_load.py --clients 16 --seconds 10
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+
+import requests
+
+from girder.asgi import _FileWrapper, _wrapped_file, _WSGIBridge, info, wsgi_app
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.models.user import User
+
+
+class LegacyWSGIBridge(_WSGIBridge):
+    async def __call__(self, scope, receive, send):  # noqa
+        if scope['type'] != 'http':
+            return
+        loop = asyncio.get_running_loop()
+        rsock, wsock = socket.socketpair()
+        rsock.setblocking(True)
+        wsock.setblocking(False)
+        response_status = {}
+        response_headers = []
+        chunk_queue = queue.Queue(maxsize=1)
+        file_sent = threading.Event()
+        error = []
+
+        def start_response(status, headers, exc_info=None):
+            response_headers.clear()
+            response_status['code'] = int(status.split()[0])
+            response_headers.extend(
+                (k.encode('latin-1'), v.encode('latin-1'))
+                for k, v in headers
+            )
+
+            def write(data):
+                if data:
+                    chunk_queue.put(bytes(data))
+
+            return write
+
+        def run_wsgi():
+            body_file = rsock.makefile('rb')
+            try:
+                environ = self._build_environ(scope, body_file)
+                result = self._app(environ, start_response)
+                try:
+                    file_wrapper = _wrapped_file(result)
+                    if file_wrapper is not None:
+                        # Keep the file open until it has been sent
+                        chunk_queue.put(file_wrapper)
+                        file_sent.wait()
+                    else:
+                        for chunk in result:
+                            if chunk:
+                                chunk_queue.put(bytes(chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except Exception as exc:
+                error.append(exc)
+            finally:
+                chunk_queue.put(None)
+                body_file.close()
+                rsock.close()
+
+        thread = threading.Thread(target=run_wsgi, daemon=True)
+        thread.start()
+
+        async def handle_request():
+            try:
+                while True:
+                    message = await receive()
+                    if message['type'] == 'http.disconnect':
+                        break
+                    body = message.get('body', b'')
+                    if body:
+                        await loop.sock_sendall(wsock, body)
+                    if not message.get('more_body', False):
+                        break
+            finally:
+                try:
+                    wsock.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                wsock.close()
+
+        async def handle_response():
+            headers_sent = False
+            while True:
+                chunk = await loop.run_in_executor(None, chunk_queue.get)
+                if not headers_sent:
+                    await send({
+                        'type': 'http.response.start',
+                        'status': response_status.get('code', 500),
+                        'headers': response_headers,
+                    })
+                    headers_sent = True
+                if isinstance(chunk, _FileWrapper):
+                    try:
+                        if await self._send_file(scope, send, chunk, response_headers):
+                            return
+                    finally:
+                        file_sent.set()
+                    continue
+                if chunk is None:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': b'',
+                        'more_body': False,
+                    })
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+
+        req_task = asyncio.create_task(handle_request())
+        res_task = asyncio.create_task(handle_response())
+        try:
+            await asyncio.gather(req_task, res_task)
+        except BaseException:
+            req_task.cancel()
+            res_task.cancel()
+            file_sent.set()
+            while thread.is_alive():
+                try:
+                    if chunk_queue.get(timeout=0.1) is None:
+                        break
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            await loop.run_in_executor(None, thread.join)
+        if error:
+            raise error[0]
+
+
+def serve(variant, port):
+    import uvicorn
+
+    if variant == 'legacy':
+        bridge = LegacyWSGIBridge(wsgi_app)
+    elif variant == 'pooled':
+        bridge = _WSGIBridge(wsgi_app)
+    else:
+        bridge = _WSGIBridge(wsgi_app, info['apiRoot'])
+    uvicorn.run(bridge, host='127.0.0.1', port=port, log_level='warning',
+                access_log=False, lifespan='off')
+
+
+def client(url, seconds):
+    session = requests.Session()
+    latencies = []
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+        resp = session.get(url)
+        resp.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def load(url, clients, seconds):
+    with concurrent.futures.ProcessPoolExecutor(clients) as pool:
+        results = list(pool.map(client, [url] * clients, [seconds] * clients))
+    latencies = sorted(t for result in results for t in result)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    return len(latencies) / seconds, p50, p99
+
+
+def waitForPort(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('The server did not start.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each measurement')
+    parser.add_argument('--files', type=int, default=20, help='files in the downloaded folder')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    user = User().createUser(
+        'asgi-benchmark-%d' % os.getpid(), 'benchmark-password', 'ASGI', 'Benchmark',
+        'asgi-benchmark-%d@girder.test' % os.getpid())
+    try:
+        folder = Folder().createFolder(user, 'Benchmark', parentType='user', public=True)
+        item = Item().createItem('item', user, folder)
+        data = os.urandom(64 * 1024)
+        for index in range(args.files):
+            Upload().uploadFromFile(
+                io.BytesIO(data), len(data), 'file%d.bin' % index, parentType='folder',
+                parent=folder, user=user)
+        routes = (('item', '/api/v1/item/%s' % item['_id']),
+                  ('download', '/api/v1/folder/%s/download' % folder['_id']))
+
+        context = multiprocessing.get_context('spawn')
+        for variant in ('legacy', 'pooled', 'direct'):
+            server = context.Process(target=serve, args=(variant, args.port), daemon=True)
+            server.start()
+            try:
+                waitForPort(args.port)
+                for name, path in routes:
+                    url = 'http://127.0.0.1:%d%s' % (args.port, path)
+                    client(url, 0.5)
+                    rate, p50, p99 = load(url, args.clients, args.seconds)
+                    print('%-7s %-9s %8.1f req/s  p50 %6.1f ms  p99 %6.1f ms' % (
+                        variant, name, rate, p50 * 1000, p99 * 1000))
+            finally:
+                server.terminate()
+                server.join()
+    finally:
+        User().remove(user)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure the throughput of uploading a file in chunks to a filesystem
+assetstore, comparing FilesystemAssetstoreAdapter.uploadChunk with the
+previous implementation, which appended each chunk in 64 KiB pieces and
+restored and serialized the SHA-512 state on every chunk.
+
+This uses the database named by GIRDER_MONGO_URI (or --database) only to read
+the minimum chunk size setting.  For example::
+
+    python scripts/benchmarks/fs_upload.py --size 4096 --chunk-size 64 --dir /data/tmp
+"""
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from bson.objectid import ObjectId
+
+from girder.utility import _hash_state, config
+from girder.utility.filesystem_assetstore_adapter import BUF_SIZE, FilesystemAssetstoreAdapter
+
+MiB = 1024 * 1024
+
+
+def legacyUploadChunk(adapter, upload, chunk):
+    adapter.checkUploadSize(upload, adapter.getChunkSize(chunk))
+    checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+    with open(upload['tempFile'], 'a+b') as tempFile:
+        size = 0
+        while not upload['received'] + size > upload['size']:
+            data = chunk.read(BUF_SIZE)
+            if not data:
+                break
+            size += len(data)
+            tempFile.write(data)
+            checksum.update(data)
+    chunk.close()
+    adapter.checkUploadSize(upload, size)
+    upload['sha512state'] = _hash_state.serializeHex(checksum)
+    upload['received'] += size
+    return upload
+
+
+def currentUploadChunk(adapter, upload, chunk):
+    return adapter.uploadChunk(upload, chunk, None)
+
+
+def run(adapter, uploadChunk, size, chunkSize, data):
+    upload = adapter.initUpload({'_id': ObjectId(), 'size': size, 'received': 0}, None)
+    if uploadChunk is legacyUploadChunk:
+        upload.pop('sha512stateOffset', None)
+    start = time.perf_counter()
+    while upload['received'] < size:
+        length = min(chunkSize, size - upload['received'])
+        upload = uploadChunk(adapter, upload, io.BytesIO(data[:length]))
+    if uploadChunk is legacyUploadChunk:
+        digest = _hash_state.restoreHex(upload['sha512state'], 'sha512').hexdigest()
+    else:
+        digest = adapter._restoreChecksum(upload).hexdigest()
+    elapsed = time.perf_counter() - start
+    adapter.cancelUpload(upload)
+    return elapsed, digest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=1024, help='file size in MiB')
+    parser.add_argument('--chunk-size', type=int, default=64, help='chunk size in MiB')
+    parser.add_argument('--runs', type=int, default=3, help='runs of each implementation')
+    parser.add_argument('--dir', help='assetstore root (default: a new temp directory)')
+    parser.add_argument('--database', default=os.environ.get(
+        'GIRDER_MONGO_URI', 'mongodb://localhost:27017/girder'))
+    args = parser.parse_args()
+
+    config.getConfig()['database']['uri'] = args.database
+    root = tempfile.mkdtemp(dir=args.dir)
+    try:
+        adapter = FilesystemAssetstoreAdapter({'_id': ObjectId(), 'root': root})
+        size, chunkSize = args.size * MiB, args.chunk_size * MiB
+        data = os.urandom(chunkSize)
+        for name, uploadChunk in (('legacy', legacyUploadChunk),
+                                  ('current', currentUploadChunk)):
+            times = []
+            for _ in range(args.runs):
+                elapsed, digest = run(adapter, uploadChunk, size, chunkSize, data)
+                times.append(elapsed)
+            best = min(times)
+            print('%-8s best %.3fs  %.1f MiB/s  sha512 %s...' % (
+                name, best, args.size / best, digest[:16]))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
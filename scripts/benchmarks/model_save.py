@@ -0,0 +1,67 @@
+"""
+Measure the time taken to change one field of a large item and save it,
+comparing saves that only write the changed fields with the previous
+implementation, which replaced the whole document.
+
+This creates a user with an item, whose metadata has the given size, in the
+database named by GIRDER_MONGO_URI (or --database), and removes them when
+done.  For example::
+
+    python scripts/benchmarks/model_save.py --size 1024 --saves 200
+"""
+import argparse
+import os
+import time
+
+import bson
+
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.user import User
+from girder.utility import config
+
+KiB = 1024
+
+
+def run(trackChanges, itemId, saves):
+    model = Item()
+    model.trackChanges = trackChanges
+    item = model.load(itemId, force=True)
+    start = time.perf_counter()
+    for index in range(saves):
+        item['description'] = 'save %d' % index
+        item = model.save(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=1024, help='metadata size in KiB')
+    parser.add_argument('--saves', type=int, default=200, help='saves of each implementation')
+    parser.add_argument('--runs', type=int, default=3, help='runs of each implementation')
+    parser.add_argument('--database', default=os.environ.get(
+        'GIRDER_MONGO_URI', 'mongodb://localhost:27017/girder'))
+    args = parser.parse_args()
+
+    config.getConfig()['database']['uri'] = args.database
+    user = User().createUser(
+        'model-save-benchmark-%d' % os.getpid(), 'benchmark-password', 'Model', 'Benchmark',
+        'model-save-benchmark-%d@girder.test' % os.getpid())
+    try:
+        folder = Folder().createFolder(user, 'Benchmark', parentType='user')
+        item = Item().createItem('large', user, folder)
+        # Many small values, as in the metadata of an annotated image
+        item = Item().setMetadata(item, {
+            'key%d' % index: os.urandom(48).hex()
+            for index in range(args.size * KiB // 110)})
+        print('document size %.1f KiB' % (len(bson.encode(item)) / KiB))
+        for name, trackChanges in (('replace', False), ('changes', True)):
+            best = min(run(trackChanges, item['_id'], args.saves) for _ in range(args.runs))
+            print('%-8s best %.3fs  %.2f ms/save' % (name, best, best * 1000 / args.saves))
+    finally:
+        Item().trackChanges = True
+        User().remove(user)
+
+
+if __name__ == '__main__':
+    main()
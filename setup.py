@@ -63,6 +63,9 @@ extrasReqs = {
         'cachetools',
         'diskcache',
         'mfusepy>=3.0'
+    ],
+    'zstd': [
+        'zstandard'
     ]
 }
 
@@ -100,8 +103,11 @@ setup(
         ],
         'girder.cli_plugins': [
             'serve = girder.cli.serve:main',
+            'migrate = girder.cli.migrate:main',
             'mount = girder.cli.mount:main',
             'shell = girder.cli.shell:main',
+            'blobs = girder.cli.blobs:main',
+            'sizes = girder.cli.sizes:main',
             'sftpd = girder.cli.sftpd:main',
         ],
         'girder_worker_plugins': [
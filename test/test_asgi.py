@@ -1,13 +1,23 @@
+import asyncio
+import concurrent.futures
+import io
 import os
 import stat
 import time
+import zipfile
 
+import cherrypy
 import psutil
+import pytest
 import requests
 from requests.adapters import HTTPAdapter
 
+from girder import events
+from girder.api.rest import getApiUrl
 from girder.models.file import File
 from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.token import Token
 from pytest_girder.utils import uploadFile
 
 
@@ -74,3 +84,176 @@ def test_large_file_download_memory_consumption(asgiBoundServer, admin, fsAssets
     )
     assert len(memory_usage) > 10, 'Insufficient memory samples'
     assert download_time > 0.5, 'Download too fast, may not have been throttled'
+
+
+def test_ranged_download(asgiBoundServer, admin, fsAssetstore):
+    content = os.urandom(3 * 1024 * 1024)
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    file = uploadFile('ranged.bin', content, admin, dest)
+    url = f'http://127.0.0.1:{asgiBoundServer.boundPort}/api/v1/file/{file["_id"]}/download'
+    resp = requests.get(url)
+    assert resp.status_code == 200
+    assert resp.content == content
+    resp = requests.get(url, headers={'Range': 'bytes=100-2000099'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 100-2000099/%d' % len(content)
+    assert resp.content == content[100:2000100]
+
+
+def test_direct_item_route(asgiBoundServer, admin):
+    folder = Folder().childFolders(admin, parentType='user', filters={'public': False})[0]
+    item = Item().createItem('direct', admin, folder)
+    url = f'http://127.0.0.1:{asgiBoundServer.boundPort}/api/v1/item/{item["_id"]}'
+    resp = requests.get(url)
+    assert resp.status_code == 401
+    assert resp.json()['type'] == 'access'
+
+    token = Token().createToken(admin)
+    seen = []
+    with events.bound('rest.get.item/:id.after', 'test', lambda event: seen.append(
+            event.info['returnVal']['_id'])):
+        resp = requests.get(url, headers={'Girder-Token': str(token['_id'])})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'application/json'
+    assert 'Girder-Request-Uid' in resp.headers
+    assert resp.json()['name'] == 'direct'
+    assert seen == [item['_id']]
+
+    resp = requests.get(url, params={'token': str(token['_id'])})
+    assert resp.status_code == 200
+    resp = requests.get(url, params=[('token', str(token['_id'])), ('token', 'x')])
+    assert resp.status_code == 400
+
+
+def test_streamed_download(asgiBoundServer, admin, fsAssetstore):
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    contents = {f'file{i}.bin': os.urandom(100 * 1024) for i in range(10)}
+    for name, content in contents.items():
+        uploadFile(name, content, admin, dest)
+    resp = requests.get(
+        f'http://127.0.0.1:{asgiBoundServer.boundPort}/api/v1/folder/{dest["_id"]}/download')
+    assert resp.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+        assert {name.split('/')[-1]: zf.read(name) for name in zf.namelist()} == contents
+
+
+def _asgiScope(path, extensions=None, headers=()):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'127.0.0.1')] + list(headers),
+        'server': ('127.0.0.1', 80),
+        'client': ('127.0.0.1', 12345),
+        'extensions': extensions or {},
+    }
+
+
+async def _receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+def _asgiGet(path, extensions, headers=()):
+    from girder.asgi import app
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(_asgiScope(path, extensions, headers), _receive, send))
+    return messages
+
+
+@pytest.mark.parametrize('extension', ['http.response.pathsend', 'http.response.zerocopysend'])
+def test_download_sent_from_disk(asgiBoundServer, admin, fsAssetstore, extension):
+    content = os.urandom(1024 * 1024)
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    file = uploadFile('direct.bin', content, admin, dest)
+    path = File().getAssetstoreAdapter(file).fullPath(file)
+    completed = []
+
+    with events.bound('model.file.download.complete', 'test', lambda event: completed.append(
+            event.info['file']['_id'])):
+        messages = _asgiGet(f'/api/v1/file/{file["_id"]}/download', {extension: {}})
+
+    assert messages[0]['type'] == 'http.response.start'
+    assert messages[0]['status'] == 200
+    assert messages[1]['type'] == extension
+    if extension == 'http.response.pathsend':
+        assert messages[1]['path'] == path
+    else:
+        assert messages[1]['file'].closed
+        assert (messages[1]['offset'], messages[1]['count']) == (0, len(content))
+    assert len(messages) == 2
+    assert completed == [file['_id']]
+
+    # Ranges are streamed
+    messages = _asgiGet(
+        f'/api/v1/file/{file["_id"]}/download', {extension: {}}, [(b'range', b'bytes=10-99')])
+    assert messages[0]['status'] == 206
+    assert b''.join(message.get('body', b'') for message in messages[1:]) == content[10:100]
+
+
+def test_direct_item_route_behind_proxy(asgiBoundServer, admin):
+    folder = Folder().childFolders(admin, parentType='user', filters={'public': False})[0]
+    item = Item().createItem('direct', admin, folder)
+    token = Token().createToken(admin)
+    seen = []
+
+    with events.bound('rest.get.item/:id.after', 'test', lambda event: seen.append(
+            (cherrypy.request.remote.ip, getApiUrl()))):
+        messages = _asgiGet(f'/api/v1/item/{item["_id"]}', {}, [
+            (b'girder-token', str(token['_id']).encode()),
+            (b'x-forwarded-for', b'10.1.2.3, 127.0.0.1'),
+            (b'x-forwarded-host', b'girder.example.com'),
+            (b'x-forwarded-proto', b'https'),
+        ])
+    assert messages[0]['status'] == 200
+    assert seen == [('10.1.2.3', 'https://girder.example.com/api/v1')]
+
+
+def test_streamed_download_releases_thread(asgiBoundServer, admin, fsAssetstore, monkeypatch):
+    from girder import asgi
+
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    for i in range(4):
+        uploadFile(f'file{i}.bin', os.urandom(1024 * 1024), admin, dest)
+    path = f'/api/v1/folder/{dest["_id"]}/download'
+    monkeypatch.setattr(asgi, '_executor', concurrent.futures.ThreadPoolExecutor(1))
+    monkeypatch.setattr(asgi, '_executorPid', os.getpid())
+
+    async def download():
+        slowDone = asyncio.Event()
+        sizes = []
+
+        async def slowSend(message):
+            # The client of the first download does not read until the
+            # second download is done
+            if message['type'] == 'http.response.body' and message['more_body']:
+                await slowDone.wait()
+                sizes.append(len(message['body']))
+
+        async def send(message):
+            sizes.append(len(message.get('body', b'')))
+
+        slow = asyncio.create_task(asgi.app(_asgiScope(path), _receive, slowSend))
+        await asyncio.sleep(0.5)
+        await asyncio.wait_for(asgi.app(_asgiScope(path), _receive, send), 30)
+        secondSize = sum(sizes)
+        slowDone.set()
+        await slow
+        return secondSize, sum(sizes) - secondSize
+
+    try:
+        second, first = asyncio.run(download())
+    finally:
+        asgi._executor.shutdown()
+    assert second > 4 * 1024 * 1024
+    assert first == second
@@ -1,11 +1,21 @@
+import time
 import unittest.mock
 
 import pytest
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
 
+from girder.constants import AccessType
+from girder.models.folder import Folder
+from girder.models.item import Item
 from girder.models.setting import Setting
+from girder.models.token import Token
+from girder.models.user import User
 from girder.settings import SettingKey
-from girder.utility._cache import _setupCache, cache, requestCache
+from girder.utility._auth_cache import AuthCache, authCache
+from girder.utility._cache import _setupCache, cache, rateLimitBuffer, requestCache
 from girder.utility.config import getConfig
+from pytest_girder.assertions import assertStatusOk
 
 
 @pytest.fixture
@@ -59,3 +69,112 @@ def testSettingsCache(db, enabledCache):
         setting.get(SettingKey.BRAND_NAME)
 
         findOneMock.assert_called_once()
+
+
+def testAclDecisionCache(db, enabledCache, admin, user):
+    folder = Folder().createFolder(
+        parent=admin, name='acl', parentType='user', creator=admin, public=False)
+    folder = Folder().setUserAccess(folder, user, AccessType.READ, save=True)
+    item = Item().createItem('item', creator=admin, folder=folder)
+
+    # The parent folder is only consulted once for repeated checks on its items
+    with unittest.mock.patch.object(Folder(), 'load', wraps=Folder().load) as loadMock:
+        for _ in range(3):
+            assert Item().hasAccess(item, user, AccessType.READ)
+            assert not Item().hasAccess(item, user, AccessType.WRITE)
+        assert loadMock.call_count == 2
+
+    # Changing the ACL of the folder invalidates the cached decisions
+    folder = Folder().setUserAccess(folder, user, AccessType.WRITE, save=True)
+    assert Item().hasAccess(item, user, AccessType.WRITE)
+
+    # Direct updates of access fields also invalidate the cached decisions
+    assert Item().hasAccess(item, user, AccessType.READ)
+    Folder().update({'_id': folder['_id']}, {'$set': {'access.users': []}})
+    assert not Item().hasAccess(item, user, AccessType.READ)
+
+
+def testRateLimitBufferConfigurable(db):
+    Setting().set(SettingKey.CACHE_CONFIG, {
+        'cache.global.backend': 'dogpile.cache.null',
+        'cache.rate_limit.backend': 'dogpile.cache.memory',
+        'cache.rate_limit.expiration_time': 123,
+    })
+    try:
+        _setupCache(getConfig())
+        assert rateLimitBuffer.expiration_time == 123
+    finally:
+        Setting().unset(SettingKey.CACHE_CONFIG)
+        _setupCache(getConfig())
+    assert rateLimitBuffer.expiration_time is None
+
+
+def testSharedRedisCache():
+    # Two regions on separate backends stand in for two server processes
+    channel = 'girder.cache.test.%s' % time.time()
+    regions = [
+        make_region().configure('girder_redis', arguments={'invalidation_channel': channel})
+        for _ in range(2)]
+    key = 'girder.test.%s' % time.time()
+
+    def waitFor(region, value):
+        for _ in range(50):
+            if region.get(key) == value:
+                return True
+            time.sleep(0.1)
+        return False
+
+    try:
+        regions[0].set(key, 'a')
+        assert regions[1].get(key) == 'a'
+        # The second process now holds the value in its local tier; a write from
+        # the first process must invalidate it
+        regions[0].set(key, 'b')
+        assert waitFor(regions[1], 'b')
+        regions[1].delete(key)
+        assert waitFor(regions[0], NO_VALUE)
+    finally:
+        regions[0].delete(key)
+
+
+def testAuthCache(server, user):
+    token = Token().createToken(user)
+    hits = authCache.stats()['hits']
+    with unittest.mock.patch.object(Token(), 'load', wraps=Token().load) as tokenLoad, \
+            unittest.mock.patch.object(User(), 'load', wraps=User().load) as userLoad:
+        for _ in range(3):
+            resp = server.request('/user/me', token=token['_id'])
+            assertStatusOk(resp)
+            assert resp.json['login'] == 'user'
+        assert tokenLoad.call_count == 1
+        assert userLoad.call_count == 1
+    assert authCache.stats()['hits'] >= hits + 4
+
+    # Saving the user or removing the token drops them from the cache
+    user['firstName'] = 'Changed'
+    User().save(user)
+    resp = server.request('/user/me', token=token['_id'])
+    assert resp.json['firstName'] == 'Changed'
+    Token().remove(token)
+    resp = server.request('/user/me', token=token['_id'])
+    assertStatusOk(resp)
+    assert resp.json is None
+
+
+def testAuthCacheInvalidation(db, user):
+    # Two caches on the same channel stand in for two server processes
+    channel = 'girder.auth_cache.test.%s' % time.time()
+    caches = [AuthCache(channel) for _ in range(2)]
+    token = Token().createToken(user)
+    for processCache in caches:
+        assert processCache.loadToken(token['_id'])['scope'] == token['scope']
+
+    Token().collection.update_one({'_id': token['_id']}, {'$set': {'scope': ['custom']}})
+    assert caches[1].loadToken(token['_id'])['scope'] == token['scope']
+    caches[0].invalidate(tokenIds=[token['_id']])
+    for _ in range(50):
+        if caches[1].loadToken(token['_id'])['scope'] == ['custom']:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail('The token was not invalidated')
@@ -1,11 +1,16 @@
+import hashlib
 import io
+import os
+import unittest.mock
 
 import pytest
 
 from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.upload import Upload
-from pytest_girder.assertions import assertStatus
+from girder.notification import Notification
+from girder.utility import filesystem_assetstore_adapter
+from pytest_girder.assertions import assertStatus, assertStatusOk
 from pytest_girder.utils import uploadFile
 
 
@@ -33,3 +38,84 @@ def testRangeRequestBehavior(range, status, cr, cl, admin, server, fsAssetstore)
         assert 'Content-Range' not in resp.headers
     else:
         assert resp.headers['Content-Range'] == cr
+
+
+def testChunkedUploadChecksum(admin, fsAssetstore):
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    data = b'abcdefgh' * 1000
+    upload = Upload().createUpload(admin, 'chunked', 'folder', dest, size=len(data))
+    upload = Upload().handleChunk(upload, data[:3000])
+    # Continuing the upload in another process restores the persisted state
+    filesystem_assetstore_adapter._checksums.clear()
+    upload = Upload().handleChunk(upload, data[3000:5000])
+    assert Upload().requestOffset(upload) == 5000
+    file = Upload().handleChunk(upload, data[5000:])
+    assert file['size'] == len(data)
+    assert file['sha512'] == hashlib.sha512(data).hexdigest()
+    with File().open(file) as fh:
+        assert fh.read() == data
+
+
+def testBlobReport(admin, fsAssetstore):
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    uploadFile('a', b'shared', admin, dest)
+    uploadFile('b', b'shared', admin, dest)
+    unique = uploadFile('c', b'unique', admin, dest)
+    orphan = hashlib.sha512(b'orphan').hexdigest()
+    orphanPath = os.path.join(fsAssetstore['root'], orphan[:2], orphan[2:4], orphan)
+    os.makedirs(os.path.dirname(orphanPath), exist_ok=True)
+    with open(orphanPath, 'wb') as f:
+        f.write(b'orphan')
+    adapter = File().getAssetstoreAdapter(unique)
+    os.unlink(adapter.fullPath(unique))
+
+    report = adapter.blobReport()
+    assert report['blobs'] == 2
+    assert report['blobBytes'] == 12
+    assert report['files'] == 3
+    assert report['fileBytes'] == 18
+    assert report['sharedBlobs'] == 1
+    assert report['savedBytes'] == 6
+    assert report['orphanedBlobs'] == 1
+    assert report['missingBlobs'] == 1
+    assert report['reclaimedBlobs'] == 0
+
+    report = adapter.blobReport(reclaim=True, minimumAge=0)
+    assert report['reclaimedBlobs'] == 1
+    assert report['reclaimedBytes'] == 6
+    assert not os.path.exists(orphanPath)
+
+
+def testBlobReportTask(server, admin, fsAssetstore, eagerWorkerTasks):
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    uploadFile('a', b'shared', admin, dest)
+    uploadFile('b', b'shared', admin, dest)
+
+    with unittest.mock.patch.object(Notification, 'flush', autospec=True) as flush:
+        resp = server.request(
+            path='/assetstore/%s/blobs' % fsAssetstore['_id'], method='GET', user=admin)
+    assertStatusOk(resp)
+    notification = flush.call_args[0][0]
+    assert notification._payload['type'] == 'assetstore.blob_report'
+    assert notification._payload['data']['taskId'] == resp.json['taskId']
+    report = notification._payload['data']['report']
+    assert (report['blobs'], report['files'], report['sharedBlobs']) == (1, 2, 1)
+
+
+def testPreallocatedUpload(admin, fsAssetstore, monkeypatch):
+    monkeypatch.setattr(filesystem_assetstore_adapter, 'PREALLOCATE_MIN_SIZE', 4096)
+    dest = Folder().childFolders(admin, parentType='user')[0]
+    data = b'abcdefgh' * 1000
+    upload = Upload().createUpload(admin, 'reserved', 'folder', dest, size=len(data))
+    # The reserved space does not change the size of the temp file
+    assert os.stat(upload['tempFile']).st_size == 0
+    upload = Upload().handleChunk(upload, data[:3000])
+    assert Upload().requestOffset(upload) == 3000
+    Upload().cancelUpload(upload)
+    assert not os.path.exists(upload['tempFile'])
+
+    upload = Upload().createUpload(admin, 'reserved', 'folder', dest, size=len(data))
+    file = Upload().handleChunk(upload, data)
+    assert file['size'] == len(data)
+    with File().open(file) as fh:
+        assert fh.read() == data
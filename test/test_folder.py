@@ -1,9 +1,20 @@
+import io
+import tarfile
+import unittest.mock
+import zipfile
+
 import pytest
 from bson.objectid import ObjectId
 
+from girder import events
+from girder.constants import AccessType, SortDir
 from girder.exceptions import AccessException
+from girder.models.file import File
 from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.model_base import keysetSort, makeAfterToken
 from pytest_girder.assertions import assertStatus, assertStatusOk
+from pytest_girder.utils import getResponseBody, uploadFile
 
 
 @pytest.fixture
@@ -130,3 +141,279 @@ def testGetResourcePathForNoneUser(server, parentChain):
                           method='GET', user=None,
                           params={'type': 'folder'})
     assertStatus(resp, 401)
+
+
+def testAncestorIdsMaintained(parentChain, admin):
+    F1, F2, F3, F4 = (parentChain[k] for k in ('folder1', 'folder2', 'privateFolder', 'folder4'))
+    assert F1['ancestorIds'] == []
+    assert F4['ancestorIds'] == [F1['_id'], F2['_id'], F3['_id']]
+    item = Item().createItem('item', creator=admin, folder=F4)
+    assert item['ancestorIds'] == [F1['_id'], F2['_id'], F3['_id'], F4['_id']]
+
+    assert Folder()._isAncestor(F2, F4)
+    assert not Folder()._isAncestor(F4, F2)
+
+    # Moving a folder rewrites the ancestors of its whole subtree
+    Folder().move(F3, F1, 'folder')
+    assert Folder().load(F3['_id'], force=True)['ancestorIds'] == [F1['_id']]
+    assert Folder().load(F4['_id'], force=True)['ancestorIds'] == [F1['_id'], F3['_id']]
+    assert Item().load(item['_id'], force=True)['ancestorIds'] == [
+        F1['_id'], F3['_id'], F4['_id']]
+
+    Folder().move(F3, admin, 'user')
+    assert Folder().load(F4['_id'], force=True)['ancestorIds'] == [F3['_id']]
+    assert Item().load(item['_id'], force=True)['ancestorIds'] == [F3['_id'], F4['_id']]
+
+    copy = Folder().copyFolder(F3, parent=F2, parentType='folder', creator=admin)
+    assert copy['ancestorIds'] == [F1['_id'], F2['_id']]
+    copyChild = Folder().findOne({'parentId': copy['_id']})
+    assert copyChild['ancestorIds'] == [F1['_id'], F2['_id'], copy['_id']]
+    copyItem = Item().findOne({'folderId': copyChild['_id']})
+    assert copyItem['ancestorIds'] == [F1['_id'], F2['_id'], copy['_id'], copyChild['_id']]
+
+
+def testAncestorIdsBackfill(parentChain, admin):
+    F1, F2, F3, F4 = (parentChain[k] for k in ('folder1', 'folder2', 'privateFolder', 'folder4'))
+    item = Item().createItem('item', creator=admin, folder=F4)
+    Folder().update({}, {'$unset': {'ancestorIds': True}})
+    Item().update({}, {'$unset': {'ancestorIds': True}})
+    Folder()._ancestorIdsComplete = False
+    assert not Folder().hasCompleteAncestorIds()
+
+    # The admin's default folders are included in the count
+    assert Folder().backfillAncestorIds(batchSize=1) == (Folder().find().count(), 1)
+    assert Folder().hasCompleteAncestorIds()
+    assert Folder().findOne({'_id': F4['_id']})['ancestorIds'] == [
+        F1['_id'], F2['_id'], F3['_id']]
+    assert Item().findOne({'_id': item['_id']})['ancestorIds'] == [
+        F1['_id'], F2['_id'], F3['_id'], F4['_id']]
+    assert Folder().backfillAncestorIds() == (0, 0)
+
+
+def testAncestorIdsLazyMigration(parentChain, admin):
+    F1, F4 = parentChain['folder1'], parentChain['folder4']
+    Folder().update({}, {'$unset': {'ancestorIds': True}})
+    Folder()._ancestorIdsComplete = False
+
+    folder = Folder().load(F4['_id'], force=True)
+    assert folder['ancestorIds'][0] == F1['_id']
+    assert len(folder['ancestorIds']) == 3
+    assert Folder().findOne({'_id': F4['_id']})['ancestorIds'] == folder['ancestorIds']
+
+
+def testSubtreeQueries(parentChain, admin, user):
+    F1, F2, F3, F4 = (parentChain[k] for k in ('folder1', 'folder2', 'privateFolder', 'folder4'))
+    Folder().increment({'_id': {'$in': [F2['_id'], F4['_id']]}}, 'size', 5)
+    assert Folder().getSizeRecursive(Folder().load(F1['_id'], force=True)) == 10
+    assert Folder().subtreeCount(F1) == 4
+
+    # Recursive access changes skip subtrees that the user can't administer
+    Folder().setUserAccess(F1, user, AccessType.ADMIN, save=True)
+    Folder().setUserAccess(F2, user, AccessType.ADMIN, save=True)
+    saved = []
+    with events.bound('model.folder.save.after', 'test', lambda event: saved.append(
+            (event.info['_id'], event.info['public']))):
+        Folder().setAccessList(
+            F1, {'users': [{'id': user['_id'], 'level': AccessType.ADMIN}]}, save=True,
+            recurse=True, user=user, setPublic=False)
+    assert saved == [(F1['_id'], False), (F2['_id'], False)]
+    assert Folder().load(F2['_id'], force=True)['public'] is False
+    assert Folder().load(F3['_id'], force=True)['public'] is False
+    assert Folder().load(F4['_id'], force=True)['public'] is True
+
+    Folder().setAccessList(F1, {'users': []}, save=True, recurse=True, user=admin, setPublic=True)
+    for folder in (F1, F2, F3, F4):
+        folder = Folder().load(folder['_id'], force=True)
+        assert folder['public'] is True
+        assert folder['access'] == {'users': [], 'groups': []}
+
+
+def testKeysetPagination(server, admin, user):
+    parent = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='parent', public=True)
+    names = ['b', 'a', 'C', 'c', 'd']
+    for name in names:
+        Item().createItem(name, creator=admin, folder=parent)
+        Folder().createFolder(
+            parent=parent, parentType='folder', creator=admin, name='folder ' + name)
+    private = Folder().createFolder(
+        parent=parent, parentType='folder', creator=admin, name='folder bb', public=False)
+
+    def pages(path, params, user):
+        params = dict(params, limit=2)
+        results = []
+        while True:
+            resp = server.request(path=path, user=user, params=params)
+            assertStatusOk(resp)
+            # Only the first page is counted
+            assert ('Girder-Total-Count' in resp.headers) == ('after' not in params)
+            results.extend(doc['name'] for doc in resp.json)
+            if 'Girder-Next-After' not in resp.headers:
+                return results
+            params['after'] = resp.headers['Girder-Next-After']
+
+    expected = [item['name'] for item in Item().find(
+        {'folderId': parent['_id']}, sort=[('lowerName', 1), ('_id', 1)])]
+    assert pages('/item', {'folderId': parent['_id']}, user) == expected
+    assert pages('/item', {'folderId': parent['_id'], 'sortdir': -1}, user) == expected[::-1]
+
+    folderParams = {'parentType': 'folder', 'parentId': parent['_id']}
+    expected = [folder['name'] for folder in Folder().find(
+        {'parentId': parent['_id']}, sort=[('lowerName', 1), ('_id', 1)])]
+    assert pages('/folder', folderParams, admin) == expected
+    assert pages('/folder', folderParams, user) == [
+        name for name in expected if name != private['name']]
+
+    # The token is tied to the sort order
+    resp = server.request(path='/item', user=user, params={
+        'folderId': parent['_id'], 'limit': 2})
+    resp = server.request(path='/item', user=user, params={
+        'folderId': parent['_id'], 'sort': 'created',
+        'after': resp.headers['Girder-Next-After']})
+    assertStatus(resp, 400)
+    resp = server.request(path='/item', user=user, params={'text': 'a', 'after': 'abc'})
+    assertStatus(resp, 400)
+
+
+@pytest.mark.parametrize('sortdir', [SortDir.ASCENDING, SortDir.DESCENDING])
+def testKeysetPaginationNullValues(admin, sortdir):
+    parent = Folder().createFolder(parent=admin, parentType='user', creator=admin, name='parent')
+    for index, rank in enumerate([3, None, 1, None, 2, 1, None]):
+        item = Item().createItem('item%d' % index, creator=admin, folder=parent)
+        if rank is not None:
+            Item().setMetadata(item, {'rank': rank})
+
+    query = {'folderId': parent['_id']}
+    sort = keysetSort([('meta.rank', sortdir)])
+    expected = [item['_id'] for item in Item().find(query, sort=sort)]
+    results = []
+    after = None
+    while True:
+        page = list(Item().find(query, limit=2, sort=sort, after=after))
+        results.extend(item['_id'] for item in page)
+        if len(page) < 2:
+            break
+        after = makeAfterToken(page[-1], sort)
+    # Items without a rank sort first in ascending and last in descending order
+    assert len(expected) == 7
+    assert results == expected
+
+
+def testInheritedAccess(admin, user):
+    folder = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='acl', public=False)
+    other = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='other', public=True)
+    sub = Folder().createFolder(parent=folder, parentType='folder', creator=admin, name='sub')
+    item = Item().createItem('item', creator=admin, folder=folder)
+    subItem = Item().createItem('item', creator=admin, folder=sub)
+    file = File().createLinkFile(
+        'file', parent=item, parentType='item', url='http://a.com', creator=admin)
+    assert Item().hasCompleteInheritedAccess()
+    assert File().hasCompleteInheritedAccess()
+
+    def visible(model, level=AccessType.READ):
+        cursor = model.findWithPermissions(user=user, level=level)
+        # The permission check is a plain query rather than an aggregation
+        assert not getattr(cursor, 'fromAggregate', False)
+        return {doc['_id'] for doc in cursor}
+
+    assert item['inheritedAccess']['sourceId'] == folder['_id']
+    assert visible(Item()) == set()
+    assert visible(File()) == set()
+
+    folder = Folder().setUserAccess(folder, user, AccessType.WRITE, save=True)
+    assert visible(Item()) == {item['_id']}
+    assert visible(Item(), AccessType.WRITE) == {item['_id']}
+    assert visible(Item(), AccessType.ADMIN) == set()
+    assert visible(File()) == {file['_id']}
+
+    Folder().setAccessList(folder, {}, save=True, recurse=True, user=admin)
+    Folder().setPublic(sub, True, save=True)
+    assert visible(Item()) == {subItem['_id']}
+    assert visible(File()) == set()
+
+    # Moving an item updates its files
+    Item().move(Item().load(item['_id'], force=True), other)
+    assert visible(Item()) == {item['_id'], subItem['_id']}
+    assert visible(File()) == {file['_id']}
+
+    # Backfill documents lacking the field
+    for model in (Item(), File()):
+        model.collection.update_many({}, {'$unset': {'inheritedAccess': ''}})
+        model._inheritedAccessComplete = False
+        assert not model.hasCompleteInheritedAccess()
+    assert Item().backfillInheritedAccess(batchSize=1) == 2
+    assert File().backfillInheritedAccess() == 1
+    assert Item().hasCompleteInheritedAccess()
+    assert File().hasCompleteInheritedAccess()
+    assert visible(Item()) == {item['_id'], subItem['_id']}
+    assert visible(File()) == {file['_id']}
+
+
+def testInheritedAccessWithoutQueries(admin, user):
+    folder = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='acl', public=False)
+    folder = Folder().setUserAccess(folder, user, AccessType.READ, save=True)
+    assert Item().hasCompleteInheritedAccess()
+
+    # New items and files take the field from the parent document they are
+    # created in, and saving a loaded folder doesn't reread its ACL.
+    with unittest.mock.patch.object(
+            Item(), '_inheritedAccessFromParent') as itemMock, unittest.mock.patch.object(
+            File(), '_inheritedAccessFromParent') as fileMock, unittest.mock.patch.object(
+            Folder(), 'findOne', wraps=Folder().findOne) as findOneMock:
+        item = Item().createItem('item', creator=admin, folder=folder)
+        file = File().createLinkFile(
+            'file', parent=item, parentType='item', url='http://a.com', creator=admin)
+        loaded = Folder().load(folder['_id'], force=True)
+        findOneMock.reset_mock()
+        Folder().save(loaded)
+    assert not any(
+        call.kwargs.get('fields') == ['public', 'access'] for call in findOneMock.call_args_list)
+    itemMock.assert_not_called()
+    fileMock.assert_not_called()
+    assert item['inheritedAccess']['sourceId'] == folder['_id']
+    assert file['inheritedAccess']['access'] == item['inheritedAccess']['access']
+
+    # Documents saved without validation still get the field
+    unvalidated = Item().save({
+        'name': 'unvalidated', 'folderId': folder['_id'], 'creatorId': admin['_id'],
+        'baseParentType': 'user', 'baseParentId': admin['_id']}, validate=False)
+    assert unvalidated['inheritedAccess']['sourceId'] == folder['_id']
+
+    # A document written without the field is backfilled when loaded, and the
+    # other documents are checked again before permission queries rely on it.
+    raw = Item().collection.insert_one({
+        'name': 'raw', 'folderId': folder['_id'], 'creatorId': admin['_id'],
+        'baseParentType': 'user', 'baseParentId': admin['_id']}).inserted_id
+    Item().collection.insert_one({
+        'name': 'raw2', 'folderId': folder['_id'], 'creatorId': admin['_id'],
+        'baseParentType': 'user', 'baseParentId': admin['_id']})
+    assert Item().load(raw, force=True)['inheritedAccess']['sourceId'] == folder['_id']
+    assert not Item().hasCompleteInheritedAccess()
+    assert {doc['name'] for doc in Item().findWithPermissions(
+        {'folderId': folder['_id']}, user=user)} == {'item', 'unvalidated', 'raw', 'raw2'}
+
+
+@pytest.mark.parametrize('format,compression', (('zip', True), ('tar', False)))
+def testDownloadFolderArchive(server, admin, fsAssetstore, format, compression):
+    folder = Folder().createFolder(admin, 'archive', parentType='user', creator=admin)
+    uploadFile('notes.txt', b'text ' * 100, admin, folder)
+    uploadFile('photo.jpg', b'jpeg data', admin, folder)
+    resp = server.request(
+        path='/folder/%s/download' % folder['_id'], user=admin, isJson=False,
+        params={'format': format, 'compression': compression})
+    assertStatusOk(resp)
+    data = io.BytesIO(getResponseBody(resp, text=False))
+    if format == 'zip':
+        assert resp.headers['Content-Type'] == 'application/zip'
+        with zipfile.ZipFile(data) as zf:
+            assert zf.getinfo('archive/notes.txt').compress_type == zipfile.ZIP_DEFLATED
+            assert zf.getinfo('archive/photo.jpg').compress_type == zipfile.ZIP_STORED
+            assert zf.read('archive/notes.txt') == b'text ' * 100
+    else:
+        assert resp.headers['Content-Type'] == 'application/x-tar'
+        with tarfile.open(fileobj=data) as tf:
+            assert tf.getnames() == ['archive/notes.txt', 'archive/photo.jpg']
+            assert tf.extractfile('archive/photo.jpg').read() == b'jpeg data'
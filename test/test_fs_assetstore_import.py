@@ -3,8 +3,12 @@ import tempfile
 
 import pytest
 
+from girder import events
+from girder.models.file import File
 from girder.models.folder import Folder
+from girder.utility import filesystem_assetstore_adapter
 from girder.utility import path as path_util
+from girder.utility import progress
 from pytest_girder.assertions import assertStatusOk
 
 
@@ -66,3 +70,68 @@ def test_mimetype_guessing(server, admin, fsAssetstore, temp_files, eagerWorkerT
                 'jpg': 'image/jpeg',
             }[key]
         )
+
+
+def test_import_tree(admin, fsAssetstore, tmp_path, monkeypatch):
+    monkeypatch.setattr(filesystem_assetstore_adapter, 'IMPORT_BATCH_SIZE', 2)
+    for name in ('a/x.txt', 'a/y.txt', 'b/c/z.txt', 'b/w.txt', 'top.txt'):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+    folder = Folder().createFolder(admin, 'import', parentType='user', creator=admin)
+    adapter = File().getAssetstoreAdapter(fsAssetstore)
+    checkpoints = []
+
+    def recordCheckpoint(event):
+        checkpoints.append(event.info['checkpoint'])
+
+    with events.bound('assetstore_import.checkpoint', 'test', recordCheckpoint):
+        adapter.importData(
+            folder, 'folder', {'importPath': str(tmp_path)}, progress.noProgress, admin,
+            leafFoldersAsItems=True)
+    assert checkpoints[-1] == os.path.join('b', 'c')
+
+    def lookUp(path):
+        return path_util.lookUpPath(f'/user/{admin["login"]}/import/{path}', admin)['document']
+
+    assert lookUp('a/x.txt')['path'] == str(tmp_path / 'a' / 'x.txt')
+    assert lookUp('a/y.txt')['size'] == 7
+    assert lookUp('b/c/z.txt')['size'] == 9
+    assert lookUp('b/w.txt/w.txt')['imported']
+    assert lookUp('top.txt/top.txt')['mimeType'] == 'text/plain'
+    assert Folder().load(folder['_id'], force=True)['size'] == 37
+
+    # Resuming skips the files in directories up to the checkpoint
+    (tmp_path / 'a' / 'new.txt').write_bytes(b'new')
+    (tmp_path / 'b' / 'new.txt').write_bytes(b'new')
+    adapter.importData(
+        folder, 'folder', {'importPath': str(tmp_path), 'resumeCheckpoint': 'a'},
+        progress.noProgress, admin, leafFoldersAsItems=True)
+    with pytest.raises(path_util.ResourcePathNotFound):
+        lookUp('a/new.txt')
+    assert lookUp('b/new.txt/new.txt')['size'] == 3
+    assert Folder().load(folder['_id'], force=True)['size'] == 40
+
+
+def test_import_failure_writes_batch(admin, fsAssetstore, tmp_path):
+    for name in ('a/x.txt', 'b/y.txt'):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+    folder = Folder().createFolder(admin, 'import', parentType='user', creator=admin)
+    adapter = File().getAssetstoreAdapter(fsAssetstore)
+
+    def fail(event):
+        if event.info['type'] == 'folder' and event.info['importPath'].endswith('b'):
+            raise ValueError('Import failed')
+
+    with events.bound('filesystem_assetstore_imported', 'test', fail):
+        with pytest.raises(ValueError):
+            adapter.importData(
+                folder, 'folder', {'importPath': str(tmp_path)}, progress.noProgress, admin,
+                leafFoldersAsItems=False)
+
+    # The files buffered before the failure were written
+    file = path_util.lookUpPath(
+        f'/user/{admin["login"]}/import/a/x.txt/x.txt', admin)['document']
+    assert file['size'] == 7
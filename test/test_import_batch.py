@@ -0,0 +1,40 @@
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.utility.import_batch import ImportBatch
+
+
+def testImportBatch(admin, fsAssetstore):
+    coll = Collection().createCollection(name='Coll', creator=admin)
+    folder = Folder().createFolder(parent=coll, creator=admin, parentType='collection', name='F')
+    existing = Item().createItem(name='existing', creator=admin, folder=folder)
+    Folder().createFolder(parent=folder, creator=admin, parentType='folder', name='clash')
+
+    batch = ImportBatch(admin, fsAssetstore, batchSize=3)
+    assert batch.add(folder, 'a', 'a.TXT', 5, {'imported': True}, 'path/a') == []
+    assert batch.hasPendingItem(folder, 'a')
+    assert batch.add(folder, 'existing', 'existing', 7, {'imported': True}, 'path/e') == []
+    written = batch.add(folder, 'clash', 'clash', 11, {'imported': True}, 'path/c')
+    assert not batch.hasPendingItem(folder, 'a')
+    assert [importPath for _, _, importPath in written] == ['path/a', 'path/e', 'path/c']
+    assert written[1][0]['_id'] == existing['_id']
+    assert written[2][0]['name'] == 'clash (1)'
+
+    item = Item().load(written[0][0]['_id'], force=True)
+    assert item['size'] == 5
+    assert item['ancestorIds'] == [folder['_id']]
+    assert Item().load(existing['_id'], force=True)['size'] == 7
+    file = File().load(written[0][1]['_id'], force=True)
+    assert file['exts'] == ['txt']
+    assert file['imported'] is True
+    assert file['inheritedAccess']['parentId'] == item['_id']
+    assert Folder().load(folder['_id'], force=True)['size'] == 23
+    assert Collection().load(coll['_id'], force=True)['size'] == 23
+
+    # Importing again reuses the items and files
+    batch.add(folder, 'a', 'a.TXT', 5, {'imported': 'again'}, 'path/a')
+    written = batch.flush()
+    assert written[0][1]['_id'] == file['_id']
+    assert File().load(file['_id'], force=True)['imported'] == 'again'
+    assert Folder().load(folder['_id'], force=True)['size'] == 23
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from girder import events
+from girder.constants import AccessType
+from girder.exceptions import AccessException, ValidationException
+from girder.models.folder import Folder
+from girder.models.item import Item
+from pytest_girder.assertions import assertStatus, assertStatusOk
+
+
+@pytest.fixture
+def folders(admin, user):
+    public = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='public', public=True)
+    public = Folder().setUserAccess(public, user, AccessType.WRITE, save=True)
+    private = Folder().createFolder(
+        parent=admin, parentType='user', creator=admin, name='private', public=False)
+    yield public, private
+
+
+def testBulkSetMetadataPairs(folders, admin, user):
+    writable, private = folders
+    items = [Item().createItem('item%d' % i, creator=admin, folder=writable) for i in range(5)]
+    items[0] = Item().setMetadata(items[0], {'keep': 1, 'drop': 2})
+    privateItem = Item().createItem('private', creator=admin, folder=private)
+
+    fired = []
+    with events.bound('model.item.bulkSetMetadata.after', 'test', fired.append):
+        result = Item().bulkSetMetadata(
+            updates=[(item['_id'], {'index': i, 'drop': None}) for i, item in enumerate(items)],
+            user=user, batchSize=2)
+    assert result == {'matched': 5, 'modified': 5}
+    assert len(fired) == 1
+    assert fired[0].info['ids'] == [item['_id'] for item in items]
+
+    for i, item in enumerate(items):
+        item = Item().load(item['_id'], force=True)
+        assert item['meta']['index'] == i
+        assert 'drop' not in item['meta']
+    assert Item().load(items[0]['_id'], force=True)['meta']['keep'] == 1
+
+    # Nothing is written if access is denied on any item
+    with pytest.raises(AccessException):
+        Item().bulkSetMetadata(
+            updates=[(items[0]['_id'], {'a': 1}), (privateItem['_id'], {'a': 1})], user=user)
+    assert 'a' not in Item().load(items[0]['_id'], force=True)['meta']
+
+    with pytest.raises(ValidationException):
+        Item().bulkSetMetadata(updates=[(items[0]['_id'], {'a.b': 1})], user=user)
+
+
+def testBulkSetMetadataQuery(server, folders, admin, user):
+    writable, private = folders
+    items = [Item().createItem('item%d' % i, creator=admin, folder=writable) for i in range(3)]
+    items[1] = Item().setMetadata(items[1], {'group': 'x'})
+    privateItem = Item().createItem('private', creator=admin, folder=private)
+
+    # Items the user can't write are skipped
+    result = Item().bulkSetMetadata(query={}, metadata={'tag': 'all'}, user=user)
+    assert result['matched'] == 3
+    assert 'tag' not in Item().load(privateItem['_id'], force=True).get('meta', {})
+
+    resp = server.request(
+        path='/item/metadata', method='PUT', user=user, type='application/json',
+        body=json.dumps({'query': {'folderId': str(writable['_id']), 'meta.group': 'x'},
+                         'metadata': {'tag': 'x'}}))
+    assertStatusOk(resp)
+    assert resp.json == {'matched': 1, 'modified': 1}
+    assert [Item().load(item['_id'], force=True)['meta']['tag'] for item in items] == [
+        'all', 'x', 'all']
+
+    resp = server.request(
+        path='/item/metadata', method='PUT', user=user, type='application/json',
+        body=json.dumps({'updates': [{'id': str(items[2]['_id']), 'metadata': {'tag': None}}]}))
+    assertStatusOk(resp)
+    assert 'tag' not in Item().load(items[2]['_id'], force=True)['meta']
+
+    resp = server.request(
+        path='/item/metadata', method='PUT', user=user, type='application/json',
+        body=json.dumps({'updates': [{'id': str(privateItem['_id']), 'metadata': {'a': 1}}]}))
+    assertStatus(resp, 403)
+
+    # Arbitrary query operators are rejected
+    resp = server.request(
+        path='/item/metadata', method='PUT', user=user, type='application/json',
+        body=json.dumps({'query': {'meta.group': {'$ne': 'x'}}, 'metadata': {'a': 1}}))
+    assertStatus(resp, 400)
+    resp = server.request(
+        path='/item/metadata', method='PUT', user=user, type='application/json',
+        body=json.dumps({'query': {'creatorId': str(admin['_id'])}, 'metadata': {'a': 1}}))
+    assertStatus(resp, 400)
+    # Queries must be scoped to a folder
+    for query in ({}, {'meta.group': 'x'}, {'folderId': [str(writable['_id'])]}):
+        resp = server.request(
+            path='/item/metadata', method='PUT', user=user, type='application/json',
+            body=json.dumps({'query': query, 'metadata': {'a': 1}}))
+        assertStatus(resp, 400)
+    assert 'a' not in Item().load(items[0]['_id'], force=True)['meta']
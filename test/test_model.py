@@ -1,6 +1,9 @@
 import pytest
 
+from girder import events
+from girder.models.folder import Folder
 from girder.models.group import Group
+from girder.models.item import Item
 from girder.models.model_base import AccessControlledModel, AccessType, Model
 from girder.models.user import User
 from girder.utility import acl_mixin, model_importer
@@ -447,6 +450,38 @@ class TestFindWithPermissions:
         self.generalTest(_model, admin, user)
 
 
+def testSaveTrackedChanges(admin):
+    folder = Folder().childFolders(admin, parentType='user')[0]
+    item = Item().createItem('tracked', admin, folder)
+    item = Item().setMetadata(item, {'a': 1, 'b': 2})
+
+    # Saves of different fields of the same item don't overwrite each other
+    first = Item().load(item['_id'], force=True)
+    second = Item().load(item['_id'], force=True)
+    first['meta']['a'] = 10
+    second['description'] = 'changed'
+    del second['meta']['b']
+    saved = []
+    with events.bound('model.item.save', 'test', lambda event: saved.append(event.info['_id'])):
+        Item().save(first)
+        Item().save(second)
+    assert saved == [item['_id'], item['_id']]
+    item = Item().load(item['_id'], force=True)
+    assert item['meta'] == {'a': 10}
+    assert item['description'] == 'changed'
+
+    # Later saves compare with what was last saved
+    item['meta']['a'] = 1
+    Item().save(item)
+    item['meta']['a'] = 10
+    Item().save(item)
+    assert Item().load(item['_id'], force=True)['meta'] == {'a': 10}
+
+    # Documents that weren't loaded by the model replace the stored one
+    Item().save(dict(item, meta={}))
+    assert Item().load(item['_id'], force=True)['meta'] == {}
+
+
 def testDatabaseConnectivityRequiresDbFixtureInTesting():
     """
     This test exists to verify that attempting to use Girder's model layer without using the
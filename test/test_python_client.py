@@ -0,0 +1,229 @@
+import concurrent.futures
+import io
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import girder_client
+import httmock
+import pytest
+from girder_client import GirderClient, HttpError
+
+S3_URL = 'https://s3.example.com/bucket/key'
+
+
+class _S3Mock:
+    """
+    Mock the Girder and S3 endpoints of a multipart upload sent directly to S3.
+
+    :param failures: A dict of part number to the list of statuses that the
+        part is answered with before it succeeds.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = {partNumber: list(statuses) for partNumber, statuses in (
+            failures or {}).items()}
+        self.parts = {}
+        self.attempts = []
+        self.completed = False
+        self.held = 0
+        self.maxHeld = 0
+        self.lock = threading.Lock()
+
+    @httmock.all_requests
+    def __call__(self, url, request):
+        query = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        if url.path.endswith('/file/chunk'):
+            partNumber = json.loads(query['chunk'])['partNumber']
+            return httmock.response(200, {'s3': {'request': {
+                'method': 'PUT', 'url': '%s?partNumber=%d' % (S3_URL, partNumber)}}})
+        if url.path.endswith('/file/completion'):
+            self.completed = True
+            return httmock.response(200, {'_id': 'file'})
+        if 'uploads' in query:
+            return httmock.response(200, '<UploadId>upload</UploadId>')
+        partNumber = int(query['partNumber'])
+        data = request.body.read()
+        time.sleep(random.random() * 0.01)
+        with self.lock:
+            self.attempts.append(partNumber)
+            statuses = self.failures.get(partNumber)
+            if statuses:
+                return httmock.response(statuses.pop(0))
+            self.parts[partNumber] = data
+            self.held -= 1
+        return httmock.response(200)
+
+    def stream(self, data):
+        mock = self
+
+        class Stream(io.BytesIO):
+            def read(self, size=-1):
+                chunk = super().read(size)
+                with mock.lock:
+                    mock.held += bool(chunk)
+                    mock.maxHeld = max(mock.maxHeld, mock.held)
+                return chunk
+
+        return Stream(data)
+
+
+def _uploadObj(chunkLength=4):
+    return {'_id': 'upload', 'behavior': 's3', 's3': {
+        'chunked': True, 'chunkLength': chunkLength,
+        'request': {'method': 'POST', 'url': S3_URL + '?uploads'}}}
+
+
+@pytest.fixture
+def client():
+    yield GirderClient(apiUrl='http://girder.example.com/api/v1', uploadThreads=3)
+
+
+def testS3UploadParts(client):
+    data = bytes(range(50))
+    mock = _S3Mock()
+    progress = []
+    with httmock.HTTMock(mock):
+        result = client._uploadContents(
+            _uploadObj(), mock.stream(data), len(data), progress.append)
+    assert result == {'_id': 'file'}
+    assert mock.completed
+    assert sorted(mock.parts) == list(range(1, 14))
+    assert b''.join(mock.parts[partNumber] for partNumber in sorted(mock.parts)) == data
+    assert progress[-1] == {'current': len(data), 'total': len(data)}
+    assert mock.maxHeld <= client.uploadThreads
+
+
+def testS3UploadPartsHeldAcrossFiles(client):
+    data = bytes(range(100))
+    mock = _S3Mock()
+    client._s3PartSlots = threading.BoundedSemaphore(client.uploadThreads)
+    with httmock.HTTMock(mock), concurrent.futures.ThreadPoolExecutor(3) as pool:
+        uploads = [pool.submit(
+            client._uploadContents, _uploadObj(), mock.stream(data), len(data))
+            for _ in range(3)]
+        for upload in uploads:
+            assert upload.result() == {'_id': 'file'}
+    assert mock.held == 0
+    assert mock.maxHeld <= client.uploadThreads
+
+
+def testS3UploadPartRetry(client):
+    data = bytes(range(20))
+    mock = _S3Mock(failures={2: [500, 503]})
+    with httmock.HTTMock(mock):
+        client._uploadContents(_uploadObj(), mock.stream(data), len(data))
+    assert mock.attempts.count(2) == 3
+    assert b''.join(mock.parts[partNumber] for partNumber in sorted(mock.parts)) == data
+
+
+@pytest.mark.parametrize('statuses', ([403], [500] * (GirderClient.S3_PART_RETRIES + 1)))
+def testS3UploadPartFailure(client, statuses):
+    data = bytes(range(200))
+    mock = _S3Mock(failures={1: statuses})
+    with httmock.HTTMock(mock), pytest.raises(HttpError) as exc:
+        client._uploadContents(_uploadObj(), mock.stream(data), len(data))
+    assert exc.value.status == statuses[-1]
+    assert mock.attempts.count(1) == len(statuses)
+    assert not mock.completed
+    # The parts that had not started when the part failed are not sent
+    assert len(mock.parts) < 50
+
+
+class _DownloadMock:
+    """
+    Mock the download of Girder files.
+
+    :param contents: A dict of file ID to the current contents of the file.
+    :param etag: The ETag of the responses.
+    :param contentRange: If set, the Content-Range of every partial response.
+    """
+
+    def __init__(self, contents, etag='"current"', contentRange=None):
+        self.contents = contents
+        self.etag = etag
+        self.contentRange = contentRange
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @httmock.all_requests
+    def __call__(self, url, request):
+        with self.lock:
+            self.requests.append((url.path, request.headers.get('Range'),
+                                  request.headers.get('If-Range')))
+        if url.path.endswith('/files'):
+            return httmock.response(200, [
+                self.file(fileId) for fileId in sorted(self.contents)
+            ], {'Content-Type': 'application/json'})
+        fileId = url.path.split('/')[-2]
+        data = self.contents[fileId]
+        time.sleep(0.02)
+        if data is None:
+            return httmock.response(500)
+        headers = {'ETag': self.etag}
+        rangeHeader = request.headers.get('Range')
+        if rangeHeader and request.headers.get('If-Range') in (None, self.etag):
+            offset = int(rangeHeader.split('=')[1].rstrip('-'))
+            headers['Content-Range'] = self.contentRange or 'bytes %d-%d/%d' % (
+                offset, len(data) - 1, len(data))
+            return httmock.response(206, data[offset:], headers)
+        return httmock.response(200, data, headers)
+
+    def file(self, fileId, **kwargs):
+        return dict({
+            '_id': fileId, 'name': fileId, 'size': len(self.contents[fileId] or b''),
+            'created': '2026-01-01T00:00:00'}, **kwargs)
+
+
+def _writePartial(client, fileObj, path, data, etag='"current"'):
+    with open(path + girder_client.PARTIAL_DOWNLOAD_SUFFIX, 'wb') as fp:
+        fp.write(data)
+    with open(path + girder_client.PARTIAL_DOWNLOAD_SUFFIX
+              + girder_client.PARTIAL_DOWNLOAD_INFO_SUFFIX, 'w') as fp:
+        json.dump({'version': client._fileVersion(fileObj), 'ifRange': etag}, fp)
+
+
+def testDownloadResume(client, tmp_path):
+    mock = _DownloadMock({'file': b'0123456789'})
+    path = str(tmp_path / 'file')
+    _writePartial(client, mock.file('file'), path, b'0123')
+    with httmock.HTTMock(mock):
+        client._downloadFile(mock.file('file'), path)
+    assert mock.requests == [('/api/v1/file/file/download', 'bytes=4-', '"current"')]
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'0123456789'
+    assert os.listdir(tmp_path) == ['file']
+
+
+@pytest.mark.parametrize('partialVersion,etag,contentRange,ranges', (
+    # The file was updated in Girder
+    ({'updated': '2026-02-01T00:00:00'}, '"current"', None, [None]),
+    # The server sends the whole file as the validator does not match
+    ({}, '"changed"', None, ['bytes=4-']),
+    # The server sends a different range
+    ({}, '"current"', 'bytes 0-9/10', ['bytes=4-', None]),
+))
+def testDownloadResumeMismatch(client, tmp_path, partialVersion, etag, contentRange, ranges):
+    mock = _DownloadMock({'file': b'0123456789'}, etag=etag, contentRange=contentRange)
+    path = str(tmp_path / 'file')
+    _writePartial(client, mock.file('file', **partialVersion), path, b'abcd')
+    with httmock.HTTMock(mock):
+        client._downloadFile(mock.file('file'), path)
+    assert [request[1] for request in mock.requests] == ranges
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'0123456789'
+    assert os.listdir(tmp_path) == ['file']
+
+
+def testDownloadFailureCancelsQueued(client, tmp_path):
+    contents = {'file%02d' % index: b'data' for index in range(20)}
+    contents['file00'] = None
+    mock = _DownloadMock(contents)
+    client.downloadThreads = 2
+    with httmock.HTTMock(mock), pytest.raises(HttpError):
+        client.downloadItem('item', str(tmp_path), name='item')
+    downloads = [request for request in mock.requests if request[0].endswith('/download')]
+    assert len(downloads) < 10
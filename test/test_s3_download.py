@@ -0,0 +1,53 @@
+import re
+
+import httmock
+import pytest
+
+from girder.utility import s3_assetstore_adapter
+from girder.utility.s3_assetstore_adapter import S3AssetstoreAdapter
+
+CONTENT = bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def adapter():
+    return S3AssetstoreAdapter({
+        'bucket': 'bucketname', 'accessKeyId': 'access', 'secret': 'secret', 'service': ''})
+
+
+@httmock.all_requests
+def _rangedS3(url, request):
+    start, end = re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups()
+    return httmock.response(206, CONTENT[int(start):int(end) + 1])
+
+
+@pytest.mark.parametrize('offset,endByte', (
+    (0, None),
+    (1000, 200000),
+    (5, 4096 * 3 + 7),
+))
+def testRangedDownload(adapter, monkeypatch, offset, endByte):
+    monkeypatch.setattr(s3_assetstore_adapter, 'RANGE_LEN', 4096)
+    monkeypatch.setenv('GIRDER_S3_DOWNLOAD_STREAMS', '3')
+    file = {'name': 'test', 's3Key': 'key', 'size': len(CONTENT)}
+    with httmock.HTTMock(_rangedS3):
+        stream = adapter.downloadFile(file, offset=offset, endByte=endByte, headers=False)
+        assert b''.join(stream()) == CONTENT[offset:endByte]
+
+
+def testRangedDownloadRetries(adapter, monkeypatch):
+    monkeypatch.setattr(s3_assetstore_adapter, 'RANGE_LEN', 4096)
+    failures = []
+
+    @httmock.all_requests
+    def flakyS3(url, request):
+        if not failures:
+            failures.append(request.headers['Range'])
+            return httmock.response(500)
+        return _rangedS3(url, request)
+
+    file = {'name': 'test', 's3Key': 'key', 'size': len(CONTENT)}
+    with httmock.HTTMock(flakyS3):
+        stream = adapter.downloadFile(file, headers=False)
+        assert b''.join(stream()) == CONTENT
+    assert len(failures) == 1
@@ -6,7 +6,10 @@ from girder.models.collection import Collection
 from girder.models.file import File
 from girder.models.folder import Folder
 from girder.models.item import Item
+from girder.models.setting import Setting
+from girder.models.size_delta import SizeDelta
 from girder.models.user import User
+from girder.settings import SettingKey
 from pytest_girder.assertions import assertStatus, assertStatusOk
 
 Hierarchy = collections.namedtuple('Hierarchy', ['collections', 'folders', 'items', 'files'])
@@ -106,3 +109,86 @@ def testDeleteFolderUpdatesSize(server, admin, hierarchy, eagerWorkerTasks):
         path='/folder/%s' % hierarchy.folders[1]['_id'], method='DELETE', user=admin)
     assertStatusOk(resp)
     assertNodeSize(hierarchy.collections[0], Collection, 1)
+
+
+def testBufferedSizeChanges(admin, hierarchy, fsAssetstore):
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, True)
+    File().createFile(
+        name='File3', creator=admin, item=hierarchy.items[1], size=100, assetstore=fsAssetstore)
+    Item().move(hierarchy.items[0], hierarchy.folders[1])
+
+    # Item sizes change at once; nothing else changes until the log is applied
+    assertNodeSize(hierarchy.items[1], Item, 110)
+    assertNodeSize(hierarchy.folders[0], Folder, 1)
+    assertNodeSize(hierarchy.collections[0], Collection, 11)
+    assert SizeDelta().hasPending()
+
+    assert SizeDelta().applyPending(limit=2) == 2
+    assert SizeDelta().applyPending() == 1
+    assert not SizeDelta().hasPending()
+    assertNodeSize(hierarchy.items[1], Item, 110)
+    assertNodeSize(hierarchy.folders[0], Folder, 0)
+    assertNodeSize(hierarchy.folders[1], Folder, 111)
+    assertNodeSize(hierarchy.collections[0], Collection, 111)
+
+
+def reconcilePass():
+    results = [SizeDelta().reconcile(batchSize=1)]
+    while not results[-1]['completed']:
+        results.append(SizeDelta().reconcile(batchSize=1))
+    return sum(result['fixed'] for result in results)
+
+
+def testReconcileSizes(hierarchy):
+    Item().update({'_id': hierarchy.items[1]['_id']}, {'$set': {'size': 7}})
+    Folder().update({'_id': hierarchy.folders[0]['_id']}, {'$set': {'size': 5}})
+    Collection().update({'_id': hierarchy.collections[1]['_id']}, {'$set': {'size': 3}})
+
+    # Resources with pending changes are left alone
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, True)
+    Item().propagateSizeChange(hierarchy.items[0], 2)
+    assert reconcilePass() == 2
+    assertNodeSize(hierarchy.items[1], Item, 10)
+    assertNodeSize(hierarchy.folders[0], Folder, 5)
+    assertNodeSize(hierarchy.collections[0], Collection, 11)
+    assertNodeSize(hierarchy.collections[1], Collection, 0)
+
+    SizeDelta().applyPending()
+    assertNodeSize(hierarchy.folders[0], Folder, 7)
+    assertNodeSize(hierarchy.collections[0], Collection, 13)
+    assert reconcilePass() == 2
+    assertNodeSize(hierarchy.folders[0], Folder, 1)
+    assertNodeSize(hierarchy.collections[0], Collection, 11)
+    assert reconcilePass() == 0
+
+
+def testBufferedFolderMove(admin, hierarchy, fsAssetstore):
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, True)
+    assert SizeDelta().isBuffered()
+    File().createFile(
+        name='File3', creator=admin, item=hierarchy.items[1], size=100, assetstore=fsAssetstore)
+    assert SizeDelta().hasPending()
+
+    # The pending change inside the moved folder is applied to its old collection first
+    Folder().move(hierarchy.folders[0], hierarchy.collections[1], 'collection')
+    SizeDelta().applyPending()
+    assertNodeSize(hierarchy.folders[1], Folder, 110)
+    assertNodeSize(hierarchy.collections[0], Collection, 0)
+    assertNodeSize(hierarchy.collections[1], Collection, 111)
+
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, False)
+    assert not SizeDelta().isBuffered()
+
+    # Changes logged before buffering was turned off are still applied first
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, True)
+    File().createFile(
+        name='File4', creator=admin, item=hierarchy.items[1], size=1000, assetstore=fsAssetstore)
+    Setting().set(SettingKey.BUFFER_SIZE_CHANGES, False)
+    Folder().move(
+        Folder().load(hierarchy.folders[0]['_id'], force=True), hierarchy.collections[0],
+        'collection')
+    assert not SizeDelta().hasPending()
+    assertNodeSize(hierarchy.items[1], Item, 1110)
+    assertNodeSize(hierarchy.folders[1], Folder, 1110)
+    assertNodeSize(hierarchy.collections[0], Collection, 1111)
+    assertNodeSize(hierarchy.collections[1], Collection, 0)
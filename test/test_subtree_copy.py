@@ -0,0 +1,110 @@
+import collections
+import contextlib
+import io
+import os
+
+from girder import events
+from girder.constants import AccessType
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.models.user import User
+from girder.utility.subtree_copy import SubtreeCopy
+
+
+def _upload(contents, item, user):
+    return Upload().uploadFromFile(
+        io.BytesIO(contents), size=len(contents), name='file', parentType='item', parent=item,
+        user=user)
+
+
+def testSubtreeCopy(admin, user, fsAssetstore):
+    coll = Collection().createCollection(name='Coll', creator=admin, public=False)
+    root = Folder().createFolder(coll, 'root', parentType='collection', creator=admin)
+    root = Folder().setUserAccess(root, user, AccessType.READ, save=True)
+    sub = Folder().createFolder(root, 'sub', creator=admin)
+    subsub = Folder().createFolder(sub, 'subsub', creator=admin)
+    # The user cannot read this folder, so it is not copied
+    hidden = Folder().createFolder(root, 'hidden', creator=admin)
+    Folder().setUserAccess(hidden, user, None, save=True)
+    Item().createItem('hidden item', admin, hidden)
+    items = [
+        Item().setMetadata(Item().createItem('item%d' % index, admin, folder), {'index': index})
+        for index, folder in enumerate((root, root, root, sub, subsub))]
+    files = [_upload(b'data %d' % index, item, admin) for index, item in enumerate(items)]
+    files.append(_upload(b'more data', items[0], admin))
+    items = [Item().load(item['_id'], force=True) for item in items]
+    dest = Folder().createFolder(user, 'dest', parentType='user', creator=user)
+    newRoot = Folder().createFolder(dest, 'copy', creator=user)
+
+    batches = collections.Counter()
+
+    def bulkCopy(event):
+        batches[event.name] += 1
+        assert 0 < len(event.info['copies']) <= 2
+        for original, copied in event.info['copies']:
+            assert original['_id'] != copied['_id']
+
+    with contextlib.ExitStack() as stack:
+        for name in ('folder', 'item', 'file'):
+            stack.enter_context(events.bound('model.%s.bulkCopy' % name, 'test', bulkCopy))
+        copier = SubtreeCopy(root, newRoot, user, batchSize=2)
+        assert copier.run() == {'folders': 2, 'items': 5, 'files': 6}
+
+    assert batches == {
+        'model.folder.bulkCopy': 2,
+        'model.item.bulkCopy': 4,
+        'model.file.bulkCopy': 5,
+    }
+    newFolders = list(Folder().find({'ancestorIds': newRoot['_id']}, sort=[('name', 1)]))
+    assert [folder['name'] for folder in newFolders] == ['sub', 'subsub']
+    newSub, newSubsub = newFolders
+    assert newSubsub['parentId'] == newSub['_id']
+    assert newSubsub['ancestorIds'] == newRoot['ancestorIds'] + [newRoot['_id'], newSub['_id']]
+    for folder in newFolders:
+        assert folder['baseParentType'] == 'user'
+        assert folder['baseParentId'] == user['_id']
+        assert folder['creatorId'] == user['_id']
+        assert folder['access'] == newRoot['access']
+
+    newItems = list(Item().find({'ancestorIds': newRoot['_id']}, sort=[('name', 1)]))
+    assert [item['copyOfItem'] for item in newItems] == [item['_id'] for item in items]
+    for item, newItem in zip(items, newItems):
+        assert newItem['meta'] == item['meta']
+        assert newItem['size'] == item['size']
+        assert Item().hasAccess(newItem, user, AccessType.ADMIN)
+    assert newItems[4]['folderId'] == newSubsub['_id']
+    assert Folder().load(newRoot['_id'], force=True)['size'] == sum(
+        item['size'] for item in newItems[:3])
+    assert Folder().load(newSub['_id'], force=True)['size'] == newItems[3]['size']
+    assert User().load(user['_id'], force=True)['size'] == sum(
+        item['size'] for item in newItems)
+
+    newFiles = list(File().find({'itemId': {'$in': [item['_id'] for item in newItems]}}))
+    # The copies share their data with the original files
+    assert sorted(file['path'] for file in newFiles) == sorted(file['path'] for file in files)
+    for file in newFiles:
+        assert file['copierId'] == user['_id']
+        assert file['inheritedAccess']['parentId'] == file['itemId']
+        with File().open(file) as handle:
+            assert handle.read() in {b'data %d' % index for index in range(5)} | {b'more data'}
+
+    Folder().remove(newRoot)
+    for file in files:
+        assert os.path.isfile(os.path.join(fsAssetstore['root'], file['path']))
+
+
+def testCopyFolderBulk(admin, fsAssetstore):
+    root = Folder().createFolder(admin, 'root', parentType='user', creator=admin)
+    Folder().createFolder(root, 'sub', creator=admin)
+    _upload(b'data', Item().createItem('item', admin, root), admin)
+
+    with events.bound('model.item.copy.prepare', 'test', lambda event: 1 / 0):
+        newRoot = Folder().copyFolder(root, name='copy', creator=admin, bulk=True)
+
+    assert newRoot['name'] == 'copy'
+    assert newRoot['size'] == len(b'data')
+    assert Folder().findOne({'parentId': newRoot['_id']})['name'] == 'sub'
+    assert Item().findOne({'folderId': newRoot['_id']})['copyOfItem'] is not None
@@ -0,0 +1,68 @@
+import collections
+import contextlib
+import io
+import os
+
+from girder import events
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.utility.subtree_delete import SubtreeDelete
+
+
+def _upload(contents, item, user):
+    return Upload().uploadFromFile(
+        io.BytesIO(contents), size=len(contents), name='file', parentType='item', parent=item,
+        user=user)
+
+
+def testSubtreeDelete(admin, fsAssetstore):
+    coll = Collection().createCollection(name='Coll', creator=admin)
+    root = Folder().createFolder(coll, 'root', parentType='collection', creator=admin)
+    sub = Folder().createFolder(root, 'sub', creator=admin)
+    subsub = Folder().createFolder(sub, 'subsub', creator=admin)
+    outside = Folder().createFolder(coll, 'outside', parentType='collection', creator=admin)
+    files = [
+        _upload(b'data %d' % index, Item().createItem('item%d' % index, admin, folder), admin)
+        for index, folder in enumerate((root, root, sub, subsub, subsub))]
+    # A file outside of the subtree shares its data with the first file
+    shared = _upload(b'data 0', Item().createItem('kept', admin, outside), admin)
+    pending = Upload().createUpload(admin, 'pending', 'folder', sub, 10)
+
+    batches = collections.Counter()
+
+    def bulkRemove(event):
+        batches[event.name] += 1
+        assert 0 < len(event.info['documents']) <= 2
+
+    with contextlib.ExitStack() as stack:
+        for name in ('folder', 'item', 'file', 'upload'):
+            stack.enter_context(events.bound('model.%s.bulkRemove' % name, 'test', bulkRemove))
+        deleter = SubtreeDelete(root, 'folder', batchSize=2)
+        assert deleter.count() == 7
+        assert deleter.run() == {'folders': 2, 'items': 5, 'files': 5}
+
+    assert batches == {
+        'model.item.bulkRemove': 3,
+        'model.file.bulkRemove': 3,
+        'model.upload.bulkRemove': 1,
+        'model.folder.bulkRemove': 1,
+    }
+    assert Folder().load(root['_id'], force=True)['size'] == 0
+    assert Folder().findOne({'ancestorIds': root['_id']}) is None
+    assert Item().findOne({'ancestorIds': root['_id']}) is None
+    assert File().findOne({'_id': {'$in': [file['_id'] for file in files]}}) is None
+    assert Upload().load(pending['_id']) is None
+    assert Collection().load(coll['_id'], force=True)['size'] == len(b'data 0')
+    # Only data that no other file references is deleted
+    paths = [os.path.join(fsAssetstore['root'], file['path']) for file in files]
+    assert os.path.isfile(paths[0])
+    assert not any(os.path.exists(path) for path in paths[1:])
+
+    Collection().remove(coll)
+    assert Folder().load(root['_id'], force=True) is None
+    assert Item().findOne({'baseParentId': coll['_id']}) is None
+    assert File().load(shared['_id'], force=True) is None
+    assert not os.path.exists(paths[0])
@@ -0,0 +1,114 @@
+import io
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+from girder.utility import tarutil, ziputil
+
+
+def slowFile(data, delay=0.01):
+    def stream():
+        time.sleep(delay)
+        for i in range(0, len(data), 3):
+            yield data[i:i + 3]
+    return stream
+
+
+@pytest.mark.parametrize('prefetch,prefetchBytes', ((0, 0), (2, 4), (8, 1024)))
+def testAddFiles(prefetch, prefetchBytes):
+    contents = [('file%d.txt' % i, b'contents of file %d' % i) for i in range(10)]
+    zip = ziputil.ZipGenerator('root', prefetch=prefetch, prefetchBytes=prefetchBytes)
+    data = b''.join(zip.addFiles((name, slowFile(data)) for name, data in contents))
+    data += zip.footer()
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ['root/%s' % name for name, _ in contents]
+        for name, value in contents:
+            assert zf.read('root/%s' % name) == value
+
+
+def testAddFilesError():
+    def failing():
+        yield b'start'
+        raise OSError('unavailable')
+
+    zip = ziputil.ZipGenerator(prefetch=2)
+    with pytest.raises(OSError, match='unavailable'):
+        b''.join(zip.addFiles([('a', slowFile(b'abc')), ('b', failing), ('c', slowFile(b'c'))]))
+
+
+def testReadAheadConsumption():
+    completed = []
+
+    def tracked(name, chunks):
+        def stream():
+            yield from chunks
+            ziputil.whenConsumed(lambda: completed.append(name))
+        return stream
+
+    files = [('a', tracked('a', [b'1', b'', b'2'])), ('b', tracked('b', [b'3']))]
+    entries = ziputil.readAhead(iter(files), 2)
+    name, stream = next(entries)
+    # Give the workers time to read both files
+    time.sleep(0.1)
+    assert completed == []
+    # An empty chunk does not end the file
+    assert list(stream()) == [b'1', b'', b'2']
+    assert completed == ['a']
+    # An archive that is abandoned does not complete the files read ahead
+    entries.close()
+    assert completed == ['a']
+
+
+def testParallelDeflate(monkeypatch):
+    monkeypatch.setattr(ziputil, 'COMPRESS_BLOCK_SIZE', 1000)
+    data = b''.join(b'line %d\n' % i for i in range(5000))
+    zip = ziputil.ZipGenerator(compression=ziputil.DEFLATE, prefetch=0)
+    out = b''.join(zip.addFile(slowFile(data, 0), 'a.txt'))
+    out += b''.join(zip.addFile(slowFile(data, 0), 'b.png'))
+    out += b''.join(zip.addFile(slowFile(b'', 0), 'empty.txt'))
+    out += zip.footer()
+    with zipfile.ZipFile(io.BytesIO(out)) as zf:
+        assert zf.getinfo('a.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo('a.txt').compress_size < len(data) // 2
+        assert zf.getinfo('b.png').compress_type == zipfile.ZIP_STORED
+        assert zf.read('a.txt') == data
+        assert zf.read('b.png') == data
+        assert zf.read('empty.txt') == b''
+
+
+@pytest.mark.parametrize('path,mimeType,compressible', (
+    ('a.txt', None, True),
+    ('a.jpg', None, False),
+    ('a', 'video/mp4', False),
+    ('a.dat', 'application/octet-stream', True),
+))
+def testIsCompressible(path, mimeType, compressible):
+    assert ziputil.isCompressible(path, mimeType) is compressible
+
+
+@pytest.mark.parametrize('compression', (None, tarutil.ZSTD))
+def testTarGenerator(compression):
+    if compression and not tarutil.zstandard:
+        pytest.skip('zstandard is not installed')
+    tar = tarutil.TarGenerator('root', compression=compression, prefetch=2)
+    out = b''.join(tar.addFiles([
+        ('a.txt', slowFile(b'hello world'), {'size': 11, 'assetstoreId': 'a'}),
+        ('gap.txt', lambda: iter([b'ab', b'', b'c']), {'size': 3, 'assetstoreId': 'a'}),
+        ('meta.json', slowFile('{"key": "value"}')),
+    ])) + tar.footer()
+    if compression:
+        out = tarutil.zstandard.ZstdDecompressor().stream_reader(io.BytesIO(out)).read()
+    with tarfile.open(fileobj=io.BytesIO(out)) as tf:
+        assert tf.getnames() == ['root/a.txt', 'root/gap.txt', 'root/meta.json']
+        assert tf.extractfile('root/a.txt').read() == b'hello world'
+        assert tf.extractfile('root/gap.txt').read() == b'abc'
+        assert tf.extractfile('root/meta.json').read() == b'{"key": "value"}'
+
+
+@pytest.mark.parametrize('size', (2, 5))
+def testTarGeneratorSizeMismatch(size):
+    tar = tarutil.TarGenerator('root')
+    with pytest.raises(ValueError, match='root/a.txt'):
+        b''.join(tar.addFile(slowFile(b'abc'), 'a.txt', size=size))